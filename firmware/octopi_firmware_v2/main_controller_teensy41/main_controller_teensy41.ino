@@ -65,6 +65,10 @@ static const int SET_PID_ARGUMENTS = 29;
 static const int SEND_HARDWARE_TRIGGER = 30;
 static const int SET_STROBE_DELAY = 31;
 static const int SET_AXIS_DISABLE_ENABLE = 32;
+static const int CLEAR_SEQUENCE = 33;
+static const int ADD_SEQUENCE_STEP = 34;
+static const int RUN_SEQUENCE = 35;
+static const int ABORT_SEQUENCE = 36;
 static const int SET_PIN_LEVEL = 41;
 static const int INITIALIZE = 254;
 static const int RESET = 255;
@@ -151,6 +155,28 @@ long timestamp_trigger_rising_edge[6] = {0, 0, 0, 0, 0, 0};
 IntervalTimer strobeTimer;
 static const int strobeTimer_interval_us = 100;
 
+/***************************************************************************************************/
+/******************************************** sequence *********************************************/
+/***************************************************************************************************/
+// steps uploaded by the computer (ADD_SEQUENCE_STEP) and executed one after another (RUN_SEQUENCE),
+// the command is reported as in progress until all the repeats of the sequence are completed
+// step: byte 0 - step type, byte 1-4 - arguments (byte 2-6 of the command)
+static const int SEQ_MOVE_Z = 0;
+static const int SEQ_SET_ILLUMINATION = 1;
+static const int SEQ_SEND_HARDWARE_TRIGGER = 2;
+static const int SEQ_WAIT_US = 3;
+static const int SEQ_TURN_ON_ILLUMINATION = 4;
+static const int SEQ_TURN_OFF_ILLUMINATION = 5;
+static const int MAX_SEQUENCE_STEPS = 255;
+byte sequence_steps[MAX_SEQUENCE_STEPS][5];
+int sequence_length = 0;
+int sequence_step = 0;
+uint16_t sequence_repeats_remaining = 0;
+uint16_t sequence_steps_completed = 0;
+bool sequence_running = false;
+bool sequence_step_started = false;
+elapsedMicros us_since_sequence_step_started;
+
 /***************************************************************************************************/
 /******************************************* DAC80508 **********************************************/
 /***************************************************************************************************/
@@ -791,6 +817,90 @@ void setup() {
   us_since_last_check_limit = 2000;
 }
 
+/***************************************************************************************************/
+/******************************************** sequence *********************************************/
+/***************************************************************************************************/
+void run_sequence()
+{
+  if (!sequence_running)
+    return;
+
+  byte* step = sequence_steps[sequence_step];
+
+  // start the current step
+  if (!sequence_step_started)
+  {
+    switch (step[0])
+    {
+      case SEQ_MOVE_Z:
+        {
+          long relative_position = int32_t(uint32_t(step[1]) * 16777216 + uint32_t(step[2]) * 65536 + uint32_t(step[3]) * 256 + uint32_t(step[4]));
+          long current_position = tmc4361A_currentPosition(&tmc4361[z]);
+          Z_direction = sgn(relative_position);
+          Z_commanded_target_position = ( relative_position > 0 ? min(current_position + relative_position, Z_POS_LIMIT) : max(current_position + relative_position, Z_NEG_LIMIT) );
+          focusPosition = Z_commanded_target_position;
+          if ( tmc4361A_moveTo(&tmc4361[z], Z_commanded_target_position) == 0)
+            Z_commanded_movement_in_progress = true;
+          break;
+        }
+      case SEQ_SET_ILLUMINATION:
+        set_illumination(step[1], uint16_t(step[2]) * 256 + uint16_t(step[3]));
+        break;
+      case SEQ_SEND_HARDWARE_TRIGGER:
+        {
+          int camera_channel = step[1] & 0x0f;
+          control_strobe[camera_channel] = step[1] >> 7;
+          illumination_on_time[camera_channel] = uint32_t(step[2]) * 65536 + uint32_t(step[3]) * 256 + uint32_t(step[4]);
+          digitalWrite(camera_trigger_pins[camera_channel], LOW);
+          timestamp_trigger_rising_edge[camera_channel] = micros();
+          trigger_output_level[camera_channel] = LOW;
+          break;
+        }
+      case SEQ_TURN_ON_ILLUMINATION:
+        turn_on_illumination();
+        break;
+      case SEQ_TURN_OFF_ILLUMINATION:
+        turn_off_illumination();
+        break;
+    }
+    sequence_step_started = true;
+    us_since_sequence_step_started = 0;
+    return;
+  }
+
+  // check if the current step has been completed
+  bool step_completed = true;
+  switch (step[0])
+  {
+    case SEQ_MOVE_Z:
+      step_completed = !Z_commanded_movement_in_progress;
+      break;
+    case SEQ_SEND_HARDWARE_TRIGGER:
+      {
+        int camera_channel = step[1] & 0x0f;
+        step_completed = trigger_output_level[camera_channel] == HIGH && !control_strobe[camera_channel];
+        break;
+      }
+    case SEQ_WAIT_US:
+      step_completed = us_since_sequence_step_started >= uint32_t(step[1]) * 16777216 + uint32_t(step[2]) * 65536 + uint32_t(step[3]) * 256 + uint32_t(step[4]);
+      break;
+  }
+  if (!step_completed)
+    return;
+
+  // go to the next step
+  sequence_step_started = false;
+  sequence_steps_completed = sequence_steps_completed + 1;
+  sequence_step = sequence_step + 1;
+  if (sequence_step == sequence_length)
+  {
+    sequence_step = 0;
+    sequence_repeats_remaining = sequence_repeats_remaining - 1;
+    if (sequence_repeats_remaining == 0)
+      sequence_running = false;
+  }
+}
+
 /***************************************************************************************************/
 /********************************************** loop ***********************************************/
 /***************************************************************************************************/
@@ -1464,6 +1574,40 @@ void loop() {
             trigger_output_level[camera_channel] = LOW;
             break;
           }
+        case CLEAR_SEQUENCE:
+          {
+            if (!sequence_running)
+              sequence_length = 0;
+            break;
+          }
+        case ADD_SEQUENCE_STEP:
+          {
+            if (!sequence_running && sequence_length < MAX_SEQUENCE_STEPS)
+            {
+              for (int i = 0; i < 5; i++)
+                sequence_steps[sequence_length][i] = buffer_rx[2 + i];
+              sequence_length = sequence_length + 1;
+            }
+            break;
+          }
+        case RUN_SEQUENCE:
+          {
+            uint16_t repeats = uint16_t(buffer_rx[2]) * 256 + uint16_t(buffer_rx[3]);
+            if (sequence_length > 0 && repeats > 0)
+            {
+              sequence_repeats_remaining = repeats;
+              sequence_step = 0;
+              sequence_steps_completed = 0;
+              sequence_step_started = false;
+              sequence_running = true;
+            }
+            break;
+          }
+        case ABORT_SEQUENCE:
+          {
+            sequence_running = false;
+            break;
+          }
         case SET_PIN_LEVEL:
           {
             int pin = buffer_rx[2];
@@ -1583,6 +1727,9 @@ void loop() {
     }
   }
 
+  // sequence
+  run_sequence();
+
   // camera trigger
   for (int camera_channel = 0; camera_channel < 6; camera_channel++)
   {
@@ -1922,7 +2069,7 @@ void loop() {
     if (checksum_error)
       buffer_tx[1] = CMD_CHECKSUM_ERROR; // cmd_execution_status
     else
-      buffer_tx[1] = mcu_cmd_execution_in_progress ? IN_PROGRESS : COMPLETED_WITHOUT_ERRORS; // cmd_execution_status
+      buffer_tx[1] = (mcu_cmd_execution_in_progress || sequence_running) ? IN_PROGRESS : COMPLETED_WITHOUT_ERRORS; // cmd_execution_status
 
     uint32_t X_pos_int32t = uint32_t( X_use_encoder ? X_pos : int32_t(tmc4361A_currentPosition(&tmc4361[x])) );
     buffer_tx[2] = byte(X_pos_int32t >> 24);
@@ -1949,6 +2096,15 @@ void loop() {
     buffer_tx[18] &= ~ (1 << BIT_POS_JOYSTICK_BUTTON); // clear the joystick button bit
     buffer_tx[18] = buffer_tx[18] | joystick_button_pressed << BIT_POS_JOYSTICK_BUTTON;
 
+    // sequence status
+    buffer_tx[19] = sequence_running;
+    buffer_tx[20] = byte(sequence_steps_completed >> 8);
+    buffer_tx[21] = byte(sequence_steps_completed % 256);
+    buffer_tx[22] = byte(sequence_length);
+
+    // CRC so that the computer can resynchronize on packet boundaries
+    buffer_tx[MSG_LENGTH - 1] = crc8ccitt(buffer_tx, MSG_LENGTH - 1);
+
     if(!DEBUG_MODE)
       SerialUSB.write(buffer_tx,MSG_LENGTH);
     else
@@ -91,6 +91,9 @@ class MicrocontrollerDef:
     CMD_LENGTH = 8
     N_BYTES_POS = 4
 
+MCU_SERIAL_READ_TIMEOUT_S = 0.1
+MCU_SEQUENCE_UPLOAD_TIMEOUT_S = 0.5 # for the status packet confirming the number of steps of an uploaded sequence
+
 class Microcontroller2Def:
     MSG_LENGTH = 4
     CMD_LENGTH = 8
@@ -147,6 +150,10 @@ class CMD_SET:
     SEND_HARDWARE_TRIGGER = 30
     SET_STROBE_DELAY = 31
     SET_AXIS_DISABLE_ENABLE = 32
+    CLEAR_SEQUENCE = 33
+    ADD_SEQUENCE_STEP = 34
+    RUN_SEQUENCE = 35
+    ABORT_SEQUENCE = 36
     SET_PIN_LEVEL = 41
     INITIALIZE = 254
     RESET = 255
@@ -160,6 +167,17 @@ class CMD_SET2:
 BIT_POS_JOYSTICK_BUTTON = 0
 BIT_POS_SWITCH = 1
 
+# steps of a sequence uploaded to and executed by the MCU (see Microcontroller.upload_sequence)
+class SEQUENCE_STEP:
+    MOVE_Z = 0
+    SET_ILLUMINATION = 1
+    SEND_HARDWARE_TRIGGER = 2
+    WAIT_US = 3
+    TURN_ON_ILLUMINATION = 4
+    TURN_OFF_ILLUMINATION = 5
+
+MAX_SEQUENCE_STEPS = 255
+
 class HOME_OR_ZERO:
     HOME_NEGATIVE = 1 # motor moves along the negative direction (MCU coordinates)
     HOME_POSITIVE = 0 # motor moves along the negative direction (MCU coordinates)
@@ -455,6 +473,20 @@ N_SPECTRUM_PER_POINT = 5
 
 # focus measure operator
 FOCUS_MEASURE_OPERATOR = 'LAPE' # 'GLVA' # LAPE has worked well for bright field images; GLVA works well for darkfield/fluorescence
+# other operators: 'LAPV', 'TENG', 'BREN', 'NVAR', 'WAVL' (see control/focus_measure.py)
+# the focus measure is computed on every FOCUS_MEASURE_DOWNSAMPLE-th pixel, per ROI of FOCUS_MEASURE_ROI_GRID ([ny, nx]) combined with FOCUS_MEASURE_ROI_REDUCE
+FOCUS_MEASURE_DOWNSAMPLE = 1
+FOCUS_MEASURE_ROI_GRID = [1,1]
+FOCUS_MEASURE_ROI_REDUCE = 'mean' # 'mean', 'median' or 'max'
+
+# contrast autofocus search: 'sweep' (N steps of dz), 'coarse_to_fine' (steps of AF_COARSE_STEP_FACTOR*dz, then dz around the best one), 'golden_section'
+# or 'continuous' (frames streamed during a single z move, the velocity is set so that frames are about dz apart)
+AF_METHOD = 'sweep'
+AF_COARSE_STEP_FACTOR = 3
+AF_CONTINUOUS_FRAME_OVERHEAD_MS = 20 # readout and transfer time added to the exposure time to get the frame period
+AF_CONTINUOUS_FRAME_TIMEOUT_S = 1
+# sub-step estimate of the peak from the best focus measure and its neighbours: 'none', 'parabolic' or 'gaussian'
+AF_PEAK_FIT = 'none'
 
 # controller version
 CONTROLLER_VERSION = 'Arduino Due' # 'Teensy'
@@ -475,6 +507,29 @@ LASER_AF_CROP_HEIGHT = 256
 HAS_TWO_INTERFACES = True
 LASER_AF_RANGE = 200
 USE_GLASS_TOP = True
+# refine the laser spot centroid with a Gaussian fit of the spot profiles
+LASER_AF_SPOT_GAUSSIAN_FIT = False
+# grab the LASER_AF_AVERAGING_N frames in one burst with the focus camera running continuously instead of triggering them one by one
+LASER_AF_BURST_CAPTURE = False
+LASER_AF_BURST_TIMEOUT_S = 0.5
+
+# focus lock - closed-loop reflection AF running in the background during scans
+FOCUS_LOCK_DURING_SCAN = False
+FOCUS_LOCK_ACTUATOR = 'auto' # 'z', 'piezo' or 'auto' (piezo if there is an objective piezo)
+FOCUS_LOCK_AVERAGING_N = 1 # frames per displacement measurement
+FOCUS_LOCK_GAIN = 0.8 # proportional gain
+FOCUS_LOCK_INTEGRAL_GAIN = 0 # 1/s
+FOCUS_LOCK_DEADBAND_UM = 0.2 # no correction below this error
+FOCUS_LOCK_MAX_STEP_UM = 5 # largest correction per iteration
+FOCUS_LOCK_TOLERANCE_UM = 0.5
+FOCUS_LOCK_N_LOCKED = 2 # consecutive measurements within the tolerance for the focus to be considered locked
+FOCUS_LOCK_SETTLE_MS = 10 # wait after each correction
+FOCUS_LOCK_COMMAND_TIMEOUT_S = 5 # for the completion of each correction
+FOCUS_LOCK_RETRY_MIN_S = 0.01 # delay before measuring again when the laser spot is not found, doubled at each failure
+FOCUS_LOCK_RETRY_MAX_S = 0.5
+FOCUS_LOCK_LOOP_PERIOD_MS = 0 # 0: as fast as the focus camera delivers frames
+FOCUS_LOCK_TIMEOUT_S = 1 # time to wait for the lock at each FOV before falling back to a regular laser AF
+FOCUS_LOCK_TELEMETRY_LENGTH = 100000
 SHOW_LEGACY_DISPLACEMENT_MEASUREMENT_WINDOWS = False
 
 MULTIPOINT_REFLECTION_AUTOFOCUS_ENABLE_BY_DEFAULT = False
@@ -562,6 +617,8 @@ SCIMICROSCOPY_LED_ARRAY_TURN_ON_DELAY = 0.03 # time to wait before trigger the c
 # Tiled preview
 SHOW_TILED_PREVIEW = False
 PRVIEW_DOWNSAMPLE_FACTOR = 5
+MOSAIC_TILE_SIZE = 512 # tiles of the live napari mosaic, allocated where images are placed
+MOSAIC_PYRAMID_LEVELS = 6
 
 # Navigation Bar (Stages)
 SHOW_NAVIGATION_BAR = False
@@ -572,6 +629,24 @@ ENABLE_STITCHER = False
 IS_HCS = False
 DYNAMIC_REGISTRATION = False
 STITCH_COMPLETE_ACQUISITION = False
+STITCHING_LOADER_THREADS = 8 # threads decoding tiles
+STITCHING_READ_AHEAD = 32 # tiles decoded ahead of the one being placed
+STITCHING_STREAMING_WRITER = True # assemble OME-Zarr mosaics chunk by chunk in the store instead of in memory
+STITCH_DURING_ACQUISITION = False # stitch coordinate acquisitions into stitched.ome.zarr as the images are acquired
+LIVE_STITCHING_QUEUE_SIZE = 32 # images waiting to be placed before the acquisition waits for the stitcher
+FLATFIELD_STORE_PATH = str(Path.home()) + "/.squid/flatfields" # profiles keyed by objective, camera, channel and binning
+FLATFIELD_USE_STORE = True # stitching uses stored profiles and saves the ones it fits
+FLATFIELD_UPDATE_DURING_ACQUISITION = False # fit profiles from a random sample of the acquired FOVs at the end of acquisitions
+FLATFIELD_APPLY_DURING_ACQUISITION = False # correct images with the stored profiles before they are saved
+FLATFIELD_N_SAMPLES = 32
+FLATFIELD_MIN_SAMPLES = 8
+FLATFIELD_SAMPLE_DOWNSAMPLE = 4
+FLATFIELD_FIT_DARKFIELD = False
+STITCHING_REGISTRATION_METHOD = 'global' # 'global' (all neighbouring pairs, least-squares layout) or 'single_pair' (one shift for the whole grid)
+STITCHING_REGISTRATION_DOWNSAMPLE = 2
+STITCHING_REGISTRATION_MAX_SHIFT_PX = 100 # largest deviation from the stage positions
+STITCHING_REGISTRATION_MIN_SCORE = 0.3 # pairs with a lower correlation are not used
+STITCHING_REGISTRATION_MAX_RESIDUAL_PX = 5 # pairs that disagree with the global layout by more are not used
 CHANNEL_COLORS_MAP = {
     "405": {"hex": 0x3300FF, "name": "blue"},
     "488": {"hex": 0x1FFF00, "name": "green"},
@@ -601,6 +676,71 @@ PRIOR_STAGE_SN = ""
 DISPLAY_TOUPCAMER_BLACKLEVEL_SETTINGS = False
 DEFAULT_BLACKLEVEL_VALUE = 3
 
+# live frame pool between the camera callback and the stream handler (minimum number of slots, the stream handler adds slots to hold a full image saver queue)
+FRAME_RING_BUFFER_N_SLOTS = 8
+
+# recording (image saver) - 'files' for one file per frame, 'zarr' or 'tiff' to stream into a single container
+RECORDING_CONTAINER_FORMAT = 'files'
+RECORDING_ZARR_CHUNK_FRAMES = 16
+IMAGE_SAVER_QUEUE_SIZE = 10
+IMAGE_SAVER_MAX_QUEUE_MEMORY_MB = 512
+
+# multipoint acquisition - images are written by a pool of threads, 0 to write on the acquisition thread
+MULTIPOINT_WRITER_N_WORKERS = 2
+MULTIPOINT_WRITER_MAX_MEMORY_MB = 1024
+# 'files' for one file per image, 'ome_zarr' to write straight into an OME-Zarr HCS plate
+MULTIPOINT_OUTPUT_FORMAT = 'files'
+# row of the OME-Zarr plate for the regions that are not well names (e.g. 'R0', 'ROI'), one column per region
+OME_ZARR_NON_WELL_ROW = 'ZZ'
+# trigger the next image while the previous one is read out and processed, frames are matched by frame ID - requires hardware
+# triggering (the microcontroller switches the illumination), with software triggering images are acquired one by one
+MULTIPOINT_PIPELINED_ACQUISITION = False
+MULTIPOINT_PIPELINED_FRAME_TIMEOUT_S = 2
+# with pipelined acquisition and hardware trigger, z-stacks are run by the microcontroller as one sequence (z moves, illumination and triggers)
+# when all the channels use the same camera settings, the camera readout time between triggers is MULTIPOINT_MCU_Z_STACK_READOUT_US
+MULTIPOINT_MCU_Z_STACK_SEQUENCE = False
+MULTIPOINT_MCU_Z_STACK_READOUT_US = 20000
+COORDINATE_LOG_FLUSH_EVERY = 50 # rows of coordinates.csv/images.csv kept in memory before they are appended to the file
+COORDINATE_LOG_FLUSH_INTERVAL_S = 5
+# simulated hardware: time taken by mcu commands other than moves, and whether moves/exposure/readout take realistic time (for benchmarking)
+SIMULATION_MCU_COMMAND_TIME_S = 0.05
+SIMULATION_MOTION_TIMING = False
+SIMULATION_CAMERA_TIMING = False
+# simulated camera images rendered from a specimen at the stage position (synthetic cells unless SIMULATION_SPECIMEN_PATH is set), with defocus blur around a focal surface
+SIMULATION_SPECIMEN = False
+SIMULATION_SPECIMEN_PATH = None
+SIMULATION_SPECIMEN_SIZE_PX = 2048 # the specimen repeats beyond its size
+SIMULATION_SPECIMEN_PIXEL_SIZE_UM = 1
+SIMULATION_SPECIMEN_CELL_DENSITY_PER_MM2 = 2000
+SIMULATION_SPECIMEN_CELL_RADIUS_UM = 6
+SIMULATION_SPECIMEN_FOCUS_Z_MM = 0 # focal surface z at (0,0), tilted by SIMULATION_SPECIMEN_FOCUS_TILT_UM_PER_MM (x, y)
+SIMULATION_SPECIMEN_FOCUS_TILT_UM_PER_MM = (0, 0)
+SIMULATION_SPECIMEN_BLUR_UM_PER_UM = 0.5 # gaussian blur sigma per um of defocus
+SIMULATION_SPECIMEN_BLUR_LEVEL_STEP_UM = 2 # defocus between the cached blur levels, blended in between
+SIMULATION_SPECIMEN_BLUR_LEVELS = 16
+SIMULATION_SPECIMEN_REFERENCE_EXPOSURE_MS = 20 # exposure at which the specimen fills the dynamic range (channel intensity 1, gain 0)
+SIMULATION_SPECIMEN_CHANNEL_INTENSITY = {'BF': 0.8, 'Fluorescence 405': 0.6, 'Fluorescence 488': 0.5, 'Fluorescence 561': 0.4, 'Fluorescence 638': 0.3, 'Fluorescence 730': 0.2}
+SIMULATION_SPECIMEN_FULL_WELL_E = 10000
+SIMULATION_SPECIMEN_READ_NOISE_E = 5
+SIMULATION_SPECIMEN_VIGNETTING = 0.3 # relative intensity loss at the corners
+# order of the regions/FOVs in a scan: 'serpentine' (default), 'tsp' (opt-in travel time heuristic, falls back to serpentine for large scans),
+# or 'none' to keep the given order - the given order is also kept when it is not slower than the reordered one
+SCAN_PATH_OPTIMIZATION = 'serpentine'
+SCAN_PATH_TSP_MAX_POSITIONS = 1500
+SCAN_PATH_TSP_MAX_TIME_S = 2
+SCAN_PATH_ROW_TOLERANCE_MM = 0.05
+# move x and y at the same time when going to the next region/FOV
+SCAN_SIMULTANEOUS_XY_MOVES = True
+# focus surface fitted to the focus map points: 'plane', 'quadratic', 'thin_plate' or 'auto' (from the number of points)
+FOCUS_SURFACE_METHOD = 'auto'
+FOCUS_SURFACE_OUTLIER_THRESHOLD_UM = 5
+FOCUS_SURFACE_SMOOTHING = 1e-4
+# when using the focus map, run contrast AF every N FOVs and add the result to the focus surface (0 to disable)
+FOCUS_SURFACE_REFINE_EVERY_N_FOVS = 0
+# timing spans of the acquisition (moves, settling, illumination, trigger, readout, processing, display, saving), written to trace.json (Chrome trace/Perfetto) and timing_summary.json in the experiment folder
+TRACING_ENABLED = False
+TRACING_MAX_EVENTS = 1000000
+
 def read_objectives_csv(file_path):
     objectives = {}
     with open(file_path, 'r') as csvfile:
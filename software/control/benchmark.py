@@ -0,0 +1,298 @@
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+import tempfile
+import threading
+import functools
+import contextlib
+import psutil
+import pandas as pd
+
+from qtpy.QtCore import *
+
+from control._def import *
+import control.camera as camera
+import control.microcontroller as microcontroller
+import control.core as core
+from control.simulated_specimen import SimulatedSpecimen, stage_position_getter
+from control.tracing import tracer
+
+class PhaseTimer(object):
+    """
+    :brief: accumulates the wall time spent in groups of methods of a class
+        (phases) while installed. The methods are wrapped on the class, so
+        instances created afterwards (e.g. the MultiPointWorker of an
+        acquisition) are timed too. Nested calls within the same phase are
+        only counted once.
+    """
+    def __init__(self,cls,phases):
+        # phases: phase -> list of method names of cls
+        self.cls = cls
+        self.phases = phases
+        self.originals = {}
+        self.total_s = {phase: 0.0 for phase in phases}
+        self.calls = {phase: 0 for phase in phases}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _wrap(self,phase,function):
+        timer = self
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            depth = getattr(timer.local,phase,0)
+            setattr(timer.local,phase,depth+1)
+            t0 = time.perf_counter()
+            try:
+                return function(*args,**kwargs)
+            finally:
+                setattr(timer.local,phase,depth)
+                if depth == 0:
+                    with timer.lock:
+                        timer.total_s[phase] = timer.total_s[phase] + time.perf_counter() - t0
+                        timer.calls[phase] = timer.calls[phase] + 1
+        return wrapper
+
+    def install(self):
+        for phase, names in self.phases.items():
+            for name in names:
+                original = self.cls.__dict__[name]
+                self.originals[name] = original
+                setattr(self.cls,name,self._wrap(phase,original))
+
+    def uninstall(self):
+        for name, original in self.originals.items():
+            setattr(self.cls,name,original)
+        self.originals = {}
+
+
+class MemorySampler(object):
+    """
+    :brief: samples the resident set size of the process in a background
+        thread and keeps the peak.
+    """
+    def __init__(self,interval_s=0.05):
+        self.interval_s = interval_s
+        self.process = psutil.Process(os.getpid())
+        self.peak_rss = self.process.memory_info().rss
+        self.stop_requested = False
+        self.thread = threading.Thread(target=self._run,daemon=True)
+
+    def _run(self):
+        while not self.stop_requested:
+            self.peak_rss = max(self.peak_rss,self.process.memory_info().rss)
+            time.sleep(self.interval_s)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_requested = True
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss,self.process.memory_info().rss)
+
+
+# methods of MultiPointWorker timed by the benchmark
+BENCHMARK_PHASES = {
+    'move_xy': ['move_to_coordinate','move_to_next_x_position','move_to_next_y_position'],
+    'move_z': ['move_to_z_level','prepare_z_stack','move_z_for_stack','move_z_back_after_stack'],
+    'autofocus': ['perform_autofocus'],
+    'acquire': ['acquire_camera_image','trigger_camera_image','acquire_rgb_image'],
+    'process': ['process_camera_image'],
+    'save': ['save_image'],
+    'pipeline_drain': ['end_pipelined_fov'],
+    'time_point': ['run_single_time_point'],
+}
+
+
+class AcquisitionBenchmark(object):
+    """
+    :brief: runs a multipoint acquisition of a simulated plate scan
+        (wells x FOVs x z x channels x time points) headless on
+        Camera_Simulation and Microcontroller_Simulation, with realistic
+        move, exposure and readout times, and reports the throughput, the
+        time spent in each phase of MultiPointWorker, the peak memory and
+        the number of dropped frames.
+    """
+    def __init__(self,n_wells=4,fov_nx=3,fov_ny=3,fov_step_mm=0.8,well_spacing_mm=9,NZ=1,dz_um=1.5,n_channels=1,channels=None,Nt=1,dt_s=0,
+                 output_format=MULTIPOINT_OUTPUT_FORMAT,pipelined=False,realistic_timing=True,image_width=None,image_height=None,
+                 base_path=None,keep_output=False,timeout_s=3600,trace=False,specimen=False,configurations_file='./channel_configurations.xml'):
+        self.parameters = {'n_wells': n_wells, 'fov_nx': fov_nx, 'fov_ny': fov_ny, 'fov_step_mm': fov_step_mm, 'well_spacing_mm': well_spacing_mm,
+                           'NZ': NZ, 'dz_um': dz_um, 'n_channels': n_channels, 'channels': channels, 'Nt': Nt, 'dt_s': dt_s,
+                           'output_format': output_format, 'pipelined': pipelined, 'realistic_timing': realistic_timing,
+                           'image_width': image_width, 'image_height': image_height, 'specimen': specimen}
+        self.base_path = base_path
+        self.keep_output = keep_output
+        self.timeout_s = timeout_s
+        self.trace = trace
+        self.configurations_file = configurations_file
+
+    def setup(self):
+        p = self.parameters
+        self.camera = camera.Camera_Simulation()
+        self.camera.open()
+        self.camera.set_software_triggered_acquisition()
+        self.camera.simulate_timing = p['realistic_timing']
+        if p['image_width'] is not None:
+            self.camera.Width = p['image_width']
+        if p['image_height'] is not None:
+            self.camera.Height = p['image_height']
+        self.microcontroller = microcontroller.Microcontroller_Simulation()
+        self.microcontroller.simulate_motion_timing = p['realistic_timing']
+        self.microcontroller.set_hardware_trigger_callback(self.camera.send_trigger)
+
+        self.objectiveStore = core.ObjectiveStore()
+        self.configurationManager = core.ConfigurationManager(filename=self.configurations_file)
+        self.liveController = core.LiveController(self.camera,self.microcontroller,self.configurationManager)
+        self.navigationController = core.NavigationController(self.microcontroller,self.objectiveStore)
+        self.autofocusController = core.AutoFocusController(self.camera,self.navigationController,self.liveController)
+        self.multipointController = core.MultiPointController(self.camera,self.navigationController,self.liveController,self.autofocusController,self.configurationManager)
+        # what the live control widget does in the GUI
+        self.multipointController.signal_current_configuration.connect(self.liveController.set_microscope_mode)
+        if p['specimen']:
+            get_channel = lambda: self.liveController.currentConfiguration.name if self.liveController.currentConfiguration is not None else None
+            self.camera.set_specimen(SimulatedSpecimen(),stage_position_getter(self.microcontroller,self.navigationController),
+                                     get_channel=get_channel,pixel_size_um=self.objectiveStore.get_pixel_size())
+
+    def plate(self):
+        # region -> center, region -> FOV coordinates
+        p = self.parameters
+        n_columns = 12
+        centers = {}
+        fovs = {}
+        for n in range(p['n_wells']):
+            row, column = n // n_columns, n % n_columns
+            name = chr(ord('A') + row) + str(column + 1)
+            x0 = 10 + column*p['well_spacing_mm']
+            y0 = 10 + row*p['well_spacing_mm']
+            centers[name] = [x0, y0]
+            fovs[name] = [(x0 + (i - (p['fov_nx']-1)/2)*p['fov_step_mm'], y0 + (j - (p['fov_ny']-1)/2)*p['fov_step_mm'])
+                          for j in range(p['fov_ny']) for i in range(p['fov_nx'])]
+        return centers, fovs
+
+    def count_images(self,experiment_path):
+        n_images = 0
+        for t in range(self.parameters['Nt']):
+            image_log_path = os.path.join(experiment_path,str(t),'images.csv')
+            if os.path.exists(image_log_path):
+                n_images = n_images + len(pd.read_csv(image_log_path))
+        return n_images
+
+    def run(self):
+        p = self.parameters
+        created_base_path = self.base_path is None
+        base_path = tempfile.mkdtemp(prefix='squid_benchmark_') if created_base_path else self.base_path
+        mpc = self.multipointController
+
+        channels = p['channels'] or [config.name for config in self.configurationManager.configurations[:p['n_channels']]]
+        z_mm = self.navigationController.z_pos_mm
+        mpc.set_base_path(base_path)
+        mpc.set_NZ(p['NZ'])
+        mpc.set_deltaZ(p['dz_um'])
+        mpc.set_z_range(z_mm, z_mm)
+        mpc.set_Nt(p['Nt'])
+        mpc.set_deltat(p['dt_s'])
+        mpc.set_af_flag(False)
+        mpc.set_reflection_af_flag(False)
+        mpc.set_output_format(p['output_format'])
+        mpc.set_pipelined_acquisition_flag(p['pipelined'])
+        mpc.set_selected_configurations(channels)
+        if p['pipelined']:
+            # pipelined acquisition requires hardware triggering
+            self.liveController.set_microscope_mode(mpc.selected_configurations[0])
+            self.liveController.set_trigger_mode(TriggerMode.HARDWARE)
+        mpc.start_new_experiment('benchmark')
+        experiment_path = os.path.join(base_path,mpc.experiment_ID)
+        centers, fovs = self.plate()
+
+        timer = PhaseTimer(core.MultiPointWorker,BENCHMARK_PHASES)
+        memory = MemorySampler()
+        rss_before = memory.peak_rss
+        frame_ID_before = self.camera.frame_ID
+
+        loop = QEventLoop()
+        mpc.acquisitionFinished.connect(loop.quit)
+        timed_out = []
+        def on_timeout():
+            timed_out.append(True)
+            mpc.request_abort_aquisition()
+        QTimer.singleShot(int(self.timeout_s*1000),on_timeout)
+
+        memory.start()
+        timer.install()
+        if self.trace:
+            tracer.start()
+        t0 = time.perf_counter()
+        try:
+            mpc.run_acquisition(location_list=centers,coordinate_dict=fovs)
+            loop.exec_()
+        finally:
+            elapsed_s = time.perf_counter() - t0
+            timer.uninstall()
+            memory.stop()
+            tracer.stop()
+            mpc.acquisitionFinished.disconnect(loop.quit)
+
+        n_triggers = self.camera.frame_ID - frame_ID_before
+        n_images = self.count_images(experiment_path)
+        n_expected = p['n_wells']*p['fov_nx']*p['fov_ny']*p['NZ']*len(channels)*p['Nt']
+        result = {
+            'parameters': dict(p, channels=channels),
+            'completed': not timed_out and not mpc.abort_acqusition_requested,
+            'n_images_expected': n_expected,
+            'n_images': n_images,
+            'n_triggers': n_triggers,
+            'dropped_frames': max(0,n_triggers - n_images),
+            'write_errors': len(mpc.write_errors),
+            'elapsed_s': elapsed_s,
+            'images_per_s': n_images/elapsed_s if elapsed_s > 0 else 0,
+            'phases_s': timer.total_s,
+            'phase_calls': timer.calls,
+            'spans': tracer.summary()['spans'] if self.trace else None,
+            'rss_before_mb': rss_before/2**20,
+            'peak_rss_mb': memory.peak_rss/2**20,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        if created_base_path and not self.keep_output:
+            shutil.rmtree(base_path,ignore_errors=True)
+        else:
+            result['output_path'] = experiment_path
+        return result
+
+    def close(self):
+        self.microcontroller.close()
+        self.camera.close()
+
+
+def run_benchmark(quiet=True,**kwargs):
+    # sets up the simulated microscope, runs one acquisition and returns the results, the prints of the acquisition are suppressed when quiet
+    app = QCoreApplication.instance()
+    if app is None:
+        from qtpy.QtWidgets import QApplication
+        app = QApplication(sys.argv[:1])
+    benchmark = AcquisitionBenchmark(**kwargs)
+    with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        benchmark.setup()
+        try:
+            result = benchmark.run()
+        finally:
+            benchmark.close()
+    return result
+
+
+def write_result(result,path=None):
+    text = json.dumps(result,indent=2)
+    if path is None:
+        print(text)
+    else:
+        with open(path,'w') as f:
+            f.write(text)
+
+
+def write_trace(path):
+    with open(path,'w') as f:
+        json.dump(tracer.chrome_trace(),f)
@@ -1,6 +1,8 @@
 import argparse
 import cv2
+import copy
 import time
+import threading
 import numpy as np
 try:
     import control.gxipy as gx
@@ -49,6 +51,7 @@ class Camera(object):
 
         self.image_locked = False
         self.current_frame = None
+        self.frame_buffer = None # frames received through the callback are written into its slots
 
         self.callback_is_enabled = False
         self.is_streaming = False
@@ -111,6 +114,10 @@ class Camera(object):
     def set_callback(self,function):
         self.new_image_callback_external = function
 
+    def set_frame_buffer(self,frame_buffer):
+        # FrameRingBuffer the frames received through the callback are written into, instead of a new array per frame
+        self.frame_buffer = frame_buffer
+
     def enable_callback(self):
         if self.callback_is_enabled == False:
             # stop streaming
@@ -340,14 +347,21 @@ class Camera(object):
         if self.is_color:
             rgb_image = raw_image.convert("RGB")
             numpy_image = rgb_image.get_numpy_array()
-            if self.pixel_format == 'BAYER_RG12':
-                numpy_image = numpy_image << 4
+            shift = 4 if self.pixel_format == 'BAYER_RG12' else 0
         else:
             numpy_image = raw_image.get_numpy_array()
-            if self.pixel_format == 'MONO12':
-                numpy_image = numpy_image << 4
+            shift = 4 if self.pixel_format == 'MONO12' else 0
         if numpy_image is None:
             return
+        if self.frame_buffer is not None:
+            # the sdk buffer is copied (and shifted) straight into a slot of the frame pool
+            index, slot = self.frame_buffer.get_write_slot(numpy_image.shape,numpy_image.dtype)
+            if slot is None:
+                return # all slots in use, counted by the frame pool
+            np.left_shift(numpy_image,shift,out=slot)
+            numpy_image = slot
+        elif shift > 0:
+            numpy_image = numpy_image << shift
         self.current_frame = numpy_image
         self.frame_ID_software = self.frame_ID_software + 1
         self.frame_ID = raw_image.get_frame_id()
@@ -356,6 +370,8 @@ class Camera(object):
                 self.frame_ID_offset_hardware_trigger = self.frame_ID
             self.frame_ID = self.frame_ID - self.frame_ID_offset_hardware_trigger
         self.timestamp = time.time()
+        if self.frame_buffer is not None:
+            self.frame_buffer.commit(index,self.frame_ID,self.timestamp)
         self.new_image_callback_external(self)
 
         # self.frameID = self.frameID + 1
@@ -490,9 +506,38 @@ class Camera_Simulation(object):
 
         self.new_image_callback_external = None
 
+        # exposure and readout take time (for benchmarking), frames delivered through the callback arrive after the readout
+        self.simulate_timing = SIMULATION_CAMERA_TIMING
+        self.readout_time_ms = self.row_period_us*self.row_numbers/1000
+        self.timestamp_frame_ready = 0
+
+        # optional z stack served according to the stage z (for testing autofocus)
+        self.defocus_stack = None
+        self.defocus_stack_dz_um = 1
+        self.get_z_um = None
+
+        # optional specimen rendered at the stage position (see control.simulated_specimen)
+        self.specimen = None
+        self.get_position_mm = None
+        self.get_channel = None
+        self.specimen_pixel_size_um = 1
+
     def open(self,index=0):
         pass
 
+    def set_defocus_stack(self,stack,dz_um,get_z_um):
+        # stack: (n_z,height,width) with the in-focus plane in the middle, get_z_um() returns the current z of the stage
+        self.defocus_stack = stack
+        self.defocus_stack_dz_um = dz_um
+        self.get_z_um = get_z_um
+
+    def set_specimen(self,specimen,get_position_mm,get_channel=None,pixel_size_um=None):
+        # get_position_mm() returns the current (x, y, z) of the stage in mm, get_channel() the name of the current channel
+        self.specimen = specimen
+        self.get_position_mm = get_position_mm
+        self.get_channel = get_channel
+        self.specimen_pixel_size_um = specimen.pixel_size_um if pixel_size_um is None else pixel_size_um
+
     def set_callback(self,function):
         self.new_image_callback_external = function
 
@@ -509,13 +554,13 @@ class Camera_Simulation(object):
         pass
 
     def set_exposure_time(self,exposure_time):
-        pass
+        self.exposure_time = exposure_time
 
     def update_camera_exposure_time(self):
         pass
 
     def set_analog_gain(self,analog_gain):
-        pass
+        self.analog_gain = analog_gain
 
     def get_awb_ratios(self):
         pass
@@ -553,9 +598,20 @@ class Camera_Simulation(object):
         pass
 
     def send_trigger(self):
+        if self.simulate_timing:
+            time.sleep(self.exposure_time/1000)
         self.frame_ID = self.frame_ID + 1
         self.timestamp = time.time()
-        if self.frame_ID == 1:
+        if self.specimen is not None:
+            x_mm, y_mm, z_mm = self.get_position_mm()
+            channel = self.get_channel() if self.get_channel is not None else None
+            self.current_frame = self.specimen.render(x_mm,y_mm,z_mm,self.Height,self.Width,self.specimen_pixel_size_um,
+                                                      channel,self.exposure_time,self.analog_gain,self.pixel_format)
+        elif self.defocus_stack is not None:
+            n_z = len(self.defocus_stack)
+            index = int(round(self.get_z_um()/self.defocus_stack_dz_um)) + n_z//2
+            self.current_frame = self.defocus_stack[min(max(index,0),n_z-1)]
+        elif self.frame_ID == 1:
             if self.pixel_format == 'MONO8':
                 self.current_frame = np.random.randint(255,size=(self.Height,self.Width),dtype=np.uint8)
                 self.current_frame[self.Height//2-99:self.Height//2+100,self.Width//2-99:self.Width//2+100] = 200
@@ -570,10 +626,31 @@ class Camera_Simulation(object):
             self.current_frame = np.roll(self.current_frame,10,axis=0)
             pass 
             # self.current_frame = np.random.randint(255,size=(768,1024),dtype=np.uint8)
+        if self.simulate_timing:
+            self.timestamp_frame_ready = time.time() + self.readout_time_ms/1000
+            if self.new_image_callback_external is not None and self.callback_is_enabled:
+                threading.Timer(self.readout_time_ms/1000,self._deliver_frame,args=(self.current_frame,self.frame_ID,self.timestamp)).start()
+            return
         if self.new_image_callback_external is not None and self.callback_is_enabled:
             self.new_image_callback_external(self)
 
+    def _deliver_frame(self,frame,frame_ID,timestamp):
+        # end of the simulated readout, the frame, frame ID and timestamp of the camera are already those of the latest trigger
+        # a frame that has been overtaken by a later trigger is passed to the callback on a copy of the camera, so that the camera does not go back to it
+        if self.new_image_callback_external is None or not self.callback_is_enabled:
+            return
+        if frame_ID == self.frame_ID:
+            self.new_image_callback_external(self)
+            return
+        camera = copy.copy(self)
+        camera.current_frame = frame
+        camera.frame_ID = frame_ID
+        camera.timestamp = timestamp
+        self.new_image_callback_external(camera)
+
     def read_frame(self):
+        if self.simulate_timing:
+            time.sleep(max(0,self.timestamp_frame_ready - time.time()))
         return self.current_frame
 
     def _on_frame_callback(self, user_param, raw_image):
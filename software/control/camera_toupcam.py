@@ -2,6 +2,7 @@ import sys
 import argparse
 import cv2
 import time
+import ctypes
 import numpy as np
 
 from control._def import *
@@ -40,9 +41,16 @@ class Camera(object):
             print('last image is still being processed, a frame is dropped')
             return
 
-        # get the image from the camera
+        # get the image from the camera - pulled straight into a slot of the frame pool if there is one
+        buffer = self.buf
+        slot = None
+        if self.frame_buffer is not None and self.data_format != 'RGB':
+            index, slot = self.frame_buffer.get_write_slot((self.Height,self.Width),np.uint8 if self.pixel_size_byte == 1 else np.uint16)
+            if slot is None:
+                return # all slots in use, counted by the frame pool
+            buffer = slot.ctypes.data_as(ctypes.POINTER(ctypes.c_char))
         try:
-            self.camera.PullImageV2(self.buf, self.pixel_size_byte*8, None) # the second camera is number of bits per pixel - ignored in RAW mode
+            self.camera.PullImageV2(buffer, self.pixel_size_byte*8, None) # the second camera is number of bits per pixel - ignored in RAW mode
             # print('  >>> pull image ok, current frame # = {}'.format(self.frame_ID))
         except toupcam.HRESULTException as ex:
             print('pull image failed, hr=0x{:x}'.format(ex.hr))
@@ -58,6 +66,8 @@ class Camera(object):
                 # self.current_frame = QImage(self.buf, self.w, self.h, (self.w * 24 + 31) // 32 * 4, QImage.Format_RGB888)
                 print('convert buffer to image not yet implemented for the RGB format')
             return()
+        elif slot is not None:
+            self.current_frame = slot
         else:
             if self.pixel_size_byte == 1:
                 raw_image = np.frombuffer(self.buf, dtype='uint8')
@@ -75,6 +85,9 @@ class Camera(object):
                 self.frame_ID_offset_hardware_trigger = self.frame_ID
             self.frame_ID = self.frame_ID - self.frame_ID_offset_hardware_trigger
 
+        if slot is not None:
+            self.frame_buffer.commit(index,self.frame_ID,self.timestamp)
+
         self.image_is_ready = True
 
         if self.callback_is_enabled == True:
@@ -108,6 +121,7 @@ class Camera(object):
 
         self.image_locked = False
         self.current_frame = None
+        self.frame_buffer = None # frames are pulled into its slots when set
 
         self.callback_is_enabled = False
         self.is_streaming = False
@@ -262,6 +276,10 @@ class Camera(object):
     def set_callback(self,function):
         self.new_image_callback_external = function
 
+    def set_frame_buffer(self,frame_buffer):
+        # FrameRingBuffer the frames are pulled into, instead of the single pull buffer
+        self.frame_buffer = frame_buffer
+
     def set_temperature_reading_callback(self, func):
         self.temperature_reading_callback = func
 
@@ -0,0 +1,68 @@
+import os
+import csv
+import time
+import threading
+import pandas as pd
+
+from control._def import *
+
+class CoordinateLog(object):
+    """
+    :brief: append-only log of acquisition rows kept as columns. New rows
+        are appended to the CSV file every flush_every rows or
+        flush_interval_s seconds (and on close), so the file is usable
+        after a crash and no table is rebuilt per row.
+    """
+    def __init__(self,path,columns,flush_every=COORDINATE_LOG_FLUSH_EVERY,flush_interval_s=COORDINATE_LOG_FLUSH_INTERVAL_S):
+        self.path = path
+        self.columns = list(columns)
+        self.data = {column: [] for column in self.columns}
+        self.n_rows = 0
+        self.n_flushed = 0
+        self.flush_every = flush_every
+        self.flush_interval_s = flush_interval_s
+        self.timestamp_last_flush = time.time()
+        self.lock = threading.Lock()
+        # rows are appended to the file, a log of a repeated time point starts over
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self):
+        return self.n_rows
+
+    def append(self,values):
+        # values: column -> value, missing columns are left empty
+        with self.lock:
+            for column in self.columns:
+                self.data[column].append(values.get(column))
+            self.n_rows = self.n_rows + 1
+            if self.n_rows - self.n_flushed >= self.flush_every or time.time() - self.timestamp_last_flush >= self.flush_interval_s:
+                self._flush()
+
+    def _flush(self):
+        if self.n_flushed < self.n_rows or not os.path.exists(self.path):
+            write_header = not os.path.exists(self.path)
+            with open(self.path,'a',newline='') as f:
+                writer = csv.writer(f)
+                if write_header:
+                    writer.writerow(self.columns)
+                columns = [self.data[column][self.n_flushed:self.n_rows] for column in self.columns]
+                writer.writerows(zip(*columns))
+                f.flush()
+                os.fsync(f.fileno())
+            self.n_flushed = self.n_rows
+        self.timestamp_last_flush = time.time()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+    def column(self,name):
+        return list(self.data[name])
+
+    def to_dataframe(self):
+        with self.lock:
+            return pd.DataFrame({column: list(values) for column, values in self.data.items()},columns=self.columns)
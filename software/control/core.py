@@ -19,6 +19,18 @@ if DO_FLUORESCENCE_RTP:
 
 import control.utils as utils
 import control.utils_config as utils_config
+from control.frame_buffer import FrameRingBuffer
+from control.recording_writer import create_recording_writer
+from control.image_writer import ImageWriterPool
+from control.ome_zarr_writer import HCSOmeZarrWriter
+from control.live_stitcher import LiveStitcher
+from control.coordinate_log import CoordinateLog
+from control.flatfield import FlatfieldStore, FlatfieldSampler, calibration_from_acquisition_parameters
+from control.scan_planner import ScanPathPlanner, motion_model_from_microcontroller
+from control.focus_surface import FocusSurface
+from control.spot_detection import SpotDetector
+from control.tracing import tracer
+from control.microcontroller import z_stack_sequence, z_stack_frames, applied_velocity_mm
 import control.tracking as tracking
 import control.serial_peripherals as serial_peripherals
 
@@ -28,8 +40,9 @@ try:
 except:
     pass
 
-from queue import Queue
-from threading import Thread, Lock
+from queue import Queue, Full
+from collections import deque
+from threading import Thread, Lock, Event, Condition
 from pathlib import Path
 from datetime import datetime
 import time
@@ -110,6 +123,11 @@ class StreamHandler(QObject):
         self.track_flag = False
         self.handler_busy = False
 
+        # preallocated frame pool - frames are written once into a slot and passed on by reference
+        # there are enough slots for a full saver queue, the frame on display and the frames being written and processed
+        self.frame_buffer = FrameRingBuffer(max(FRAME_RING_BUFFER_N_SLOTS,IMAGE_SAVER_QUEUE_SIZE+3))
+        self.frames_dropped_reported = 0
+
         # for fps measurement
         self.timestamp_last = 0
         self.counter = 0
@@ -149,6 +167,20 @@ class StreamHandler(QObject):
             self.handler_busy = True
             self.signal_new_frame_received.emit() # self.liveController.turn_off_illumination()
 
+            # copy the frame into the frame pool (unless the camera driver has written it there) and unlock the camera
+            # right away so that the next frame is not dropped while this one is being processed
+            with tracer.span('frame copy','live'):
+                if self.frame_buffer.is_latest(camera.current_frame):
+                    frame = camera.current_frame
+                else:
+                    frame = self.frame_buffer.put(camera.current_frame,camera.frame_ID,camera.timestamp)
+            frame_ID = camera.frame_ID
+            timestamp = camera.timestamp
+            camera.image_locked = False
+            if frame is None:
+                self.handler_busy = False
+                return
+
             # measure real fps
             timestamp_now = round(time.time())
             if timestamp_now == self.timestamp_last:
@@ -158,44 +190,57 @@ class StreamHandler(QObject):
                 self.fps_real = self.counter
                 self.counter = 0
                 print('real camera fps is ' + str(self.fps_real))
+                if self.frame_buffer.frames_dropped > self.frames_dropped_reported:
+                    print(str(self.frame_buffer.frames_dropped - self.frames_dropped_reported) + ' frames dropped with all frame buffer slots in use (' + str(self.frame_buffer.frames_dropped) + ' in total)')
+                    self.frames_dropped_reported = self.frame_buffer.frames_dropped
 
             # moved down (so that it does not modify the camera.current_frame, which causes minor problems for simulation) - 1/30/2022
             # # rotate and flip - eventually these should be done in the camera
             # camera.current_frame = utils.rotate_and_flip_image(camera.current_frame,rotate_image_angle=camera.rotate_image_angle,flip_image=camera.flip_image)
 
             # crop image
-            image_cropped = utils.crop_image(camera.current_frame,self.crop_width,self.crop_height)
-            image_cropped = np.squeeze(image_cropped)
+            with tracer.span('process','live'):
+                image_cropped = utils.crop_image(frame,self.crop_width,self.crop_height)
+                image_cropped = np.squeeze(image_cropped)
 
-            # # rotate and flip - moved up (1/10/2022)
-            # image_cropped = utils.rotate_and_flip_image(image_cropped,rotate_image_angle=ROTATE_IMAGE_ANGLE,flip_image=FLIP_IMAGE)
-            # added on 1/30/2022
-            # @@@ to move to camera
-            image_cropped = utils.rotate_and_flip_image(image_cropped,rotate_image_angle=camera.rotate_image_angle,flip_image=camera.flip_image)
+                # # rotate and flip - moved up (1/10/2022)
+                # image_cropped = utils.rotate_and_flip_image(image_cropped,rotate_image_angle=ROTATE_IMAGE_ANGLE,flip_image=FLIP_IMAGE)
+                # added on 1/30/2022
+                # @@@ to move to camera
+                # no copy - image_cropped is a view of the frame pool slot unless it is rotated/flipped
+                image_cropped = utils.rotate_and_flip_image(image_cropped,rotate_image_angle=camera.rotate_image_angle,flip_image=camera.flip_image,copy=False)
 
             # send image to display
             time_now = time.time()
             if time_now-self.timestamp_last_display >= 1/self.fps_display:
                 # self.image_to_display.emit(cv2.resize(image_cropped,(round(self.crop_width*self.display_resolution_scaling), round(self.crop_height*self.display_resolution_scaling)),cv2.INTER_LINEAR))
-                self.image_to_display.emit(utils.crop_image(image_cropped,round(self.crop_width*self.display_resolution_scaling), round(self.crop_height*self.display_resolution_scaling)))
+                with tracer.span('display emit','live'):
+                    self.image_to_display.emit(utils.crop_image(image_cropped,round(self.crop_width*self.display_resolution_scaling), round(self.crop_height*self.display_resolution_scaling)))
                 self.timestamp_last_display = time_now
 
             # send image to write
             if self.save_image_flag and time_now-self.timestamp_last_save >= 1/self.fps_save:
-                if camera.is_color:
-                    image_cropped = cv2.cvtColor(image_cropped,cv2.COLOR_RGB2BGR)
-                self.packet_image_to_write.emit(image_cropped,camera.frame_ID,camera.timestamp)
+                # colour frames stay RGB, the saver converts them only for cv2.imwrite
+                # the saver may hold on to the frame for a while - pin the slot if the saver releases
+                # it after writing, otherwise hand over a copy
+                if self.frame_buffer.pinning_enabled and self.frame_buffer.acquire(image_cropped):
+                    image_to_write = image_cropped
+                elif np.shares_memory(image_cropped,frame):
+                    image_to_write = np.copy(image_cropped)
+                else:
+                    image_to_write = image_cropped
+                with tracer.span('save emit','live'):
+                    self.packet_image_to_write.emit(image_to_write,frame_ID,timestamp)
                 self.timestamp_last_save = time_now
 
             # send image to track
             if self.track_flag and time_now-self.timestamp_last_track >= 1/self.fps_track:
                 # track is a blocking operation - it needs to be
                 # @@@ will cropping before emitting the signal lead to speedup?
-                self.packet_image_for_tracking.emit(image_cropped,camera.frame_ID,camera.timestamp)
+                self.packet_image_for_tracking.emit(image_cropped,frame_ID,timestamp)
                 self.timestamp_last_track = time_now
 
             self.handler_busy = False
-            camera.image_locked = False
 
     '''
     def on_new_frame_from_simulation(self,image,frame_ID,timestamp):
@@ -235,7 +280,14 @@ class ImageSaver(QObject):
         self.experiment_ID = ''
         self.image_format = image_format
         self.max_num_image_per_folder = 1000
-        self.queue = Queue(10) # max 10 items in the queue
+        self.container_format = RECORDING_CONTAINER_FORMAT
+        self.writer = None
+        self.queue = Queue(IMAGE_SAVER_QUEUE_SIZE)
+        # bound the memory held by queued frames in addition to the number of queued frames
+        self.max_queue_bytes = IMAGE_SAVER_MAX_QUEUE_MEMORY_MB*1024*1024
+        self.queue_bytes = 0
+        self.queue_bytes_lock = Lock() # updated by the stream handler and the saving thread
+        self.frames_dropped = 0
         self.image_lock = Lock()
         self.stop_signal_received = False
         self.thread = Thread(target=self.process_queue)
@@ -243,6 +295,12 @@ class ImageSaver(QObject):
         self.counter = 0
         self.recording_start_time = 0
         self.recording_time_limit = -1
+        self.frame_buffer = None
+
+    def set_frame_buffer(self,frame_buffer):
+        # frames from the stream handler's frame pool are released after they are written
+        self.frame_buffer = frame_buffer
+        self.frame_buffer.enable_pinning(True)
 
     def process_queue(self):
         while True:
@@ -252,35 +310,70 @@ class ImageSaver(QObject):
             # process the queue
             try:
                 [image,frame_ID,timestamp] = self.queue.get(timeout=0.1)
-                self.image_lock.acquire(True)
-                folder_ID = int(self.counter/self.max_num_image_per_folder)
-                file_ID = int(self.counter%self.max_num_image_per_folder)
-                # create a new folder
-                if file_ID == 0:
-                    os.mkdir(os.path.join(self.base_path,self.experiment_ID,str(folder_ID)))
-
-                if image.dtype == np.uint16:
-                    # need to use tiff when saving 16 bit images
-                    saving_path = os.path.join(self.base_path,self.experiment_ID,str(folder_ID),str(file_ID) + '_' + str(frame_ID) + '.tiff')
-                    iio.imwrite(saving_path,image)
-                else:
-                    saving_path = os.path.join(self.base_path,self.experiment_ID,str(folder_ID),str(file_ID) + '_' + str(frame_ID) + '.' + self.image_format)
-                    cv2.imwrite(saving_path,image)
-
-                self.counter = self.counter + 1
-                self.queue.task_done()
-                self.image_lock.release()
             except:
-                pass
+                continue
+            self.image_lock.acquire(True)
+            try:
+                if image is None:
+                    # end of recording
+                    self._close_writer()
+                elif self.writer is not None:
+                    self.writer.write(image,frame_ID,timestamp)
+                    self.counter = self.counter + 1
+                else:
+                    folder_ID = int(self.counter/self.max_num_image_per_folder)
+                    file_ID = int(self.counter%self.max_num_image_per_folder)
+                    # create a new folder
+                    if file_ID == 0:
+                        os.mkdir(os.path.join(self.base_path,self.experiment_ID,str(folder_ID)))
+
+                    if image.dtype == np.uint16:
+                        # need to use tiff when saving 16 bit images
+                        saving_path = os.path.join(self.base_path,self.experiment_ID,str(folder_ID),str(file_ID) + '_' + str(frame_ID) + '.tiff')
+                        iio.imwrite(saving_path,image)
+                    else:
+                        saving_path = os.path.join(self.base_path,self.experiment_ID,str(folder_ID),str(file_ID) + '_' + str(frame_ID) + '.' + self.image_format)
+                        cv2.imwrite(saving_path,cv2.cvtColor(image,cv2.COLOR_RGB2BGR) if image.ndim == 3 else image)
+                    self.counter = self.counter + 1
+            except Exception as e:
+                print('imageSaver: error saving image: ' + str(e))
+            if image is not None:
+                with self.queue_bytes_lock:
+                    self.queue_bytes = self.queue_bytes - image.nbytes
+                if self.frame_buffer is not None:
+                    self.frame_buffer.release(image)
+            self.queue.task_done()
+            self.image_lock.release()
 
     def enqueue(self,image,frame_ID,timestamp):
-        try:
-            self.queue.put_nowait([image,frame_ID,timestamp])
-            if ( self.recording_time_limit>0 ) and ( time.time()-self.recording_start_time >= self.recording_time_limit ):
-                self.stop_recording.emit()
-            # when using self.queue.put(str_), program can be slowed down despite multithreading because of the block and the GIL
-        except:
-            print('imageSaver queue is full, image discarded')
+        # backpressure: drop the new frame rather than blocking the stream handler
+        # when using self.queue.put(str_), program can be slowed down despite multithreading because of the block and the GIL
+        with self.queue_bytes_lock:
+            queued = self.queue_bytes + image.nbytes <= self.max_queue_bytes
+            if queued:
+                try:
+                    self.queue.put_nowait([image,frame_ID,timestamp])
+                    self.queue_bytes = self.queue_bytes + image.nbytes
+                except Full:
+                    queued = False
+        if not queued:
+            if self.frame_buffer is not None:
+                self.frame_buffer.release(image)
+            self.frames_dropped = self.frames_dropped + 1
+            print('imageSaver queue is full, image discarded (' + str(self.frames_dropped) + ' dropped)')
+            return
+        if ( self.recording_time_limit>0 ) and ( time.time()-self.recording_start_time >= self.recording_time_limit ):
+            self.stop_recording.emit()
+
+    def set_container_format(self,container_format):
+        # 'files', 'zarr' or 'tiff' - takes effect for the next recording
+        self.container_format = container_format
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            print('recording finished: ' + str(self.writer.frames_written) + ' frames written, ' + str(self.frames_dropped) + ' frames dropped')
+            self.writer = None
 
     def set_base_path(self,path):
         self.base_path = path
@@ -302,12 +395,22 @@ class ImageSaver(QObject):
         except:
             pass
         # reset the counter
+        self.image_lock.acquire(True)
+        self._close_writer()
+        self.writer = create_recording_writer(self.container_format,os.path.join(self.base_path,self.experiment_ID))
         self.counter = 0
+        self.frames_dropped = 0
+        self.image_lock.release()
+
+    def finish_experiment(self):
+        # the writer is closed by the saving thread once the frames queued before this call are written
+        self.queue.put([None,-1,0])
 
     def close(self):
         self.queue.join()
         self.stop_signal_received = True
         self.thread.join()
+        self._close_writer()
 
 
 class ImageSaver_Tracking(QObject):
@@ -999,6 +1102,11 @@ class NavigationController(QObject):
         self.move_y_to(y_mm)
         self.microcontroller.wait_till_operation_is_completed()
 
+    def move_xy_to(self,x_mm,y_mm):
+        # both axes move at the same time, the controller reports the command as completed once x and y have both arrived
+        self.move_x_to(x_mm)
+        self.move_y_to(y_mm)
+
     def configure_encoder(self, axis, transitions_per_revolution,flip_direction):
         self.microcontroller.configure_stage_pid(axis, transitions_per_revolution=int(transitions_per_revolution), flip_direction=flip_direction)
 
@@ -1044,13 +1152,11 @@ class SlidePositionControlWorker(QObject):
         self.home_x_and_y_separately = home_x_and_y_separately
 
     def wait_till_operation_is_completed(self,timestamp_start, SLIDE_POTISION_SWITCHING_TIMEOUT_LIMIT_S):
-        while self.microcontroller.is_busy():
-            time.sleep(SLEEP_TIME_S)
-            if time.time() - timestamp_start > SLIDE_POTISION_SWITCHING_TIMEOUT_LIMIT_S:
-                print('Error - slide position switching timeout, the program will exit')
-                self.navigationController.move_x(0)
-                self.navigationController.move_y(0)
-                sys.exit(1)
+        if not self.microcontroller.wait_for_completion(max(0,SLIDE_POTISION_SWITCHING_TIMEOUT_LIMIT_S - (time.time() - timestamp_start))):
+            print('Error - slide position switching timeout, the program will exit')
+            self.navigationController.move_x(0)
+            self.navigationController.move_y(0)
+            sys.exit(1)
 
     def move_to_slide_loading_position(self):
         was_live = self.liveController.is_live
@@ -1320,108 +1426,271 @@ class AutofocusWorker(QObject):
 
         self.crop_width = self.autofocusController.crop_width
         self.crop_height = self.autofocusController.crop_height
+        self.method = self.autofocusController.af_method
+        self.peak_fit = self.autofocusController.peak_fit
 
     def run(self):
-        self.run_autofocus()
+        with tracer.span('contrast autofocus','autofocus',method=self.method):
+            self.run_autofocus()
         self.finished.emit()
 
     def wait_till_operation_is_completed(self):
-        while self.microcontroller.is_busy():
-            time.sleep(SLEEP_TIME_S)
+        self.microcontroller.wait_for_completion()
 
     def run_autofocus(self):
         # @@@ to add: increase gain, decrease exposure time
         # @@@ can move the execution into a thread - done 08/21/2021
-        focus_measure_vs_z = [0]*self.N
-        focus_measure_max = 0
+        self.frames_used = 0
+        self.z_moves = 0
+        self.z_offset_usteps = 0 # relative to the z where the autofocus started
+        self.focus_measures = {} # z offset (usteps) -> focus measure
+
+        if self.method == 'coarse_to_fine':
+            self.run_coarse_to_fine_search()
+        elif self.method == 'golden_section':
+            self.run_golden_section_search()
+        elif self.method == 'continuous':
+            self.run_continuous_sweep()
+        else:
+            self.run_sweep()
+
+        QApplication.processEvents()
+
+        # move to the in-focus position
+        z_in_focus_usteps = self.find_focus_peak()
+        self.move_to_z_offset(z_in_focus_usteps)
 
+        QApplication.processEvents()
+
+        z_min, z_max = self.get_z_range_usteps()
+        if z_in_focus_usteps <= z_min:
+            print('moved to the bottom end of the AF range')
+        if z_in_focus_usteps >= z_max:
+            print('moved to the top end of the AF range')
+        self.autofocusController.last_autofocus_result = {
+            'method': self.method,
+            'peak_fit': self.peak_fit,
+            'frames': self.frames_used,
+            'z_moves': self.z_moves,
+            'z_offset_um': z_in_focus_usteps*self.navigationController.get_mm_per_ustep_Z()*1000 }
+        print('autofocus (' + self.method + '): ' + str(self.frames_used) + ' frames, ' + str(self.z_moves) + ' z moves, z offset ' + str(round(self.autofocusController.last_autofocus_result['z_offset_um'],2)) + ' um')
+
+    def get_z_range_usteps(self):
+        # first and last positions of the sweep, the other searches use the same range
         z_af_offset_usteps = self.deltaZ_usteps*round(self.N/2)
-        # self.navigationController.move_z_usteps(-z_af_offset_usteps) # combine with the back and forth maneuver below
-        # self.wait_till_operation_is_completed()
+        return self.deltaZ_usteps - z_af_offset_usteps, self.N*self.deltaZ_usteps - z_af_offset_usteps
 
-        # maneuver for achiving uniform step size and repeatability when using open-loop control
-        # can be moved to the firmware
-        if self.navigationController.get_pid_control_flag(2) is False:
+    def move_to_z_offset(self,z_offset_usteps):
+        # targets are approached from below (upward move) to get uniform step size and repeatability when using open-loop control
+        z_offset_usteps = int(round(z_offset_usteps))
+        delta_usteps = z_offset_usteps - self.z_offset_usteps
+        if delta_usteps == 0:
+            return
+        if delta_usteps < 0 and self.navigationController.get_pid_control_flag(2) is False:
             _usteps_to_clear_backlash = max(160,20*self.navigationController.z_microstepping)
-            self.navigationController.move_z_usteps(-_usteps_to_clear_backlash-z_af_offset_usteps)
+            self.navigationController.move_z_usteps(delta_usteps-_usteps_to_clear_backlash)
             self.wait_till_operation_is_completed()
             self.navigationController.move_z_usteps(_usteps_to_clear_backlash)
-            self.wait_till_operation_is_completed()
         else:
-            self.navigationController.move_z_usteps(-z_af_offset_usteps)
-            self.wait_till_operation_is_completed()
+            self.navigationController.move_z_usteps(delta_usteps)
+        self.wait_till_operation_is_completed()
+        self.z_offset_usteps = z_offset_usteps
+        self.z_moves = self.z_moves + 1
 
-        steps_moved = 0
-        for i in range(self.N):
-            self.navigationController.move_z_usteps(self.deltaZ_usteps)
+    def acquire_image(self):
+        # trigger acquisition (including turning on the illumination) and read frame
+        if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
+            self.liveController.turn_on_illumination()
             self.wait_till_operation_is_completed()
-            steps_moved = steps_moved + 1
-            # trigger acquisition (including turning on the illumination) and read frame
-            if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
-                self.liveController.turn_on_illumination()
-                self.wait_till_operation_is_completed()
-                self.camera.send_trigger()
+            self.camera.send_trigger()
+            image = self.camera.read_frame()
+        elif self.liveController.trigger_mode == TriggerMode.HARDWARE:
+            if 'Fluorescence' in config.name and ENABLE_NL5 and NL5_USE_DOUT:
+                self.camera.image_is_ready = False # to remove
+                self.microscope.nl5.start_acquisition()
+                image = self.camera.read_frame(reset_image_ready_flag=False)
+            else:
+                self.microcontroller.send_hardware_trigger(control_illumination=True,illumination_on_time_us=self.camera.exposure_time*1000)
                 image = self.camera.read_frame()
-            elif self.liveController.trigger_mode == TriggerMode.HARDWARE:
-                if 'Fluorescence' in config.name and ENABLE_NL5 and NL5_USE_DOUT:
-                    self.camera.image_is_ready = False # to remove
-                    self.microscope.nl5.start_acquisition()
-                    image = self.camera.read_frame(reset_image_ready_flag=False)
-                else:
-                    self.microcontroller.send_hardware_trigger(control_illumination=True,illumination_on_time_us=self.camera.exposure_time*1000)
-                    image = self.camera.read_frame()
-            if image is None:
-                continue
-            # tunr of the illumination if using software trigger
-            if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
-                self.liveController.turn_off_illumination()
+        if image is None:
+            return None
+        # tunr of the illumination if using software trigger
+        if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
+            self.liveController.turn_off_illumination()
+        self.frames_used = self.frames_used + 1
+        return image
+
+    def measure_focus_at(self,z_offset_usteps):
+        # each z position is imaged only once
+        z_offset_usteps = int(round(z_offset_usteps))
+        if z_offset_usteps in self.focus_measures:
+            return self.focus_measures[z_offset_usteps]
+        with tracer.span('move z','autofocus'):
+            self.move_to_z_offset(z_offset_usteps)
+        with tracer.span('acquire','autofocus'):
+            image = self.acquire_image()
+        if image is None:
+            self.focus_measures[z_offset_usteps] = 0
+            return 0
 
+        with tracer.span('process','autofocus'):
             image = utils.crop_image(image,self.crop_width,self.crop_height)
             image = utils.rotate_and_flip_image(image,rotate_image_angle=self.camera.rotate_image_angle,flip_image=self.camera.flip_image)
+        with tracer.span('display emit','autofocus'):
             self.image_to_display.emit(image)
-            #image_to_display = utils.crop_image(image,round(self.crop_width* self.liveController.display_resolution_scaling), round(self.crop_height* self.liveController.display_resolution_scaling))
+        #image_to_display = utils.crop_image(image,round(self.crop_width* self.liveController.display_resolution_scaling), round(self.crop_height* self.liveController.display_resolution_scaling))
 
-            QApplication.processEvents()
-            timestamp_0 = time.time()
-            focus_measure = utils.calculate_focus_measure(image,FOCUS_MEASURE_OPERATOR)
-            timestamp_1 = time.time()
-            print('             calculating focus measure took ' + str(timestamp_1-timestamp_0) + ' second')
-            focus_measure_vs_z[i] = focus_measure
-            print(i,focus_measure)
+        QApplication.processEvents()
+        with tracer.span('focus measure','autofocus'):
+            focus_measure = utils.calculate_focus_measure(image,FOCUS_MEASURE_OPERATOR,FOCUS_MEASURE_DOWNSAMPLE,FOCUS_MEASURE_ROI_GRID,FOCUS_MEASURE_ROI_REDUCE)
+        print(z_offset_usteps,focus_measure)
+        self.focus_measures[z_offset_usteps] = focus_measure
+        return focus_measure
+
+    def run_sweep(self,z_positions_usteps=None):
+        # stops once the focus measure has dropped well below the best one seen
+        if z_positions_usteps is None:
+            z_af_offset_usteps = self.deltaZ_usteps*round(self.N/2)
+            z_positions_usteps = [(i+1)*self.deltaZ_usteps - z_af_offset_usteps for i in range(self.N)]
+        focus_measure_max = 0
+        for z_offset_usteps in z_positions_usteps:
+            focus_measure = self.measure_focus_at(z_offset_usteps)
             focus_measure_max = max(focus_measure, focus_measure_max)
             if focus_measure < focus_measure_max*AF.STOP_THRESHOLD:
                 break
 
-        QApplication.processEvents()
-
-        # move to the starting location
-        # self.navigationController.move_z_usteps(-steps_moved*self.deltaZ_usteps) # combine with the back and forth maneuver below
-        # self.wait_till_operation_is_completed()
+    def run_coarse_to_fine_search(self):
+        z_min, z_max = self.get_z_range_usteps()
+        coarse_step_usteps = self.deltaZ_usteps*AF_COARSE_STEP_FACTOR
+        n_coarse = max(2,int(np.ceil((z_max-z_min)/coarse_step_usteps))+1)
+        self.run_sweep([min(z_min+i*coarse_step_usteps,z_max) for i in range(n_coarse)])
+        z_best = max(self.focus_measures,key=self.focus_measures.get)
+        # fine steps between the coarse neighbours of the best coarse position
+        self.run_sweep([z_best + i*self.deltaZ_usteps for i in range(1-AF_COARSE_STEP_FACTOR,AF_COARSE_STEP_FACTOR) if z_min <= z_best + i*self.deltaZ_usteps <= z_max])
+
+    def run_golden_section_search(self):
+        # search over the sweep positions (in units of dz) assuming a unimodal focus curve
+        z_min, z_max = self.get_z_range_usteps()
+        f = lambda i: self.measure_focus_at(z_min + i*self.deltaZ_usteps)
+        invphi = (np.sqrt(5)-1)/2
+        a = 0
+        b = self.N - 1
+        while b - a > 2:
+            c = int(round(b - invphi*(b-a)))
+            d = int(round(a + invphi*(b-a)))
+            if c == d:
+                d = c + 1
+            if f(c) >= f(d):
+                b = d
+            else:
+                a = c
+        for i in range(a,b+1):
+            f(i)
+
+    def run_continuous_sweep(self):
+        # one continuous z move over the AF range, frames are streamed through the camera callback and each one is
+        # tagged with the z at the middle of its exposure, interpolated from the positions reported by the microcontroller
+        z_min, z_max = self.get_z_range_usteps()
+        mm_per_ustep_Z = self.navigationController.get_mm_per_ustep_Z()
+        velocity_before, acceleration = self.microcontroller.max_velocity_acceleration[AXIS.Z]
+        frame_period_s = (self.camera.exposure_time + AF_CONTINUOUS_FRAME_OVERHEAD_MS)/1000
+        # the velocity the microcontroller applies (it is set in steps of 0.01 mm/s) is used for the ramp, the timeout and the report
+        velocity = max(applied_velocity_mm(min(abs(self.deltaZ)/frame_period_s,velocity_before)),0.01)
+        # start and stop outside of the range so that the velocity is constant within it
+        ramp_usteps = int(np.ceil(velocity**2/(2*acceleration)/mm_per_ustep_Z)) + abs(self.deltaZ_usteps)
+        z_start = z_min - ramp_usteps
+        z_end = z_max + ramp_usteps
+
+        self.move_to_z_offset(z_start)
+        z_pos_start = self.microcontroller.z_pos
+        self.microcontroller.set_max_velocity_acceleration(AXIS.Z,velocity,acceleration)
+        self.wait_till_operation_is_completed()
 
-        # maneuver for achiving uniform step size and repeatability when using open-loop control
-        if self.navigationController.get_pid_control_flag(2) is False:
-            _usteps_to_clear_backlash = max(160,20*self.navigationController.z_microstepping)
-            self.navigationController.move_z_usteps(-_usteps_to_clear_backlash-steps_moved*self.deltaZ_usteps)
-            # determine the in-focus position
-            idx_in_focus = focus_measure_vs_z.index(max(focus_measure_vs_z))
-            self.wait_till_operation_is_completed()
-            self.navigationController.move_z_usteps(_usteps_to_clear_backlash+(idx_in_focus+1)*self.deltaZ_usteps)
-            self.wait_till_operation_is_completed()
-        else:
-            # determine the in-focus position
-            idx_in_focus = focus_measure_vs_z.index(max(focus_measure_vs_z))
-            self.navigationController.move_z_usteps((idx_in_focus+1)*self.deltaZ_usteps-steps_moved*self.deltaZ_usteps)
+        frames = []
+        frame_received = Event()
+        def on_frame(camera):
+            frames.append(np.copy(utils.crop_image(camera.current_frame,self.crop_width,self.crop_height)))
+            frame_received.set()
+        callback_before = self.camera.new_image_callback_external
+        callback_was_enabled = self.camera.callback_is_enabled
+        self.camera.set_callback(on_frame)
+        self.camera.enable_callback()
+        if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
+            self.liveController.turn_on_illumination()
             self.wait_till_operation_is_completed()
 
-        QApplication.processEvents()
+        self.microcontroller.start_z_position_recording()
+        self.navigationController.move_z_usteps(z_end - z_start)
+        trigger_timestamps = []
+        timeout = time.time() + (z_end-z_start)*mm_per_ustep_Z/velocity + 5
+        while self.microcontroller.mcu_cmd_execution_in_progress and time.time() < timeout:
+            frame_received.clear()
+            trigger_timestamps.append(time.time())
+            if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
+                self.camera.send_trigger()
+            else:
+                self.microcontroller.send_hardware_trigger(control_illumination=True,illumination_on_time_us=self.camera.exposure_time*1000)
+            if not frame_received.wait(self.camera.exposure_time/1000 + AF_CONTINUOUS_FRAME_TIMEOUT_S):
+                # a late frame would be matched with the wrong trigger, stop here
+                print('continuous AF: frame timeout')
+                trigger_timestamps.pop()
+                break
+        self.wait_till_operation_is_completed()
+        z_pos_history = self.microcontroller.stop_z_position_recording()
+        self.z_offset_usteps = z_end
+        self.z_moves = self.z_moves + 1
 
-        # move to the calculated in-focus position
-        # self.navigationController.move_z_usteps(idx_in_focus*self.deltaZ_usteps)
-        # self.wait_till_operation_is_completed() # combine with the movement above
-        if idx_in_focus == 0:
-            print('moved to the bottom end of the AF range')
-        if idx_in_focus == self.N-1:
-            print('moved to the top end of the AF range')
+        if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
+            self.liveController.turn_off_illumination()
+        self.camera.disable_callback()
+        self.camera.set_callback(callback_before)
+        if callback_was_enabled:
+            self.camera.enable_callback()
+        self.microcontroller.set_max_velocity_acceleration(AXIS.Z,velocity_before,acceleration)
+        self.wait_till_operation_is_completed()
+
+        self.frames_used = self.frames_used + len(frames)
+        if len(z_pos_history) < 2:
+            print('continuous AF: no position updates received during the sweep')
+            return
+        t_history = np.array([t for t, z_pos in z_pos_history])
+        z_history = z_start + STAGE_MOVEMENT_SIGN_Z*(np.array([z_pos for t, z_pos in z_pos_history]) - z_pos_start)
+        for image, timestamp in zip(frames,trigger_timestamps):
+            timestamp = timestamp + self.camera.exposure_time/2000
+            if timestamp < t_history[0] or timestamp > t_history[-1]:
+                continue
+            z_offset_usteps = int(round(np.interp(timestamp,t_history,z_history)))
+            if z_offset_usteps < z_min or z_offset_usteps > z_max:
+                continue
+            image = utils.rotate_and_flip_image(image,rotate_image_angle=self.camera.rotate_image_angle,flip_image=self.camera.flip_image,copy=False)
+            self.focus_measures[z_offset_usteps] = utils.calculate_focus_measure(image,FOCUS_MEASURE_OPERATOR,FOCUS_MEASURE_DOWNSAMPLE,FOCUS_MEASURE_ROI_GRID,FOCUS_MEASURE_ROI_REDUCE)
+        print('continuous AF: ' + str(len(frames)) + ' frames, ' + str(len(self.focus_measures)) + ' within the AF range, sweep velocity ' + str(round(velocity,3)) + ' mm/s')
+        if len(frames) > 0:
+            self.image_to_display.emit(frames[-1])
+        if len(self.focus_measures) < 3:
+            print('continuous AF: not enough frames, falling back to the step sweep')
+            self.run_sweep()
+
+    def find_focus_peak(self):
+        # z offset (usteps) of the best focus measure, refined with its two neighbours if a peak fit is selected
+        z = sorted(self.focus_measures)
+        focus_measure = [self.focus_measures[z_offset_usteps] for z_offset_usteps in z]
+        idx = int(np.argmax(focus_measure))
+        if self.peak_fit == 'none' or idx == 0 or idx == len(z)-1:
+            return z[idx]
+        x0, x1, x2 = z[idx-1], z[idx], z[idx+1]
+        y0, y1, y2 = focus_measure[idx-1], focus_measure[idx], focus_measure[idx+1]
+        if self.peak_fit == 'gaussian':
+            if min(y0,y1,y2) <= 0:
+                return z[idx]
+            y0, y1, y2 = np.log(y0), np.log(y1), np.log(y2)
+        # vertex of the parabola through the three points
+        denom = (x0-x1)*(x0-x2)*(x1-x2)
+        A = (x2*(y1-y0) + x1*(y0-y2) + x0*(y2-y1))/denom
+        B = (x2*x2*(y0-y1) + x1*x1*(y2-y0) + x0*x0*(y1-y2))/denom
+        if A >= 0:
+            return z[idx]
+        return int(round(min(max(-B/(2*A),x0),x2)))
 
 class AutoFocusController(QObject):
 
@@ -1442,6 +1711,11 @@ class AutoFocusController(QObject):
         self.autofocus_in_progress = False
         self.focus_map_coords = []
         self.use_focus_map = False
+        self.focus_surface = FocusSurface() # fitted to focus_map_coords when the focus map is enabled
+        self.focus_surface_points_not_fitted = 0
+        self.af_method = AF_METHOD
+        self.peak_fit = AF_PEAK_FIT
+        self.last_autofocus_result = None # method, frames, z moves and z offset of the last contrast AF
 
     def set_N(self,N):
         self.N = N
@@ -1455,6 +1729,14 @@ class AutoFocusController(QObject):
         self.crop_width = crop_width
         self.crop_height = crop_height
 
+    def set_af_method(self,method):
+        # 'sweep', 'coarse_to_fine', 'golden_section' or 'continuous'
+        self.af_method = method
+
+    def set_peak_fit(self,peak_fit):
+        # 'none', 'parabolic' or 'gaussian'
+        self.peak_fit = peak_fit
+
     def autofocus(self, focus_map_override=False):
         if self.use_focus_map and (not focus_map_override):
             self.autofocus_in_progress = True
@@ -1463,10 +1745,11 @@ class AutoFocusController(QObject):
             y = self.navigationController.y_pos_mm
 
             # z here is in mm because that's how the navigation controller stores it
-            target_z = utils.interpolate_plane(*self.focus_map_coords[:3], (x,y))
+            target_z = self.focus_surface.predict(x,y)
             print(f"Interpolated target z as {target_z} mm from focus map, moving there.")
-            self.navigationController.move_z_to(target_z)
-            self.navigationController.microcontroller.wait_till_operation_is_completed()
+            if abs(target_z - self.navigationController.z_pos_mm) >= self.navigationController.get_mm_per_ustep_Z():
+                self.navigationController.move_z_to(target_z)
+                self.navigationController.microcontroller.wait_till_operation_is_completed()
             self.autofocus_in_progress = False
             self.autofocusFinished.emit()
             return
@@ -1546,29 +1829,54 @@ class AutoFocusController(QObject):
             print("Not enough coordinates (less than 3) for focus map generation, disabling focus map.")
             self.use_focus_map = False
             return
-        x1,y1,_ = self.focus_map_coords[0]
-        x2,y2,_ = self.focus_map_coords[1]
-        x3,y3,_ = self.focus_map_coords[2]
-
-        detT = (y2 - y3) * (x1 - x3) + (x3 - x2) * (y1 - y3)
-        if detT == 0:
-            print("Your 3 x-y coordinates are linear, cannot use to interpolate, disabling focus map.")
+        self.focus_surface.set_points(self.focus_map_coords)
+        try:
+            method = self.focus_surface.fit()
+        except ValueError as e:
+            print("Cannot fit the focus map (" + str(e) + "), disabling focus map.")
             self.use_focus_map = False
             return
 
         if enable:
-            print("Enabling focus map.")
+            print("Enabling focus map (" + method + " fit to " + str(len(self.focus_map_coords)) + " points).")
             self.use_focus_map = True
 
+    def add_focus_measurement(self,x,y,z,source='autofocus',refit=True):
+        # add a measured in-focus position (e.g. from contrast or laser AF during a scan) to the focus map, the surface is refitted if in use
+        # during a scan refit is False and the points are fitted at once by refit_focus_surface
+        self.focus_map_coords.append((x,y,z))
+        if self.use_focus_map:
+            self.focus_surface.add_point(x,y,z,source,refit=refit)
+            self.focus_surface_points_not_fitted = 0 if refit else self.focus_surface_points_not_fitted + 1
+
+    def refit_focus_surface(self):
+        # returns True if points added since the last fit have been fitted
+        if not self.use_focus_map or self.focus_surface_points_not_fitted == 0:
+            return False
+        self.focus_surface_points_not_fitted = 0
+        try:
+            self.focus_surface.fit()
+        except ValueError as e:
+            print('focus surface: ' + str(e))
+            return False
+        return True
+
+    def predict_focus_z(self,positions):
+        # z (mm) of the focus surface at each (x,y) in positions, None if the focus map is not in use
+        if not self.use_focus_map:
+            return None
+        return self.focus_surface.predict_many([position[:2] for position in positions])
+
     def clear_focus_map(self):
         self.focus_map_coords = []
         self.set_focus_map_use(False)
 
-    def gen_focus_map(self, coord1,coord2,coord3):
+    def gen_focus_map(self, coord1,coord2,coord3,*more_coords):
         """
-        Navigate to 3 coordinates and get your focus-map coordinates
+        Navigate to 3 (or more) coordinates and get your focus-map coordinates
         by autofocusing there and saving the z-values.
         :param coord1-3: Tuples of (x,y) values, coordinates in mm.
+        :param more_coords: additional (x,y) tuples for fitting a curved surface.
         :raise: ValueError if coordinates are all on the same line
         """
         x1,y1 = coord1
@@ -1580,7 +1888,7 @@ class AutoFocusController(QObject):
 
         self.focus_map_coords = []
 
-        for coord in [coord1,coord2,coord3]:
+        for coord in [coord1,coord2,coord3] + list(more_coords):
             print(f"Navigating to coordinates ({coord[0]},{coord[1]}) to sample for focus map")
             self.navigationController.move_to(coord[0],coord[1])
             self.navigationController.microcontroller.wait_till_operation_is_completed()
@@ -1597,8 +1905,6 @@ class AutoFocusController(QObject):
         print("Generated focus map.")
 
     def add_current_coords_to_focus_map(self):
-        if len(self.focus_map_coords) >= 3:
-            print("Replacing last coordinate on focus map.")
         self.navigationController.microcontroller.wait_till_operation_is_completed()
         print("Autofocusing")
         self.autofocus(True)
@@ -1607,7 +1913,7 @@ class AutoFocusController(QObject):
         x = self.navigationController.x_pos_mm
         y = self.navigationController.y_pos_mm
         z = self.navigationController.z_pos_mm
-        if len(self.focus_map_coords) >= 2:
+        if len(self.focus_map_coords) == 2:
             x1,y1,_ = self.focus_map_coords[0]
             x2,y2,_ = self.focus_map_coords[1]
             x3 = x
@@ -1616,12 +1922,24 @@ class AutoFocusController(QObject):
             detT = (y2-y3) * (x1-x3) + (x3-x2) * (y1-y3)
             if detT == 0:
                 raise ValueError("Your 3 x-y coordinates are linear. Navigate to a different coordinate or clear and try again.")
-        if len(self.focus_map_coords) >= 3:
-            self.focus_map_coords.pop()
-        self.focus_map_coords.append((x,y,z))
+        self.add_focus_measurement(x,y,z,'manual')
         print(f"Added triple ({x},{y},{z}) to focus map")
 
 
+class PipelinedFrameProcessor(QObject):
+    '''
+    :brief: processes the frames of a pipelined multipoint acquisition in a QThread of its own, the frames are handed over by
+            the camera callback through a queued signal
+    '''
+
+    def __init__(self, multiPointWorker):
+        QObject.__init__(self)
+        self.multiPointWorker = multiPointWorker
+
+    def process_frame(self, image, frame_ID, timestamp):
+        self.multiPointWorker.process_pipelined_frame(image, frame_ID, timestamp)
+
+
 class MultiPointWorker(QObject):
 
     finished = Signal()
@@ -1640,10 +1958,13 @@ class MultiPointWorker(QObject):
     napari_rtp_layers_update = Signal(np.ndarray, str)
     signal_acquisition_progress = Signal(int, int, int)
     signal_region_progress = Signal(int, int)
+    signal_write_errors = Signal(object) # list of (saving path, error) of the images that could not be written
+    signal_pipelined_frame = Signal(np.ndarray, int, float) # image, frame ID, timestamp
 
     def __init__(self,multiPointController):
         QObject.__init__(self)
         self.multiPointController = multiPointController
+        self.write_errors = []
 
         self.signal_update_stats.connect(self.update_stats)
         self.start_time = 0
@@ -1669,6 +1990,7 @@ class MultiPointWorker(QObject):
         self.dt = self.multiPointController.deltat
         self.do_autofocus = self.multiPointController.do_autofocus
         self.do_reflection_af= self.multiPointController.do_reflection_af
+        self.use_focus_lock = self.multiPointController.use_focus_lock
         self.crop_width = self.multiPointController.crop_width
         self.crop_height = self.multiPointController.crop_height
         self.display_resolution_scaling = self.multiPointController.display_resolution_scaling
@@ -1688,6 +2010,9 @@ class MultiPointWorker(QObject):
             self.coordinate_dict = self.multiPointController.coordinate_dict.copy()
         else:
             self.coordinate_dict = None
+        self.fov_order = self.multiPointController.fov_order
+        self.focus_surface_z = self.multiPointController.focus_surface_z
+        self.focus_surface_fov_count = 0
         self.use_scan_coordinates = self.multiPointController.use_scan_coordinates
         self.scan_coordinates_mm = self.multiPointController.scan_coordinates_mm
         self.scan_coordinates_name = self.multiPointController.scan_coordinates_name
@@ -1716,6 +2041,62 @@ class MultiPointWorker(QObject):
         self.merged_image = None
         self.image_count = 0
 
+        # images are written in the background while the next FOV is acquired
+        self.image_writer = ImageWriterPool()
+        self.ome_zarr_writer = None
+        if self.multiPointController.output_format == 'ome_zarr':
+            self.ome_zarr_writer = HCSOmeZarrWriter(os.path.join(self.base_path,self.experiment_ID,'acquisition.ome.zarr'),
+                                                    [config.name for config in self.selected_configurations],
+                                                    Nt=self.Nt,NZ=self.NZ,dz_um=self.deltaZ*1000,
+                                                    pixel_size_um=self.multiPointController.get_pixel_size_um())
+        self.live_stitcher = None
+        if self.multiPointController.live_stitching and self.coordinate_dict is not None:
+            self.live_stitcher = LiveStitcher(os.path.join(self.base_path,self.experiment_ID,'stitched.ome.zarr'),
+                                              [config.name for config in self.selected_configurations],
+                                              self.coordinate_dict,Nt=self.Nt,NZ=self.NZ,dz_um=self.deltaZ*1000,
+                                              pixel_size_um=self.multiPointController.get_pixel_size_um())
+            self.multiPointController.live_stitching_path = self.live_stitcher.path
+        self.current_fov_key = None
+
+        # flatfield profiles applied to the images and/or fitted from a sample of them
+        self.flatfield_calibration = calibration_from_acquisition_parameters(self.multiPointController.acquisition_parameters)
+        self.flatfield_store = None
+        self.flatfield_correctors = {}
+        self.flatfield_sampler = None
+        self.flatfield_fit_thread = None
+        if FLATFIELD_APPLY_DURING_ACQUISITION or FLATFIELD_UPDATE_DURING_ACQUISITION:
+            self.flatfield_store = FlatfieldStore()
+        if FLATFIELD_APPLY_DURING_ACQUISITION:
+            objective, camera, binning = self.flatfield_calibration
+            for config in self.selected_configurations:
+                corrector = self.flatfield_store.get(objective, camera, config.name, binning)
+                if corrector is not None:
+                    self.flatfield_correctors[config.name] = corrector
+                else:
+                    print('no stored flatfield for ' + config.name + ', its images are not corrected')
+        # recorded for the stitchers, which then do not correct these channels again
+        self.multiPointController.update_acquisition_parameters(flatfield_corrected=len(self.flatfield_correctors) > 0,
+                                                                flatfield_corrected_channels=sorted(self.flatfield_correctors.keys()))
+        if FLATFIELD_UPDATE_DURING_ACQUISITION:
+            self.flatfield_sampler = FlatfieldSampler()
+
+        # pipelined acquisition
+        self.pipeline_active = False
+        self.pipeline_accepting = False
+        self.pipeline_pending = {} # trigger index -> parameters of the image
+        self.pipeline_trigger_time = {} # trigger index -> time the trigger was sent
+        self.pipeline_frames_in_flight = 0 # frames handed to the processing thread and not processed yet
+        self.pipeline_trigger_count = 0
+        self.pipeline_frame_ID_offset = None
+        self.pipeline_lock = Lock()
+        self.pipeline_frame_received = Condition(self.pipeline_lock)
+        self.pipeline_last_frame_ID = None
+        self.pipeline_config = None
+        self.pipeline_callback_before = None
+        self.pipeline_callback_was_enabled = False
+        self.pipeline_thread = None
+        self.pipeline_processor = None
+
     def update_stats(self, new_stats):
         self.count += 1
         print("stats", self.count)
@@ -1735,8 +2116,14 @@ class MultiPointWorker(QObject):
 
     def run(self):
         self.start_time = time.perf_counter_ns()
+        # an acquisition traced from outside (e.g. the benchmark) keeps its tracer running
+        self.tracing_started_here = TRACING_ENABLED and not tracer.enabled
+        if self.tracing_started_here:
+            tracer.start()
         if not self.camera.is_streaming:
             self.camera.start_streaming()
+        if self.pipelined_acquisition_possible():
+            self.start_pipelined_acquisition()
 
         while self.time_point < self.Nt:
             # check if abort acquisition has been requested
@@ -1765,9 +2152,28 @@ class MultiPointWorker(QObject):
                         break
                     time.sleep(0.05)
 
+        if self.do_reflection_af and self.microscope.laserAutofocusController.focus_lock_is_running():
+            self.microscope.laserAutofocusController.stop_focus_lock()
+            self.microscope.laserAutofocusController.get_focus_lock_telemetry().to_csv(os.path.join(self.base_path,self.experiment_ID,'focus_lock.csv'),index=False)
+
         elapsed_time = time.perf_counter_ns() - self.start_time
         print("Time taken for acquisition: " + str(elapsed_time/10**9))
 
+        # finish writing the images (also when the acquisition is aborted)
+        self.finish_pipelined_acquisition()
+        self.write_errors.extend(self.image_writer.close())
+        if self.ome_zarr_writer is not None:
+            self.ome_zarr_writer.close()
+        if self.live_stitcher is not None:
+            self.live_stitcher.close()
+        if self.flatfield_sampler is not None and not self.multiPointController.abort_acqusition_requested:
+            self.flatfield_fit_thread = self.flatfield_sampler.fit_in_background(self.flatfield_store, *self.flatfield_calibration)
+        print("Time taken for acquisition/saving: " + str((time.perf_counter_ns() - self.start_time)/10**9))
+        if tracer.enabled:
+            tracer.write(os.path.join(self.base_path,self.experiment_ID))
+        if self.tracing_started_here:
+            tracer.stop()
+
         # End processing using the updated method
         if DO_FLUORESCENCE_RTP:
             self.processingHandler.processing_queue.join()
@@ -1776,45 +2182,45 @@ class MultiPointWorker(QObject):
         # time.sleep(0.2)
         # wait for signal_update_stats in process_fn_with_count_and_display
         print("Time taken for acquisition/processing: ", (time.perf_counter_ns() - self.start_time) / 1e9)
+        if len(self.write_errors) > 0:
+            self.signal_write_errors.emit(self.write_errors)
         self.finished.emit()
 
     def wait_till_operation_is_completed(self):
-        while self.microcontroller.is_busy():
-            time.sleep(SLEEP_TIME_S)
+        self.microcontroller.wait_for_completion()
 
     def run_single_time_point(self):
-        start = time.time()
-        print(time.time())
-        # disable joystick button action
-        self.navigationController.enable_joystick_button_action = False
+        with tracer.span('time point',time_point=self.time_point):
+            # disable joystick button action
+            self.navigationController.enable_joystick_button_action = False
 
-        print('multipoint acquisition - time point ' + str(self.time_point+1))
+            print('multipoint acquisition - time point ' + str(self.time_point+1))
 
-        # for each time point, create a new folder
-        current_path = os.path.join(self.base_path,self.experiment_ID,str(self.time_point))
-        os.mkdir(current_path)
+            # for each time point, create a new folder
+            current_path = os.path.join(self.base_path,self.experiment_ID,str(self.time_point))
+            os.mkdir(current_path)
 
-        slide_path = os.path.join(self.base_path, self.experiment_ID)
+            slide_path = os.path.join(self.base_path, self.experiment_ID)
 
-        # create a dataframe to save coordinates
-        self.initialize_coordinates_dataframe()
+            # logs of the FOV coordinates and of the images, written to the time point folder as they grow
+            self.initialize_coordinates_dataframe(current_path)
 
-        # init z parameters, z range
-        self.initialize_z_stack()
+            # init z parameters, z range
+            self.initialize_z_stack()
 
-        if self.coordinate_dict is not None:
-            print("coordinate acquisition")
-            self.run_coordinate_acquisition(current_path)
-        else:
-            print("grid acquisition")
-            self.run_grid_acquisition(current_path)
+            if self.coordinate_dict is not None:
+                print("coordinate acquisition")
+                self.run_coordinate_acquisition(current_path)
+            else:
+                print("grid acquisition")
+                self.run_grid_acquisition(current_path)
 
-        # finished region scan
-        self.coordinates_pd.to_csv(os.path.join(current_path,'coordinates.csv'),index=False,header=True)
-        utils.create_done_file(current_path)
-        self.navigationController.enable_joystick_button_action = True
-        print(time.time())
-        print(time.time()-start)
+            # finished region scan
+            self.coordinate_log.close()
+            self.image_log.close()
+            self.write_errors.extend(self.image_writer.wait_until_done())
+            utils.create_done_file(current_path)
+            self.navigationController.enable_joystick_button_action = True
 
     def initialize_z_stack(self):
         self.count_rtp = 0
@@ -1842,51 +2248,56 @@ class MultiPointWorker(QObject):
             if MULTIPOINT_PIEZO_UPDATE_DISPLAY:
                 self.signal_z_piezo_um.emit(self.z_piezo_um)
 
-    def initialize_coordinates_dataframe(self):
+    def initialize_coordinates_dataframe(self, current_path):
         base_columns = ['z_level', 'x (mm)', 'y (mm)', 'z (um)', 'time']
         piezo_column = ['z_piezo (um)'] if self.use_piezo else []
 
         if IS_HCS:
             if self.coordinate_dict is not None:
-                self.coordinates_pd = pd.DataFrame(columns=['region', 'fov'] + base_columns + piezo_column)
+                columns = ['region', 'fov'] + base_columns + piezo_column
             else:
-                self.coordinates_pd = pd.DataFrame(columns=['region', 'i', 'j'] + base_columns + piezo_column)
+                columns = ['region', 'i', 'j'] + base_columns + piezo_column
         else:
-            self.coordinates_pd = pd.DataFrame(columns=['i', 'j'] + base_columns + piezo_column)
-
-    def update_coordinates_dataframe(self, region_id, z_level, fov=None, i=None, j=None):
-        base_data = {
-            'z_level': [z_level],
-            'x (mm)': [self.navigationController.x_pos_mm],
-            'y (mm)': [self.navigationController.y_pos_mm],
-            'z (um)': [self.navigationController.z_pos_mm * 1000],
-            'time': [datetime.now().strftime('%Y-%m-%d_%H-%M-%S.%f')]
+            columns = ['i', 'j'] + base_columns + piezo_column
+        self.coordinate_log = CoordinateLog(os.path.join(current_path, 'coordinates.csv'), columns)
+        self.image_log = CoordinateLog(os.path.join(current_path, 'images.csv'),
+                                       ['region', 'fov', 'i', 'j', 'z_level', 'channel', 'file', 'exposure_time (ms)', 'frame_ID', 'timestamp',
+                                        'time', 'x (mm)', 'y (mm)', 'z (um)', 'z_piezo (um)'])
+
+    @property
+    def coordinates_pd(self):
+        return self.coordinate_log.to_dataframe()
+
+    def update_coordinates_dataframe(self, region_id, z_level, fov=None, i=None, j=None, z_mm=None):
+        values = {
+            'z_level': z_level,
+            'x (mm)': self.navigationController.x_pos_mm,
+            'y (mm)': self.navigationController.y_pos_mm,
+            'z (um)': (self.navigationController.z_pos_mm if z_mm is None else z_mm) * 1000,
+            'time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S.%f'),
+            'i': i, 'j': j, 'fov': fov
         }
-        piezo_data = {'z_piezo (um)': [self.z_piezo_um - OBJECTIVE_PIEZO_HOME_UM]} if self.use_piezo else {}
-
+        if self.use_piezo:
+            values['z_piezo (um)'] = self.z_piezo_um - OBJECTIVE_PIEZO_HOME_UM
         if IS_HCS:
-            if self.coordinate_dict is not None:
-                new_row = pd.DataFrame({
-                    'region': [region_id],
-                    'fov': [fov],
-                    **base_data,
-                    **piezo_data
-                })
-            else:
-                new_row = pd.DataFrame({
-                    'region': [self.scan_coordinates_name[region_id]],
-                    'i': [i], 'j': [j],
-                    **base_data,
-                    **piezo_data
-                })
-        else:
-            new_row = pd.DataFrame({
-                'i': [i], 'j': [j],
-                **base_data,
-                **piezo_data
-            })
-
-        self.coordinates_pd = pd.concat([self.coordinates_pd, new_row], ignore_index=True)
+            values['region'] = region_id if self.coordinate_dict is not None else self.scan_coordinates_name[region_id]
+        self.coordinate_log.append(values)
+
+    def log_image(self, config, file_name, i=None, j=None, k=None, fov_key=None, position=None, frame_ID=None, timestamp=None):
+        # file_name is empty for images written to the OME-Zarr store
+        if fov_key is None:
+            fov_key = self.current_fov_key
+        region, fov, z_level = fov_key if fov_key is not None else (None, None, k)
+        if position is None:
+            position = (self.navigationController.x_pos_mm, self.navigationController.y_pos_mm, self.navigationController.z_pos_mm)
+        self.image_log.append({
+            'region': region, 'fov': fov, 'i': i, 'j': j, 'z_level': z_level,
+            'channel': config.name, 'file': file_name,
+            'exposure_time (ms)': config.exposure_time, 'frame_ID': frame_ID, 'timestamp': timestamp,
+            'time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S.%f'),
+            'x (mm)': position[0], 'y (mm)': position[1], 'z (um)': position[2] * 1000,
+            'z_piezo (um)': self.z_piezo_um - OBJECTIVE_PIEZO_HOME_UM if self.use_piezo else None
+        })
 
     def calculate_grid_indices(self, i, j):
         # Ensure that i/y-indexing is always top to bottom
@@ -1902,37 +2313,54 @@ class MultiPointWorker(QObject):
 
     def move_to_coordinate(self, coordinate_mm):
         print("moving to coordinate", coordinate_mm)
+        # with the focus lock, the focus is measured and corrected between the moves and until the FOV is imaged
+        self.resume_focus_lock()
         x_mm = coordinate_mm[0]
-        self.navigationController.move_x_to(x_mm)
-        self.wait_till_operation_is_completed()
-        time.sleep(SCAN_STABILIZATION_TIME_MS_X/1000)
-
         y_mm = coordinate_mm[1]
-        self.navigationController.move_y_to(y_mm)
-        self.wait_till_operation_is_completed()
-        time.sleep(SCAN_STABILIZATION_TIME_MS_Y/1000)
+        if SCAN_SIMULTANEOUS_XY_MOVES:
+            with tracer.span('move xy'), self.microcontroller.command_sequence_lock:
+                self.navigationController.move_xy_to(x_mm, y_mm)
+                self.wait_till_operation_is_completed()
+            with tracer.span('settle'):
+                time.sleep(max(SCAN_STABILIZATION_TIME_MS_X,SCAN_STABILIZATION_TIME_MS_Y)/1000)
+        else:
+            with tracer.span('move xy'), self.microcontroller.command_sequence_lock:
+                self.navigationController.move_x_to(x_mm)
+                self.wait_till_operation_is_completed()
+            with tracer.span('settle'):
+                time.sleep(SCAN_STABILIZATION_TIME_MS_X/1000)
+
+            with tracer.span('move xy'), self.microcontroller.command_sequence_lock:
+                self.navigationController.move_y_to(y_mm)
+                self.wait_till_operation_is_completed()
+            with tracer.span('settle'):
+                time.sleep(SCAN_STABILIZATION_TIME_MS_Y/1000)
 
         # check if z is included in the coordinate
         if len(coordinate_mm) == 3:
             z_mm = coordinate_mm[2]
             self.move_to_z_level(z_mm)
 
+        self.resume_focus_lock()
+
     def move_to_z_level(self, z_mm):
         print("moving z")
-        if z_mm >= self.navigationController.z_pos_mm:
-            self.navigationController.move_z_to(z_mm)
-            self.wait_till_operation_is_completed()
-        else:
-            self.navigationController.move_z_to(z_mm)
-            self.wait_till_operation_is_completed()
-            # remove backlash
-            if self.navigationController.get_pid_control_flag(2) is False:
-                _usteps_to_clear_backlash = max(160,20*self.navigationController.z_microstepping)
-                self.navigationController.move_z_usteps(-_usteps_to_clear_backlash) # to-do: combine this with the above
+        with tracer.span('move z'), self.microcontroller.command_sequence_lock:
+            if z_mm >= self.navigationController.z_pos_mm:
+                self.navigationController.move_z_to(z_mm)
                 self.wait_till_operation_is_completed()
-                self.navigationController.move_z_usteps(_usteps_to_clear_backlash)
+            else:
+                self.navigationController.move_z_to(z_mm)
                 self.wait_till_operation_is_completed()
-        time.sleep(SCAN_STABILIZATION_TIME_MS_Z/1000)
+                # remove backlash
+                if self.navigationController.get_pid_control_flag(2) is False:
+                    _usteps_to_clear_backlash = max(160,20*self.navigationController.z_microstepping)
+                    self.navigationController.move_z_usteps(-_usteps_to_clear_backlash) # to-do: combine this with the above
+                    self.wait_till_operation_is_completed()
+                    self.navigationController.move_z_usteps(_usteps_to_clear_backlash)
+                    self.wait_till_operation_is_completed()
+        with tracer.span('settle'):
+            time.sleep(SCAN_STABILIZATION_TIME_MS_Z/1000)
 
     def run_grid_acquisition(self, current_path):
         n_regions = len(self.scan_coordinates_mm)
@@ -1971,7 +2399,8 @@ class MultiPointWorker(QObject):
                     sgn_i, sgn_j, real_i, real_j = self.calculate_grid_indices(i, j)
 
                     if not self.multiPointController.scanCoordinates or (real_i, real_j) not in self.multiPointController.scanCoordinates.grid_skip_positions:
-                        self.acquire_at_position(region_id, current_path, fov_count, i=real_i, j=real_j)
+                        with tracer.span('fov',region=region_id,fov=fov_count):
+                            self.acquire_at_position(region_id, current_path, fov_count, i=real_i, j=real_j)
                         fov_count += 1
 
                     if self.multiPointController.abort_acqusition_requested:
@@ -1987,6 +2416,7 @@ class MultiPointWorker(QObject):
                 self.x_scan_direction = -self.x_scan_direction
 
             self.finish_grid_scan(n_regions, region_id)
+            self.refit_focus_surface()
 
     def run_coordinate_acquisition(self, current_path):
         n_regions = len(self.scan_coordinates_mm)
@@ -1998,15 +2428,27 @@ class MultiPointWorker(QObject):
             self.num_fovs = len(coordinates)
             self.total_scans = self.num_fovs * self.NZ * len(self.selected_configurations)
 
-            for fov_count, coordinate_mm in enumerate(coordinates):
+            if self.fov_order is not None and region_id in self.fov_order:
+                fov_order = self.fov_order[region_id]
+            else:
+                fov_order = range(len(coordinates))
+
+            # FOVs keep their index in coordinate_dict when visited in a different order
+            for fov_count in fov_order:
+                coordinate_mm = coordinates[fov_count]
+                if self.focus_surface_z is not None and region_id in self.focus_surface_z:
+                    coordinate_mm = (coordinate_mm[0], coordinate_mm[1], self.focus_surface_z[region_id][fov_count])
 
-                self.move_to_coordinate(coordinate_mm)
-                self.acquire_at_position(region_id, current_path, fov_count)
+                with tracer.span('fov',region=region_id,fov=fov_count):
+                    self.move_to_coordinate(coordinate_mm)
+                    self.acquire_at_position(region_id, current_path, fov_count)
 
                 if self.multiPointController.abort_acqusition_requested:
                     self.handle_acquisition_abort(current_path, region_id)
                     return
 
+            self.refit_focus_surface()
+
     def acquire_at_position(self, region_id, current_path, fov, i=None, j=None):
 
         if RUN_CUSTOM_MULTIPOINT and "multipoint_custom_script_entry" in globals():
@@ -2014,10 +2456,12 @@ class MultiPointWorker(QObject):
             multipoint_custom_script_entry(self, current_path, region_id, fov, i, j)
             return
 
-        self.perform_autofocus(region_id)
+        with tracer.span('autofocus'):
+            self.perform_autofocus(region_id)
 
         if self.NZ > 1:
-            self.prepare_z_stack()
+            with tracer.span('move z'):
+                self.prepare_z_stack()
 
         if self.coordinate_dict is not None:
             coordinate_name = region_id
@@ -2027,7 +2471,14 @@ class MultiPointWorker(QObject):
         x_mm = self.navigationController.x_pos_mm
         y_mm = self.navigationController.y_pos_mm
 
-        for z_level in range(self.NZ):
+        self.begin_pipelined_fov()
+
+        if self.mcu_z_stack_possible() and self.run_mcu_z_stack(region_id, coordinate_name, fov, current_path, i, j):
+            z_levels = [] # the z-stack has been acquired
+        else:
+            z_levels = range(self.NZ)
+
+        for z_level in z_levels:
             if i is not None and j is not None:
                 file_ID = f"{coordinate_name}_{i}_{j}_{z_level}"
             else:
@@ -2035,12 +2486,13 @@ class MultiPointWorker(QObject):
 
             metadata = dict(x = self.navigationController.x_pos_mm, y = self.navigationController.y_pos_mm, z = self.navigationController.z_pos_mm)
             print(f"Acquiring image: ID={file_ID}, Metadata={metadata}")
+            self.current_fov_key = (coordinate_name, fov, z_level)
 
             # laser af characterization mode
             if LASER_AF_CHARACTERIZATION_MODE:
                 image = self.microscope.laserAutofocusController.get_image()
                 saving_path = os.path.join(current_path, file_ID + '_laser af camera' + '.bmp')
-                iio.imwrite(saving_path,image)
+                self.image_writer.submit(saving_path,image)
 
             current_round_images = {}
             # iterate through selected modes
@@ -2049,7 +2501,9 @@ class MultiPointWorker(QObject):
                 self.handle_z_offset(config, True)
 
                 # acquire image
-                if 'USB Spectrometer' not in config.name and 'RGB' not in config.name:
+                if self.pipeline_active:
+                    self.trigger_camera_image(config, file_ID, current_path, current_round_images, i, j, z_level)
+                elif 'USB Spectrometer' not in config.name and 'RGB' not in config.name:
                     self.acquire_camera_image(config, file_ID, current_path, current_round_images, i, j, z_level)
                 elif 'RGB' in config.name:
                     self.acquire_rgb_image(config, file_ID, current_path, current_round_images, i, j, z_level)
@@ -2095,6 +2549,7 @@ class MultiPointWorker(QObject):
 
             # check if the acquisition should be aborted
             if self.multiPointController.abort_acqusition_requested:
+                self.end_pipelined_fov()
                 self.handle_acquisition_abort(current_path, region_id)
                 return
 
@@ -2104,6 +2559,8 @@ class MultiPointWorker(QObject):
             if z_level < self.NZ - 1:
                 self.move_z_for_stack()
 
+        self.end_pipelined_fov()
+
         if self.NZ > 1:
             self.move_z_back_after_stack()
 
@@ -2132,13 +2589,24 @@ class MultiPointWorker(QObject):
     def perform_autofocus(self, region_id):
         if self.do_reflection_af == False:
             # contrast-based AF; perform AF only if when not taking z stack or doing z stack from center
-            if ( (self.NZ == 1) or self.z_stacking_config == 'FROM CENTER' ) and (self.do_autofocus) and (self.af_fov_count%Acquisition.NUMBER_OF_FOVS_PER_AF==0):
+            # with a focus map, z comes from the focus surface for every FOV (no z scan)
+            use_focus_map = self.autofocusController.use_focus_map
+            z_from_focus_surface = self.z_from_focus_surface(region_id)
+            if ( (self.NZ == 1) or self.z_stacking_config == 'FROM CENTER' ) and (self.do_autofocus) and (self.af_fov_count%Acquisition.NUMBER_OF_FOVS_PER_AF==0 or use_focus_map):
                 configuration_name_AF = MULTIPOINT_AUTOFOCUS_CHANNEL
                 config_AF = next((config for config in self.configurationManager.configurations if config.name == configuration_name_AF))
                 self.signal_current_configuration.emit(config_AF)
-                if (self.af_fov_count%Acquisition.NUMBER_OF_FOVS_PER_AF==0) or self.autofocusController.use_focus_map:
+                # with a focus map, move_to_coordinate has already placed z at the predicted z of coordinate based acquisitions
+                if ((self.af_fov_count%Acquisition.NUMBER_OF_FOVS_PER_AF==0) or use_focus_map) and not z_from_focus_surface:
                     self.autofocusController.autofocus()
                     self.autofocusController.wait_till_autofocus_has_completed()
+                if use_focus_map and FOCUS_SURFACE_REFINE_EVERY_N_FOVS > 0:
+                    # refine the surface with a contrast AF started from the predicted z
+                    if self.focus_surface_fov_count%FOCUS_SURFACE_REFINE_EVERY_N_FOVS == 0:
+                        self.autofocusController.autofocus(True)
+                        self.autofocusController.wait_till_autofocus_has_completed()
+                        self.autofocusController.add_focus_measurement(self.navigationController.x_pos_mm,self.navigationController.y_pos_mm,self.navigationController.z_pos_mm,'contrast AF',refit=False)
+                    self.focus_surface_fov_count = self.focus_surface_fov_count + 1
                 # update z location of scan_coordinates_mm after AF
                 if len(self.scan_coordinates_mm[region_id]) == 3:
                     self.scan_coordinates_mm[region_id][2] = self.navigationController.z_pos_mm
@@ -2146,6 +2614,8 @@ class MultiPointWorker(QObject):
                     if self.coordinate_dict is not None:
                         self.microscope.multiPointWidgetGrid.update_region_z_level(region_id, self.navigationController.z_pos_mm)
                     elif self.multiPointController.location_list is not None:
+                        if self.multiPointController.region_index is not None:
+                            region_id = self.multiPointController.region_index[region_id]
                         try:
                             self.microscope.multiPointWidget2._update_z(region_id, self.navigationController.z_pos_mm)
                         except:
@@ -2171,20 +2641,53 @@ class MultiPointWorker(QObject):
                     self.autofocusController.wait_till_autofocus_has_completed()
                 # set the current plane as reference
                 self.microscope.laserAutofocusController.set_reference()
+                if self.use_focus_lock:
+                    # the piezo is used for z stacks, corrections then go to the z stepper
+                    self.microscope.laserAutofocusController.start_focus_lock(0,'z' if self.use_piezo else FOCUS_LOCK_ACTUATOR)
+                    self.microscope.laserAutofocusController.pause_focus_lock()
+            elif self.microscope.laserAutofocusController.focus_lock_is_running():
+                # the FOV is usually in focus already, the lock is paused while it is imaged
+                locked = self.microscope.laserAutofocusController.wait_for_focus_lock()
+                self.microscope.laserAutofocusController.pause_focus_lock()
+                if locked:
+                    if self.autofocusController.use_focus_map:
+                        self.autofocusController.add_focus_measurement(self.navigationController.x_pos_mm,self.navigationController.y_pos_mm,self.navigationController.z_pos_mm,'laser AF',refit=False)
+                else:
+                    print('focus lock not locked, using laser AF')
+                    try:
+                        self.microscope.laserAutofocusController.move_to_target(0)
+                    except:
+                        print('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!! laser AF failed !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
             else:
                 print("laser reflection af")
                 try:
+                    if self.autofocusController.use_focus_map and not self.z_from_focus_surface(region_id):
+                        # start from the focus surface so that the laser spot is within the capture range
+                        self.autofocusController.autofocus()
+                        self.autofocusController.wait_till_autofocus_has_completed()
                     if self.navigationController.get_pid_control_flag(2) is False:
                         self.microscope.laserAutofocusController.move_to_target(0)
                         self.microscope.laserAutofocusController.move_to_target(0) # for stepper in open loop mode, repeat the operation to counter backlash
                     else:
                         self.microscope.laserAutofocusController.move_to_target(0)
+                    if self.autofocusController.use_focus_map:
+                        self.autofocusController.add_focus_measurement(self.navigationController.x_pos_mm,self.navigationController.y_pos_mm,self.navigationController.z_pos_mm,'laser AF',refit=False)
                 except:
                     file_ID = f"{region_id}_focus_camera.bmp"
                     saving_path = os.path.join(self.base_path, self.experiment_ID, str(self.time_point), file_ID)
-                    iio.imwrite(saving_path, self.microscope.laserAutofocusController.image)
+                    self.image_writer.submit(saving_path, np.copy(self.microscope.laserAutofocusController.image))
                     print('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!! laser AF failed !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
 
+    def z_from_focus_surface(self, region_id):
+        # True if the FOVs of the region are moved to the z predicted by the focus surface
+        return self.autofocusController.use_focus_map and self.focus_surface_z is not None and region_id in self.focus_surface_z
+
+    def refit_focus_surface(self):
+        # the focus measurements of a region are fitted once the region is done, then the z of the FOVs is predicted again
+        if self.autofocusController.refit_focus_surface() and self.focus_surface_z is not None:
+            for region_id, coordinates in self.coordinate_dict.items():
+                self.focus_surface_z[region_id] = self.autofocusController.predict_focus_z(coordinates)
+
     def prepare_z_stack(self):
         # move to bottom of the z stack
         if self.z_stacking_config == 'FROM CENTER':
@@ -2209,25 +2712,34 @@ class MultiPointWorker(QObject):
 
     def acquire_camera_image(self, config, file_ID, current_path, current_round_images, i, j, k):
         # update the current configuration
-        self.signal_current_configuration.emit(config)
-        self.wait_till_operation_is_completed()
+        with tracer.span('configure',channel=config.name):
+            self.signal_current_configuration.emit(config)
+            self.wait_till_operation_is_completed()
 
         # trigger acquisition (including turning on the illumination) and read frame
         if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
-            self.liveController.turn_on_illumination()
-            self.wait_till_operation_is_completed()
-            self.camera.send_trigger()
-            image = self.camera.read_frame()
+            with tracer.span('illumination'):
+                self.liveController.turn_on_illumination()
+                self.wait_till_operation_is_completed()
+            with tracer.span('trigger'):
+                self.camera.send_trigger()
+            with tracer.span('readout'):
+                image = self.camera.read_frame()
         elif self.liveController.trigger_mode == TriggerMode.HARDWARE:
             if 'Fluorescence' in config.name and ENABLE_NL5 and NL5_USE_DOUT:
                 self.camera.image_is_ready = False # to remove
-                self.microscope.nl5.start_acquisition()
-                image = self.camera.read_frame(reset_image_ready_flag=False)
+                with tracer.span('trigger'):
+                    self.microscope.nl5.start_acquisition()
+                with tracer.span('readout'):
+                    image = self.camera.read_frame(reset_image_ready_flag=False)
             else:
-                self.microcontroller.send_hardware_trigger(control_illumination=True,illumination_on_time_us=self.camera.exposure_time*1000)
-                image = self.camera.read_frame()
+                with tracer.span('trigger'):
+                    self.microcontroller.send_hardware_trigger(control_illumination=True,illumination_on_time_us=self.camera.exposure_time*1000)
+                with tracer.span('readout'):
+                    image = self.camera.read_frame()
         else: # continuous acquisition
-            image = self.camera.read_frame()
+            with tracer.span('readout'):
+                image = self.camera.read_frame()
 
         if image is None:
             print('self.camera.read_frame() returned None')
@@ -2235,24 +2747,288 @@ class MultiPointWorker(QObject):
 
         # turn off the illumination if using software trigger
         if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
-            self.liveController.turn_off_illumination()
+            with tracer.span('illumination'):
+                self.liveController.turn_off_illumination()
+
+        self.process_camera_image(image, config, file_ID, current_path, current_round_images, i, j, k,
+                                  frame_ID=self.camera.frame_ID, timestamp=self.camera.timestamp)
 
+        QApplication.processEvents()
+
+    def process_camera_image(self, image, config, file_ID, current_path, current_round_images, i, j, k, fov_key=None, position=None, frame_ID=None, timestamp=None):
         # process the image -  @@@ to move to camera
-        image = utils.crop_image(image,self.crop_width,self.crop_height)
-        image = utils.rotate_and_flip_image(image,rotate_image_angle=self.camera.rotate_image_angle,flip_image=self.camera.flip_image)
-        image_to_display = utils.crop_image(image,round(self.crop_width*self.display_resolution_scaling), round(self.crop_height*self.display_resolution_scaling))
-        self.image_to_display.emit(image_to_display)
-        self.image_to_display_multi.emit(image_to_display,config.illumination_source)
+        with tracer.span('process'):
+            image = utils.crop_image(image,self.crop_width,self.crop_height)
+            image = utils.rotate_and_flip_image(image,rotate_image_angle=self.camera.rotate_image_angle,flip_image=self.camera.flip_image)
+        with tracer.span('display emit'):
+            image_to_display = utils.crop_image(image,round(self.crop_width*self.display_resolution_scaling), round(self.crop_height*self.display_resolution_scaling))
+            self.image_to_display.emit(image_to_display)
+            self.image_to_display_multi.emit(image_to_display,config.illumination_source)
 
-        self.save_image(image, file_ID, config, current_path)
-        self.update_napari(image, config.name, i, j, k)
+        with tracer.span('save',channel=config.name):
+            file_name = self.save_image(image, file_ID, config, current_path, fov_key, position)
+            self.log_image(config, file_name, i, j, k, fov_key, position, frame_ID, timestamp)
+        with tracer.span('display emit'):
+            self.update_napari(image, config.name, i, j, k, position)
 
-        current_round_images[config.name] = np.copy(image)
+        with tracer.span('process'):
+            current_round_images[config.name] = np.copy(image)
 
-        self.handle_dpc_generation(current_round_images)
-        self.handle_rgb_generation(current_round_images, file_ID, current_path, i, j, k)
+            self.handle_dpc_generation(current_round_images)
+            self.handle_rgb_generation(current_round_images, file_ID, current_path, i, j, k)
 
-        QApplication.processEvents()
+    def pipelined_acquisition_possible(self):
+        if not self.multiPointController.use_pipelined_acquisition:
+            return False
+        # the readout only overlaps with the next exposure when the microcontroller switches the illumination - with a software
+        # trigger the illumination has to stay on until the frame has arrived, so there would be nothing to gain
+        if self.liveController.trigger_mode != TriggerMode.HARDWARE:
+            print('pipelined acquisition requires hardware triggering, acquiring image by image')
+            return False
+        if self.multiPointController.do_fluorescence_rtp or self.use_piezo:
+            return False
+        for config in self.selected_configurations:
+            if 'USB Spectrometer' in config.name or 'RGB' in config.name:
+                return False
+            if 'Fluorescence' in config.name and ENABLE_NL5 and NL5_USE_DOUT:
+                return False
+        return True
+
+    def start_pipelined_acquisition(self):
+        # frames are delivered through the camera callback and handed to a PipelinedFrameProcessor running in its own QThread,
+        # which processes them while the next images are triggered - started once for the whole acquisition
+        self.pipeline_pending = {}
+        self.pipeline_trigger_time = {}
+        self.pipeline_trigger_count = 0
+        self.pipeline_frames_in_flight = 0
+        self.pipeline_accepting = False
+        self.pipeline_config = None
+        self.pipeline_thread = QThread()
+        self.pipeline_processor = PipelinedFrameProcessor(self)
+        self.pipeline_processor.moveToThread(self.pipeline_thread)
+        self.signal_pipelined_frame.connect(self.pipeline_processor.process_frame, Qt.QueuedConnection)
+        self.pipeline_thread.start()
+        self.pipeline_active = True
+
+    def begin_pipelined_fov(self):
+        if not self.pipeline_active:
+            return
+        # frames are matched to their trigger by frame ID, counted from the frame ID of the camera at the start of the FOV -
+        # the callback is only installed for the images of the FOV, autofocus in between reads frames as usual
+        with self.pipeline_lock:
+            self.pipeline_pending = {}
+            self.pipeline_trigger_time = {}
+            self.pipeline_trigger_count = 0
+            self.pipeline_frame_ID_offset = self.camera.frame_ID + 1
+            self.pipeline_last_frame_ID = self.camera.frame_ID
+            self.pipeline_config = None
+            self.pipeline_accepting = True
+        self.pipeline_callback_before = self.camera.new_image_callback_external
+        self.pipeline_callback_was_enabled = self.camera.callback_is_enabled
+        self.camera.set_callback(self._on_pipelined_frame)
+        self.camera.enable_callback()
+
+    def _on_pipelined_frame(self, camera):
+        # camera callback - hand a copy of the frame over to the processing thread and return right away
+        with self.pipeline_frame_received:
+            if not self.pipeline_accepting:
+                return
+            self.pipeline_last_frame_ID = max(self.pipeline_last_frame_ID, camera.frame_ID)
+            self.pipeline_frames_in_flight = self.pipeline_frames_in_flight + 1
+            self.pipeline_frame_received.notify_all()
+        self.signal_pipelined_frame.emit(np.copy(camera.current_frame), camera.frame_ID, camera.timestamp)
+
+    def wait_for_pipelined_frame(self, index):
+        # waits until the frame of trigger index (or a later one) has arrived, False on timeout
+        frame_ID = self.pipeline_frame_ID_offset + index
+        with self.pipeline_frame_received:
+            return self.pipeline_frame_received.wait_for(lambda: self.pipeline_last_frame_ID >= frame_ID, MULTIPOINT_PIPELINED_FRAME_TIMEOUT_S)
+
+    def trigger_camera_image(self, config, file_ID, current_path, current_round_images, i, j, k):
+        # exposure and gain are only changed once the frames of the previous configuration have been read out
+        if self.pipeline_config is not None and config is not self.pipeline_config and self.pipeline_trigger_count > 0:
+            with tracer.span('readout'):
+                if not self.wait_for_pipelined_frame(self.pipeline_trigger_count - 1):
+                    print('pipelined acquisition: timed out waiting for the frames of ' + self.pipeline_config.name)
+        self.pipeline_config = config
+
+        # update the current configuration
+        with tracer.span('configure',channel=config.name):
+            self.signal_current_configuration.emit(config)
+            self.wait_till_operation_is_completed()
+
+        with self.pipeline_lock:
+            index = self.pipeline_trigger_count
+            self.pipeline_pending[index] = [config, file_ID, current_path, current_round_images, i, j, k, self.current_fov_key,
+                                            (self.navigationController.x_pos_mm, self.navigationController.y_pos_mm, self.navigationController.z_pos_mm)]
+            self.pipeline_trigger_time[index] = time.time()
+            self.pipeline_trigger_count = self.pipeline_trigger_count + 1
+
+        # the illumination is controlled by the microcontroller, readout and processing overlap with the next image
+        t_exposure_end = time.time() + self.camera.exposure_time/1000
+        with tracer.span('trigger'):
+            self.microcontroller.send_hardware_trigger(control_illumination=True,illumination_on_time_us=self.camera.exposure_time*1000)
+        with tracer.span('exposure'):
+            self.wait_till_operation_is_completed()
+            while time.time() < t_exposure_end:
+                time.sleep(SLEEP_TIME_S)
+
+    def mcu_z_stack_possible(self):
+        # the camera settings cannot change within a sequence
+        if not MULTIPOINT_MCU_Z_STACK_SEQUENCE or self.NZ < 2 or not self.pipeline_active:
+            return False
+        if self.liveController.trigger_mode != TriggerMode.HARDWARE or LASER_AF_CHARACTERIZATION_MODE:
+            return False
+        first = self.selected_configurations[0]
+        for config in self.selected_configurations:
+            if config.z_offset is not None and config.z_offset != 0:
+                return False
+            if (config.exposure_time, config.analog_gain, config.emission_filter_position, config.pixel_format) != (first.exposure_time, first.analog_gain, first.emission_filter_position, first.pixel_format):
+                return False
+            if not self.mcu_z_stack_illumination_possible(config):
+                print('z-stack sequence: the illumination of ' + config.name + ' is not set by the microcontroller, acquiring plane by plane')
+                return False
+        if ENABLE_SPINNING_DISK_CONFOCAL and len(set(XLIGHT_EMISSION_FILTER_MAPPING.get(config.illumination_source) for config in self.selected_configurations)) > 1:
+            return False
+        return True
+
+    def mcu_z_stack_illumination_possible(self, config):
+        # the sequence sets the illumination the way LiveController.set_illumination does for the sources driven by the microcontroller
+        # (microcontroller.set_illumination with the intensity of the configuration) - the LED matrix, the LED array and the lasers
+        # controlled over serial are set differently
+        if config.illumination_source < 10:
+            return False
+        if USE_LDI_SERIAL_CONTROL and 'Fluorescence' in config.name:
+            return False
+        if ENABLE_NL5 and NL5_USE_DOUT and 'Fluorescence' in config.name:
+            return False
+        return True
+
+    def run_mcu_z_stack(self, region_id, coordinate_name, fov, current_path, i=None, j=None):
+        # the microcontroller moves z, sets the illumination and triggers the camera for the whole z-stack, the pipeline matches
+        # the frames to the planes and channels as they arrive - returns False if the z-stack is to be acquired plane by plane
+        configs = self.selected_configurations
+        channels = [(config.illumination_source, config.illumination_intensity, config.exposure_time*1000, MULTIPOINT_MCU_Z_STACK_READOUT_US) for config in configs]
+        # open-loop z: prepare_z_stack approaches the first plane from below, a z-stack going down has to approach it from above
+        backlash_usteps = 0
+        if self.deltaZ_usteps < 0 and self.navigationController.get_pid_control_flag(2) is False:
+            backlash_usteps = max(160,20*self.navigationController.z_microstepping)
+        try:
+            steps = z_stack_sequence(self.deltaZ_usteps, channels, self.NZ, SCAN_STABILIZATION_TIME_MS_Z*1000, backlash_usteps)
+        except ValueError as e:
+            print('z-stack sequence: ' + str(e) + ', acquiring plane by plane')
+            return False
+
+        with tracer.span('configure',channel=configs[0].name):
+            self.signal_current_configuration.emit(configs[0])
+            self.wait_till_operation_is_completed()
+        with tracer.span('upload sequence'):
+            if not self.microcontroller.upload_sequence(steps):
+                print('z-stack sequence: upload failed, acquiring plane by plane')
+                return False
+
+        x_mm = self.navigationController.x_pos_mm
+        y_mm = self.navigationController.y_pos_mm
+        z_mm = self.navigationController.z_pos_mm
+        # the planes follow the signed z step (negative for 'FROM TOP', deltaZ is not)
+        dz_mm = self.deltaZ_usteps*self.navigationController.get_mm_per_ustep_Z()
+        with self.pipeline_lock:
+            for z_level, channel in z_stack_frames(self.NZ, len(configs)):
+                if channel == 0:
+                    if i is not None and j is not None:
+                        file_ID = f"{coordinate_name}_{i}_{j}_{z_level}"
+                    else:
+                        file_ID = f"{coordinate_name}_{fov}_{z_level}"
+                    current_round_images = {}
+                self.pipeline_pending[self.pipeline_trigger_count] = [configs[channel], file_ID, current_path, current_round_images, i, j, z_level, (coordinate_name, fov, z_level),
+                                                                     (x_mm, y_mm, z_mm + z_level*dz_mm)]
+                # the microcontroller triggers the frames once the sequence runs, which is after this point
+                self.pipeline_trigger_time[self.pipeline_trigger_count] = time.time()
+                self.pipeline_trigger_count = self.pipeline_trigger_count + 1
+            self.pipeline_config = configs[-1]
+
+        # z moves with the max velocity/acceleration currently set on the microcontroller
+        velocity, acceleration = self.microcontroller.max_velocity_acceleration[AXIS.Z]
+        move_duration_s = lambda distance_mm: distance_mm/velocity + velocity/acceleration
+        duration_s = self.NZ*sum(config.exposure_time/1000 + MULTIPOINT_MCU_Z_STACK_READOUT_US/1e6 for config in configs) + (self.NZ-1)*(move_duration_s(abs(dz_mm)) + SCAN_STABILIZATION_TIME_MS_Z/1000)
+        if backlash_usteps > 0:
+            duration_s = duration_s + 2*move_duration_s(backlash_usteps*self.navigationController.get_mm_per_ustep_Z()) + SCAN_STABILIZATION_TIME_MS_Z/1000
+        with tracer.span('z stack sequence',planes=self.NZ):
+            self.microcontroller.run_sequence(1)
+            if not self.microcontroller.wait_for_completion(2*duration_s + MULTIPOINT_PIPELINED_FRAME_TIMEOUT_S):
+                print('z-stack sequence: not completed in time, aborting it')
+                self.microcontroller.abort_sequence()
+                self.wait_till_operation_is_completed()
+        self.dz_usteps = self.dz_usteps + self.deltaZ_usteps*(self.NZ-1)
+
+        for z_level in range(self.NZ):
+            self.current_fov_key = (coordinate_name, fov, z_level)
+            self.update_coordinates_dataframe(region_id, z_level, fov=fov, i=i, j=j, z_mm=z_mm + z_level*dz_mm)
+            self.af_fov_count = self.af_fov_count + 1
+        self.signal_region_progress.emit((fov + 1) * self.NZ * len(configs), self.total_scans)
+        self.signal_register_current_fov.emit(x_mm, y_mm)
+        return True
+
+    def process_pipelined_frame(self, image, frame_ID, timestamp):
+        # runs in the thread of the PipelinedFrameProcessor
+        with self.pipeline_lock:
+            index = frame_ID - self.pipeline_frame_ID_offset
+            parameters = self.pipeline_pending.pop(index, None)
+            trigger_time = self.pipeline_trigger_time.pop(index, None)
+        # a frame ID that was not triggered, or a frame that arrived before its trigger was sent, means that a frame has been
+        # dropped or duplicated and that the remaining frames of the FOV can no longer be matched to their trigger
+        error = None
+        if parameters is None:
+            error = 'unexpected frame ' + str(frame_ID)
+        elif timestamp is not None and timestamp < trigger_time:
+            error = 'frame ' + str(frame_ID) + ' received before the trigger of ' + parameters[1] + ' ' + parameters[0].name
+        else:
+            config, file_ID, current_path, current_round_images, i, j, k, fov_key, position = parameters
+            try:
+                self.process_camera_image(image, config, file_ID, current_path, current_round_images, i, j, k, fov_key, position, frame_ID, timestamp)
+            except Exception as e:
+                print('pipelined acquisition: error processing ' + file_ID + ' ' + config.name + ': ' + str(e))
+        with self.pipeline_frame_received:
+            self.pipeline_frames_in_flight = self.pipeline_frames_in_flight - 1
+            self.pipeline_frame_received.notify_all()
+        if error is not None:
+            self.fail_pipelined_acquisition(error)
+
+    def fail_pipelined_acquisition(self, error):
+        with self.pipeline_lock:
+            fov_key = self.current_fov_key
+            self.pipeline_pending = {}
+            self.pipeline_accepting = False
+        print('pipelined acquisition: ' + error + ' in FOV ' + str(fov_key) + ' - frames cannot be matched to their trigger, aborting the acquisition')
+        self.multiPointController.request_abort_aquisition()
+
+    def end_pipelined_fov(self):
+        if not self.pipeline_active:
+            return
+        with tracer.span('pipeline drain'):
+            with self.pipeline_frame_received:
+                # wait for the frames still to be read out, then for the processing of the frames that have arrived
+                last_frame_ID = self.pipeline_frame_ID_offset + self.pipeline_trigger_count - 1
+                self.pipeline_frame_received.wait_for(lambda: self.pipeline_last_frame_ID >= last_frame_ID, MULTIPOINT_PIPELINED_FRAME_TIMEOUT_S)
+                self.pipeline_accepting = False
+                self.pipeline_frame_received.wait_for(lambda: self.pipeline_frames_in_flight == 0)
+                missing = list(self.pipeline_pending.values())
+                self.pipeline_pending = {}
+        # restore the camera callback
+        if not self.pipeline_callback_was_enabled:
+            self.camera.disable_callback()
+        self.camera.set_callback(self.pipeline_callback_before)
+        if len(missing) > 0:
+            self.fail_pipelined_acquisition('no frame received for ' + ', '.join(parameters[1] + ' ' + parameters[0].name for parameters in missing))
+
+    def finish_pipelined_acquisition(self):
+        if not self.pipeline_active:
+            return
+        self.signal_pipelined_frame.disconnect(self.pipeline_processor.process_frame)
+        self.pipeline_thread.quit()
+        self.pipeline_thread.wait()
+        self.pipeline_active = False
+        self.pipeline_config = None
 
     def acquire_rgb_image(self, config, file_ID, current_path, current_round_images, i, j, k):
         # go through the channels
@@ -2312,7 +3088,7 @@ class MultiPointWorker(QObject):
                 saving_path = os.path.join(current_path, file_ID + '_' + str(config.name).replace(' ','_') + '_' + str(l) + '.csv')
                 np.savetxt(saving_path,data,delimiter=',')
 
-    def save_image(self, image, file_ID, config, current_path):
+    def save_image(self, image, file_ID, config, current_path, fov_key=None, position=None):
         if image.dtype == np.uint16:
             saving_path = os.path.join(current_path, file_ID + '_' + str(config.name).replace(' ','_') + '.tiff')
         else:
@@ -2325,18 +3101,46 @@ class MultiPointWorker(QObject):
                 elif MULTIPOINT_BF_SAVING_OPTION == 'Green Channel Only':
                     image = image[:,:,1]
 
+        if self.flatfield_sampler is not None:
+            self.flatfield_sampler.add(config.name, image)
+        if config.name in self.flatfield_correctors:
+            image = self.flatfield_correctors[config.name].apply(image)
+
+        if self.live_stitcher is not None:
+            stitch_fov_key = fov_key if fov_key is not None else self.current_fov_key
+            if stitch_fov_key is not None:
+                region, fov, z_level = stitch_fov_key
+                self.live_stitcher.submit(region, fov, self.time_point, config.name, z_level, image)
+
+        if self.save_image_to_ome_zarr(image, config, fov_key, position):
+            return ''
+
         if Acquisition.PSEUDO_COLOR:
             image = self.return_pseudo_colored_image(image, config)
 
         if Acquisition.MERGE_CHANNELS:
             self._save_merged_image(image, file_ID, current_path)
 
-        iio.imwrite(saving_path,image)
+        self.image_writer.submit(saving_path,image)
+        return os.path.basename(saving_path)
+
+    def save_image_to_ome_zarr(self, image, config, fov_key=None, position=None):
+        # mono images of the selected channels go into the OME-Zarr plate, anything else is saved as files
+        if fov_key is None:
+            fov_key = self.current_fov_key
+        if self.ome_zarr_writer is None or fov_key is None or not self.ome_zarr_writer.has_channel(config.name) or image.ndim != 2:
+            return False
+        region, fov, z_level = fov_key
+        if position is None:
+            position = (self.navigationController.x_pos_mm, self.navigationController.y_pos_mm, self.navigationController.z_pos_mm)
+        self.image_writer.submit((region, fov, self.time_point, config.name, z_level, position), image, write_fn=self.ome_zarr_writer.write)
+        return True
 
     def _save_merged_image(self, image, file_ID, current_path):
         self.image_count += 1
         if self.image_count == 1:
-            self.merged_image = image
+            # copy - the merged image is accumulated in place while the channel image may still be waiting to be written
+            self.merged_image = np.copy(image)
         else:
             self.merged_image += image
 
@@ -2346,7 +3150,8 @@ class MultiPointWorker(QObject):
                 else:
                     saving_path = os.path.join(current_path, file_ID + '_merged' + '.' + Acquisition.IMAGE_FORMAT)
 
-                iio.imwrite(saving_path, self.merged_image)
+                self.image_writer.submit(saving_path, self.merged_image)
+                self.merged_image = None
                 self.image_count = 0
         return
 
@@ -2371,7 +3176,7 @@ class MultiPointWorker(QObject):
         rgb = np.stack([image] * 3, axis=-1) * rgb_ratios
         return rgb.astype(image.dtype)
 
-    def update_napari(self, image, config_name, i, j, k):
+    def update_napari(self, image, config_name, i, j, k, position=None):
         if not self.performance_mode:
             i = -1 if i is None else i
             j = -1 if j is None else j
@@ -2384,8 +3189,10 @@ class MultiPointWorker(QObject):
                     self.napari_layers_init.emit(image.shape[0],image.shape[1], image.dtype)
                 self.napari_layers_update.emit(image, i, j, k, config_name)
             if USE_NAPARI_FOR_MOSAIC_DISPLAY and k == 0:
-                print(f"Updating mosaic layers: x={self.navigationController.x_pos_mm:.6f}, y={self.navigationController.y_pos_mm:.6f}")
-                self.napari_mosaic_update.emit(image, self.navigationController.x_pos_mm, self.navigationController.y_pos_mm, k, config_name)
+                # images processed in the pipeline are placed where they were taken, not where the stage is now
+                x_mm, y_mm = (self.navigationController.x_pos_mm, self.navigationController.y_pos_mm) if position is None else position[:2]
+                print(f"Updating mosaic layers: x={x_mm:.6f}, y={y_mm:.6f}")
+                self.napari_mosaic_update.emit(image, x_mm, y_mm, k, config_name)
 
     def handle_dpc_generation(self, current_round_images):
         keys_to_check = ['BF LED matrix left half', 'BF LED matrix right half', 'BF LED matrix top half', 'BF LED matrix bottom half']
@@ -2412,9 +3219,9 @@ class MultiPointWorker(QObject):
             if len(rgb_image.shape) == 3:
                 print('writing RGB image')
                 if rgb_image.dtype == np.uint16:
-                    iio.imwrite(os.path.join(current_path, file_ID + '_BF_LED_matrix_full_RGB.tiff'), rgb_image)
+                    self.image_writer.submit(os.path.join(current_path, file_ID + '_BF_LED_matrix_full_RGB.tiff'), rgb_image)
                 else:
-                    iio.imwrite(os.path.join(current_path, file_ID + '_BF_LED_matrix_full_RGB.' + Acquisition.IMAGE_FORMAT),rgb_image)
+                    self.image_writer.submit(os.path.join(current_path, file_ID + '_BF_LED_matrix_full_RGB.' + Acquisition.IMAGE_FORMAT),rgb_image)
 
     def handle_rgb_channels(self, images, file_ID, current_path, config, i, j, k):
         for channel in ['BF LED matrix full_R', 'BF LED matrix full_G', 'BF LED matrix full_B']:
@@ -2425,7 +3232,7 @@ class MultiPointWorker(QObject):
             self.update_napari(images[channel], channel, i, j, k)
 
             file_name = file_ID + '_' + channel.replace(' ', '_') + ('.tiff' if images[channel].dtype == np.uint16 else '.' + Acquisition.IMAGE_FORMAT)
-            iio.imwrite(os.path.join(current_path, file_name), images[channel])
+            self.image_writer.submit(os.path.join(current_path, file_name), images[channel])
 
     def construct_rgb_image(self, images, file_ID, current_path, config, i, j, k):
         rgb_image = np.zeros((*images['BF LED matrix full_R'].shape, 3), dtype=images['BF LED matrix full_R'].dtype)
@@ -2443,23 +3250,36 @@ class MultiPointWorker(QObject):
         # write the RGB image
         print('writing RGB image')
         file_name = file_ID + '_BF_LED_matrix_full_RGB' + ('.tiff' if rgb_image.dtype == np.uint16 else '.' + Acquisition.IMAGE_FORMAT)
-        iio.imwrite(os.path.join(current_path, file_name), rgb_image)
+        self.image_writer.submit(os.path.join(current_path, file_name), rgb_image)
 
     def handle_acquisition_abort(self, current_path, region_id=0):
         self.move_to_coordinate(self.scan_coordinates_mm[region_id])
-        self.coordinates_pd.to_csv(os.path.join(current_path,'coordinates.csv'),index=False,header=True)
+        self.coordinate_log.close()
+        self.image_log.close()
         self.navigationController.enable_joystick_button_action = True
 
+    def resume_focus_lock(self):
+        # while the lock runs, each move and its wait are done under the command sequence lock so that no correction is sent in between
+        # the lock is paused again before the FOV (and its z stack) is imaged
+        if self.do_reflection_af and self.microscope.laserAutofocusController.focus_lock_is_running():
+            self.microscope.laserAutofocusController.resume_focus_lock()
+
     def move_to_next_x_position(self):
-        self.navigationController.move_x_usteps(self.x_scan_direction*self.deltaX_usteps)
-        self.wait_till_operation_is_completed()
-        time.sleep(SCAN_STABILIZATION_TIME_MS_X/1000)
+        self.resume_focus_lock()
+        with tracer.span('move xy'), self.microcontroller.command_sequence_lock:
+            self.navigationController.move_x_usteps(self.x_scan_direction*self.deltaX_usteps)
+            self.wait_till_operation_is_completed()
+        with tracer.span('settle'):
+            time.sleep(SCAN_STABILIZATION_TIME_MS_X/1000)
         self.dx_usteps = self.dx_usteps + self.x_scan_direction*self.deltaX_usteps
 
     def move_to_next_y_position(self):
-        self.navigationController.move_y_usteps(self.deltaY_usteps)
-        self.wait_till_operation_is_completed()
-        time.sleep(SCAN_STABILIZATION_TIME_MS_Y/1000)
+        self.resume_focus_lock()
+        with tracer.span('move xy'), self.microcontroller.command_sequence_lock:
+            self.navigationController.move_y_usteps(self.deltaY_usteps)
+            self.wait_till_operation_is_completed()
+        with tracer.span('settle'):
+            time.sleep(SCAN_STABILIZATION_TIME_MS_Y/1000)
         self.dy_usteps = self.dy_usteps + self.deltaY_usteps
 
     def move_z_for_stack(self):
@@ -2471,9 +3291,11 @@ class MultiPointWorker(QObject):
             if MULTIPOINT_PIEZO_UPDATE_DISPLAY:
                 self.signal_z_piezo_um.emit(self.z_piezo_um)
         else:
-            self.navigationController.move_z_usteps(self.deltaZ_usteps)
-            self.wait_till_operation_is_completed()
-            time.sleep(SCAN_STABILIZATION_TIME_MS_Z/1000)
+            with tracer.span('move z'):
+                self.navigationController.move_z_usteps(self.deltaZ_usteps)
+                self.wait_till_operation_is_completed()
+            with tracer.span('settle'):
+                time.sleep(SCAN_STABILIZATION_TIME_MS_Z/1000)
             self.dz_usteps = self.dz_usteps + self.deltaZ_usteps
 
     def move_z_back_after_stack(self):
@@ -2581,11 +3403,13 @@ class MultiPointController(QObject):
     signal_z_piezo_um = Signal(float)
     signal_acquisition_progress = Signal(int, int, int)
     signal_region_progress = Signal(int, int)
+    signal_write_errors = Signal(object) # list of (saving path, error), emitted before acquisitionFinished
 
     def __init__(self,camera,navigationController,liveController,autofocusController,configurationManager,usb_spectrometer=None,scanCoordinates=None,parent=None):
         QObject.__init__(self)
 
         self.camera = camera
+        self.write_errors = [] # (saving path, error) of the images of the last acquisition that could not be written
         if DO_FLUORESCENCE_RTP:
             self.processingHandler = ProcessingHandler()
         self.microcontroller = navigationController.microcontroller # to move to gui for transparency
@@ -2609,6 +3433,9 @@ class MultiPointController(QObject):
         self.deltat = 0
         self.do_autofocus = False
         self.do_reflection_af = False
+        self.use_focus_lock = FOCUS_LOCK_DURING_SCAN
+        self.live_stitching = STITCH_DURING_ACQUISITION
+        self.live_stitching_path = None
         self.gen_focus_map = False
         self.focus_map_storage = []
         self.already_using_fmap = False
@@ -2639,6 +3466,13 @@ class MultiPointController(QObject):
         self.location_list = None # for flexible multipoint
         self.coordinate_dict = None # for coordinate grid vs postion grid
         self.z_stacking_config = Z_STACKING_CONFIG
+        self.output_format = MULTIPOINT_OUTPUT_FORMAT
+        self.use_pipelined_acquisition = MULTIPOINT_PIPELINED_ACQUISITION
+        self.scan_path_optimization = SCAN_PATH_OPTIMIZATION
+        self.fov_order = None # region_id -> order in which the FOVs of coordinate_dict are visited
+        self.focus_surface_z = None # region_id -> z (mm) of each FOV of coordinate_dict predicted by the focus map
+        self.region_index = None # index in location_list of each entry of scan_coordinates_mm after reordering
+        self.acquisition_parameters = {}
 
     def set_use_piezo(self, checked):
         print("set use_piezo to", checked)
@@ -2690,6 +3524,12 @@ class MultiPointController(QObject):
     def set_reflection_af_flag(self,flag):
         self.do_reflection_af = flag
 
+    def set_focus_lock_flag(self,flag):
+        self.use_focus_lock = flag
+
+    def set_live_stitching_flag(self,flag):
+        self.live_stitching = flag
+
     def set_gen_focus_map_flag(self, flag):
         self.gen_focus_map = flag
         if not flag:
@@ -2711,6 +3551,124 @@ class MultiPointController(QObject):
     def set_base_path(self,path):
         self.base_path = path
 
+    def set_output_format(self,output_format):
+        # 'files' or 'ome_zarr'
+        self.output_format = output_format
+
+    def set_pipelined_acquisition_flag(self,flag):
+        self.use_pipelined_acquisition = flag
+
+    def set_scan_path_optimization(self,method):
+        # 'none', 'serpentine' or 'tsp'
+        self.scan_path_optimization = method
+
+    def get_scan_planner(self):
+        return ScanPathPlanner(motion_model_from_microcontroller(self.navigationController.microcontroller),method=self.scan_path_optimization)
+
+    def optimize_scan_path(self):
+        # reorder the regions (and the FOVs of coordinate based acquisitions) to minimize the stage travel time
+        self.fov_order = None
+        self.region_index = None
+        if self.scan_path_optimization == 'none':
+            return
+        planner = self.get_scan_planner()
+        start = (self.navigationController.x_pos_mm,self.navigationController.y_pos_mm)
+        if self.coordinate_dict is not None:
+            t_before = planner.plan_time(self.coordinate_dict,[(region_id,list(range(len(coordinates)))) for region_id, coordinates in self.coordinate_dict.items()],start)
+            plan = planner.plan(self.coordinate_dict,start)
+            t_after = planner.plan_time(self.coordinate_dict,plan,start)
+            self.coordinate_dict = {region_id:self.coordinate_dict[region_id] for region_id, fov_order in plan}
+            self.fov_order = {region_id:fov_order for region_id, fov_order in plan}
+            self.scan_coordinates_name = list(self.coordinate_dict.keys())
+        elif self.use_scan_coordinates and len(self.scan_coordinates_mm) > 1:
+            # the FOVs within each region are scanned as a serpentine grid, only the regions are reordered
+            centers = [coordinate_mm[:2] for coordinate_mm in self.scan_coordinates_mm]
+            order = planner.order(centers,start)
+            t_before = planner.motion_model.path_time(centers,start=start)
+            t_after = planner.motion_model.path_time(centers,order,start)
+            self.scan_coordinates_mm = [self.scan_coordinates_mm[k] for k in order]
+            self.scan_coordinates_name = [self.scan_coordinates_name[k] for k in order]
+            self.region_index = order
+        else:
+            return
+        print('scan path (' + self.scan_path_optimization + '): predicted travel time ' + str(round(t_before,1)) + ' s -> ' + str(round(t_after,1)) + ' s')
+
+    def predict_focus_z(self):
+        # z of every FOV of a coordinate based acquisition from the focus surface, computed once before the scan
+        self.focus_surface_z = None
+        if self.coordinate_dict is None or not self.autofocusController.use_focus_map:
+            return
+        self.focus_surface_z = {}
+        for region_id, coordinates in self.coordinate_dict.items():
+            self.focus_surface_z[region_id] = self.autofocusController.predict_focus_z(coordinates)
+        z_all = np.concatenate([z for z in self.focus_surface_z.values()] + [np.zeros(0)])
+        if len(z_all) > 0:
+            print('focus surface: predicted z from ' + str(round(np.min(z_all),4)) + ' to ' + str(round(np.max(z_all),4)) + ' mm')
+            if np.min(z_all) < SOFTWARE_POS_LIMIT.Z_NEGATIVE or np.max(z_all) > SOFTWARE_POS_LIMIT.Z_POSITIVE:
+                print('focus surface: predicted z outside of the software limits, check the focus map')
+
+    def _grid_positions(self,x_mm,y_mm):
+        # FOV positions of an NX x NY grid starting at (x_mm, y_mm), in the order MultiPointWorker visits them
+        positions = []
+        for i in range(self.NY):
+            columns = range(self.NX) if i % 2 == 0 else range(self.NX-1,-1,-1)
+            for j in columns:
+                positions.append((x_mm + j*self.deltaX, y_mm + i*self.deltaY))
+        return positions
+
+    def estimate_acquisition_time(self,location_list=None,coordinate_dict=None):
+        # dry run - predicts the duration of an acquisition with the current settings without moving the stage or acquiring images
+        planner = self.get_scan_planner()
+        start = (self.navigationController.x_pos_mm,self.navigationController.y_pos_mm)
+        if coordinate_dict is not None:
+            regions = coordinate_dict
+            plan = planner.plan(regions,start)
+        else:
+            if location_list is not None:
+                centers = [tuple(location[:2]) for location in location_list]
+            elif self.scanCoordinates is not None and self.scanCoordinates.get_selected_wells():
+                centers = [tuple(coordinate_mm[:2]) for coordinate_mm in self.scanCoordinates.coordinates_mm]
+            else:
+                centers = None
+            regions = {}
+            if centers is None:
+                regions[0] = self._grid_positions(start[0],start[1])
+            else:
+                for k, (x_mm, y_mm) in enumerate(centers):
+                    regions[k] = self._grid_positions(x_mm - (self.NX-1)*self.deltaX/2, y_mm - (self.NY-1)*self.deltaY/2)
+            region_order = planner.order(centers,start) if centers is not None else [0]
+            plan = [(k,list(range(len(regions[k])))) for k in region_order]
+        unoptimized_plan = [(region_id,list(range(len(coordinates)))) for region_id, coordinates in regions.items()]
+        n_fovs = sum(len(coordinates) for coordinates in regions.values())
+
+        # imaging time per FOV: exposures and z steps
+        velocity_z, acceleration_z = self.navigationController.microcontroller.max_velocity_acceleration[AXIS.Z]
+        t_z_step = float(planner.motion_model.axis_move_time(self.deltaZ,velocity_z,acceleration_z)) + SCAN_STABILIZATION_TIME_MS_Z/1000
+        t_exposure = sum(config.exposure_time for config in self.selected_configurations)/1000
+        t_fov = self.NZ*t_exposure + (self.NZ-1)*t_z_step
+
+        estimate = {
+            'n_regions': len(regions),
+            'n_fovs': n_fovs,
+            'travel_time_s': planner.plan_time(regions,plan,start),
+            'travel_time_unoptimized_s': planner.plan_time(regions,unoptimized_plan,start),
+            'imaging_time_s': n_fovs*t_fov }
+        estimate['time_point_s'] = estimate['travel_time_s'] + estimate['imaging_time_s']
+        estimate['total_time_s'] = max(self.Nt*estimate['time_point_s'],(self.Nt-1)*self.deltat + estimate['time_point_s'])
+        print('dry run: ' + str(n_fovs) + ' FOVs in ' + str(len(regions)) + ' regions, travel ' + str(round(estimate['travel_time_s'],1)) + ' s (' +
+              str(round(estimate['travel_time_unoptimized_s'],1)) + ' s unoptimized), imaging ' + str(round(estimate['imaging_time_s'],1)) + ' s, total ' + str(round(estimate['total_time_s'],1)) + ' s')
+        return estimate
+
+    def get_pixel_size_um(self):
+        try:
+            objective = self.acquisition_parameters['objective']
+            obj_focal_length_mm = objective['tube_lens_f_mm'] / objective['magnification']
+            actual_mag = self.acquisition_parameters['tube_lens_mm'] / obj_focal_length_mm
+            return self.acquisition_parameters['sensor_pixel_size_um'] / actual_mag
+        except (KeyError, TypeError, ZeroDivisionError) as e:
+            print('cannot compute the pixel size from the acquisition parameters (' + repr(e) + '), the OME-Zarr scale is set to 1 um per pixel')
+            return 1.0
+
     def start_new_experiment(self,experiment_ID): # @@@ to do: change name to prepare_folder_for_new_experiment
         # generate unique experiment ID
         self.experiment_ID = experiment_ID.replace(' ','_') + '_' + datetime.now().strftime('%Y-%m-%d_%H-%M-%S.%f')
@@ -2726,6 +3684,7 @@ class MultiPointController(QObject):
             'dz(um)': self.deltaZ * 1000 if self.deltaZ != 0 else 1, 'Nz': self.NZ,
             'dt(s)': self.deltat, 'Nt': self.Nt,
             'with AF': self.do_autofocus, 'with reflection AF': self.do_reflection_af,
+            'AF method': self.autofocusController.af_method, 'AF peak fit': self.autofocusController.peak_fit,
         }
         try: # write objective data if it is available
             current_objective = self.parent.objectiveStore.current_objective
@@ -2745,11 +3704,25 @@ class MultiPointController(QObject):
                 pass
         # TODO: USE OBJECTIVE STORE DATA
         acquisition_parameters['sensor_pixel_size_um'] = CAMERA_PIXEL_SIZE_UM[CAMERA_SENSOR]
+        acquisition_parameters['camera_sensor'] = CAMERA_SENSOR
+        try:
+            acquisition_parameters['binning'] = self.parent.objectiveStore.pixel_binning
+        except:
+            acquisition_parameters['binning'] = 1
         acquisition_parameters['tube_lens_mm'] = TUBE_LENS_MM
+        acquisition_parameters['output_format'] = self.output_format
+        self.acquisition_parameters = acquisition_parameters
         f = open(os.path.join(self.base_path,self.experiment_ID)+"/acquisition parameters.json","w")
         f.write(json.dumps(acquisition_parameters))
         f.close()
 
+    def update_acquisition_parameters(self, **values):
+        # adds values known once the acquisition starts to acquisition parameters.json
+        self.acquisition_parameters.update(values)
+        f = open(os.path.join(self.base_path,self.experiment_ID)+"/acquisition parameters.json","w")
+        f.write(json.dumps(self.acquisition_parameters))
+        f.close()
+
     def set_selected_configurations(self, selected_configurations_name):
         self.selected_configurations = []
         for configuration_name in selected_configurations_name:
@@ -2757,6 +3730,8 @@ class MultiPointController(QObject):
 
     def run_acquisition(self, location_list=None, coordinate_dict=None):
         print('start multipoint')
+        self.live_stitching_path = None
+        self.write_errors = []
 
         if coordinate_dict is not None:
             print('Using coordinate-based acquisition')
@@ -2788,6 +3763,9 @@ class MultiPointController(QObject):
                 self.scan_coordinates_mm = [(self.navigationController.x_pos_mm, self.navigationController.y_pos_mm)]
                 self.scan_coordinates_name = ['ROI']
 
+        self.optimize_scan_path()
+        self.predict_focus_z()
+
         print("num regions:",len(self.scan_coordinates_mm))
         print("region ids:", self.scan_coordinates_name)
         print("region coordinates:", self.scan_coordinates_mm)
@@ -2817,7 +3795,7 @@ class MultiPointController(QObject):
                 self.usb_spectrometer_was_streaming = False
 
         # set current tabs
-        if self.parent.performance_mode:
+        if self.parent is not None and self.parent.performance_mode:
             self.parent.imageDisplayTabs.setCurrentIndex(0)
 
         elif self.parent is not None and not self.parent.live_only_mode:
@@ -2912,6 +3890,7 @@ class MultiPointController(QObject):
         self.multiPointWorker.signal_z_piezo_um.connect(self.slot_z_piezo_um)
         self.multiPointWorker.signal_acquisition_progress.connect(self.slot_acquisition_progress)
         self.multiPointWorker.signal_region_progress.connect(self.slot_region_progress)
+        self.multiPointWorker.signal_write_errors.connect(self.slot_write_errors)
 
         # self.thread.finished.connect(self.thread.deleteLater)
         self.thread.finished.connect(self.thread.quit)
@@ -2924,7 +3903,7 @@ class MultiPointController(QObject):
             self.autofocusController.clear_focus_map()
             for x,y,z in self.focus_map_storage:
                 self.autofocusController.focus_map_coords.append((x,y,z))
-            self.autofocusController.use_focus_map = self.already_using_fmap
+            self.autofocusController.set_focus_map_use(self.already_using_fmap)
         self.signal_current_configuration.emit(self.configuration_before_running_multipoint)
 
         # re-enable callback
@@ -2952,7 +3931,12 @@ class MultiPointController(QObject):
         utils.create_done_file(os.path.join(self.base_path,self.experiment_ID))
         self.acquisitionFinished.emit()
         if not self.abort_acqusition_requested:
-            self.signal_stitcher.emit(os.path.join(self.base_path,self.experiment_ID))
+            if self.live_stitching_path is not None:
+                print('acquisition stitched into ' + self.live_stitching_path + ', tile stitching is skipped')
+            elif self.output_format == 'ome_zarr':
+                print('acquisition written to ' + os.path.join(self.base_path,self.experiment_ID,'acquisition.ome.zarr') + ', tile stitching is skipped')
+            else:
+                self.signal_stitcher.emit(os.path.join(self.base_path,self.experiment_ID))
         QApplication.processEvents()
 
     def request_abort_aquisition(self):
@@ -3000,6 +3984,11 @@ class MultiPointController(QObject):
     def slot_region_progress(self, current_fov, total_fovs):
         self.signal_region_progress.emit(current_fov, total_fovs)
 
+    def slot_write_errors(self, write_errors):
+        self.write_errors = write_errors
+        print('multipoint acquisition: ' + str(len(write_errors)) + ' image(s) could not be written')
+        self.signal_write_errors.emit(write_errors)
+
 
 class TrackingController(QObject):
 
@@ -3389,8 +4378,7 @@ class TrackingWorker(QObject):
         self.finished.emit()
 
     def wait_till_operation_is_completed(self):
-        while self.microcontroller.is_busy():
-            time.sleep(SLEEP_TIME_S)
+        self.microcontroller.wait_for_completion()
 
 
 class ImageDisplayWindow(QMainWindow):
@@ -4210,6 +5198,18 @@ class LaserAutofocusController(QObject):
         self.look_for_cache = look_for_cache
 
         self.image = None # for saving the focus camera image for debugging when centroid cannot be found
+        self.spot_detector = SpotDetector()
+
+        # focus lock
+        self.focus_lock_thread = None
+        self.focus_lock_target_um = 0
+        self.focus_lock_actuator = None
+        self.focus_lock_z_piezo_um = OBJECTIVE_PIEZO_HOME_UM
+        self.focus_lock_running = Event() # cleared while the lock is paused
+        self.focus_lock_idle = Event() # set by the loop once it has stopped applying corrections
+        self.focus_lock_locked = Event()
+        self.focus_lock_terminate = False
+        self.focus_lock_telemetry = deque(maxlen=FOCUS_LOCK_TELEMETRY_LENGTH)
 
         if look_for_cache:
             cache_path = "cache/laser_af_reference_plane.txt"
@@ -4383,66 +5383,18 @@ class LaserAutofocusController(QObject):
         self.signal_displacement_um.emit(0)
 
     def _caculate_centroid(self,image):
-        if self.has_two_interfaces == False:
-            h,w = image.shape
-            x,y = np.meshgrid(range(w),range(h))
-            I = image.astype(float)
-            I = I - np.amin(I)
-            I[I/np.amax(I)<0.2] = 0
-            x = np.sum(x*I)/np.sum(I)
-            y = np.sum(y*I)/np.sum(I)
-            return x,y
-        else:
-            I = image
-            # get the y position of the spots
-            tmp = np.sum(I,axis=1)
-            y0 = np.argmax(tmp)
-            # crop along the y axis
-            I = I[y0-96:y0+96,:]
-            # signal along x
-            tmp = np.sum(I,axis=0)
-            # find peaks
-            peak_locations,_ = scipy.signal.find_peaks(tmp,distance=100)
-            idx = np.argsort(tmp[peak_locations])
-            peak_0_location = peak_locations[idx[-1]]
-            peak_1_location = peak_locations[idx[-2]] # for air-glass-water, the smaller peak corresponds to the glass-water interface
-            self.spot_spacing_pixels = peak_1_location-peak_0_location
-            '''
-            # find peaks - alternative
-            if self.spot_spacing_pixels is not None:
-                peak_locations,_ = scipy.signal.find_peaks(tmp,distance=100)
-                idx = np.argsort(tmp[peak_locations])
-                peak_0_location = peak_locations[idx[-1]]
-                peak_1_location = peak_locations[idx[-2]] # for air-glass-water, the smaller peak corresponds to the glass-water interface
-                self.spot_spacing_pixels = peak_1_location-peak_0_location
-            else:
-                peak_0_location = np.argmax(tmp)
-                peak_1_location = peak_0_location + self.spot_spacing_pixels
-            '''
-            # choose which surface to use
-            if self.use_glass_top:
-                x1 = peak_1_location
-            else:
-                x1 = peak_0_location
-            # find centroid
-            h,w = I.shape
-            x,y = np.meshgrid(range(w),range(h))
-            I = I[:,max(0,x1-64):min(w-1,x1+64)]
-            x = x[:,max(0,x1-64):min(w-1,x1+64)]
-            y = y[:,max(0,x1-64):min(w-1,x1+64)]
-            I = I.astype(float)
-            I = I - np.amin(I)
-            I[I/np.amax(I)<0.1] = 0
-            x1 = np.sum(x*I)/np.sum(I)
-            y1 = np.sum(y*I)/np.sum(I)
-            return x1,y0-96+y1
-
-    def _get_laser_spot_centroid(self):
+        x, y = self.spot_detector.find_spot(image,self.has_two_interfaces,self.use_glass_top)
+        if self.has_two_interfaces:
+            self.spot_spacing_pixels = self.spot_detector.spot_spacing_pixels
+        return x,y
+
+    def _get_laser_spot_centroid(self,n=LASER_AF_AVERAGING_N):
         # disable camera callback
         self.camera.disable_callback()
-        tmp_x = 0
-        tmp_y = 0
-        for i in range(LASER_AF_AVERAGING_N):
+        images = []
+        if LASER_AF_BURST_CAPTURE and n > 1:
+            images = self._grab_burst(n)
+        while len(images) < n:
             # send camera trigger
             if self.liveController.trigger_mode == TriggerMode.SOFTWARE:
                 self.camera.send_trigger()
@@ -4450,22 +5402,199 @@ class LaserAutofocusController(QObject):
                 # self.microcontroller.send_hardware_trigger(control_illumination=True,illumination_on_time_us=self.camera.exposure_time*1000)
                 pass # to edit
             # read camera frame
-            image = self.camera.read_frame()
-            self.image = image
-            # optionally display the image
-            if LASER_AF_DISPLAY_SPOT_IMAGE:
-                self.image_to_display.emit(image)
+            images.append(self.camera.read_frame())
+        tmp_x = 0
+        tmp_y = 0
+        for image in images:
             # calculate centroid
             x,y = self._caculate_centroid(image)
             tmp_x = tmp_x + x
             tmp_y = tmp_y + y
-        x = tmp_x/LASER_AF_AVERAGING_N
-        y = tmp_y/LASER_AF_AVERAGING_N
+        self.image = images[-1]
+        # optionally display the image
+        if LASER_AF_DISPLAY_SPOT_IMAGE:
+            self.image_to_display.emit(self.image)
+        x = tmp_x/n
+        y = tmp_y/n
         return x,y
 
+    def start_focus_lock(self,target_um=0,actuator=FOCUS_LOCK_ACTUATOR):
+        # keeps the displacement at target_um in a background thread, corrections are applied with the z stepper or the objective piezo
+        if self.focus_lock_thread is not None:
+            return
+        if actuator == 'auto':
+            actuator = 'piezo' if ENABLE_OBJECTIVE_PIEZO else 'z'
+        self.focus_lock_actuator = actuator
+        self.focus_lock_target_um = target_um
+        if actuator == 'piezo':
+            self.focus_lock_z_piezo_um = OBJECTIVE_PIEZO_HOME_UM
+            self.navigationController.set_piezo_um(self.focus_lock_z_piezo_um)
+        self.focus_lock_telemetry.clear()
+        self.focus_lock_terminate = False
+        self.focus_lock_locked.clear()
+        self.resume_focus_lock()
+        self.focus_lock_thread = Thread(target=self._run_focus_lock,daemon=True)
+        self.focus_lock_thread.start()
+        print('focus lock started (' + actuator + ')')
+
+    def stop_focus_lock(self):
+        if self.focus_lock_thread is None:
+            return
+        self.pause_focus_lock()
+        self.focus_lock_terminate = True
+        self.focus_lock_running.set()
+        self.focus_lock_thread.join()
+        self.focus_lock_thread = None
+        self.focus_lock_running.clear()
+        errors = [entry[2] for entry in self.focus_lock_telemetry if entry[5] == 'tracking']
+        if len(errors) > 0:
+            print('focus lock stopped, rms error ' + str(round(float(np.sqrt(np.mean(np.square(errors)))),2)) + ' um over ' + str(len(errors)) + ' measurements')
+
+    def focus_lock_is_running(self):
+        return self.focus_lock_thread is not None
+
+    def pause_focus_lock(self):
+        # returns once no correction is in progress, the laser is turned off so that it does not show up in the images
+        if not self.focus_lock_running.is_set():
+            return
+        self.focus_lock_running.clear()
+        if not self.focus_lock_idle.wait(1):
+            print('focus lock: still measuring when paused')
+        # a correction holds the command lock until it has been completed, and none is started once the lock is paused
+        with self.microcontroller.command_sequence_lock:
+            pass
+        self.microcontroller.turn_off_AF_laser()
+        self.wait_till_operation_is_completed()
+
+    def resume_focus_lock(self):
+        if self.focus_lock_running.is_set():
+            return
+        self.microcontroller.turn_on_AF_laser()
+        self.wait_till_operation_is_completed()
+        self.focus_lock_locked.clear()
+        self.focus_lock_idle.clear()
+        self.focus_lock_running.set()
+
+    def wait_for_focus_lock(self,timeout_s=FOCUS_LOCK_TIMEOUT_S):
+        return self.focus_lock_locked.wait(timeout_s)
+
+    def _run_focus_lock(self):
+        integral_um = 0
+        n_within_tolerance = 0
+        n_failures = 0
+        timestamp_last = time.time()
+        while self.focus_lock_terminate == False:
+            if not self.focus_lock_running.is_set():
+                integral_um = 0
+                n_within_tolerance = 0
+                self.focus_lock_locked.clear()
+                self.focus_lock_idle.set()
+                self.focus_lock_running.wait(0.05)
+                timestamp_last = time.time()
+                continue
+            if self.microcontroller.is_busy():
+                # the spot moves with the stage, measurements start once the acquisition's move has been completed
+                self.microcontroller.wait_for_completion(0.1)
+                continue
+            timestamp_0 = time.time()
+            try:
+                x,y = self._get_laser_spot_centroid(FOCUS_LOCK_AVERAGING_N)
+            except Exception as e:
+                # retry with an increasing delay rather than as fast as the camera fails
+                if n_failures == 0:
+                    print('focus lock: no laser spot (' + str(e) + ')')
+                n_failures = n_failures + 1
+                self.focus_lock_locked.clear()
+                n_within_tolerance = 0
+                time.sleep(min(FOCUS_LOCK_RETRY_MIN_S*2**(n_failures-1),FOCUS_LOCK_RETRY_MAX_S))
+                continue
+            if n_failures > 0:
+                print('focus lock: laser spot found after ' + str(n_failures) + ' failed measurements')
+                n_failures = 0
+            timestamp = time.time()
+            displacement_um = (x - self.x_reference)*self.pixel_to_um
+            error_um = self.focus_lock_target_um - displacement_um
+            correction_um = 0
+            if abs(displacement_um) > LASER_AF_RANGE:
+                status = 'out of range'
+                n_within_tolerance = 0
+            else:
+                status = 'tracking'
+                n_within_tolerance = n_within_tolerance + 1 if abs(error_um) < FOCUS_LOCK_TOLERANCE_UM else 0
+                if abs(error_um) > FOCUS_LOCK_DEADBAND_UM:
+                    integral_next_um = integral_um + error_um*(timestamp-timestamp_last)
+                    correction_um = FOCUS_LOCK_GAIN*error_um + FOCUS_LOCK_INTEGRAL_GAIN*integral_next_um
+                    correction_um = min(max(correction_um,-FOCUS_LOCK_MAX_STEP_UM),FOCUS_LOCK_MAX_STEP_UM)
+                    if self._apply_focus_correction(correction_um):
+                        integral_um = integral_next_um
+                    else:
+                        # the stage started moving (or the lock was paused) during the measurement
+                        status = 'stage busy'
+                        correction_um = 0
+                        n_within_tolerance = 0
+            timestamp_last = timestamp
+            if n_within_tolerance >= FOCUS_LOCK_N_LOCKED:
+                self.focus_lock_locked.set()
+            else:
+                self.focus_lock_locked.clear()
+            self.focus_lock_telemetry.append((timestamp,displacement_um,error_um,correction_um,self.focus_lock_z_piezo_um if self.focus_lock_actuator == 'piezo' else self.navigationController.z_pos_mm*1000,status))
+            self.signal_displacement_um.emit(displacement_um)
+            if FOCUS_LOCK_LOOP_PERIOD_MS > 0:
+                time.sleep(max(0,FOCUS_LOCK_LOOP_PERIOD_MS/1000-(time.time()-timestamp_0)))
+
+    def _apply_focus_correction(self,correction_um):
+        # the correction is only sent while the mcu is idle, and waited for while holding the command lock so that the commands of the acquisition thread are not interleaved with it
+        # returns False if the correction was not applied
+        with self.microcontroller.command_sequence_lock:
+            if self.microcontroller.is_busy() or not self.focus_lock_running.is_set():
+                return False
+            if self.focus_lock_actuator == 'piezo':
+                z_piezo_um = min(max(self.focus_lock_z_piezo_um + correction_um,0),OBJECTIVE_PIEZO_RANGE_UM)
+                if z_piezo_um != self.focus_lock_z_piezo_um + correction_um:
+                    print('focus lock: piezo at the end of its range')
+                self.focus_lock_z_piezo_um = z_piezo_um
+                self.navigationController.set_piezo_um(z_piezo_um)
+            else:
+                self.navigationController.move_z(correction_um/1000)
+            if not self.microcontroller.wait_for_completion(FOCUS_LOCK_COMMAND_TIMEOUT_S):
+                print('focus lock: correction not completed')
+        # the next measurement is taken once the correction has settled
+        time.sleep(FOCUS_LOCK_SETTLE_MS/1000)
+        return True
+
+    def get_focus_lock_telemetry(self):
+        return pd.DataFrame(list(self.focus_lock_telemetry),columns=['time','displacement (um)','error (um)','correction (um)','actuator position (um)','status'])
+
+    def _grab_burst(self,n):
+        # the camera runs continuously until n frames have been received through the callback, then goes back to its previous trigger mode
+        images = []
+        burst_done = Event()
+        timestamp_switch = [None] # frames delivered before the camera has switched to continuous acquisition are dropped
+        def on_frame(camera):
+            if timestamp_switch[0] is None or camera.timestamp < timestamp_switch[0]:
+                return
+            if len(images) < n:
+                images.append(np.copy(camera.current_frame))
+            if len(images) >= n:
+                burst_done.set()
+        trigger_mode_before = getattr(self.camera,'trigger_mode',None)
+        callback_before = self.camera.new_image_callback_external
+        self.camera.set_callback(on_frame)
+        self.camera.enable_callback()
+        self.camera.set_continuous_acquisition()
+        timestamp_switch[0] = time.time()
+        if not burst_done.wait(LASER_AF_BURST_TIMEOUT_S):
+            print('laser AF burst: received ' + str(len(images)) + ' of ' + str(n) + ' frames')
+        if trigger_mode_before == TriggerMode.HARDWARE:
+            self.camera.set_hardware_triggered_acquisition()
+        elif trigger_mode_before != TriggerMode.CONTINUOUS:
+            self.camera.set_software_triggered_acquisition()
+        self.camera.disable_callback()
+        self.camera.set_callback(callback_before)
+        return images[:n]
+
     def wait_till_operation_is_completed(self):
-        while self.microcontroller.is_busy():
-            time.sleep(SLEEP_TIME_S)
+        self.microcontroller.wait_for_completion()
 
     def get_image(self):
         # turn on the laser
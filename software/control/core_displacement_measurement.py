@@ -10,6 +10,7 @@ from qtpy.QtGui import *
 
 import control.utils as utils
 from control._def import *
+from control.spot_detection import SpotDetector
 
 import time
 import numpy as np
@@ -32,6 +33,7 @@ class DisplacementMeasurementController(QObject):
         self.t_array = np.array([])
         self.x_array = np.array([])
         self.y_array = np.array([])
+        self.spot_detector = SpotDetector(gaussian_fit=False)
 
     def update_measurement(self,image):
 
@@ -40,14 +42,8 @@ class DisplacementMeasurementController(QObject):
         if len(image.shape)==3:
             image = cv2.cvtColor(image,cv2.COLOR_RGB2GRAY)
 
-        h,w = image.shape
-        x,y = np.meshgrid(range(w),range(h))
-        I = image.astype(float)
-        I = I - np.amin(I)
-        I[I/np.amax(I)<0.2] = 0
-        x = np.sum(x*I)/np.sum(I)
-        y = np.sum(y*I)/np.sum(I)
-        
+        x,y = self.spot_detector.centroid(image,0.2)
+
         x = x - self.x_offset
         y = y - self.y_offset
         x = x*self.x_scaling
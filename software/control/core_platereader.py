@@ -93,8 +93,7 @@ class PlateReadingWorker(QObject):
         self.finished.emit()
 
     def wait_till_operation_is_completed(self):
-        while self.microcontroller.is_busy():
-            time.sleep(SLEEP_TIME_S)
+        self.microcontroller.wait_for_completion()
 
     def run_single_time_point(self):
         self.FOV_counter = 0
@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import random
+import threading
+import numpy as np
+import cv2
+
+from control._def import *
+
+
+def calibration_from_acquisition_parameters(acquisition_params):
+    # (objective, camera, binning) of an acquisition, for acquisitions saved before these were recorded the defaults are used
+    objective = acquisition_params.get('objective', {}).get('name', DEFAULT_OBJECTIVE)
+    camera = acquisition_params.get('camera_sensor', CAMERA_SENSOR)
+    binning = acquisition_params.get('binning', 1)
+    return objective, camera, binning
+
+
+def fit_flatfield(images, get_darkfield=FLATFIELD_FIT_DARKFIELD):
+    # images: (N, Y, X) of one channel, returns float32 flatfield (mean 1) and darkfield (or None)
+    from basicpy import BaSiC # imported here so that acquisitions that only apply stored profiles don't load it
+    basic = BaSiC(get_darkfield=get_darkfield, smoothness_flatfield=1)
+    basic.fit(np.asarray(images))
+    flatfield = np.asarray(basic.flatfield, dtype=np.float32)
+    darkfield = np.asarray(basic.darkfield, dtype=np.float32) if get_darkfield else None
+    return flatfield, darkfield
+
+
+class FlatfieldCorrector(object):
+    """
+    :brief: applies a flatfield/darkfield profile to images of one channel,
+        (image - darkfield) * (1 / flatfield) in float32 with the reciprocal
+        precomputed and the intermediate buffer reused between images.
+    """
+    def __init__(self,flatfield,darkfield=None):
+        self.flatfield = np.asarray(flatfield,dtype=np.float32)
+        self.gain = (1/np.maximum(self.flatfield,1e-6)).astype(np.float32)
+        self.darkfield = None if darkfield is None else np.asarray(darkfield,dtype=np.float32)
+        self.shape = self.flatfield.shape
+        self._buffer = None
+        self._lock = threading.Lock()
+
+    def _resized(self,profile,shape):
+        return cv2.resize(profile,(shape[1],shape[0]),interpolation=cv2.INTER_LINEAR)
+
+    def resize(self,shape):
+        # profile for images of a different size (e.g. fitted on downsampled images)
+        darkfield = None if self.darkfield is None else self._resized(self.darkfield,shape)
+        return FlatfieldCorrector(self._resized(self.flatfield,shape),darkfield)
+
+    def apply(self,image,dtype=None):
+        if image.shape[:2] != self.shape:
+            print('flatfield: image of shape ' + str(image.shape) + ' does not match the profile (' + str(self.shape) + '), not corrected')
+            return image
+        dtype = np.dtype(image.dtype if dtype is None else dtype)
+        with self._lock:
+            if self._buffer is None or self._buffer.shape != image.shape[:2]:
+                self._buffer = np.empty(image.shape[:2],dtype=np.float32)
+            out = self._buffer
+            if self.darkfield is not None:
+                np.subtract(image,self.darkfield,out=out,dtype=np.float32)
+            else:
+                out[...] = image
+            np.multiply(out,self.gain,out=out)
+            if np.issubdtype(dtype,np.integer):
+                info = np.iinfo(dtype)
+                np.rint(out,out=out)
+                np.clip(out,info.min,info.max,out=out)
+            return out.astype(dtype)
+
+
+class FlatfieldStore(object):
+    """
+    :brief: persistent flatfield/darkfield profiles keyed by objective,
+        camera, channel and binning. Each profile is an .npz file in the
+        store folder, index.json lists them with the number of images they
+        were fitted on, so that stitching runs and acquisitions reuse the
+        same calibration instead of fitting it again.
+    """
+    def __init__(self,path=FLATFIELD_STORE_PATH):
+        self.path = path
+        self.index_path = os.path.join(path,'index.json')
+        self.index = {}
+        self.correctors = {} # key -> FlatfieldCorrector of the profiles loaded
+        self._lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path,'r') as f:
+                    self.index = json.load(f)
+            except Exception as e:
+                print('flatfield store: could not read ' + self.index_path + ': ' + str(e))
+
+    def make_key(self,objective,camera,channel,binning=1):
+        return '|'.join([str(objective),str(camera),str(channel),'bin' + str(int(binning))])
+
+    def _filename(self,key):
+        return re.sub(r'[^A-Za-z0-9_.-]+','_',key) + '.npz'
+
+    def has(self,objective,camera,channel,binning=1):
+        return self.make_key(objective,camera,channel,binning) in self.index
+
+    def get(self,objective,camera,channel,binning=1):
+        # FlatfieldCorrector of the stored profile, or None
+        key = self.make_key(objective,camera,channel,binning)
+        with self._lock:
+            if key in self.correctors:
+                return self.correctors[key]
+            if key not in self.index:
+                return None
+            try:
+                data = np.load(os.path.join(self.path,self.index[key]['file']))
+                darkfield = data['darkfield'] if 'darkfield' in data.files else None
+                self.correctors[key] = FlatfieldCorrector(data['flatfield'],darkfield)
+            except Exception as e:
+                print('flatfield store: could not load ' + key + ': ' + str(e))
+                return None
+            return self.correctors[key]
+
+    def put(self,objective,camera,channel,binning,flatfield,darkfield=None,n_images=0):
+        key = self.make_key(objective,camera,channel,binning)
+        filename = self._filename(key)
+        arrays = {'flatfield': np.asarray(flatfield,dtype=np.float32)}
+        if darkfield is not None:
+            arrays['darkfield'] = np.asarray(darkfield,dtype=np.float32)
+        with self._lock:
+            os.makedirs(self.path,exist_ok=True)
+            np.savez(os.path.join(self.path,filename),**arrays)
+            # profiles saved by another store (e.g. the fit of a previous acquisition finishing) are kept
+            if os.path.exists(self.index_path):
+                try:
+                    with open(self.index_path,'r') as f:
+                        self.index = json.load(f)
+                except Exception as e:
+                    print('flatfield store: could not read ' + self.index_path + ': ' + str(e))
+            self.index[key] = {'file': filename, 'objective': objective, 'camera': camera, 'channel': channel, 'binning': binning,
+                               'shape': list(arrays['flatfield'].shape), 'n_images': int(n_images), 'darkfield': darkfield is not None}
+            with open(self.index_path,'w') as f:
+                json.dump(self.index,f,indent=2)
+            self.correctors[key] = FlatfieldCorrector(flatfield,darkfield)
+        print('flatfield store: saved ' + key + ' (' + str(n_images) + ' images)')
+        return self.correctors[key]
+
+
+class FlatfieldSampler(object):
+    """
+    :brief: keeps a uniform random sample (reservoir sampling) of the FOVs
+        of each channel while an acquisition runs, downsampled to limit the
+        memory held, and fits their profiles into a FlatfieldStore at the end
+        (in a background thread, so that the acquisition finishes without
+        waiting for the fit).
+    """
+    def __init__(self,n_samples=FLATFIELD_N_SAMPLES,downsample=FLATFIELD_SAMPLE_DOWNSAMPLE):
+        self.n_samples = n_samples
+        self.downsample = max(1,int(downsample))
+        self.samples = {} # channel -> list of images
+        self.n_seen = {} # channel -> number of images offered
+        self.shapes = {} # channel -> full image shape
+
+    def add(self,channel,image):
+        if image.ndim != 2:
+            return
+        n = self.n_seen.get(channel,0) + 1
+        self.n_seen[channel] = n
+        samples = self.samples.setdefault(channel,[])
+        if len(samples) < self.n_samples:
+            i = len(samples)
+            samples.append(None)
+        else:
+            i = random.randrange(n)
+            if i >= self.n_samples:
+                return
+        self.shapes[channel] = image.shape
+        ds = self.downsample
+        h = image.shape[0] // ds * ds
+        w = image.shape[1] // ds * ds
+        samples[i] = image[:h,:w].reshape(h//ds,ds,w//ds,ds).mean(axis=(1,3),dtype=np.float32)
+
+    def fit_in_background(self,store,objective,camera,binning=1):
+        # the profiles are in the store once the thread has finished, acquisitions started before use the previous ones
+        thread = threading.Thread(target=self.fit,args=(store,objective,camera,binning),name='flatfield fit')
+        thread.start()
+        return thread
+
+    def fit(self,store,objective,camera,binning=1,min_samples=FLATFIELD_MIN_SAMPLES):
+        for channel, samples in self.samples.items():
+            if len(samples) < min_samples:
+                print('flatfield: ' + str(len(samples)) + ' images of ' + channel + ', at least ' + str(min_samples) + ' are needed for a profile')
+                continue
+            flatfield, darkfield = fit_flatfield(np.stack(samples))
+            corrector = FlatfieldCorrector(flatfield,darkfield).resize(self.shapes[channel])
+            store.put(objective,camera,channel,binning,corrector.flatfield,corrector.darkfield,n_images=len(samples))
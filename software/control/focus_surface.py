@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from scipy.interpolate import RBFInterpolator
+
+from control._def import *
+
+class FocusSurface(object):
+    """
+    :brief: smooth z(x,y) model of the sample surface fitted to any number of
+        focus measurements (contrast AF, laser AF, previous scans). Outliers
+        are rejected against a robust polynomial fit before the final surface
+        is fitted. method is 'plane', 'quadratic', 'thin_plate' or 'auto'
+        (picked from the number of points). Units are mm.
+    """
+    def __init__(self,method=FOCUS_SURFACE_METHOD,outlier_threshold_um=FOCUS_SURFACE_OUTLIER_THRESHOLD_UM,smoothing=FOCUS_SURFACE_SMOOTHING):
+        self.method = method
+        self.outlier_threshold_mm = outlier_threshold_um/1000
+        self.smoothing = smoothing
+        self.points = [] # (x_mm, y_mm, z_mm, source)
+        self.inliers = None
+        self.fitted_method = None
+        self.coefficients = None
+        self.interpolator = None
+
+    def __len__(self):
+        return len(self.points)
+
+    def clear(self):
+        self.points = []
+        self.inliers = None
+        self.fitted_method = None
+        self.coefficients = None
+        self.interpolator = None
+
+    def add_point(self,x_mm,y_mm,z_mm,source='manual',refit=True):
+        self.points.append((float(x_mm),float(y_mm),float(z_mm),source))
+        if refit and self.is_fitted():
+            try:
+                self.fit()
+            except ValueError as e:
+                print('focus surface: ' + str(e))
+
+    def set_points(self,points,source='manual'):
+        self.clear()
+        for x_mm, y_mm, z_mm in points:
+            self.points.append((float(x_mm),float(y_mm),float(z_mm),source))
+
+    def load_coordinates_csv(self,path,source='previous scan'):
+        # coordinates.csv written by MultiPointWorker, only the first z level of each FOV is used
+        coordinates = pd.read_csv(path)
+        if 'z_level' in coordinates.columns:
+            coordinates = coordinates[coordinates['z_level'] == 0]
+        for x_mm, y_mm, z_um in zip(coordinates['x (mm)'],coordinates['y (mm)'],coordinates['z (um)']):
+            self.points.append((float(x_mm),float(y_mm),float(z_um)/1000,source))
+
+    def is_fitted(self):
+        return self.fitted_method is not None
+
+    def _design_matrix(self,x,y,order):
+        columns = [np.ones_like(x),x,y]
+        if order == 2:
+            columns = columns + [x*x,x*y,y*y]
+        return np.stack(columns,axis=-1)
+
+    def _fit_polynomial(self,x,y,z,order):
+        A = self._design_matrix(x,y,order)
+        coefficients, residuals, rank, s = np.linalg.lstsq(A,z,rcond=None)
+        if rank < A.shape[1]:
+            raise ValueError('the focus points are degenerate (e.g. all on a line)')
+        return coefficients
+
+    def _choose_method(self,n):
+        if self.method != 'auto':
+            return self.method
+        if n >= 10:
+            return 'thin_plate'
+        if n >= 6:
+            return 'quadratic'
+        return 'plane'
+
+    def fit(self):
+        n = len(self.points)
+        if n < 3:
+            raise ValueError('at least 3 points are needed, got ' + str(n))
+        xyz = np.array([point[:3] for point in self.points],dtype=float)
+        # the coordinates are centered so that the polynomial fits are well conditioned
+        self.center = np.mean(xyz[:,:2],axis=0)
+        x = xyz[:,0] - self.center[0]
+        y = xyz[:,1] - self.center[1]
+        z = xyz[:,2]
+        method = self._choose_method(n)
+
+        # outlier rejection against a robust polynomial fit - drop the worst point until all residuals are within the threshold
+        order = 2 if method != 'plane' and n >= 8 else 1
+        inliers = np.ones(n,dtype=bool)
+        while np.count_nonzero(inliers) > (3 if order == 1 else 6) + 1:
+            coefficients = self._fit_polynomial(x[inliers],y[inliers],z[inliers],order)
+            residuals = np.abs(z - self._design_matrix(x,y,order) @ coefficients)
+            mad = 1.4826*np.median(residuals[inliers])
+            threshold = max(self.outlier_threshold_mm,3*mad)
+            worst = np.argmax(np.where(inliers,residuals,-1))
+            if residuals[worst] <= threshold:
+                break
+            print('focus surface: rejecting point (' + str(round(xyz[worst,0],3)) + ',' + str(round(xyz[worst,1],3)) + ',' + str(round(xyz[worst,2],4)) + '), residual ' + str(round(residuals[worst]*1000,1)) + ' um')
+            inliers[worst] = False
+        if method == 'thin_plate' and np.count_nonzero(inliers) < 10:
+            method = 'quadratic'
+        if method == 'quadratic' and np.count_nonzero(inliers) < 6:
+            method = 'plane'
+
+        if method == 'thin_plate':
+            self.interpolator = RBFInterpolator(np.stack([x[inliers],y[inliers]],axis=-1),z[inliers],kernel='thin_plate_spline',smoothing=self.smoothing,degree=1)
+            self.coefficients = None
+        else:
+            self.coefficients = self._fit_polynomial(x[inliers],y[inliers],z[inliers],2 if method == 'quadratic' else 1)
+            self.interpolator = None
+        self.inliers = inliers
+        self.fitted_method = method
+        return method
+
+    def predict(self,x_mm,y_mm):
+        # works on scalars and arrays
+        if not self.is_fitted():
+            self.fit()
+        x = np.asarray(x_mm,dtype=float) - self.center[0]
+        y = np.asarray(y_mm,dtype=float) - self.center[1]
+        if self.interpolator is not None:
+            z = self.interpolator(np.stack([x.ravel(),y.ravel()],axis=-1)).reshape(x.shape)
+        else:
+            order = 2 if len(self.coefficients) == 6 else 1
+            z = self._design_matrix(x,y,order) @ self.coefficients
+        if z.ndim == 0:
+            return float(z)
+        return z
+
+    def predict_many(self,positions):
+        positions = np.asarray(positions,dtype=float)
+        if len(positions) == 0:
+            return np.zeros(0)
+        return self.predict(positions[:,0],positions[:,1])
+
+    def get_residuals(self):
+        # residual of each point (mm), for checking the fit
+        xyz = np.array([point[:3] for point in self.points],dtype=float)
+        return xyz[:,2] - self.predict(xyz[:,0],xyz[:,1])
+
+    def save(self,path):
+        pd.DataFrame({'x (mm)':[point[0] for point in self.points],'y (mm)':[point[1] for point in self.points],
+                      'z (um)':[point[2]*1000 for point in self.points],'source':[point[3] for point in self.points],
+                      'inlier':list(self.inliers) if self.inliers is not None and len(self.inliers) == len(self.points) else [True]*len(self.points)}).to_csv(path,index=False)
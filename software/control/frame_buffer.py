@@ -0,0 +1,124 @@
+import threading
+import numpy as np
+
+from control._def import *
+
+class FrameRingBuffer(object):
+    """
+    :brief: preallocated N-slot frame pool shared between the camera callback
+        path and the frame consumers (display, saver, tracking). Camera drivers
+        that support it write frames straight into a slot (get_write_slot()
+        and commit()), frames of other drivers are copied once into a slot with
+        put(). Consumers get views of the slot instead of freshly allocated
+        arrays. A frame that arrives while all slots are pinned is dropped and
+        counted in frames_dropped. A consumer that holds on to a frame for longer
+        than a few frames (e.g. the image saver queue) should acquire() the
+        frame and release() it when done, pinned slots are never overwritten.
+    """
+    def __init__(self,n_slots=FRAME_RING_BUFFER_N_SLOTS):
+        self.n_slots = max(2,int(n_slots))
+        self.lock = threading.Lock()
+        self.shape = None
+        self.dtype = None
+        self.slots = []
+        self.frame_ID = np.full(self.n_slots,-1,dtype=np.int64)
+        self.timestamp = np.zeros(self.n_slots,dtype=np.float64)
+        self.pin_count = np.zeros(self.n_slots,dtype=np.int32)
+        self.write_index = -1
+        self.latest_index = -1
+        self.pinning_enabled = False
+        # statistics
+        self.frames_written = 0
+        self.frames_dropped = 0
+
+    def _allocate(self,shape,dtype):
+        # (re)allocate the slots - only happens when the frame shape/dtype changes (e.g. ROI, pixel format)
+        self.slots = [np.empty(shape,dtype=dtype) for i in range(self.n_slots)]
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_ID[:] = -1
+        self.timestamp[:] = 0
+        self.pin_count[:] = 0
+        self.write_index = -1
+        self.latest_index = -1
+
+    def _next_free_slot(self):
+        for n in range(1,self.n_slots+1):
+            index = (self.write_index + n) % self.n_slots
+            if self.pin_count[index] == 0 and index != self.latest_index:
+                return index
+        return None
+
+    def get_write_slot(self,shape,dtype):
+        # for drivers that can fill a buffer in place; call commit() once the slot is filled
+        with self.lock:
+            if self.shape != tuple(shape) or self.dtype != np.dtype(dtype):
+                self._allocate(shape,dtype)
+            index = self._next_free_slot()
+            if index is None:
+                self.frames_dropped = self.frames_dropped + 1
+                return None, None
+            self.write_index = index
+            return index, self.slots[index]
+
+    def commit(self,index,frame_ID,timestamp):
+        with self.lock:
+            self.frame_ID[index] = frame_ID
+            self.timestamp[index] = timestamp
+            self.latest_index = index
+            self.frames_written = self.frames_written + 1
+
+    def put(self,image,frame_ID,timestamp):
+        # copy a frame into the next free slot, returns a view of the slot (or None if all slots are pinned)
+        index, slot = self.get_write_slot(image.shape,image.dtype)
+        if index is None:
+            return None
+        np.copyto(slot,image)
+        self.commit(index,frame_ID,timestamp)
+        return slot
+
+    def get_latest(self):
+        with self.lock:
+            if self.latest_index < 0:
+                return None, -1, 0
+            index = self.latest_index
+            return self.slots[index], int(self.frame_ID[index]), float(self.timestamp[index])
+
+    def is_latest(self,image):
+        # whether image is the slot last committed, i.e. the driver has written the frame into the pool itself
+        with self.lock:
+            return self.latest_index >= 0 and self.slots[self.latest_index] is image
+
+    def _find_slot(self,image):
+        # find the slot an image (or a view of it, e.g. a crop) belongs to
+        if self.shape is None or not isinstance(image,np.ndarray):
+            return None
+        address = image.__array_interface__['data'][0]
+        for index, slot in enumerate(self.slots):
+            start = slot.__array_interface__['data'][0]
+            if start <= address < start + slot.nbytes:
+                return index
+        return None
+
+    def acquire(self,image):
+        with self.lock:
+            index = self._find_slot(image)
+            if index is None:
+                return False
+            self.pin_count[index] = self.pin_count[index] + 1
+            return True
+
+    def release(self,image):
+        with self.lock:
+            index = self._find_slot(image)
+            if index is None or self.pin_count[index] == 0:
+                return False
+            self.pin_count[index] = self.pin_count[index] - 1
+            return True
+
+    def enable_pinning(self,enabled=True):
+        # set by consumers that release() the frames they receive
+        self.pinning_enabled = enabled
+
+    def get_statistics(self):
+        return {'frames_written':self.frames_written,'frames_dropped':self.frames_dropped,'slots_pinned':int(np.count_nonzero(self.pin_count))}
@@ -144,6 +144,8 @@ class OctopiGUI(QMainWindow):
             self.navigationController = NavigationController_PriorStage(self.priorstage, self.microcontroller, self.objectiveStore, parent=self)
         else:
             self.navigationController = core.NavigationController(self.microcontroller, self.objectiveStore, parent=self)
+        if SIMULATION_SPECIMEN and hasattr(self.camera, 'set_specimen'):
+            self.loadSimulatedSpecimen()
         self.slidePositionController = core.SlidePositionController(self.navigationController, self.liveController, is_for_wellplate=True)
         self.autofocusController = core.AutoFocusController(self.camera, self.navigationController, self.liveController)
         self.scanCoordinates = core.ScanCoordinates()
@@ -184,6 +186,18 @@ class OctopiGUI(QMainWindow):
         if USE_OPTOSPIN_EMISSION_FILTER_WHEEL:
             self.emission_filter_wheel = serial_peripherals.Optospin_Simulation(SN=None)
         self.microcontroller = microcontroller.Microcontroller_Simulation()
+        # the hardware triggers of mcu sequences trigger the simulated camera
+        self.microcontroller.set_hardware_trigger_callback(self.camera.send_trigger)
+
+    def loadSimulatedSpecimen(self):
+        # the simulated camera images a specimen at the simulated stage position
+        from control.simulated_specimen import SimulatedSpecimen, stage_position_getter
+        if SIMULATION_SPECIMEN_PATH is not None:
+            specimen = SimulatedSpecimen.from_file(SIMULATION_SPECIMEN_PATH)
+        else:
+            specimen = SimulatedSpecimen()
+        get_channel = lambda: self.liveController.currentConfiguration.name if self.liveController.currentConfiguration is not None else None
+        self.camera.set_specimen(specimen, stage_position_getter(self.microcontroller, self.navigationController), get_channel=get_channel, pixel_size_um=self.objectiveStore.get_pixel_size())
 
     def loadHardwareObjects(self):
         # Initialize hardware objects
@@ -322,6 +336,8 @@ class OctopiGUI(QMainWindow):
 
         self.camera.set_software_triggered_acquisition()
         self.camera.set_callback(self.streamHandler.on_new_frame)
+        if hasattr(self.camera,'set_frame_buffer'):
+            self.camera.set_frame_buffer(self.streamHandler.frame_buffer)
         self.camera.enable_callback()
 
         if CAMERA_TYPE == "Toupcam":
@@ -334,12 +350,9 @@ class OctopiGUI(QMainWindow):
             self.camera_focus.start_streaming()
 
     def waitForMicrocontroller(self, timeout=None, error_message=None):
-        start_time = time.time()
-        while self.microcontroller.is_busy():
-            time.sleep(0.005)
-            if timeout and time.time() - start_time > timeout:
-                print(error_message or 'Microcontroller operation timed out')
-                sys.exit(1)
+        if not self.microcontroller.wait_for_completion(timeout if timeout else None):
+            print(error_message or 'Microcontroller operation timed out')
+            sys.exit(1)
 
     def loadWidgets(self):
         # Initialize all GUI widgets
@@ -595,6 +608,7 @@ class OctopiGUI(QMainWindow):
     def makeConnections(self):
         self.streamHandler.signal_new_frame_received.connect(self.liveController.on_new_frame)
         self.streamHandler.packet_image_to_write.connect(self.imageSaver.enqueue)
+        self.imageSaver.set_frame_buffer(self.streamHandler.frame_buffer)
         # self.streamHandler.packet_image_for_tracking.connect(self.trackingController.on_new_frame)
         self.navigationController.xPos.connect(lambda x: self.navigationWidget.label_Xpos.setText("{:.2f}".format(x) + " mm"))
         self.navigationController.yPos.connect(lambda x: self.navigationWidget.label_Ypos.setText("{:.2f}".format(x) + " mm"))
@@ -649,6 +663,7 @@ class OctopiGUI(QMainWindow):
         self.multipointController.signal_register_current_fov.connect(self.navigationViewer.register_fov)
         self.multipointController.signal_current_configuration.connect(self.liveControlWidget.set_microscope_mode)
         self.multipointController.signal_z_piezo_um.connect(self.piezoWidget.update_displacement_um_display)
+        self.multipointController.signal_write_errors.connect(self.showWriteErrors)
         self.multiPointWidgetGrid.signal_z_stacking.connect(self.multipointController.set_z_stacking_config)
 
         self.recordTabWidget.currentChanged.connect(self.onTabChanged)
@@ -984,6 +999,14 @@ class OctopiGUI(QMainWindow):
         else:
             self.stitcherWidget.hide()
 
+    def showWriteErrors(self, write_errors):
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Warning)
+        msg.setWindowTitle("Acquisition")
+        msg.setText(str(len(write_errors)) + " image(s) could not be written")
+        msg.setDetailedText("\n".join(str(path) + ": " + error for path, error in write_errors))
+        msg.exec_()
+
     def onStartLive(self):
         self.imageDisplayTabs.setCurrentIndex(0)
 
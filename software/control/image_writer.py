@@ -0,0 +1,87 @@
+import threading
+from queue import Queue
+import imageio as iio
+
+from control._def import *
+from control.tracing import tracer
+
+class ImageWriterPool(object):
+    """
+    :brief: pool of threads that write images to disk so that the acquisition
+        thread can move on to the next FOV while the previous one is being
+        encoded and written. submit() blocks when the images waiting to be
+        written exceed the memory budget. wait_until_done() returns once
+        everything submitted so far is on disk. With n_workers = 0 images are
+        written synchronously in submit().
+    """
+    def __init__(self,n_workers=MULTIPOINT_WRITER_N_WORKERS,max_memory_mb=MULTIPOINT_WRITER_MAX_MEMORY_MB,write_fn=None):
+        self.n_workers = max(0,int(n_workers))
+        self.max_pending_bytes = max_memory_mb*1024*1024
+        self.write_fn = write_fn if write_fn is not None else iio.imwrite
+        self.queue = Queue()
+        self.pending_bytes = 0
+        self.condition = threading.Condition()
+        self.errors = []
+        self.images_written = 0
+        self.threads = []
+        for i in range(self.n_workers):
+            thread = threading.Thread(target=self.process_queue,daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self,saving_path,image,write_fn=None):
+        # write_fn(saving_path,image) overrides the default writer for this image
+        if self.n_workers == 0:
+            self._write(saving_path,image,write_fn)
+            return
+        with self.condition:
+            # backpressure - wait for the writers to catch up (always accept at least one image)
+            while self.pending_bytes > 0 and self.pending_bytes + image.nbytes > self.max_pending_bytes:
+                self.condition.wait()
+            self.pending_bytes = self.pending_bytes + image.nbytes
+        self.queue.put([saving_path,image,write_fn])
+
+    def process_queue(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            saving_path, image, write_fn = item
+            self._write(saving_path,image,write_fn)
+            with self.condition:
+                self.pending_bytes = self.pending_bytes - image.nbytes
+                self.condition.notify_all()
+            self.queue.task_done()
+
+    def _write(self,saving_path,image,write_fn=None):
+        try:
+            if write_fn is None:
+                write_fn = self.write_fn
+            with tracer.span('write','io'):
+                write_fn(saving_path,image)
+            self.images_written = self.images_written + 1
+        except Exception as e:
+            print('error writing ' + str(saving_path) + ': ' + str(e))
+            with self.condition:
+                self.errors.append((saving_path,str(e)))
+
+    def wait_until_done(self):
+        # returns the list of (saving_path, error) for the images that failed to be written
+        self.queue.join()
+        with self.condition:
+            errors = self.errors
+            self.errors = []
+        if len(errors) > 0:
+            print(str(len(errors)) + ' image(s) failed to be written')
+        return errors
+
+    def close(self):
+        errors = self.wait_until_done()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.n_workers = 0
+        return errors
@@ -0,0 +1,139 @@
+import os
+import math
+import threading
+from queue import Queue
+import numpy as np
+import zarr
+import ome_zarr.writer
+
+from control._def import *
+from control.stitching_writer import build_pyramid
+from control.ome_zarr_writer import assign_well, write_plate_metadata
+
+class LiveStitcher(object):
+    """
+    :brief: stitches coordinate acquisitions into an OME-Zarr while they run.
+        Images are handed over by MultiPointWorker through a queue and
+        written by a background thread straight into the level 0 mosaic of
+        their region at the stage position of the FOV. Once the last image
+        of a region and time point has arrived, its pyramid levels are built
+        from level 0. Regions are wells of a plate when there is more than
+        one region. Tiles are not registered (stage positions only).
+    """
+    def __init__(self,path,channel_names,regions,Nt=1,NZ=1,dz_um=1.0,pixel_size_um=1.0,chunk_size=512,queue_size=LIVE_STITCHING_QUEUE_SIZE):
+        # regions: region -> list of FOV coordinates (x_mm, y_mm[, z_mm])
+        self.path = path
+        self.channel_names = list(channel_names)
+        self.regions = {str(region): [tuple(coordinate[:2]) for coordinate in coordinates] for region, coordinates in regions.items() if len(coordinates) > 0}
+        self.Nt = max(1,Nt)
+        self.NZ = max(1,NZ)
+        self.dz_um = dz_um
+        self.pixel_size_um = pixel_size_um
+        self.chunk_size = chunk_size
+        self.root = zarr.group(store=zarr.DirectoryStore(path),overwrite=True)
+        self.is_plate = len(self.regions) > 1
+        self.wells = {}
+        if self.is_plate:
+            self._write_plate_metadata()
+        self.arrays = {} # region -> arrays of the pyramid levels
+        self.tile_positions = {} # region -> [(y, x)] of each FOV in pixels
+        self.received = {} # (region, t) -> number of images placed
+        self.finalized = set()
+        self.skipped_images = 0
+        self.queue = Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+
+    def _write_plate_metadata(self):
+        for region in self.regions:
+            assign_well(region,self.wells)
+        write_plate_metadata(self.root,self.wells,os.path.basename(self.path))
+
+    def _region_arrays(self,region,tile_shape,dtype):
+        if region in self.arrays:
+            return self.arrays[region]
+        coordinates = np.array(self.regions[region],dtype=float)
+        x_min, y_min = coordinates.min(axis=0)
+        self.tile_positions[region] = [(int(round((y_mm-y_min)*1000/self.pixel_size_um)),int(round((x_mm-x_min)*1000/self.pixel_size_um))) for x_mm, y_mm in coordinates]
+        height = max(y for y, x in self.tile_positions[region]) + tile_shape[0]
+        width = max(x for y, x in self.tile_positions[region]) + tile_shape[1]
+
+        # same number of levels as the stitcher, so that a plate can be browsed at the lowest resolution
+        max_dimension = max(len(set(row for row,col in self.wells.values())),len(set(col for row,col in self.wells.values()))) if self.is_plate else 1
+        num_levels = max(1,math.ceil(np.log2(max(width,height)/1024*max_dimension)))
+
+        if self.is_plate:
+            row, col = self.wells[region]
+            well_group = self.root.require_group(row).require_group(col)
+            ome_zarr.writer.write_well_metadata(well_group,[{'path': '0', 'acquisition': 0}])
+            group = well_group.require_group('0')
+        else:
+            group = self.root
+        chunks = (1,1,1,self.chunk_size,self.chunk_size)
+        arrays = []
+        level_height, level_width = height, width
+        for level in range(num_levels):
+            arrays.append(group.zeros(str(level),shape=(self.Nt,len(self.channel_names),self.NZ,level_height,level_width),chunks=chunks,dtype=dtype,overwrite=True))
+            level_height, level_width = level_height//2, level_width//2
+        datasets = [{'path': str(level), 'coordinateTransformations': [{'type': 'scale', 'scale': [1,1,self.dz_um,self.pixel_size_um*2**level,self.pixel_size_um*2**level]}]} for level in range(num_levels)]
+        axes = [
+            {'name': 't', 'type': 'time', 'unit': 'second'},
+            {'name': 'c', 'type': 'channel'},
+            {'name': 'z', 'type': 'space', 'unit': 'micrometer'},
+            {'name': 'y', 'type': 'space', 'unit': 'micrometer'},
+            {'name': 'x', 'type': 'space', 'unit': 'micrometer'}]
+        ome_zarr.writer.write_multiscales_metadata(group,datasets,axes=axes,name=region)
+        group.attrs['omero'] = {'name': region, 'version': '0.4', 'channels': [{'label': name, 'active': True} for name in self.channel_names]}
+        self.arrays[region] = arrays
+        print('live stitching: region ' + region + ' is ' + str(width) + 'x' + str(height) + ' pixels, ' + str(num_levels) + ' levels')
+        return arrays
+
+    def submit(self,region,fov,t,channel_name,z_level,image):
+        # blocks when the stitcher falls behind
+        self.queue.put((str(region),fov,t,channel_name,z_level,image))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            try:
+                self._place(*item)
+            except Exception as e:
+                print('live stitching: error placing image: ' + str(e))
+            self.queue.task_done()
+
+    def _place(self,region,fov,t,channel_name,z_level,image):
+        if region not in self.regions or channel_name not in self.channel_names or image.ndim != 2:
+            self.skipped_images = self.skipped_images + 1
+            return
+        arrays = self._region_arrays(region,image.shape,image.dtype)
+        c = self.channel_names.index(channel_name)
+        y, x = self.tile_positions[region][fov]
+        bottom = min(y + image.shape[0],arrays[0].shape[3])
+        right = min(x + image.shape[1],arrays[0].shape[4])
+        arrays[0][t,c,z_level,y:bottom,x:right] = image[:bottom-y,:right-x]
+
+        key = (region,t)
+        self.received[key] = self.received.get(key,0) + 1
+        if self.received[key] == len(self.regions[region])*self.NZ*len(self.channel_names):
+            self._finalize(region,t)
+
+    def _finalize(self,region,t):
+        arrays = self.arrays[region]
+        for c in range(len(self.channel_names)):
+            for z_level in range(self.NZ):
+                build_pyramid(arrays,(t,c,z_level),self.chunk_size)
+        self.finalized.add((region,t))
+        print('live stitching: region ' + region + ' (t=' + str(t) + ') done')
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        # regions that did not receive all of their images (e.g. aborted acquisitions)
+        for region, t in self.received:
+            if (region,t) not in self.finalized:
+                self._finalize(region,t)
+        if self.skipped_images > 0:
+            print('live stitching: ' + str(self.skipped_images) + ' images were not stitched (color images or unknown regions/channels)')
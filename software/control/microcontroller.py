@@ -3,6 +3,7 @@ import serial
 import sys
 import serial.tools.list_ports
 import time
+import struct
 import numpy as np
 import threading
 from crc import CrcCalculator, Crc8
@@ -21,6 +22,41 @@ from qtpy.QtGui import *
 
 # to do (7/28/2021) - add functions for configuring the stepper motors
 
+def z_stack_sequence(dz_usteps,channels,n_planes,settle_us=0,backlash_usteps=0):
+    # steps of a z-stack of n_planes planes, to be run once: the channels are imaged at each plane, then z moves by dz_usteps to the next plane (not after the last one)
+    # channels: list of (illumination_source, intensity, illumination_on_time_us, wait_after_trigger_us)
+    # backlash_usteps: z first moves back and forth by backlash_usteps so that the first plane is approached in the direction of the z-stack
+    steps = []
+    if backlash_usteps > 0 and dz_usteps != 0:
+        direction = 1 if dz_usteps > 0 else -1
+        steps.append((SEQUENCE_STEP.MOVE_Z,-direction*backlash_usteps))
+        steps.append((SEQUENCE_STEP.MOVE_Z,direction*backlash_usteps))
+        if settle_us > 0:
+            steps.append((SEQUENCE_STEP.WAIT_US,settle_us))
+    for plane in range(n_planes):
+        if plane > 0:
+            steps.append((SEQUENCE_STEP.MOVE_Z,dz_usteps))
+            if settle_us > 0:
+                steps.append((SEQUENCE_STEP.WAIT_US,settle_us))
+        for illumination_source, intensity, illumination_on_time_us, wait_us in channels:
+            # with a single channel the illumination is only set once
+            if plane == 0 or len(channels) > 1:
+                steps.append((SEQUENCE_STEP.SET_ILLUMINATION,illumination_source,intensity))
+            steps.append((SEQUENCE_STEP.SEND_HARDWARE_TRIGGER,illumination_on_time_us,True,0))
+            if wait_us > 0:
+                steps.append((SEQUENCE_STEP.WAIT_US,wait_us))
+    if len(steps) > MAX_SEQUENCE_STEPS:
+        raise ValueError('the z-stack needs ' + str(len(steps)) + ' steps, a sequence can have at most ' + str(MAX_SEQUENCE_STEPS))
+    return steps
+
+def applied_velocity_mm(velocity_mm):
+    # set_max_velocity_acceleration sends the velocity in units of 0.01 mm/s, this is the velocity the axis actually moves at
+    return int(velocity_mm*100)/100
+
+def z_stack_frames(n_planes,n_channels):
+    # (plane, channel index) of the frames of a z_stack_sequence, in the order they are triggered
+    return [(plane,channel) for plane in range(n_planes) for channel in range(n_channels)]
+
 class Microcontroller():    
     def __init__(self,version='Arduino Due',sn=None,parent=None):
         self.serial = None
@@ -32,6 +68,7 @@ class Microcontroller():
         self._cmd_id_mcu = None # command id of mcu's last received command 
         self._cmd_execution_status = None
         self.mcu_cmd_execution_in_progress = False
+        self.cmd_completion_condition = threading.Condition() # notified by the reading thread when a command is completed
 
         self.x_pos = 0 # unit: microstep or encoder resolution
         self.y_pos = 0 # unit: microstep or encoder resolution
@@ -42,13 +79,37 @@ class Microcontroller():
         self.signal_joystick_button_pressed_event = False
         self.switch_state = 0
 
+        # sequence executed by the mcu
+        self.sequence_running = False
+        self.sequence_steps_completed = 0
+        self.sequence_length_mcu = 0
+        self.sequence_progress_callback = None
+        self.sequence_status_condition = threading.Condition() # notified by the reading thread for every status packet
+        self.sequence_status_packets = 0
+
+        # max velocity (mm/s) and acceleration (mm/s^2) of each axis, as applied after the last set_max_velocity_acceleration()
+        self.max_velocity_acceleration = {AXIS.X:(MAX_VELOCITY_X_mm,MAX_ACCELERATION_X_mm),AXIS.Y:(MAX_VELOCITY_Y_mm,MAX_ACCELERATION_Y_mm),AXIS.Z:(MAX_VELOCITY_Z_mm,MAX_ACCELERATION_Z_mm)}
+
+        # (timestamp, z_pos) of every received packet while recording, for tagging frames taken during a z move
+        self.z_pos_history = None
+
         self.last_command = None
+        self.send_command_lock = threading.Lock() # commands can be sent from more than one thread (e.g. the focus lock)
+        # held by a thread across a command and its completion so that the other threads' commands are not interleaved (resending is not blocked)
+        self.command_sequence_lock = threading.RLock()
         self.timeout_counter = 0
         self.last_command_timestamp = time.time()
 
         self.crc_calculator = CrcCalculator(Crc8.CCITT,table_based=True)
         self.retry = 0
 
+        # packet statistics
+        self.packets_received = 0
+        self.crc_errors = 0
+        self.packet_rate = 0
+        self.packet_crc_enabled = False # set once packets with a valid CRC are received (older firmware does not send one)
+        self.n_consecutive_crc_packets = 0
+
         print('connecting to controller based on ' + version)
 
         if version =='Arduino Due':
@@ -67,7 +128,8 @@ class Microcontroller():
         if len(controller_ports) > 1:
             print('multiple controller found - using the first')
         
-        self.serial = serial.Serial(controller_ports[0],2000000)
+        # reads block until a full packet is received or the timeout expires (so that the reading thread can be terminated)
+        self.serial = serial.Serial(controller_ports[0],2000000,timeout=MCU_SERIAL_READ_TIMEOUT_S)
         time.sleep(0.2)
         print('controller connected')
 
@@ -550,6 +612,7 @@ class Microcontroller():
         cmd[5] = int(acceleration*10) >> 8
         cmd[6] = int(acceleration*10) & 0xff
         self.send_command(cmd)
+        self.max_velocity_acceleration[axis] = (applied_velocity_mm(velocity),acceleration)
 
     def set_leadscrew_pitch(self,axis,pitch_mm):
         # pitch: max 65535/1000 = 65.535 (mm)
@@ -630,43 +693,122 @@ class Microcontroller():
     def turn_off_AF_laser(self):
         self.set_pin_level(MCU_PINS.AF_LASER,0)
 
-    def send_command(self,command):
-        self._cmd_id = (self._cmd_id + 1)%256
-        command[0] = self._cmd_id
-        command[-1] = self.crc_calculator.calculate_checksum(command[:-1])
-        self.serial.write(command)
-        self.mcu_cmd_execution_in_progress = True
-        self.last_command = command
-        self.timeout_counter = 0
-        self.last_command_timestamp = time.time()
-        self.retry = 0
+    def clear_sequence(self):
+        cmd = bytearray(self.tx_buffer_length)
+        cmd[1] = CMD_SET.CLEAR_SEQUENCE
+        self.send_command(cmd)
+
+    def add_sequence_step(self,step):
+        cmd = bytearray(self.tx_buffer_length)
+        cmd[1] = CMD_SET.ADD_SEQUENCE_STEP
+        cmd[2] = step[0]
+        if step[0] == SEQUENCE_STEP.MOVE_Z:
+            payload = self._int_to_payload(STAGE_MOVEMENT_SIGN_Z*int(step[1]),4)
+            cmd[3] = payload >> 24
+            cmd[4] = (payload >> 16) & 0xff
+            cmd[5] = (payload >> 8) & 0xff
+            cmd[6] = payload & 0xff
+        elif step[0] == SEQUENCE_STEP.SET_ILLUMINATION:
+            cmd[3] = step[1]
+            cmd[4] = int((step[2]/100)*65535) >> 8
+            cmd[5] = int((step[2]/100)*65535) & 0xff
+        elif step[0] == SEQUENCE_STEP.SEND_HARDWARE_TRIGGER:
+            # illumination on time is limited to 24 bits (16.7 s)
+            illumination_on_time_us = min(int(step[1]),2**24-1)
+            control_illumination = step[2] if len(step) > 2 else True
+            trigger_output_ch = step[3] if len(step) > 3 else 0
+            cmd[3] = (control_illumination<<7) + trigger_output_ch
+            cmd[4] = illumination_on_time_us >> 16
+            cmd[5] = (illumination_on_time_us >> 8) & 0xff
+            cmd[6] = illumination_on_time_us & 0xff
+        elif step[0] == SEQUENCE_STEP.WAIT_US:
+            wait_us = int(step[1])
+            cmd[3] = wait_us >> 24
+            cmd[4] = (wait_us >> 16) & 0xff
+            cmd[5] = (wait_us >> 8) & 0xff
+            cmd[6] = wait_us & 0xff
+        self.send_command(cmd)
+
+    def upload_sequence(self,steps,max_attempts=3):
+        # steps: list of tuples, (SEQUENCE_STEP.MOVE_Z, usteps), (SEQUENCE_STEP.SET_ILLUMINATION, source, intensity),
+        # (SEQUENCE_STEP.SEND_HARDWARE_TRIGGER, illumination_on_time_us[, control_illumination, trigger_output_ch]),
+        # (SEQUENCE_STEP.WAIT_US, us), (SEQUENCE_STEP.TURN_ON_ILLUMINATION,), (SEQUENCE_STEP.TURN_OFF_ILLUMINATION,)
+        # the steps are sent back to back and the number of steps received is checked against the mcu's report
+        if len(steps) > MAX_SEQUENCE_STEPS:
+            raise ValueError('a sequence can have at most ' + str(MAX_SEQUENCE_STEPS) + ' steps')
+        for attempt in range(max_attempts):
+            self.clear_sequence()
+            for step in steps:
+                self.add_sequence_step(step)
+            self.wait_till_operation_is_completed()
+            # the number of steps is read from a status packet received after the completion of the last step
+            with self.sequence_status_condition:
+                n_packets = self.sequence_status_packets
+                if self.sequence_status_condition.wait_for(lambda: self.sequence_status_packets > n_packets and self.sequence_length_mcu == len(steps),MCU_SEQUENCE_UPLOAD_TIMEOUT_S):
+                    return True
+            print('sequence upload incomplete (' + str(self.sequence_length_mcu) + '/' + str(len(steps)) + ' steps), retrying')
+        return False
+
+    def run_sequence(self,repeats=1,progress_callback=None):
+        # the mcu reports the command as completed once all the repeats of the sequence have been executed - use
+        # wait_till_operation_is_completed() with a timeout that covers the whole sequence
+        # progress_callback(n_steps_completed) is called from the packet reading thread
+        self.sequence_progress_callback = progress_callback
+        self.sequence_steps_completed = 0
+        cmd = bytearray(self.tx_buffer_length)
+        cmd[1] = CMD_SET.RUN_SEQUENCE
+        cmd[2] = repeats >> 8
+        cmd[3] = repeats & 0xff
+        self.send_command(cmd)
+
+    def abort_sequence(self):
+        cmd = bytearray(self.tx_buffer_length)
+        cmd[1] = CMD_SET.ABORT_SEQUENCE
+        self.send_command(cmd)
+
+    def get_sequence_progress(self):
+        return self.sequence_steps_completed, self.sequence_running
 
-    def resend_last_command(self):
-        if self.last_command is not None:
-            self.serial.write(self.last_command)
+    def send_command(self,command):
+        with self.command_sequence_lock, self.send_command_lock:
+            self._cmd_id = (self._cmd_id + 1)%256
+            command[0] = self._cmd_id
+            command[-1] = self.crc_calculator.calculate_checksum(command[:-1])
+            self.serial.write(command)
             self.mcu_cmd_execution_in_progress = True
+            self.last_command = command
             self.timeout_counter = 0
-            self.retry = self.retry + 1
+            self.last_command_timestamp = time.time()
+            self.retry = 0
+
+    def resend_last_command(self):
+        with self.send_command_lock:
+            if self.last_command is not None:
+                self.serial.write(self.last_command)
+                self.mcu_cmd_execution_in_progress = True
+                self.timeout_counter = 0
+                self.retry = self.retry + 1
 
     def read_received_packet(self):
+        buffer = bytearray()
+        packets_received_last = 0
+        timestamp_last_rate_update = time.time()
         while self.terminate_reading_received_packet_thread == False:
-            # wait to receive data
-            if self.serial.in_waiting==0:
+            # block until the rest of a packet has been received
+            buffer.extend(self.serial.read(max(self.rx_buffer_length - len(buffer)%self.rx_buffer_length,self.serial.in_waiting)))
+
+            # update the packet rate
+            if time.time() - timestamp_last_rate_update >= 1:
+                self.packet_rate = (self.packets_received - packets_received_last)/(time.time() - timestamp_last_rate_update)
+                packets_received_last = self.packets_received
+                timestamp_last_rate_update = time.time()
+
+            if len(buffer) < self.rx_buffer_length:
                 continue
-            if self.serial.in_waiting % self.rx_buffer_length != 0:
+
+            msg = self._take_last_packet(buffer)
+            if msg is None:
                 continue
-            
-            # get rid of old data
-            num_bytes_in_rx_buffer = self.serial.in_waiting
-            if num_bytes_in_rx_buffer > self.rx_buffer_length:
-                # print('getting rid of old data')
-                for i in range(num_bytes_in_rx_buffer-self.rx_buffer_length):
-                    self.serial.read()
-            
-            # read the buffer
-            msg=[]
-            for i in range(self.rx_buffer_length):
-                msg.append(ord(self.serial.read()))
 
             # parse the message
             '''
@@ -680,11 +822,12 @@ class Microcontroller():
             - reserved (4 bytes)
             - CRC (1 byte)
             '''
-            self._cmd_id_mcu = msg[0]
-            self._cmd_execution_status = msg[1]
+            self._cmd_id_mcu, self._cmd_execution_status, x_pos, y_pos, z_pos, theta_pos = struct.unpack_from('>BBiiii',msg)
             if (self._cmd_id_mcu == self._cmd_id) and (self._cmd_execution_status == CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS):
                 if self.mcu_cmd_execution_in_progress == True:
-                    self.mcu_cmd_execution_in_progress = False
+                    with self.cmd_completion_condition:
+                        self.mcu_cmd_execution_in_progress = False
+                        self.cmd_completion_condition.notify_all()
                     print('   mcu command ' + str(self._cmd_id) + ' complete')
             elif self._cmd_id_mcu != self._cmd_id and time.time() - self.last_command_timestamp > 5 and self.last_command != None:
                 self.timeout_counter = self.timeout_counter + 1
@@ -700,10 +843,13 @@ class Microcontroller():
                     self.resend_last_command()
             # print('command id ' + str(self._cmd_id) + '; mcu command ' + str(self._cmd_id_mcu) + ' status: ' + str(msg[1]) )
 
-            self.x_pos = self._payload_to_int(msg[2:6],MicrocontrollerDef.N_BYTES_POS) # unit: microstep or encoder resolution
-            self.y_pos = self._payload_to_int(msg[6:10],MicrocontrollerDef.N_BYTES_POS) # unit: microstep or encoder resolution
-            self.z_pos = self._payload_to_int(msg[10:14],MicrocontrollerDef.N_BYTES_POS) # unit: microstep or encoder resolution
-            self.theta_pos = self._payload_to_int(msg[14:18],MicrocontrollerDef.N_BYTES_POS) # unit: microstep or encoder resolution
+            self.x_pos = x_pos # unit: microstep or encoder resolution
+            self.y_pos = y_pos # unit: microstep or encoder resolution
+            self.z_pos = z_pos # unit: microstep or encoder resolution
+            self.theta_pos = theta_pos # unit: microstep or encoder resolution
+            z_pos_history = self.z_pos_history
+            if z_pos_history is not None:
+                z_pos_history.append((time.time(),z_pos))
 
             self.button_and_switch_state = msg[18]
             # joystick button
@@ -717,12 +863,75 @@ class Microcontroller():
             tmp = self.button_and_switch_state & (1 << BIT_POS_SWITCH)
             self.switch_state = tmp > 0
 
+            # sequence status
+            with self.sequence_status_condition:
+                self.sequence_running = msg[19] > 0
+                self.sequence_length_mcu = msg[22]
+                self.sequence_status_packets = self.sequence_status_packets + 1
+                self.sequence_status_condition.notify_all()
+            steps_completed = msg[20]*256 + msg[21]
+            if steps_completed != self.sequence_steps_completed:
+                self.sequence_steps_completed = steps_completed
+                if self.sequence_progress_callback is not None:
+                    self.sequence_progress_callback(steps_completed)
+
             if self.new_packet_callback_external is not None:
                 self.new_packet_callback_external(self)
 
+    def _packet_crc_ok(self,msg):
+        return self.crc_calculator.calculate_checksum(bytes(msg[:-1])) == msg[-1]
+
+    def _take_last_packet(self,buffer):
+        # removes the whole packets from the buffer and returns the most recent valid one (None if there is none yet)
+        n = self.rx_buffer_length
+        if not self.packet_crc_enabled:
+            # firmware without packet CRC leaves the last byte at 0, the packets are aligned as long as whole packets have been received (as before)
+            if len(buffer)%n != 0:
+                if not self._packet_crc_ok(buffer[-n:]):
+                    del buffer[:-(n + len(buffer)%n)]
+                    return None
+                # the buffer ends with a packet with a valid CRC, the bytes before the whole packets are dropped
+                del buffer[:len(buffer)%n]
+            n_packets = len(buffer)//n
+            last = bytes(buffer[-n:])
+            # two consecutive packets with a valid CRC switch to CRC checking
+            self.n_consecutive_crc_packets = self.n_consecutive_crc_packets + 1 if self._packet_crc_ok(last) else 0
+            if self.n_consecutive_crc_packets < 2:
+                del buffer[:]
+                self.packets_received = self.packets_received + n_packets
+                return last
+            self.packet_crc_enabled = True
+        # resynchronize on packet boundaries - drop bytes until the CRC of the packet at the start of the buffer checks out
+        while len(buffer) >= n and not self._packet_crc_ok(buffer[:n]):
+            self.crc_errors = self.crc_errors + 1
+            del buffer[0]
+        n_packets = len(buffer)//n
+        # the most recent packet whose CRC checks out (a corrupted packet in between shifts the ones after it)
+        msg = None
+        for i in range(n_packets-1,-1,-1):
+            if self._packet_crc_ok(buffer[i*n:(i+1)*n]):
+                msg = bytes(buffer[i*n:(i+1)*n])
+                break
+            self.crc_errors = self.crc_errors + 1
+        del buffer[:n_packets*n]
+        self.packets_received = self.packets_received + n_packets
+        return msg
+
+    def get_packet_statistics(self):
+        return {'packets_received':self.packets_received,'crc_errors':self.crc_errors,'packet_rate':self.packet_rate}
+
     def get_pos(self):
         return self.x_pos, self.y_pos, self.z_pos, self.theta_pos
 
+    def start_z_position_recording(self):
+        self.z_pos_history = []
+
+    def stop_z_position_recording(self):
+        # returns the recorded list of (timestamp, z_pos)
+        z_pos_history = self.z_pos_history
+        self.z_pos_history = None
+        return z_pos_history
+
     def get_button_and_switch_state(self):
         return self.button_and_switch_state
 
@@ -732,13 +941,22 @@ class Microcontroller():
     def set_callback(self,function):
         self.new_packet_callback_external = function
 
+    def wait_for_completion(self, timeout_s=None, n_retries=0):
+        # block until the most recent command has been completed (woken up by the reading thread rather than by polling)
+        # on timeout the command is resent up to n_retries times, returns False if it still has not been completed
+        with self.cmd_completion_condition:
+            for attempt in range(n_retries+1):
+                if self.cmd_completion_condition.wait_for(lambda: not self.mcu_cmd_execution_in_progress, timeout_s):
+                    return True
+                if attempt < n_retries:
+                    print('mcu command ' + str(self._cmd_id) + ' timed out, resending')
+                    self.resend_last_command()
+        return False
+
     def wait_till_operation_is_completed(self, TIMEOUT_LIMIT_S=5):
-        timestamp_start = time.time()
-        while self.is_busy():
-            time.sleep(0.02)
-            if time.time() - timestamp_start > TIMEOUT_LIMIT_S:
-                print('Error - microcontroller timeout, the program will exit')
-                sys.exit(1)
+        if not self.wait_for_completion(TIMEOUT_LIMIT_S):
+            print('Error - microcontroller timeout, the program will exit')
+            sys.exit(1)
 
     def _int_to_payload(self,signed_int,number_of_bytes):
         if signed_int >= 0:
@@ -779,9 +997,12 @@ class Microcontroller_Simulation():
         self._cmd_id_mcu = None # command id of mcu's last received command 
         self._cmd_execution_status = None
         self.mcu_cmd_execution_in_progress = False
+        self.cmd_completion_condition = threading.Condition() # notified by the reading thread when a command is completed
+        self.command_sequence_lock = threading.RLock()
 
         self.x_pos = 0 # unit: microstep or encoder resolution
         self.y_pos = 0 # unit: microstep or encoder resolution
+        self._z_move = (0,0,0,0,0) # (start, target, start time, duration, acceleration time) of the last z move, see z_pos
         self.z_pos = 0 # unit: microstep or encoder resolution
         self.theta_pos = 0 # unit: microstep or encoder resolution
         self.button_and_switch_state = 0
@@ -789,8 +1010,26 @@ class Microcontroller_Simulation():
         self.signal_joystick_button_pressed_event = False
         self.switch_state = 0
 
+        # sequence executed by the mcu
+        self.sequence = []
+        self.sequence_running = False
+        self.sequence_steps_completed = 0
+        self.sequence_length_mcu = 0
+        self.sequence_progress_callback = None
+        self.terminate_sequence = False
+        self.hardware_trigger_callback = None # called for each hardware trigger, e.g. Camera_Simulation.send_trigger
+
+        # max velocity (mm/s) and acceleration (mm/s^2) of each axis, as applied after the last set_max_velocity_acceleration()
+        self.max_velocity_acceleration = {AXIS.X:(MAX_VELOCITY_X_mm,MAX_ACCELERATION_X_mm),AXIS.Y:(MAX_VELOCITY_Y_mm,MAX_ACCELERATION_Y_mm),AXIS.Z:(MAX_VELOCITY_Z_mm,MAX_ACCELERATION_Z_mm)}
+
+        # (timestamp, z_pos) of every received packet while recording, for tagging frames taken during a z move
+        self.z_pos_history = None
+
          # for simulation
         self.timestamp_last_command = time.time() # for simulation only
+        self.timestamp_command_completed = time.time() # for simulation only
+        self.simulate_motion_timing = SIMULATION_MOTION_TIMING # moves take as long as on the stage instead of SIMULATION_MCU_COMMAND_TIME_S
+        self._next_command_duration_s = None
         self._mcu_cmd_execution_status = None
         self.timer_update_command_execution_status = QTimer()
         self.timer_update_command_execution_status.timeout.connect(self._simulation_update_cmd_execution_status)
@@ -806,6 +1045,35 @@ class Microcontroller_Simulation():
         self.terminate_reading_received_packet_thread = True
         self.thread_read_received_packet.join()
 
+    @property
+    def z_pos(self):
+        # while a z move is simulated, the position follows its velocity profile (acceleration, constant velocity, deceleration)
+        z_start, z_target, t_start, duration_s, t_acceleration_s = self._z_move
+        t = time.time() - t_start
+        if t >= duration_s:
+            return z_target
+        if t <= 0:
+            return z_start
+        velocity = 1/(duration_s - t_acceleration_s) # fraction of the move per second
+        if t < t_acceleration_s:
+            fraction = 0.5*velocity*t**2/t_acceleration_s
+        elif t > duration_s - t_acceleration_s:
+            fraction = 1 - 0.5*velocity*(duration_s - t)**2/t_acceleration_s
+        else:
+            fraction = velocity*(t - t_acceleration_s/2)
+        return z_start + int(round((z_target - z_start)*fraction))
+
+    @z_pos.setter
+    def z_pos(self,usteps):
+        self._z_move = (usteps,usteps,0,0,0)
+
+    def _start_z_move(self,z_target,duration_s,t_acceleration_s=0):
+        # z_pos goes from the current position to z_target in duration_s from now
+        if duration_s <= 0:
+            self.z_pos = z_target
+            return
+        self._z_move = (self.z_pos,z_target,time.time(),duration_s,min(t_acceleration_s,duration_s/2))
+
     def reset(self):
         self._cmd_id = 0
         cmd = bytearray(self.tx_buffer_length)
@@ -820,37 +1088,42 @@ class Microcontroller_Simulation():
         print('initialize the drivers') # debug
 
     def move_x_usteps(self,usteps):
+        self._simulate_move(AXIS.X,usteps)
         self.x_pos = self.x_pos + STAGE_MOVEMENT_SIGN_X*usteps
         cmd = bytearray(self.tx_buffer_length)
         self.send_command(cmd)
         print('   mcu command ' + str(self._cmd_id) + ': move x')
 
     def move_x_to_usteps(self,usteps):
+        self._simulate_move(AXIS.X,usteps-self.x_pos)
         self.x_pos = usteps
         cmd = bytearray(self.tx_buffer_length)
         self.send_command(cmd)
         print('   mcu command ' + str(self._cmd_id) + ': move x to')
 
     def move_y_usteps(self,usteps):
+        self._simulate_move(AXIS.Y,usteps)
         self.y_pos = self.y_pos + STAGE_MOVEMENT_SIGN_Y*usteps
         cmd = bytearray(self.tx_buffer_length)
         self.send_command(cmd)
         print('   mcu command ' + str(self._cmd_id) + ': move y')
 
     def move_y_to_usteps(self,usteps):
+        self._simulate_move(AXIS.Y,usteps-self.y_pos)
         self.y_pos = usteps
         cmd = bytearray(self.tx_buffer_length)
         self.send_command(cmd)
         print('   mcu command ' + str(self._cmd_id) + ': move y to')
 
     def move_z_usteps(self,usteps):
-        self.z_pos = self.z_pos + STAGE_MOVEMENT_SIGN_Z*usteps
+        # relative to the target of the previous move, as on the mcu
+        self._simulate_z_move(self._z_move[1] + STAGE_MOVEMENT_SIGN_Z*usteps)
         cmd = bytearray(self.tx_buffer_length)
         self.send_command(cmd)
         print('   mcu command ' + str(self._cmd_id) + ': move z')
 
     def move_z_to_usteps(self,usteps):
-        self.z_pos = usteps
+        self._simulate_z_move(usteps)
         cmd = bytearray(self.tx_buffer_length)
         self.send_command(cmd)
         print('   mcu command ' + str(self._cmd_id) + ': move z to')
@@ -979,6 +1252,7 @@ class Microcontroller_Simulation():
         cmd[5] = int(acceleration*10) >> 8
         cmd[6] = int(acceleration*10) & 0xff
         self.send_command(cmd)
+        self.max_velocity_acceleration[axis] = (applied_velocity_mm(velocity),acceleration)
 
     def set_leadscrew_pitch(self,axis,pitch_mm):
         # pitch: max 65535/1000 = 65.535 (mm)
@@ -1062,7 +1336,7 @@ class Microcontroller_Simulation():
     def read_received_packet(self):
         while self.terminate_reading_received_packet_thread == False:
             # only for simulation - update the command execution status
-            if time.time() - self.timestamp_last_command > 0.05: # in the simulation, assume all the operation takes 0.05s to complete
+            if time.time() > self.timestamp_command_completed: # in the simulation, operations take SIMULATION_MCU_COMMAND_TIME_S (or the move time) to complete
                 if self._mcu_cmd_execution_status !=  CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS:
                     self._mcu_cmd_execution_status = CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS
                     print('   mcu command ' + str(self._cmd_id) + ' complete')
@@ -1077,8 +1351,11 @@ class Microcontroller_Simulation():
 
             self._cmd_id_mcu = msg[0]
             self._cmd_execution_status = msg[1]
-            if (self._cmd_id_mcu == self._cmd_id) and (self._cmd_execution_status == CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS):
-                self.mcu_cmd_execution_in_progress = False
+            if (self._cmd_id_mcu == self._cmd_id) and (self._cmd_execution_status == CMD_EXECUTION_STATUS.COMPLETED_WITHOUT_ERRORS) and not self.sequence_running:
+                if self.mcu_cmd_execution_in_progress == True:
+                    with self.cmd_completion_condition:
+                        self.mcu_cmd_execution_in_progress = False
+                        self.cmd_completion_condition.notify_all()
             # print('mcu_cmd_execution_in_progress: ' + str(self.mcu_cmd_execution_in_progress))
             
             # self.x_pos = utils.unsigned_to_signed(msg[2:6],MicrocontrollerDef.N_BYTES_POS) # unit: microstep or encoder resolution
@@ -1088,6 +1365,10 @@ class Microcontroller_Simulation():
             
             self.button_and_switch_state = msg[18]
 
+            z_pos_history = self.z_pos_history
+            if z_pos_history is not None:
+                z_pos_history.append((time.time(),self.z_pos))
+
             if self.new_packet_callback_external is not None:
                 self.new_packet_callback_external(self)
 
@@ -1123,6 +1404,9 @@ class Microcontroller_Simulation():
         cmd[5] = (illumination_on_time_us >> 8) & 0xff
         cmd[6] = illumination_on_time_us & 0xff
         self.send_command(cmd)
+        # the simulated camera is triggered by the simulated microcontroller, as the real one is through the trigger line
+        if self.hardware_trigger_callback is not None:
+            self.hardware_trigger_callback()
 
     def set_strobe_delay_us(self, strobe_delay_us, camera_channel=0):
         print('set strobe delay')
@@ -1142,9 +1426,21 @@ class Microcontroller_Simulation():
         cmd[3] = status
         self.send_command(cmd)
 
+    def get_packet_statistics(self):
+        return {'packets_received':0,'crc_errors':0,'packet_rate':0}
+
     def get_pos(self):
         return self.x_pos, self.y_pos, self.z_pos, self.theta_pos
 
+    def start_z_position_recording(self):
+        self.z_pos_history = []
+
+    def stop_z_position_recording(self):
+        # returns the recorded list of (timestamp, z_pos)
+        z_pos_history = self.z_pos_history
+        self.z_pos_history = None
+        return z_pos_history
+
     def get_button_and_switch_state(self):
         return self.button_and_switch_state
 
@@ -1167,18 +1463,125 @@ class Microcontroller_Simulation():
     def turn_off_AF_laser(self):
         self.set_pin_level(MCU_PINS.AF_LASER,0)
 
+    def clear_sequence(self):
+        self.sequence = []
+        cmd = bytearray(self.tx_buffer_length)
+        cmd[1] = CMD_SET.CLEAR_SEQUENCE
+        self.send_command(cmd)
+
+    def add_sequence_step(self,step):
+        self.sequence.append(tuple(step))
+        cmd = bytearray(self.tx_buffer_length)
+        cmd[1] = CMD_SET.ADD_SEQUENCE_STEP
+        self.send_command(cmd)
+
+    def upload_sequence(self,steps,max_attempts=3):
+        if len(steps) > MAX_SEQUENCE_STEPS:
+            raise ValueError('a sequence can have at most ' + str(MAX_SEQUENCE_STEPS) + ' steps')
+        self.clear_sequence()
+        for step in steps:
+            self.add_sequence_step(step)
+        self.sequence_length_mcu = len(self.sequence)
+        return True
+
+    def run_sequence(self,repeats=1,progress_callback=None):
+        self.sequence_progress_callback = progress_callback
+        self.sequence_steps_completed = 0
+        self.terminate_sequence = False
+        self.sequence_running = True
+        cmd = bytearray(self.tx_buffer_length)
+        cmd[1] = CMD_SET.RUN_SEQUENCE
+        self.send_command(cmd)
+        print('   mcu command ' + str(self._cmd_id) + ': run sequence of ' + str(len(self.sequence)) + ' steps x ' + str(repeats))
+        thread = threading.Thread(target=self._simulation_run_sequence,args=(list(self.sequence),repeats),daemon=True)
+        thread.start()
+
+    def abort_sequence(self):
+        self.terminate_sequence = True
+        cmd = bytearray(self.tx_buffer_length)
+        cmd[1] = CMD_SET.ABORT_SEQUENCE
+        self.send_command(cmd)
+
+    def get_sequence_progress(self):
+        return self.sequence_steps_completed, self.sequence_running
+
+    def set_hardware_trigger_callback(self,function):
+        self.hardware_trigger_callback = function
+
+    def _simulation_run_sequence(self,steps,repeats):
+        # emulate the execution of the sequence on the mcu, including the time each step takes
+        for n in range(repeats):
+            for step in steps:
+                if self.terminate_sequence:
+                    break
+                if step[0] == SEQUENCE_STEP.MOVE_Z:
+                    # with the max velocity/acceleration currently set, as the mcu does
+                    duration_s, t_acceleration_s = self._move_profile(AXIS.Z,step[1])
+                    self._start_z_move(self._z_move[1] + STAGE_MOVEMENT_SIGN_Z*int(step[1]),duration_s,t_acceleration_s)
+                    time.sleep(duration_s)
+                elif step[0] == SEQUENCE_STEP.SEND_HARDWARE_TRIGGER:
+                    timestamp_trigger = time.time()
+                    if self.hardware_trigger_callback is not None:
+                        self.hardware_trigger_callback()
+                    time.sleep(max(0,step[1]/1e6 - (time.time() - timestamp_trigger)))
+                elif step[0] == SEQUENCE_STEP.WAIT_US:
+                    time.sleep(step[1]/1e6)
+                self.sequence_steps_completed = self.sequence_steps_completed + 1
+                if self.sequence_progress_callback is not None:
+                    self.sequence_progress_callback(self.sequence_steps_completed)
+        self.sequence_running = False
+
     def send_command(self,command):
-        self._cmd_id = (self._cmd_id + 1)%256
-        command[0] = self._cmd_id
-        command[-1] = self.crc_calculator.calculate_checksum(command[:-1])
+        with self.command_sequence_lock:
+            self._cmd_id = (self._cmd_id + 1)%256
+            command[0] = self._cmd_id
+            command[-1] = self.crc_calculator.calculate_checksum(command[:-1])
+            self.mcu_cmd_execution_in_progress = True
+            # for simulation
+            self._mcu_cmd_execution_status = CMD_EXECUTION_STATUS.IN_PROGRESS
+            # self.timer_update_command_execution_status.setInterval(2000)
+            # self.timer_update_command_execution_status.start()
+            # print('start timer')
+            # timer cannot be started from another thread
+            self.timestamp_last_command = time.time()
+            duration_s = self._next_command_duration_s if self._next_command_duration_s is not None else SIMULATION_MCU_COMMAND_TIME_S
+            self._next_command_duration_s = None
+            # commands sent while others are running (e.g. x and y moves) complete together with the last one to finish
+            self.timestamp_command_completed = max(self.timestamp_command_completed,self.timestamp_last_command + duration_s)
+
+    def resend_last_command(self):
         self.mcu_cmd_execution_in_progress = True
-        # for simulation
         self._mcu_cmd_execution_status = CMD_EXECUTION_STATUS.IN_PROGRESS
-        # self.timer_update_command_execution_status.setInterval(2000)
-        # self.timer_update_command_execution_status.start()
-        # print('start timer')
-        # timer cannot be started from another thread
         self.timestamp_last_command = time.time()
+        self.timestamp_command_completed = max(self.timestamp_command_completed,self.timestamp_last_command + SIMULATION_MCU_COMMAND_TIME_S)
+
+    def _move_profile(self,axis,usteps):
+        # (duration, acceleration time) of a move: trapezoidal velocity profile with the max velocity/acceleration of the axis
+        mm_per_ustep = {AXIS.X: SCREW_PITCH_X_MM/(MICROSTEPPING_DEFAULT_X*FULLSTEPS_PER_REV_X),
+                        AXIS.Y: SCREW_PITCH_Y_MM/(MICROSTEPPING_DEFAULT_Y*FULLSTEPS_PER_REV_Y),
+                        AXIS.Z: SCREW_PITCH_Z_MM/(MICROSTEPPING_DEFAULT_Z*FULLSTEPS_PER_REV_Z)}[axis]
+        velocity, acceleration = self.max_velocity_acceleration[axis]
+        distance_mm = abs(usteps)*mm_per_ustep
+        if distance_mm*acceleration < velocity**2:
+            duration_s = 2*(distance_mm/acceleration)**0.5
+            return duration_s, duration_s/2
+        return distance_mm/velocity + velocity/acceleration, velocity/acceleration
+
+    def _simulate_move(self,axis,usteps):
+        # duration of the next command
+        if not self.simulate_motion_timing:
+            return
+        duration_s, t_acceleration_s = self._move_profile(axis,usteps)
+        self._next_command_duration_s = max(duration_s,SIMULATION_MCU_COMMAND_TIME_S)
+
+    def _simulate_z_move(self,z_target):
+        # with motion timing, z_pos moves to z_target along the velocity profile of the move instead of jumping to it
+        usteps = z_target - self.z_pos
+        self._simulate_move(AXIS.Z,usteps)
+        if self.simulate_motion_timing:
+            self._start_z_move(z_target,*self._move_profile(AXIS.Z,usteps))
+        else:
+            self.z_pos = z_target
 
     def _simulation_update_cmd_execution_status(self):
         # print('simulation - MCU command execution finished')
@@ -1186,13 +1589,22 @@ class Microcontroller_Simulation():
         # self.timer_update_command_execution_status.stop()
         pass # timer cannot be started from another thread
 
+    def wait_for_completion(self, timeout_s=None, n_retries=0):
+        # block until the most recent command has been completed (woken up by the reading thread rather than by polling)
+        # on timeout the command is resent up to n_retries times, returns False if it still has not been completed
+        with self.cmd_completion_condition:
+            for attempt in range(n_retries+1):
+                if self.cmd_completion_condition.wait_for(lambda: not self.mcu_cmd_execution_in_progress, timeout_s):
+                    return True
+                if attempt < n_retries:
+                    print('mcu command ' + str(self._cmd_id) + ' timed out, resending')
+                    self.resend_last_command()
+        return False
+
     def wait_till_operation_is_completed(self, TIMEOUT_LIMIT_S=5):
-        timestamp_start = time.time()
-        while self.is_busy():
-            time.sleep(0.02)
-            if time.time() - timestamp_start > TIMEOUT_LIMIT_S:
-                print('Error - microcontroller timeout, the program will exit')
-                sys.exit(1)
+        if not self.wait_for_completion(TIMEOUT_LIMIT_S):
+            print('Error - microcontroller timeout, the program will exit')
+            sys.exit(1)
 
     def set_dac80508_scaling_factor_for_illumination(self, illumination_intensity_factor):
         if illumination_intensity_factor > 1:
@@ -178,12 +178,10 @@ def multipoint_custom_script_entry(multiPointWorker,time_point,current_path,coor
                         np.savetxt(saving_path,data,delimiter=',')
 
         # add the coordinate of the current location
-        new_row = pd.DataFrame({'i':[i],'j':[multiPointWorker.NX-1-j],'k':[k],
-                                'x (mm)':[multiPointWorker.navigationController.x_pos_mm],
-                                'y (mm)':[multiPointWorker.navigationController.y_pos_mm],
-                                'z (um)':[multiPointWorker.navigationController.z_pos_mm*1000]},
-                                )
-        multiPointWorker.coordinates_pd = pd.concat([multiPointWorker.coordinates_pd, new_row], ignore_index=True)
+        multiPointWorker.coordinate_log.append({'i':i,'j':multiPointWorker.NX-1-j,'z_level':k,
+                                                'x (mm)':multiPointWorker.navigationController.x_pos_mm,
+                                                'y (mm)':multiPointWorker.navigationController.y_pos_mm,
+                                                'z (um)':multiPointWorker.navigationController.z_pos_mm*1000})
 
         # register the current fov in the navigationViewer 
         multiPointWorker.signal_register_current_fov.emit(multiPointWorker.navigationController.x_pos_mm,multiPointWorker.navigationController.y_pos_mm)
@@ -205,7 +203,7 @@ def multipoint_custom_script_entry(multiPointWorker,time_point,current_path,coor
                 multiPointWorker.navigationController.move_z_usteps(-multiPointWorker.dz_usteps)
                 multiPointWorker.wait_till_operation_is_completed()
 
-            multiPointWorker.coordinates_pd.to_csv(os.path.join(current_path,'coordinates.csv'),index=False,header=True)
+            multiPointWorker.coordinate_log.close()
             multiPointWorker.navigationController.enable_joystick_button_action = True
             return
 
@@ -95,6 +95,7 @@ def acquire_single_z_plane(worker, current_path, region_id, fov, i, j, z_level,
         file_ID = f"{region_id}_{i}_{j}_{z_level}"
     else:
         file_ID = f"{region_id}_{fov}_{z_level}"
+    worker.current_fov_key = (region_id, fov, z_level)
 
     current_round_images = {}
     for config_idx, config in enumerate(worker.selected_configurations):
@@ -178,8 +179,11 @@ def save_image(worker, image, file_ID, config, current_path):
     
     if worker.camera.is_color and 'BF LED matrix' in config.name:
         image = process_color_image(image)
-    
-    iio.imwrite(saving_path, image)
+
+    if worker.save_image_to_ome_zarr(image, config):
+        return
+
+    worker.image_writer.submit(saving_path, image)
 
 def process_color_image(image):
     if MULTIPOINT_BF_SAVING_OPTION == 'RGB2GRAY':
@@ -218,7 +222,7 @@ def handle_rgb_channels(worker, images, file_ID, current_path, config, i, j, z_l
         worker.image_to_display_multi.emit(image_to_display, config.illumination_source)
         worker.update_napari(images[channel], channel, i, j, z_level)
         file_name = f"{file_ID}_{channel.replace(' ', '_')}{'.tiff' if images[channel].dtype == np.uint16 else '.' + Acquisition.IMAGE_FORMAT}"
-        iio.imwrite(os.path.join(current_path, file_name), images[channel])
+        worker.image_writer.submit(os.path.join(current_path, file_name), images[channel])
 
 def construct_rgb_image(worker, images, file_ID, current_path, config, i, j, z_level):
     rgb_image = np.zeros((*images['BF LED matrix full_R'].shape, 3), dtype=images['BF LED matrix full_R'].dtype)
@@ -233,7 +237,7 @@ def construct_rgb_image(worker, images, file_ID, current_path, config, i, j, z_l
     worker.update_napari(rgb_image, config.name, i, j, z_level)
 
     file_name = f"{file_ID}_BF_LED_matrix_full_RGB{'.tiff' if rgb_image.dtype == np.uint16 else '.' + Acquisition.IMAGE_FORMAT}"
-    iio.imwrite(os.path.join(current_path, file_name), rgb_image)
+    worker.image_writer.submit(os.path.join(current_path, file_name), rgb_image)
 
 def acquire_spectrometer_data(worker, config, file_ID, current_path, i, j, z_level):
     if worker.usb_spectrometer is not None:
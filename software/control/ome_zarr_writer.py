@@ -0,0 +1,122 @@
+import os
+import re
+import threading
+import numpy as np
+import zarr
+import ome_zarr.writer
+
+from control._def import *
+
+
+def assign_well(region,wells):
+    # (row, column) of region in the plate, recorded in wells (region -> (row, column))
+    # well names (e.g. 'B3') keep their well, other regions (e.g. 'R0', 'ROI') get the next free column of row OME_ZARR_NON_WELL_ROW
+    region = str(region)
+    if region not in wells:
+        match = re.match(r'^([A-Z]+)(\d+)$',region)
+        well = (match.group(1),match.group(2)) if match is not None else None
+        taken = set(wells.values())
+        if well is None or well in taken:
+            column = 1
+            while (OME_ZARR_NON_WELL_ROW,str(column)) in taken:
+                column = column + 1
+            if well is not None:
+                print('ome-zarr: well ' + ''.join(well) + ' is already used, region ' + region + ' is written to ' + OME_ZARR_NON_WELL_ROW + str(column))
+            well = (OME_ZARR_NON_WELL_ROW,str(column))
+        wells[region] = well
+    return wells[region]
+
+
+def write_plate_metadata(root,wells,name):
+    # wells: region -> (row, column)
+    rows = sorted(set(row for row,col in wells.values()),key=lambda r: (len(r),r))
+    columns = sorted(set(col for row,col in wells.values()),key=int)
+    well_paths = [row + '/' + col for row,col in wells.values()]
+    ome_zarr.writer.write_plate_metadata(root,rows,columns,well_paths,name=name)
+
+
+class HCSOmeZarrWriter(object):
+    """
+    :brief: writes multipoint acquisitions directly into an OME-Zarr HCS plate
+        (plate/row/column/field). Each field is a single-resolution TCZYX array
+        with one chunk per image, created when the first image of the field
+        arrives. Regions that are not well names (e.g. 'R0', 'ROI') are placed
+        in a row of their own (OME_ZARR_NON_WELL_ROW), one column per region. The stage position of every image is
+        added to the field attributes as soon as the image is written, so an
+        interrupted acquisition leaves the positions of the images on disk.
+    """
+    def __init__(self,path,channel_names,Nt=1,NZ=1,dz_um=1.0,pixel_size_um=1.0):
+        self.path = path
+        self.channel_names = list(channel_names)
+        self.Nt = max(1,Nt)
+        self.NZ = max(1,NZ)
+        self.dz_um = dz_um
+        self.pixel_size_um = pixel_size_um
+        self.lock = threading.Lock()
+        self.root = zarr.group(store=zarr.DirectoryStore(path),overwrite=True)
+        self.wells = {} # region -> (row, col)
+        self.fields = {} # (region, fov) -> zarr array
+        self.fields_per_well = {}
+        self.stage_positions = {} # (region, fov) -> list of [t, c, z, x_mm, y_mm, z_mm]
+        self.images_written = 0
+
+    def _well(self,region):
+        region = str(region)
+        if region not in self.wells:
+            assign_well(region,self.wells)
+            write_plate_metadata(self.root,self.wells,os.path.basename(self.path))
+        return self.wells[region]
+
+    def _field(self,region,fov,shape,dtype):
+        key = (str(region),fov)
+        with self.lock:
+            if key in self.fields:
+                return self.fields[key]
+            row, col = self._well(region)
+            well_group = self.root.require_group(row).require_group(col)
+            fields = self.fields_per_well.setdefault(key[0],[])
+            fields.append(str(fov))
+            ome_zarr.writer.write_well_metadata(well_group,fields)
+            image_group = well_group.require_group(str(fov))
+            array = image_group.zeros('0',shape=(self.Nt,len(self.channel_names),self.NZ)+tuple(shape),chunks=(1,1,1)+tuple(shape),dtype=dtype,overwrite=True)
+            image_group.attrs['multiscales'] = [{
+                'version': '0.4',
+                'name': key[0] + '_' + str(fov),
+                'axes': [
+                    {'name': 't', 'type': 'time', 'unit': 'second'},
+                    {'name': 'c', 'type': 'channel'},
+                    {'name': 'z', 'type': 'space', 'unit': 'micrometer'},
+                    {'name': 'y', 'type': 'space', 'unit': 'micrometer'},
+                    {'name': 'x', 'type': 'space', 'unit': 'micrometer'}],
+                'datasets': [{'path': '0', 'coordinateTransformations': [{'type': 'scale', 'scale': [1,1,self.dz_um,self.pixel_size_um,self.pixel_size_um]}]}]
+            }]
+            image_group.attrs['omero'] = {'channels': [{'label': name, 'active': True} for name in self.channel_names]}
+            image_group.attrs['region'] = key[0]
+            self.fields[key] = array
+            self.stage_positions[key] = []
+            return array
+
+    def write(self,key,image):
+        # key: (region, fov, t, channel_name, z_level, (x_mm, y_mm, z_mm)), can be used as an ImageWriterPool write_fn
+        region, fov, t, channel_name, z_level, position = key
+        c = self.channel_names.index(channel_name)
+        array = self._field(region,fov,image.shape,image.dtype)
+        array[t,c,z_level] = image
+        with self.lock:
+            self.stage_positions[(str(region),fov)].append([t,c,z_level] + list(position))
+            self._write_stage_positions((str(region),fov))
+            self.images_written = self.images_written + 1
+
+    def _write_stage_positions(self,key):
+        # rewrites the positions of the field's images in its attributes, called with the lock held
+        region, fov = key
+        row, col = self.wells[region]
+        image_group = self.root[row][col][str(fov)]
+        image_group.attrs['stage_positions'] = {'columns': ['t','c','z','x (mm)','y (mm)','z (mm)'],'data': self.stage_positions[key]}
+
+    def has_channel(self,channel_name):
+        return channel_name in self.channel_names
+
+    def close(self):
+        # nothing is buffered, the images and their positions are on disk once write() returns
+        pass
@@ -0,0 +1,122 @@
+import os
+from abc import ABC, abstractmethod
+import numpy as np
+import zarr
+from tifffile import TiffWriter
+
+from control._def import *
+from control.coordinate_log import CoordinateLog
+
+class RecordingWriter(ABC):
+    """
+    :brief: streaming writer that appends recorded frames into a single
+        container instead of one file per frame. Keeps a per-frame metadata
+        table (frame_ID, timestamp) that is appended to frames.csv next to
+        the container as frames are written.
+        A new segment is started if the frame shape/dtype changes during a
+        recording (e.g. ROI change).
+    """
+    def __init__(self,path):
+        self.path = path
+        self.segment = 0
+        self.shape = None
+        self.dtype = None
+        self.frames_written = 0
+        self.frame_log = CoordinateLog(os.path.join(self.path,'frames.csv'),['frame','frame_ID','timestamp','segment'])
+
+    def _segment_name(self,extension):
+        if self.segment == 0:
+            return 'recording' + extension
+        return 'recording_' + str(self.segment) + extension
+
+    def write(self,image,frame_ID,timestamp):
+        if self.shape != image.shape or self.dtype != image.dtype:
+            if self.shape is not None:
+                self._close_segment()
+                self.segment = self.segment + 1
+            self.shape = image.shape
+            self.dtype = image.dtype
+            self._open_segment()
+        self._append(image)
+        self.frame_log.append({'frame':self.frames_written,'frame_ID':frame_ID,'timestamp':timestamp,'segment':self.segment})
+        self.frames_written = self.frames_written + 1
+
+    def close(self):
+        if self.shape is not None:
+            self._close_segment()
+        self.frame_log.close()
+
+    @abstractmethod
+    def _open_segment(self):
+        pass
+
+    @abstractmethod
+    def _append(self,image):
+        pass
+
+    @abstractmethod
+    def _close_segment(self):
+        pass
+
+
+class ZarrRecordingWriter(RecordingWriter):
+    """
+    :brief: appends frames into a chunked zarr array of shape (t,y,x[,c]).
+        Frames are collected until a full chunk along t is available so that
+        every chunk is written exactly once.
+    """
+    def __init__(self,path,chunk_frames=RECORDING_ZARR_CHUNK_FRAMES):
+        RecordingWriter.__init__(self,path)
+        self.chunk_frames = max(1,int(chunk_frames))
+        self.array = None
+        self.chunk = None
+        self.n_in_chunk = 0
+
+    def _open_segment(self):
+        store = zarr.DirectoryStore(os.path.join(self.path,self._segment_name('.zarr')))
+        self.array = zarr.open_array(store,mode='w',shape=(0,)+self.shape,chunks=(self.chunk_frames,)+self.shape,dtype=self.dtype)
+        self.chunk = np.empty((self.chunk_frames,)+self.shape,dtype=self.dtype)
+        self.n_in_chunk = 0
+
+    def _append(self,image):
+        self.chunk[self.n_in_chunk] = image
+        self.n_in_chunk = self.n_in_chunk + 1
+        if self.n_in_chunk == self.chunk_frames:
+            self._flush()
+
+    def _flush(self):
+        if self.n_in_chunk > 0:
+            self.array.append(self.chunk[:self.n_in_chunk],axis=0)
+            self.n_in_chunk = 0
+
+    def _close_segment(self):
+        self._flush()
+        self.array = None
+        self.chunk = None
+
+
+class TiffRecordingWriter(RecordingWriter):
+    """
+    :brief: appends frames as pages of a multi-page BigTIFF file.
+    """
+    def __init__(self,path):
+        RecordingWriter.__init__(self,path)
+        self.tiff = None
+
+    def _open_segment(self):
+        self.tiff = TiffWriter(os.path.join(self.path,self._segment_name('.tif')),bigtiff=True)
+
+    def _append(self,image):
+        self.tiff.write(image,contiguous=True,photometric='rgb' if image.ndim == 3 else 'minisblack')
+
+    def _close_segment(self):
+        self.tiff.close()
+        self.tiff = None
+
+
+def create_recording_writer(container_format,path):
+    if container_format == 'zarr':
+        return ZarrRecordingWriter(path)
+    if container_format == 'tiff':
+        return TiffRecordingWriter(path)
+    return None
@@ -0,0 +1,187 @@
+import time
+import numpy as np
+
+from control._def import *
+
+class StageMotionModel(object):
+    """
+    :brief: predicts how long the stage takes to move between two xy
+        positions from the per-axis max velocity/acceleration (trapezoidal
+        velocity profile) and the settling time after a move. With
+        simultaneous_xy the two axes move at the same time, otherwise x is
+        moved and settled before y (the way MultiPointWorker used to move).
+    """
+    def __init__(self,velocity_x_mm=MAX_VELOCITY_X_mm,acceleration_x_mm=MAX_ACCELERATION_X_mm,velocity_y_mm=MAX_VELOCITY_Y_mm,acceleration_y_mm=MAX_ACCELERATION_Y_mm,
+                 settle_time_x_s=SCAN_STABILIZATION_TIME_MS_X/1000,settle_time_y_s=SCAN_STABILIZATION_TIME_MS_Y/1000,simultaneous_xy=SCAN_SIMULTANEOUS_XY_MOVES):
+        self.velocity_x_mm = velocity_x_mm
+        self.acceleration_x_mm = acceleration_x_mm
+        self.velocity_y_mm = velocity_y_mm
+        self.acceleration_y_mm = acceleration_y_mm
+        self.settle_time_x_s = settle_time_x_s
+        self.settle_time_y_s = settle_time_y_s
+        self.simultaneous_xy = simultaneous_xy
+
+    def axis_move_time(self,distance_mm,velocity_mm,acceleration_mm):
+        # works on scalars and arrays
+        distance_mm = np.abs(distance_mm)
+        # the max velocity is not reached for short moves (triangular profile)
+        return np.where(distance_mm*acceleration_mm < velocity_mm**2,
+                        2*np.sqrt(distance_mm/acceleration_mm),
+                        distance_mm/velocity_mm + velocity_mm/acceleration_mm)
+
+    def move_time(self,dx_mm,dy_mm):
+        # works on scalars and arrays, the settling time is always included (as in MultiPointWorker.move_to_coordinate)
+        t_x = self.axis_move_time(dx_mm,self.velocity_x_mm,self.acceleration_x_mm)
+        t_y = self.axis_move_time(dy_mm,self.velocity_y_mm,self.acceleration_y_mm)
+        if self.simultaneous_xy:
+            return np.maximum(t_x,t_y) + max(self.settle_time_x_s,self.settle_time_y_s)
+        return t_x + t_y + self.settle_time_x_s + self.settle_time_y_s
+
+    def time_matrix(self,positions):
+        positions = np.asarray(positions,dtype=float)
+        dx = positions[:,0][:,None] - positions[:,0][None,:]
+        dy = positions[:,1][:,None] - positions[:,1][None,:]
+        return self.move_time(dx,dy)
+
+    def path_time(self,positions,order=None,start=None):
+        positions = np.asarray(positions,dtype=float)[:,:2]
+        if order is not None:
+            positions = positions[list(order)]
+        if start is not None:
+            positions = np.vstack([np.asarray(start,dtype=float)[:2],positions])
+        if len(positions) < 2:
+            return 0
+        steps = np.diff(positions,axis=0)
+        return float(np.sum(self.move_time(steps[:,0],steps[:,1])))
+
+
+def motion_model_from_microcontroller(microcontroller,simultaneous_xy=SCAN_SIMULTANEOUS_XY_MOVES):
+    # use the velocity/acceleration that have actually been sent to the controller
+    velocity_x, acceleration_x = microcontroller.max_velocity_acceleration[AXIS.X]
+    velocity_y, acceleration_y = microcontroller.max_velocity_acceleration[AXIS.Y]
+    return StageMotionModel(velocity_x,acceleration_x,velocity_y,acceleration_y,simultaneous_xy=simultaneous_xy)
+
+
+class ScanPathPlanner(object):
+    """
+    :brief: orders regions and the FOVs within them to minimize the predicted
+        stage travel time. 'tsp' builds a nearest neighbour path from the start
+        position and improves it with 2-opt under a time budget; the result is
+        only used if it beats the best serpentine path, which is also used for
+        scans with more than max_tsp_positions positions. Positions are never
+        reordered into a slower path than the given one.
+    """
+    def __init__(self,motion_model=None,method=SCAN_PATH_OPTIMIZATION,max_tsp_positions=SCAN_PATH_TSP_MAX_POSITIONS,max_time_s=SCAN_PATH_TSP_MAX_TIME_S,row_tolerance_mm=SCAN_PATH_ROW_TOLERANCE_MM):
+        self.motion_model = motion_model if motion_model is not None else StageMotionModel()
+        self.method = method
+        self.max_tsp_positions = max_tsp_positions
+        self.max_time_s = max_time_s
+        self.row_tolerance_mm = row_tolerance_mm
+
+    def order(self,positions,start=None):
+        # returns the indices of positions in the order they should be visited
+        n = len(positions)
+        if n < 2 or self.method == 'none':
+            return list(range(n))
+        positions = np.asarray(positions,dtype=float)[:,:2]
+        order = self.serpentine_order(positions,start)
+        if self.method == 'tsp' and n <= self.max_tsp_positions:
+            tsp_order = self.tsp_order(positions,start)
+            if self.motion_model.path_time(positions,tsp_order,start) < self.motion_model.path_time(positions,order,start):
+                order = tsp_order
+        # the given order is kept unless the new one is faster
+        if self.motion_model.path_time(positions,order,start) >= self.motion_model.path_time(positions,start=start):
+            return list(range(n))
+        return order
+
+    def serpentine_order(self,positions,start=None):
+        positions = np.asarray(positions,dtype=float)[:,:2]
+        # group positions into rows
+        by_y = np.argsort(positions[:,1],kind='stable')
+        rows = [[by_y[0]]]
+        for index in by_y[1:]:
+            if positions[index,1] - positions[rows[-1][-1],1] > self.row_tolerance_mm:
+                rows.append([])
+            rows[-1].append(index)
+        rows = [sorted(row,key=lambda index: positions[index,0]) for row in rows]
+        # try the four corners and keep the fastest
+        best_order = None
+        best_time = None
+        for flip_rows in (False,True):
+            for flip_first_row in (False,True):
+                order = []
+                flip = flip_first_row
+                for row in (rows[::-1] if flip_rows else rows):
+                    order.extend(row[::-1] if flip else row)
+                    flip = not flip
+                order = [int(index) for index in order]
+                path_time = self.motion_model.path_time(positions,order,start)
+                if best_time is None or path_time < best_time:
+                    best_order = order
+                    best_time = path_time
+        return best_order
+
+    def tsp_order(self,positions,start=None):
+        positions = np.asarray(positions,dtype=float)[:,:2]
+        n = len(positions)
+        if start is None:
+            start = positions[0]
+        # node 0 is the start position, the path is open (no return to start)
+        cost = self.motion_model.time_matrix(np.vstack([np.asarray(start,dtype=float)[:2],positions]))
+        # nearest neighbour
+        path = [0]
+        visited = np.zeros(n+1,dtype=bool)
+        visited[0] = True
+        for k in range(n):
+            row = np.where(visited,np.inf,cost[path[-1]])
+            next_node = int(np.argmin(row))
+            path.append(next_node)
+            visited[next_node] = True
+        path = np.array(path)
+        # 2-opt - reverse path[i..j] if that shortens the path
+        t_start = time.time()
+        improved = True
+        while improved and time.time() - t_start < self.max_time_s:
+            improved = False
+            for i in range(1,n):
+                a = path[i-1]
+                b = path[i]
+                c = path[i:]
+                e = path[i+1:]
+                delta = cost[a,c] - cost[a,b]
+                # the last node has no successor
+                delta[:-1] = delta[:-1] + cost[b,e] - cost[c[:-1],e]
+                j = int(np.argmin(delta))
+                if delta[j] < -1e-9:
+                    path[i:i+j+1] = path[i:i+j+1][::-1].copy()
+                    improved = True
+                if time.time() - t_start > self.max_time_s:
+                    break
+        return [int(node)-1 for node in path[1:]]
+
+    def plan(self,regions,start=None):
+        # regions: dict of region_id -> list of (x_mm, y_mm[, z_mm])
+        # returns a list of (region_id, [fov indices in the order they should be visited])
+        # regions are ordered by their centers, the FOVs of each region from where the previous region ended
+        region_ids = [region_id for region_id in regions.keys() if len(regions[region_id]) > 0]
+        if len(region_ids) == 0:
+            return []
+        centers = [np.mean(np.asarray(regions[region_id],dtype=float)[:,:2],axis=0) for region_id in region_ids]
+        plan = []
+        position = start
+        for k in self.order(centers,start):
+            coordinates = regions[region_ids[k]]
+            fov_order = self.order(coordinates,position)
+            plan.append((region_ids[k],fov_order))
+            position = coordinates[fov_order[-1]]
+        return plan
+
+    def plan_time(self,regions,plan,start=None):
+        # predicted travel time of a plan returned by plan()
+        positions = []
+        for region_id, fov_order in plan:
+            for fov in fov_order:
+                positions.append(regions[region_id][fov][:2])
+        if len(positions) == 0:
+            return 0
+        return self.motion_model.path_time(positions,start=start)
@@ -0,0 +1,183 @@
+import threading
+import numpy as np
+import cv2
+import imageio as iio
+
+from control._def import *
+
+
+def _periodic_blur(image,sigma_px):
+    # gaussian blur of an image that repeats, padded with itself so that the result repeats too
+    if sigma_px <= 0:
+        return image.copy()
+    pad = min(int(np.ceil(3*sigma_px)),min(image.shape))
+    padded = np.pad(image,pad,mode='wrap')
+    blurred = cv2.GaussianBlur(padded,(0,0),sigma_px)
+    return blurred[pad:pad+image.shape[0],pad:pad+image.shape[1]]
+
+
+def stage_position_getter(microcontroller,navigationController):
+    # (x, y, z) in mm of the stage, read from the positions of Microcontroller_Simulation, converted as in NavigationController.update_pos
+    def get_position_mm():
+        return (microcontroller.x_pos*STAGE_POS_SIGN_X*navigationController.get_mm_per_ustep_X(),
+                microcontroller.y_pos*STAGE_POS_SIGN_Y*navigationController.get_mm_per_ustep_Y(),
+                microcontroller.z_pos*STAGE_POS_SIGN_Z*navigationController.get_mm_per_ustep_Z())
+    return get_position_mm
+
+
+class SimulatedSpecimen(object):
+    """
+    :brief: specimen imaged by Camera_Simulation. The specimen is an image
+        (synthetic cells, or loaded from a file) that repeats over the stage,
+        rendered at the stage position with a gaussian blur that grows with
+        the distance to a (tilted) focal surface. Blurred copies of the
+        specimen are cached at fixed defocus steps and blended, so a frame
+        costs a crop, a resize and the intensity, vignetting and noise model.
+        Brightfield channels show dark cells on a bright background,
+        fluorescence channels bright cells on a dark background.
+    """
+    def __init__(self,image=None,size_px=SIMULATION_SPECIMEN_SIZE_PX,pixel_size_um=SIMULATION_SPECIMEN_PIXEL_SIZE_UM,seed=0):
+        self.pixel_size_um = pixel_size_um
+        self.rng = np.random.default_rng(seed)
+        if image is None:
+            image = self.generate_cells(size_px)
+        self.image = self.normalize(image)
+
+        self.focus_z_mm = SIMULATION_SPECIMEN_FOCUS_Z_MM
+        self.focus_tilt_um_per_mm = tuple(SIMULATION_SPECIMEN_FOCUS_TILT_UM_PER_MM)
+        self.blur_um_per_um = SIMULATION_SPECIMEN_BLUR_UM_PER_UM
+        self.blur_level_step_um = SIMULATION_SPECIMEN_BLUR_LEVEL_STEP_UM
+        self.n_blur_levels = max(1,SIMULATION_SPECIMEN_BLUR_LEVELS)
+        self.channel_intensity = dict(SIMULATION_SPECIMEN_CHANNEL_INTENSITY)
+        self.reference_exposure_ms = SIMULATION_SPECIMEN_REFERENCE_EXPOSURE_MS
+        self.full_well_e = SIMULATION_SPECIMEN_FULL_WELL_E
+        self.read_noise_e = SIMULATION_SPECIMEN_READ_NOISE_E
+        self.vignetting = SIMULATION_SPECIMEN_VIGNETTING
+
+        self.blur_levels = {} # level -> blurred specimen (uint8), computed when first used
+        self.vignetting_cache = {} # frame shape -> gain
+        self.noise = None # standard normal noise, cropped at a random offset for each frame
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls,path,pixel_size_um=SIMULATION_SPECIMEN_PIXEL_SIZE_UM):
+        image = np.asarray(iio.imread(path))
+        if image.ndim == 3:
+            image = image[...,:3].mean(axis=2)
+        return cls(image=image,pixel_size_um=pixel_size_um)
+
+    def normalize(self,image):
+        image = np.asarray(image,dtype=np.float32)
+        image = image - image.min()
+        if image.max() > 0:
+            image = image/image.max()
+        return np.round(image*255).astype(np.uint8)
+
+    def generate_cells(self,size_px):
+        # cells with a brighter nucleus, with some texture, on an empty background
+        area_mm2 = (size_px*self.pixel_size_um/1000)**2
+        n_cells = self.rng.poisson(SIMULATION_SPECIMEN_CELL_DENSITY_PER_MM2*area_mm2)
+        radius_px = SIMULATION_SPECIMEN_CELL_RADIUS_UM/self.pixel_size_um
+        cells = np.zeros((size_px,size_px),dtype=np.float32)
+        nuclei = np.zeros((size_px,size_px),dtype=np.float32)
+        for n in range(n_cells):
+            y, x = self.rng.integers(0,size_px,2)
+            r = radius_px*self.rng.uniform(0.7,1.3)
+            brightness = self.rng.uniform(0.4,1)
+            # drawn at the wrapped positions too, so that the specimen repeats without seams
+            for dy in (-size_px,0,size_px):
+                for dx in (-size_px,0,size_px):
+                    if -r <= y+dy < size_px+r and -r <= x+dx < size_px+r:
+                        cv2.circle(cells,(int(x+dx),int(y+dy)),max(1,int(round(r))),brightness,-1)
+                        cv2.circle(nuclei,(int(x+dx),int(y+dy)),max(1,int(round(r/2.5))),brightness,-1)
+        texture = _periodic_blur(self.rng.random((size_px,size_px),dtype=np.float32),max(1,radius_px/4))
+        image = 0.6*_periodic_blur(cells,max(0.5,radius_px/6)) + 0.4*_periodic_blur(nuclei,max(0.5,radius_px/8))
+        return image*(0.7 + 0.6*(texture - texture.mean()))
+
+    def set_focal_surface(self,z_mm,tilt_x_um_per_mm=0,tilt_y_um_per_mm=0):
+        self.focus_z_mm = z_mm
+        self.focus_tilt_um_per_mm = (tilt_x_um_per_mm,tilt_y_um_per_mm)
+
+    def get_focus_z_mm(self,x_mm,y_mm):
+        return self.focus_z_mm + (self.focus_tilt_um_per_mm[0]*x_mm + self.focus_tilt_um_per_mm[1]*y_mm)/1000
+
+    def get_blur_level(self,level):
+        level = min(level,self.n_blur_levels-1)
+        with self.lock:
+            if level not in self.blur_levels:
+                sigma_px = level*self.blur_level_step_um*self.blur_um_per_um/self.pixel_size_um
+                self.blur_levels[level] = _periodic_blur(self.image.astype(np.float32),sigma_px).astype(np.uint8)
+            return self.blur_levels[level]
+
+    def _crop(self,level,y0,x0,height,width):
+        # region of a blur level starting at (y0, x0), wrapped around the specimen
+        image = self.get_blur_level(level)
+        size_y, size_x = image.shape
+        y0, x0 = y0 % size_y, x0 % size_x
+        if y0 + height <= size_y and x0 + width <= size_x:
+            return image[y0:y0+height,x0:x0+width]
+        ys = np.arange(y0,y0+height) % size_y
+        xs = np.arange(x0,x0+width) % size_x
+        return image[np.ix_(ys,xs)]
+
+    def render_specimen(self,x_mm,y_mm,z_mm,height,width,pixel_size_um):
+        # specimen at the FOV centered at (x_mm, y_mm), in [0,1], blurred for the defocus at z_mm
+        scale = pixel_size_um/self.pixel_size_um
+        region_height = max(1,int(round(height*scale)))
+        region_width = max(1,int(round(width*scale)))
+        y0 = int(round(y_mm*1000/self.pixel_size_um)) - region_height//2
+        x0 = int(round(x_mm*1000/self.pixel_size_um)) - region_width//2
+        defocus_um = abs(z_mm - self.get_focus_z_mm(x_mm,y_mm))*1000
+        level = min(defocus_um/self.blur_level_step_um,self.n_blur_levels-1)
+        level_0 = int(level)
+        weight = level - level_0
+        region = self._crop(level_0,y0,x0,region_height,region_width).astype(np.float32)
+        if weight > 0:
+            region = region*(1 - weight) + self._crop(level_0+1,y0,x0,region_height,region_width).astype(np.float32)*weight
+        if (region_height,region_width) != (height,width):
+            region = cv2.resize(region,(width,height),interpolation=cv2.INTER_LINEAR)
+        return region*(1/255)
+
+    def get_channel_intensity(self,channel):
+        if channel is None:
+            return 1
+        for name, intensity in self.channel_intensity.items():
+            if name in channel:
+                return intensity
+        return 1
+
+    def get_vignetting(self,height,width):
+        if (height,width) not in self.vignetting_cache:
+            y = np.linspace(-1,1,height,dtype=np.float32)[:,None]
+            x = np.linspace(-1,1,width,dtype=np.float32)[None,:]
+            self.vignetting_cache[(height,width)] = 1 - self.vignetting*(x**2 + y**2)/2
+        return self.vignetting_cache[(height,width)]
+
+    def get_noise(self,height,width):
+        # one noise field, cropped at a random offset for each frame
+        margin = 64
+        if self.noise is None or self.noise.shape[0] < height + margin or self.noise.shape[1] < width + margin:
+            self.noise = self.rng.standard_normal((height+margin,width+margin),dtype=np.float32)
+        dy, dx = self.rng.integers(0,margin,2)
+        return self.noise[dy:dy+height,dx:dx+width]
+
+    def render(self,x_mm,y_mm,z_mm,height,width,pixel_size_um,channel=None,exposure_time_ms=None,analog_gain=0,pixel_format='MONO8'):
+        specimen = self.render_specimen(x_mm,y_mm,z_mm,height,width,pixel_size_um)
+        if channel is not None and 'BF' in channel:
+            signal = 1 - 0.6*specimen # absorption
+        else:
+            signal = specimen + 0.02 # background
+        exposure_time_ms = self.reference_exposure_ms if not exposure_time_ms else exposure_time_ms
+        signal = signal*(self.get_channel_intensity(channel)*exposure_time_ms/self.reference_exposure_ms)*self.get_vignetting(height,width)
+
+        # shot noise and read noise in electrons, then the analog gain
+        electrons = signal*self.full_well_e
+        electrons = electrons + np.sqrt(electrons + self.read_noise_e**2)*self.get_noise(height,width)
+        signal = electrons*(10**(analog_gain/20)/self.full_well_e)
+
+        if pixel_format == 'MONO8':
+            return np.clip(signal*255,0,255).astype(np.uint8)
+        elif pixel_format == 'MONO12':
+            return (np.clip(signal*4095,0,4095).astype(np.uint16) << 4)
+        else:
+            return np.clip(signal*65535,0,65535).astype(np.uint16)
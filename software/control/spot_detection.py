@@ -0,0 +1,74 @@
+import numpy as np
+import scipy.signal
+
+from control._def import *
+
+class SpotDetector(object):
+    """
+    :brief: locates the laser AF spot. The thresholded centroid is computed
+        from the row and column projections of the spot with cached index
+        vectors instead of 2D coordinate grids. Optionally the position is
+        refined with a three point Gaussian fit around the projection peaks.
+    """
+    def __init__(self,gaussian_fit=LASER_AF_SPOT_GAUSSIAN_FIT):
+        self.gaussian_fit = gaussian_fit
+        self.spot_spacing_pixels = None # spacing between the spots from the two interfaces (unit: pixel)
+        self._index_vectors = {}
+
+    def _index(self,n):
+        if n not in self._index_vectors:
+            self._index_vectors[n] = np.arange(n,dtype=np.float64)
+        return self._index_vectors[n]
+
+    def _gaussian_peak(self,profile,default):
+        # vertex of the parabola through the log of the peak and its two neighbours
+        p = int(np.argmax(profile))
+        if p == 0 or p == len(profile)-1 or profile[p-1] <= 0 or profile[p+1] <= 0:
+            return default
+        l0, l1, l2 = np.log(profile[p-1]), np.log(profile[p]), np.log(profile[p+1])
+        denom = l0 - 2*l1 + l2
+        if denom >= 0:
+            return default
+        return p + 0.5*(l0-l2)/denom
+
+    def centroid(self,image,threshold=0.2):
+        # pixels below threshold*(max-min) above the minimum are ignored
+        # the profiles of (image - min) are summed from the image under a mask, without a subtracted copy of it
+        image_min = float(image.min())
+        mask = image >= image_min + threshold*(float(image.max())-image_min)
+        column_profile = image.sum(axis=0,dtype=np.float64,where=mask) - image_min*np.count_nonzero(mask,axis=0)
+        row_profile = image.sum(axis=1,dtype=np.float64,where=mask) - image_min*np.count_nonzero(mask,axis=1)
+        total = column_profile.sum()
+        x = column_profile @ self._index(len(column_profile))/total
+        y = row_profile @ self._index(len(row_profile))/total
+        if self.gaussian_fit:
+            x = self._gaussian_peak(column_profile,x)
+            y = self._gaussian_peak(row_profile,y)
+        return x,y
+
+    def find_spot(self,image,has_two_interfaces=HAS_TWO_INTERFACES,use_glass_top=USE_GLASS_TOP):
+        if not has_two_interfaces:
+            return self.centroid(image,0.2)
+        # get the y position of the spots
+        y0 = int(np.argmax(image.sum(axis=1,dtype=np.int64)))
+        # crop along the y axis
+        top = max(0,y0-96)
+        I = image[top:y0+96,:]
+        # signal along x
+        column_profile = I.sum(axis=0,dtype=np.int64)
+        # find peaks
+        peak_locations,_ = scipy.signal.find_peaks(column_profile,distance=100)
+        idx = np.argsort(column_profile[peak_locations])
+        peak_0_location = peak_locations[idx[-1]]
+        peak_1_location = peak_locations[idx[-2]] # for air-glass-water, the smaller peak corresponds to the glass-water interface
+        self.spot_spacing_pixels = peak_1_location-peak_0_location
+        # choose which surface to use
+        if use_glass_top:
+            x1 = peak_1_location
+        else:
+            x1 = peak_0_location
+        # find centroid
+        left = max(0,x1-64)
+        right = min(I.shape[1]-1,x1+64)
+        x, y = self.centroid(I[:,left:right],0.1)
+        return left + x, top + y
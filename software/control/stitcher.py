@@ -11,6 +11,8 @@ import json
 import time
 import math
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 import numpy as np
 import pandas as pd
@@ -22,10 +24,52 @@ from skimage.registration import phase_cross_correlation
 import ome_zarr
 import zarr
 from tifffile import TiffWriter
+import tifffile
 from aicsimageio.writers import OmeTiffWriter
 from aicsimageio.writers import OmeZarrWriter
 from aicsimageio import types
-from basicpy import BaSiC
+from control.flatfield import FlatfieldStore, FlatfieldCorrector, fit_flatfield, calibration_from_acquisition_parameters
+from control.tile_registration import TileRegistration
+from control.stitching_writer import StreamingMosaicWriter
+
+
+def read_tile(filepath):
+    # same arrays as dask_imread(filepath)[0], without building a dask graph per tile
+    if filepath.endswith(('.tiff', '.tif')):
+        return tifffile.imread(filepath)
+    tile = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
+    if tile is None:
+        raise FileNotFoundError(filepath)
+    if tile.ndim == 3:
+        tile = cv2.cvtColor(tile, cv2.COLOR_BGR2RGB)
+    return tile
+
+
+class TileLoader:
+    """
+    :brief: decodes tiles in a thread pool. iter_tiles keeps up to read_ahead
+        tiles in flight and yields them in the order they were requested.
+    """
+    def __init__(self, n_threads=STITCHING_LOADER_THREADS, read_ahead=STITCHING_READ_AHEAD):
+        self.n_threads = max(1, n_threads)
+        self.read_ahead = max(1, read_ahead)
+
+    def iter_tiles(self, items):
+        # items: iterable of (key, filepath), yields (key, tile)
+        with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            pending = deque()
+            for key, filepath in items:
+                pending.append((key, pool.submit(read_tile, filepath)))
+                if len(pending) >= self.read_ahead:
+                    key, future = pending.popleft()
+                    yield key, future.result()
+            while pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+
+    def load_many(self, filepaths):
+        with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            return list(pool.map(read_tile, filepaths))
 
 class Stitcher(QThread, QObject):
 
@@ -56,6 +100,8 @@ class Stitcher(QThread, QObject):
         self.is_wellplate = IS_HCS
         self.flexible = flexible
         self.pixel_size_um = 1.0
+        self.registration_method = STITCHING_REGISTRATION_METHOD
+        self.tile_positions = {} # region -> {(row, col): (y, x)}, kept across time points
         self.init_stitching_parameters()
         # self.overlap_percent = Acquisition.OVERLAP_PERCENT
 
@@ -75,6 +121,7 @@ class Stitcher(QThread, QObject):
         self.stitching_data = {}
         self.tczyx_shape = (len(self.time_points),self.num_c,self.num_z,self.num_rows*self.input_height,self.num_cols*self.input_width)
         self.stitched_images = None
+        self.current_tile_positions = None
         self.chunks = None
         self.dtype = np.uint16
 
@@ -227,18 +274,52 @@ class Stitcher(QThread, QObject):
         print(self.mono_channel_names)
         print(self.regions)
 
+    def load_stored_flatfields(self):
+        # profiles of the mono channels already in the flatfield store
+        self.flatfield_store = FlatfieldStore() if FLATFIELD_USE_STORE else None
+        self.flatfield_calibration = calibration_from_acquisition_parameters(self.acquisition_params)
+        # channels corrected during the acquisition get no profile, so that they are not corrected twice
+        loaded = set(self.acquisition_params.get('flatfield_corrected_channels', [])) & set(self.mono_channel_names)
+        if loaded:
+            print(f"flatfields already applied during the acquisition for {sorted(loaded)}")
+        if self.flatfield_store is None:
+            return loaded
+        objective, camera, binning = self.flatfield_calibration
+        for channel_index, channel_name in enumerate(self.mono_channel_names):
+            if channel_name in loaded:
+                continue
+            corrector = self.flatfield_store.get(objective, camera, channel_name, binning)
+            if corrector is not None and corrector.shape == (self.input_height, self.input_width):
+                self.flatfields[channel_index] = corrector
+                loaded.add(channel_name)
+        if len(self.flatfields) > 0:
+            print(f"using stored flatfields for {sorted(self.mono_channel_names[i] for i in self.flatfields)}")
+        return loaded
+
     def get_flatfields(self, progress_callback=None):
         def process_images(images, channel_name):
             images = np.array(images)
-            basic = BaSiC(get_darkfield=False, smoothness_flatfield=1)
-            basic.fit(images)
+            flatfield, darkfield = fit_flatfield(images)
             channel_index = self.mono_channel_names.index(channel_name)
-            self.flatfields[channel_index] = basic.flatfield
+            if self.flatfield_store is not None:
+                objective, camera, binning = self.flatfield_calibration
+                self.flatfields[channel_index] = self.flatfield_store.put(objective, camera, channel_name, binning, flatfield, darkfield, n_images=len(images))
+            else:
+                self.flatfields[channel_index] = FlatfieldCorrector(flatfield, darkfield)
             if progress_callback:
                 progress_callback(channel_index + 1, self.num_c)
 
+        loaded = self.load_stored_flatfields()
+
         # Iterate only over the channels you need to process
         for channel in self.channel_names:
+            if self.is_rgb[channel]:
+                base_name = channel.split('_')[0]
+                channel_mono_names = [base_name + '_R', base_name + '_G', base_name + '_B']
+            else:
+                channel_mono_names = [channel]
+            if all(name in loaded for name in channel_mono_names):
+                continue
             all_tiles = []
             # Collect tiles from all roi and z-levels for the current channel
             for roi in self.regions:
@@ -313,6 +394,33 @@ class Stitcher(QThread, QObject):
             print(f"Error calculating vertical shift: {e}")
             return (0, 0)
 
+    def get_grid_spacing_pixels(self):
+        dx_mm = self.acquisition_params['dx(mm)']
+        dy_mm = self.acquisition_params['dy(mm)']
+        obj_mag = self.acquisition_params['objective']['magnification']
+        obj_tube_lens_mm = self.acquisition_params['objective']['tube_lens_f_mm']
+        sensor_pixel_size_um = self.acquisition_params['sensor_pixel_size_um']
+        tube_lens_mm = self.acquisition_params['tube_lens_mm']
+
+        obj_focal_length_mm = obj_tube_lens_mm / obj_mag
+        actual_mag = tube_lens_mm / obj_focal_length_mm
+        self.pixel_size_um = sensor_pixel_size_um / actual_mag
+        return dy_mm * 1000 / self.pixel_size_um, dx_mm * 1000 / self.pixel_size_um
+
+    def register_grid(self, roi):
+        # tile positions from the registration channel and z level, used for all channels, z levels and time points
+        self.registration_channel = self.registration_channel if self.registration_channel in self.channel_names else self.channel_names[0]
+        dy_pixels, dx_pixels = self.get_grid_spacing_pixels()
+        grid = set()
+        for channel_data in self.stitching_data[roi].values():
+            for z_data in channel_data.values():
+                grid.update(z_data.keys())
+        nominal_positions = {(row, col): (row * dy_pixels, col * dx_pixels) for row, col in sorted(grid)}
+        tiles_info = self.stitching_data[roi][self.registration_channel].get(self.registration_z_level, {})
+        registration = TileRegistration((self.input_height, self.input_width))
+        tiles = TileLoader().iter_tiles((row_col, tile_info['filepath']) for row_col, tile_info in tiles_info.items())
+        self.tile_positions[roi] = registration.register(nominal_positions, tiles)
+
     def calculate_shifts(self, roi=""):
         roi = self.regions[0] if roi not in self.regions else roi
         self.registration_channel = self.registration_channel if self.registration_channel in self.channel_names else self.channel_names[0]
@@ -411,7 +519,10 @@ class Stitcher(QThread, QObject):
                 abs((self.num_rows - 1) * self.v_shift[1])) # horizontal shift from vertical registration
         y_max = (self.input_height + ((self.num_rows - 1) * (self.input_height + self.v_shift[0])) + # vertical height with overlap
                 abs((self.num_cols - 1) * self.h_shift[0])) # vertical shift from horizontal registration
-        if self.use_registration and DYNAMIC_REGISTRATION:
+        if self.use_registration and region_id in self.tile_positions:
+            y_max = max(y for y, x in self.tile_positions[region_id].values()) + self.input_height
+            x_max = max(x for y, x in self.tile_positions[region_id].values()) + self.input_width
+        elif self.use_registration and DYNAMIC_REGISTRATION:
             y_max *= 1.05
             x_max *= 1.05
         size = max(y_max, x_max)
@@ -431,7 +542,10 @@ class Stitcher(QThread, QObject):
         return da.zeros(tczyx_shape, dtype=self.dtype, chunks=self.chunks)
 
     def stitch_images(self, time_point, roi, progress_callback=None):
+        if self.use_registration and self.registration_method == 'global' and roi not in self.tile_positions:
+            self.register_grid(roi)
         self.stitched_images = self.init_output(time_point, roi)
+        self.current_tile_positions = self.tile_positions.get(roi) if self.use_registration else None
         total_tiles = sum(len(z_data) for channel_data in self.stitching_data[roi].values() for z_data in channel_data.values())
         processed_tiles = 0
 
@@ -443,7 +557,7 @@ class Stitcher(QThread, QObject):
                 for col in range(self.num_cols):
                     col = self.num_cols - 1 - col if self.is_reversed['cols'] else col
 
-                    if self.use_registration and DYNAMIC_REGISTRATION and z_level == self.registration_z_level:
+                    if self.use_registration and self.current_tile_positions is None and DYNAMIC_REGISTRATION and z_level == self.registration_z_level:
                         if (row, col) in self.stitching_data[roi][self.registration_channel][z_level]:
                             tile_info = self.stitching_data[roi][self.registration_channel][z_level][(row, col)]
                             self.h_shift, self.v_shift = self.calculate_dynamic_shifts(roi, self.registration_channel, z_level, row, col)
@@ -468,9 +582,13 @@ class Stitcher(QThread, QObject):
 
     def stitch_single_image(self, tile, z_level, channel_idx, row, col):
         #print(tile.shape)
-        if self.apply_flatfield:
-            tile = (tile / self.flatfields[channel_idx]).clip(min=np.iinfo(self.dtype).min,
-                                                              max=np.iinfo(self.dtype).max).astype(self.dtype)
+        if self.apply_flatfield and channel_idx in self.flatfields:
+            tile = self.flatfields[channel_idx].apply(tile, self.dtype)
+        if self.current_tile_positions is not None:
+            y, x = self.current_tile_positions[(row, col)]
+            self.stitched_images[0, channel_idx, z_level, y:y+tile.shape[0], x:x+tile.shape[1]] = tile
+            return
+
         # Determine crop for tile edges
         top_crop = max(0, (-self.v_shift[0] // 2) - abs(self.h_shift[0]) // 2) if row > 0 else 0
         bottom_crop = max(0, (-self.v_shift[0] // 2) - abs(self.h_shift[0]) // 2) if row < self.num_rows - 1 else 0
@@ -712,7 +830,7 @@ class Stitcher(QThread, QObject):
                     print("time to apply flatfields", time.time() - ttime)
 
 
-                if self.use_registration:
+                if self.use_registration and self.registration_method == 'single_pair':
                     shtime = time.time()
                     print(f"calculating shifts...")
                     self.calculate_shifts()
@@ -785,6 +903,7 @@ class CoordinateStitcher(QThread, QObject):
         self.regions = []
         self.overlap_percent = overlap_percent
         self.scan_pattern = FOV_PATTERN
+        self.registration_method = STITCHING_REGISTRATION_METHOD
         self.init_stitching_parameters()
 
 
@@ -798,6 +917,11 @@ class CoordinateStitcher(QThread, QObject):
         self.num_pyramid_levels = 5
         self.flatfields = {}
         self.stitching_data = {}
+        self.region_keys = {} # region -> keys of stitching_data
+        self.position_index = {} # (region, x, y, channel, z_level) -> key of the first time point
+        self.grid_index = {} # region -> {(row, col): fov}
+        self.tile_loader = TileLoader()
+        self.tile_positions = {} # region -> {fov: (y, x)} from the global registration
         self.dtype = np.uint16
         self.chunks = None
         self.h_shift = (0, 0)
@@ -813,6 +937,29 @@ class CoordinateStitcher(QThread, QObject):
         self.time_points.sort(key=int)
         return self.time_points
 
+    def build_tile_index(self):
+        self.region_keys = {}
+        self.position_index = {}
+        self.grid_index = {}
+        for key, tile_info in self.stitching_data.items():
+            region = key[1]
+            self.region_keys.setdefault(region, []).append(key)
+            self.position_index.setdefault((region, tile_info['x'], tile_info['y'], tile_info['channel'], tile_info['z_level']), key)
+        for region, keys in self.region_keys.items():
+            x_positions, y_positions = self.get_region_positions(region)
+            col_index = {x: i for i, x in enumerate(x_positions)}
+            row_index = {y: i for i, y in enumerate(y_positions)}
+            self.grid_index[region] = {(row_index[self.stitching_data[key]['y']], col_index[self.stitching_data[key]['x']]): key[2] for key in keys}
+
+    def get_region_data(self, region):
+        return {key: self.stitching_data[key] for key in self.region_keys.get(region, [])}
+
+    def get_region_positions(self, region):
+        keys = self.region_keys.get(region, [])
+        x_positions = sorted(set(self.stitching_data[key]['x'] for key in keys))
+        y_positions = sorted(set(self.stitching_data[key]['y'] for key in keys))
+        return x_positions, y_positions
+
     def extract_acquisition_parameters(self):
         acquistion_params_path = os.path.join(self.input_folder, 'acquisition parameters.json')
         with open(acquistion_params_path, 'r') as file:
@@ -829,6 +976,16 @@ class CoordinateStitcher(QThread, QObject):
         self.pixel_size_um = sensor_pixel_size_um / actual_mag
         print("pixel_size_um:", self.pixel_size_um)
 
+    def read_image_log(self, image_folder):
+        # file -> (region, fov, z_level, channel) of the images in images.csv
+        image_log_path = os.path.join(image_folder, 'images.csv')
+        if not os.path.exists(image_log_path):
+            return {}
+        image_log = pd.read_csv(image_log_path, dtype={'region': str, 'file': str})
+        image_log = image_log.dropna(subset=['file', 'region', 'fov', 'z_level'])
+        return {file: (region, int(fov), int(z_level), channel) for file, region, fov, z_level, channel in
+                zip(image_log['file'], image_log['region'], image_log['fov'], image_log['z_level'], image_log['channel'])}
+
     def parse_filenames(self):
         self.extract_acquisition_parameters()
         self.get_pixel_size_from_params()
@@ -843,6 +1000,10 @@ class CoordinateStitcher(QThread, QObject):
             image_folder = os.path.join(self.input_folder, str(time_point))
             coordinates_path = os.path.join(self.input_folder, time_point, 'coordinates.csv')
             coordinates_df = pd.read_csv(coordinates_path)
+            # first row of each (region, fov, z_level)
+            coordinates = {}
+            for row in coordinates_df.to_dict('records'):
+                coordinates.setdefault((row['region'], row['fov'], row['z_level']), row)
 
             print(f"Processing timepoint {time_point}, image folder: {image_folder}")
 
@@ -851,21 +1012,23 @@ class CoordinateStitcher(QThread, QObject):
             if not image_files:
                 raise Exception(f"No valid files found in directory for timepoint {time_point}.")
 
+            # images.csv written during the acquisition, files that are not in it are identified by their name
+            logged_images = self.read_image_log(image_folder)
+
             for file in image_files:
-                parts = file.split('_', 3)
-                region, fov, z_level, channel = parts[0], int(parts[1]), int(parts[2]), os.path.splitext(parts[3])[0]
-                channel = channel.replace("_", " ").replace("full ", "full_")
+                if file in logged_images:
+                    region, fov, z_level, channel = logged_images[file]
+                else:
+                    parts = file.split('_', 3)
+                    region, fov, z_level, channel = parts[0], int(parts[1]), int(parts[2]), os.path.splitext(parts[3])[0]
+                    channel = channel.replace("_", " ").replace("full ", "full_")
 
-                coord_row = coordinates_df[(coordinates_df['region'] == region) & 
-                                           (coordinates_df['fov'] == fov) & 
-                                           (coordinates_df['z_level'] == z_level)]
+                coord_row = coordinates.get((region, fov, z_level))
 
-                if coord_row.empty:
+                if coord_row is None:
                     print(f"Warning: No matching coordinates found for file {file}")
                     continue
 
-                coord_row = coord_row.iloc[0]
-
                 key = (t, region, fov, z_level, channel)
                 self.stitching_data[key] = {
                     'filepath': os.path.join(image_folder, file),
@@ -889,13 +1052,14 @@ class CoordinateStitcher(QThread, QObject):
         self.num_t = len(self.time_points)
         self.num_z = max_z + 1
         self.num_fovs_per_region = max_fov + 1
+        self.build_tile_index()
         
         # Set up image parameters based on the first image
         first_key = list(self.stitching_data.keys())[0]
         first_region = self.stitching_data[first_key]['region']
         first_fov = self.stitching_data[first_key]['fov_idx']
         first_z_level = self.stitching_data[first_key]['z_level']
-        first_image = dask_imread(self.stitching_data[first_key]['filepath'])[0]
+        first_image = read_tile(self.stitching_data[first_key]['filepath'])
 
         self.dtype = first_image.dtype
         if len(first_image.shape) == 2:
@@ -910,7 +1074,7 @@ class CoordinateStitcher(QThread, QObject):
         self.mono_channel_names = []
         for channel in self.channel_names:
             channel_key = (t, first_region, first_fov, first_z_level, channel)
-            channel_image = dask_imread(self.stitching_data[channel_key]['filepath'])[0]
+            channel_image = read_tile(self.stitching_data[channel_key]['filepath'])
             if len(channel_image.shape) == 3 and channel_image.shape[2] == 3:
                 self.is_rgb[channel] = True
                 channel = channel.split('_')[0]
@@ -943,15 +1107,16 @@ class CoordinateStitcher(QThread, QObject):
         return 0xFFFFFF  # Default to white if no match found
 
     def calculate_output_dimensions(self, region):
-        region_data = [tile_info for key, tile_info in self.stitching_data.items() if key[1] == region]
-        
-        if not region_data:
+        if not self.region_keys.get(region):
             raise ValueError(f"No data found for region {region}")
 
-        self.x_positions = sorted(set(tile_info['x'] for tile_info in region_data))
-        self.y_positions = sorted(set(tile_info['y'] for tile_info in region_data))
+        self.x_positions, self.y_positions = self.get_region_positions(region)
 
-        if self.use_registration: # Add extra space for shifts 
+        if self.use_registration and region in self.tile_positions:
+            width_pixels = max(x for y, x in self.tile_positions[region].values()) + self.input_width
+            height_pixels = max(y for y, x in self.tile_positions[region].values()) + self.input_height
+
+        elif self.use_registration: # Add extra space for shifts 
             num_cols = len(self.x_positions)
             num_rows = len(self.y_positions)
 
@@ -1003,23 +1168,36 @@ class CoordinateStitcher(QThread, QObject):
             if images.ndim != 3 and images.ndim != 4:
                 raise ValueError(f"Images must be 3 or 4-dimensional array, with dimension of (T, Y, X) or (T, Z, Y, X). Got shape {images.shape}")
 
-            basic = BaSiC(get_darkfield=False, smoothness_flatfield=1)
-            basic.fit(images)
+            flatfield, darkfield = fit_flatfield(images)
             channel_index = self.mono_channel_names.index(channel_name)
-            self.flatfields[channel_index] = basic.flatfield
+            if self.flatfield_store is not None:
+                objective, camera, binning = self.flatfield_calibration
+                self.flatfields[channel_index] = self.flatfield_store.put(objective, camera, channel_name, binning, flatfield, darkfield, n_images=len(images))
+            else:
+                self.flatfields[channel_index] = FlatfieldCorrector(flatfield, darkfield)
             if progress_callback:
                 progress_callback(channel_index + 1, self.num_c)
 
+        loaded = self.load_stored_flatfields()
+
         for channel in self.channel_names:
+            if self.is_rgb[channel]:
+                base_name = channel.split('_')[0]
+                channel_mono_names = [base_name + '_R', base_name + '_G', base_name + '_B']
+            else:
+                channel_mono_names = [channel]
+            if all(name in loaded for name in channel_mono_names):
+                continue
             print(f"Calculating {channel} flatfield...")
             images = []
             for t in self.time_points:
-                time_images = [dask_imread(tile['filepath'])[0] for key, tile in self.stitching_data.items() if tile['channel'] == channel and key[0] == int(t)]
-                if not time_images:
+                # only the randomly selected tiles are decoded
+                time_filepaths = [tile['filepath'] for key, tile in self.stitching_data.items() if tile['channel'] == channel and key[0] == int(t)]
+                if not time_filepaths:
                     print(f"WARNING: No images found for channel {channel} at timepoint {t}")
                     continue
-                random.shuffle(time_images)
-                selected_tiles = time_images[:min(32, len(time_images))]
+                random.shuffle(time_filepaths)
+                selected_tiles = self.tile_loader.load_many(time_filepaths[:min(32, len(time_filepaths))])
                 images.extend(selected_tiles)
 
             if not images:
@@ -1047,23 +1225,61 @@ class CoordinateStitcher(QThread, QObject):
             else:
                 raise ValueError(f"Unexpected number of dimensions in images array: {images.ndim}")
 
+    def load_stored_flatfields(self):
+        # profiles of the mono channels already in the flatfield store
+        self.flatfield_store = FlatfieldStore() if FLATFIELD_USE_STORE else None
+        self.flatfield_calibration = calibration_from_acquisition_parameters(self.acquisition_params)
+        # channels corrected during the acquisition get no profile, so that they are not corrected twice
+        loaded = set(self.acquisition_params.get('flatfield_corrected_channels', [])) & set(self.mono_channel_names)
+        if loaded:
+            print(f"flatfields already applied during the acquisition for {sorted(loaded)}")
+        if self.flatfield_store is None:
+            return loaded
+        objective, camera, binning = self.flatfield_calibration
+        for channel_index, channel_name in enumerate(self.mono_channel_names):
+            if channel_name in loaded:
+                continue
+            corrector = self.flatfield_store.get(objective, camera, channel_name, binning)
+            if corrector is not None and corrector.shape == (self.input_height, self.input_width):
+                self.flatfields[channel_index] = corrector
+                loaded.add(channel_name)
+        if len(self.flatfields) > 0:
+            print(f"using stored flatfields for {sorted(self.mono_channel_names[i] for i in self.flatfields)}")
+        return loaded
+
+    def set_registration_channel(self):
+        if not self.registration_channel:
+            self.registration_channel = self.channel_names[0]
+        elif self.registration_channel not in self.channel_names:
+            print(f"Warning: Specified registration channel '{self.registration_channel}' not found. Using {self.channel_names[0]}.")
+            self.registration_channel = self.channel_names[0]
+
+    def register_region(self, region):
+        # tile positions from the registration channel and z level of the first time point, used for all channels, z levels and time points
+        self.set_registration_channel()
+        x_positions, y_positions = self.get_region_positions(region)
+        x_min, y_min = min(x_positions), min(y_positions)
+        nominal_positions = {}
+        registration_tiles = []
+        for key in self.region_keys[region]:
+            t, _, fov, z_level, channel = key
+            tile_info = self.stitching_data[key]
+            nominal_positions.setdefault(fov, ((tile_info['y'] - y_min) * 1000 / self.pixel_size_um, (tile_info['x'] - x_min) * 1000 / self.pixel_size_um))
+            if t == 0 and z_level == self.registration_z_level and channel == self.registration_channel:
+                registration_tiles.append((fov, tile_info['filepath']))
+        registration = TileRegistration((self.input_height, self.input_width))
+        self.tile_positions[region] = registration.register(nominal_positions, self.tile_loader.iter_tiles(registration_tiles))
+
     def calculate_shifts(self, region):
-        region_data = [v for k, v in self.stitching_data.items() if k[1] == region]
-        
         # Get unique x and y positions
-        x_positions = sorted(set(tile['x'] for tile in region_data))
-        y_positions = sorted(set(tile['y'] for tile in region_data))
+        x_positions, y_positions = self.get_region_positions(region)
         
         # Initialize shifts
         self.h_shift = (0, 0)
         self.v_shift = (0, 0)
 
         # Set registration channel if not already set
-        if not self.registration_channel:
-            self.registration_channel = self.channel_names[0]
-        elif self.registration_channel not in self.channel_names:
-            print(f"Warning: Specified registration channel '{self.registration_channel}' not found. Using {self.channel_names[0]}.")
-            self.registration_channel = self.channel_names[0]
+        self.set_registration_channel()
 
 
         max_x_overlap = round(self.input_width * self.overlap_percent / 2 / 100)
@@ -1143,19 +1359,25 @@ class CoordinateStitcher(QThread, QObject):
         return round(shift[0] - img1_overlap.shape[0]), round(shift[1])
 
     def get_tile(self, region, x, y, channel, z_level):
-        for key, value in self.stitching_data.items():
-            if (key[1] == region and 
-                value['x'] == x and 
-                value['y'] == y and 
-                value['channel'] == channel and 
-                value['z_level'] == z_level):
-                try:
-                    return dask_imread(value['filepath'])[0]
-                except FileNotFoundError:
-                    print(f"Warning: Tile file not found: {value['filepath']}")
-                    return None
-        print(f"Warning: No matching tile found for region {region}, x={x}, y={y}, channel={channel}, z={z_level}")
-        return None
+        key = self.position_index.get((region, x, y, channel, z_level))
+        if key is None:
+            print(f"Warning: No matching tile found for region {region}, x={x}, y={y}, channel={channel}, z={z_level}")
+            return None
+        value = self.stitching_data[key]
+        try:
+            return read_tile(value['filepath'])
+        except FileNotFoundError:
+            print(f"Warning: Tile file not found: {value['filepath']}")
+            return None
+
+    def get_tile_at_grid_position(self, region, row, col, channel, z_level, t=0):
+        fov = self.grid_index.get(region, {}).get((row, col))
+        if fov is None:
+            return None
+        key = (t, region, fov, z_level, channel)
+        if key not in self.stitching_data:
+            return None
+        return read_tile(self.stitching_data[key]['filepath'])
 
     def normalize_image(self, img):
         img_min, img_max = img.min(), img.max()
@@ -1183,47 +1405,74 @@ class CoordinateStitcher(QThread, QObject):
         except Exception as e:
             print(f"Error in visualize_image: {e}")
 
-    def stitch_and_save_region(self, region, progress_callback=None):
-        stitched_images = self.init_output(region)  # sets self.x_positions, self.y_positions
-        region_data = {k: v for k, v in self.stitching_data.items() if k[1] == region}
-        total_tiles = len(region_data)
-        processed_tiles = 0
+    def get_tile_position(self, region, tile_info):
+        # top left corner of the tile in the region mosaic (before cropping), self.x_positions and self.y_positions must be set
+        if self.use_registration and region in self.tile_positions:
+            y_pixel, x_pixel = self.tile_positions[region][tile_info['fov_idx']]
 
-        x_min = min(self.x_positions)
-        y_min = min(self.y_positions)
+        elif self.use_registration:
+            self.col_index = self.x_positions.index(tile_info['x'])
+            self.row_index = self.y_positions.index(tile_info['y'])
 
-        for key, tile_info in region_data.items():
-            t, _, fov, z_level, channel = key
-            tile = dask_imread(tile_info['filepath'])[0]
-            if self.use_registration:
-                self.col_index = self.x_positions.index(tile_info['x'])
-                self.row_index = self.y_positions.index(tile_info['y'])
+            if self.scan_pattern == 'S-Pattern' and self.row_index % 2 == self.h_shift_rev_odd:
+                h_shift = self.h_shift_rev
+            else:
+                h_shift = self.h_shift
 
-                if self.scan_pattern == 'S-Pattern' and self.row_index % 2 == self.h_shift_rev_odd:
-                    h_shift = self.h_shift_rev
-                else:
-                    h_shift = self.h_shift
+            # Initialize starting coordinates based on tile position and shift
+            x_pixel = int(self.col_index * (self.input_width + h_shift[1]))
+            y_pixel = int(self.row_index * (self.input_height + self.v_shift[0]))
 
-                # Initialize starting coordinates based on tile position and shift
-                x_pixel = int(self.col_index * (self.input_width + h_shift[1]))
-                y_pixel = int(self.row_index * (self.input_height + self.v_shift[0]))
+            # Apply horizontal shift effect on y-coordinate
+            if h_shift[0] < 0:
+                y_pixel += int((len(self.x_positions) - 1 - self.col_index) * abs(h_shift[0]))  # Fov moves up as cols go right
+            else:
+                y_pixel += int(self.col_index * h_shift[0])  # Fov moves down as cols go right
 
-                # Apply horizontal shift effect on y-coordinate
-                if h_shift[0] < 0:
-                    y_pixel += int((len(self.x_positions) - 1 - self.col_index) * abs(h_shift[0]))  # Fov moves up as cols go right
-                else:
-                    y_pixel += int(self.col_index * h_shift[0])  # Fov moves down as cols go right
+            # Apply vertical shift effect on x-coordinate
+            if self.v_shift[1] < 0:
+                x_pixel += int((len(self.y_positions) - 1 - self.row_index) * abs(self.v_shift[1]))  # Fov moves left as rows go down
+            else:
+                x_pixel += int(self.row_index * self.v_shift[1])   # Fov moves right as rows go down
 
-                # Apply vertical shift effect on x-coordinate
-                if self.v_shift[1] < 0:
-                    x_pixel += int((len(self.y_positions) - 1 - self.row_index) * abs(self.v_shift[1]))  # Fov moves left as rows go down
-                else:
-                    x_pixel += int(self.row_index * self.v_shift[1])   # Fov moves right as rows go down
+        else:
+            # Calculate base position
+            x_pixel = int((tile_info['x'] - min(self.x_positions)) * 1000 / self.pixel_size_um)
+            y_pixel = int((tile_info['y'] - min(self.y_positions)) * 1000 / self.pixel_size_um)
 
-            else:
-                # Calculate base position
-                x_pixel = int((tile_info['x'] - x_min) * 1000 / self.pixel_size_um)
-                y_pixel = int((tile_info['y'] - y_min) * 1000 / self.pixel_size_um)
+        return x_pixel, y_pixel
+
+    def get_tile_crop(self):
+        # (top, bottom, left, right) crop of the tile placed last by get_tile_position, only with the single pair registration
+        if not (self.use_registration and self.registration_method == 'single_pair'):
+            return 0, 0, 0, 0
+
+        if self.scan_pattern == 'S-Pattern' and self.row_index % 2 == self.h_shift_rev_odd:
+            h_shift = self.h_shift_rev
+        else:
+            h_shift = self.h_shift
+
+        # Determine crop for tile edges
+        top_crop = max(0, (-self.v_shift[0] // 2) - abs(h_shift[0]) // 2) if self.row_index > 0 else 0 # if y
+        bottom_crop = max(0, (-self.v_shift[0] // 2) - abs(h_shift[0]) // 2) if self.row_index < len(self.y_positions) - 1 else 0
+        left_crop = max(0, (-h_shift[1] // 2) - abs(self.v_shift[1]) // 2) if self.col_index > 0 else 0
+        right_crop = max(0, (-h_shift[1] // 2) - abs(self.v_shift[1]) // 2) if self.col_index < len(self.x_positions) - 1 else 0
+        return top_crop, bottom_crop, left_crop, right_crop
+
+    def stitch_and_save_region(self, region, progress_callback=None):
+        if STITCHING_STREAMING_WRITER and self.output_format.endswith('.ome.zarr'):
+            self.stitch_and_save_region_streaming(region, progress_callback)
+            return
+
+        stitched_images = self.init_output(region)  # sets self.x_positions, self.y_positions
+        region_data = self.get_region_data(region)
+        total_tiles = len(region_data)
+        processed_tiles = 0
+
+        for key, tile in self.tile_loader.iter_tiles((key, tile_info['filepath']) for key, tile_info in region_data.items()):
+            t, _, fov, z_level, channel = key
+            tile_info = region_data[key]
+            x_pixel, y_pixel = self.get_tile_position(region, tile_info)
 
             self.place_tile(stitched_images, tile, x_pixel, y_pixel, z_level, channel, t)
 
@@ -1238,6 +1487,95 @@ class CoordinateStitcher(QThread, QObject):
             # self.save_as_ome_zarr(region, stitched_images)
             self.save_region_to_ome_zarr(region, stitched_images) # bugs: when starting to save, main gui lags and disconnects
 
+    def stitch_and_save_region_streaming(self, region, progress_callback=None):
+        width, height = self.calculate_output_dimensions(region)  # sets self.x_positions, self.y_positions
+        self.num_pyramid_levels = max(1, self.num_pyramid_levels)
+        self.output_shape = (self.num_t, self.num_c, self.num_z, height, width)
+        print(f"Output shape for region {region}: {self.output_shape}")
+        region_data = self.get_region_data(region)
+        total_tiles = len(region_data)
+        processed_tiles = 0
+
+        # tiles of each (t, z, channel), a RGB channel fills three output channels
+        planes = {}
+        for key, tile_info in region_data.items():
+            t, _, fov, z_level, channel = key
+            x_pixel, y_pixel = self.get_tile_position(region, tile_info)
+            top_crop, bottom_crop, left_crop, right_crop = self.get_tile_crop()
+            planes.setdefault((t, z_level, channel), []).append((y_pixel + top_crop, x_pixel + left_crop,
+                self.input_height - top_crop - bottom_crop, self.input_width - left_crop - right_crop,
+                tile_info['filepath'], (top_crop, bottom_crop, left_crop, right_crop)))
+
+        self.starting_saving.emit(False)
+        group = self.init_region_group(region)
+        writer = StreamingMosaicWriter(group, self.output_shape, self.dtype, self.chunks, self.num_pyramid_levels, self.tile_loader)
+        for (t, z_level, channel), placements in planes.items():
+            if self.is_rgb[channel]:
+                channel_indices = [self.mono_channel_names.index(f"{channel.split('_')[0]}_{color}") for color in ['R', 'G', 'B']]
+            else:
+                channel_indices = [self.mono_channel_names.index(channel)]
+
+            def prepare_tile(tile, crop, channel_indices=channel_indices):
+                if tile.ndim == 3 and tile.shape[2] == 3:
+                    tile = np.moveaxis(tile, 2, 0)
+                elif tile.ndim == 2:
+                    tile = tile[np.newaxis]
+                top_crop, bottom_crop, left_crop, right_crop = crop
+                tile = tile[:, top_crop:tile.shape[1]-bottom_crop, left_crop:tile.shape[2]-right_crop]
+                if self.apply_flatfield:
+                    tile = np.stack([self.apply_flatfield_correction(tile[i], channel_idx) for i, channel_idx in enumerate(channel_indices)])
+                return tile
+
+            writer.write_planes(t, z_level, channel_indices, placements, prepare_tile)
+            processed_tiles += len(placements)
+            if progress_callback:
+                progress_callback(processed_tiles, total_tiles)
+
+    def init_region_group(self, region):
+        # zarr group of the region with the multiscales and omero metadata, the levels are written by StreamingMosaicWriter
+        output_path = os.path.join(self.input_folder, self.output_name)
+        store = ome_zarr.io.parse_url(output_path, mode="a").store
+        root = zarr.group(store=store)
+
+        if len(self.regions) > 1:
+            row, col = region[0], region[1:]
+            well_group = root.require_group(row).require_group(col)
+            if 'well' not in well_group.attrs:
+                ome_zarr.writer.write_well_metadata(well_group, [{"path": "0", "acquisition": 0}])
+            group = well_group.require_group("0")
+            name = f"{region}"
+        else:
+            group = root
+            name = "stitched_image"
+
+        datasets = [{
+            "path": str(i),
+            "coordinateTransformations": [{
+                "type": "scale",
+                "scale": [1, 1, self.acquisition_params.get("dz(um)", 1), self.pixel_size_um * (2 ** i), self.pixel_size_um * (2 ** i)]
+            }]
+        } for i in range(self.num_pyramid_levels)]
+
+        axes = [
+            {"name": "t", "type": "time", "unit": "second"},
+            {"name": "c", "type": "channel"},
+            {"name": "z", "type": "space", "unit": "micrometer"},
+            {"name": "y", "type": "space", "unit": "micrometer"},
+            {"name": "x", "type": "space", "unit": "micrometer"}
+        ]
+        ome_zarr.writer.write_multiscales_metadata(group, datasets, axes=axes, name=name)
+
+        group.attrs["omero"] = {
+            "name": name,
+            "version": "0.4",
+            "channels": [{
+                "label": channel_name,
+                "color": f"{color:06X}",
+                "window": {"start": 0, "end": np.iinfo(self.dtype).max, "min": 0, "max": np.iinfo(self.dtype).max}
+            } for channel_name, color in zip(self.mono_channel_names, self.channel_colors)]
+        }
+        return group
+
     def place_tile(self, stitched_images, tile, x_pixel, y_pixel, z_level, channel, t):
         if len(tile.shape) == 2:
             # Handle 2D grayscale image
@@ -1264,17 +1602,8 @@ class CoordinateStitcher(QThread, QObject):
         if self.apply_flatfield:
             tile = self.apply_flatfield_correction(tile, channel_idx)
 
-        if self.use_registration:
-            if self.scan_pattern == 'S-Pattern' and self.row_index % 2 == self.h_shift_rev_odd:
-                h_shift = self.h_shift_rev
-            else:
-                h_shift = self.h_shift
-
-            # Determine crop for tile edges
-            top_crop = max(0, (-self.v_shift[0] // 2) - abs(h_shift[0]) // 2) if self.row_index > 0 else 0 # if y
-            bottom_crop = max(0, (-self.v_shift[0] // 2) - abs(h_shift[0]) // 2) if self.row_index < len(self.y_positions) - 1 else 0
-            left_crop = max(0, (-h_shift[1] // 2) - abs(self.v_shift[1]) // 2) if self.col_index > 0 else 0
-            right_crop = max(0, (-h_shift[1] // 2) - abs(self.v_shift[1]) // 2) if self.col_index < len(self.x_positions) - 1 else 0
+        if self.use_registration and self.registration_method == 'single_pair':
+            top_crop, bottom_crop, left_crop, right_crop = self.get_tile_crop()
 
             # Apply cropping to the tile
             tile = tile[top_crop:tile.shape[0]-bottom_crop, left_crop:tile.shape[1]-right_crop]
@@ -1296,8 +1625,7 @@ class CoordinateStitcher(QThread, QObject):
 
     def apply_flatfield_correction(self, tile, channel_idx):
         if channel_idx in self.flatfields:
-            return (tile / self.flatfields[channel_idx]).clip(min=np.iinfo(self.dtype).min,
-                                                              max=np.iinfo(self.dtype).max).astype(self.dtype)
+            return self.flatfields[channel_idx].apply(tile, self.dtype)
         return tile
 
     def generate_pyramid(self, image, num_levels):
@@ -1545,13 +1873,17 @@ class CoordinateStitcher(QThread, QObject):
         if len(self.regions) > 1:
             self.write_stitched_plate_metadata()
 
-        if self.use_registration:
+        if self.use_registration and self.registration_method == 'single_pair':
             print(f"\nCalculating shifts for region {self.regions[0]}...")
             self.calculate_shifts(self.regions[0])
 
         for region in self.regions:
             wtime = time.time()
 
+            if self.use_registration and self.registration_method == 'global' and region not in self.tile_positions:
+                print(f"\nRegistering tiles of region {region}...")
+                self.register_region(region)
+
             # if self.use_registration:
             #     print(f"\nCalculating shifts for region {region}...")
             #     self.calculate_shifts(region)
@@ -1593,15 +1925,18 @@ class CoordinateStitcher(QThread, QObject):
 
         self.write_fov_plate_metadata(root)
 
-        total_fovs = sum(len(set([k[2] for k in self.stitching_data.keys() if k[1] == region])) for region in self.regions)
+        total_fovs = sum(len(set(k[2] for k in self.region_keys.get(region, []))) for region in self.regions)
         processed_fovs = 0
 
         for region in self.regions:
-            region_data = {k: v for k, v in self.stitching_data.items() if k[1] == region}
+            region_data = self.get_region_data(region)
+            fov_keys = {}
+            for k in region_data:
+                fov_keys.setdefault(k[2], []).append(k)
             well_group = self.write_fov_well_metadata(root, region)
 
             for fov_idx in range(self.num_fovs_per_region):
-                fov_data = {k: v for k, v in region_data.items() if k[2] == fov_idx}
+                fov_data = {k: region_data[k] for k in fov_keys.get(fov_idx, [])}
                 
                 if not fov_data:
                     continue  # Skip if no data for this FOV index
@@ -1635,9 +1970,8 @@ class CoordinateStitcher(QThread, QObject):
         # Initialize a 5D array to hold all the data for this FOV
         tcz_fov = np.zeros((self.num_t, self.num_c, self.num_z, self.input_height, self.input_width), dtype=self.dtype)
 
-        for key, scan_info in fov_data.items():
+        for key, image in self.tile_loader.iter_tiles((key, scan_info['filepath']) for key, scan_info in fov_data.items()):
             t, _, _, z_level, channel = key
-            image = dask_imread(scan_info['filepath'])[0]
             
             if self.apply_flatfield:
                 channel_idx = self.mono_channel_names.index(channel)
@@ -0,0 +1,127 @@
+import numpy as np
+
+
+def downsample_2x(band):
+    # mean of 2x2 blocks over the last two axes, an odd last row/column is dropped (as da.coarsen with trim_excess)
+    h = band.shape[-2] // 2 * 2
+    w = band.shape[-1] // 2 * 2
+    band = band[..., :h, :w].astype(np.float32)
+    return (band[..., 0::2, 0::2] + band[..., 1::2, 0::2] + band[..., 0::2, 1::2] + band[..., 1::2, 1::2]) / 4
+
+
+def cast_to_dtype(band, dtype):
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.clip(np.round(band), info.min, info.max).astype(dtype)
+    return band.astype(dtype)
+
+
+def build_pyramid(arrays, index, chunk_height):
+    # fills levels 1.. of the plane at index (t, c, z) from the level below, reading two chunk rows at a time
+    for level in range(1, len(arrays)):
+        source = arrays[level - 1]
+        target = arrays[level]
+        for y in range(0, target.shape[3], chunk_height):
+            rows = min(chunk_height, target.shape[3] - y)
+            band = source[index + (slice(2 * y, 2 * (y + rows)), slice(None))]
+            target[index + (slice(y, y + rows), slice(None))] = cast_to_dtype(downsample_2x(band), target.dtype)[:rows, :target.shape[4]]
+
+
+class StreamingMosaicWriter:
+    """
+    :brief: writes a (t, c, z, y, x) mosaic and its pyramid directly into a
+        zarr group. Each plane is assembled one chunk at a time: the tiles
+        overlapping a band of chunk rows are loaded, and the band is filled
+        and written block by block along x, so every chunk is written once
+        and only the tiles crossing the current band, one chunk and the
+        chunks not yet downsampled are held in memory. A chunk of a pyramid
+        level is built from the 2x2 chunks of the level below as soon as
+        they have been written.
+    """
+    def __init__(self, group, shape, dtype, chunks, num_levels, tile_loader):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_height = chunks[3]
+        self.chunk_width = chunks[4]
+        self.num_levels = max(1, num_levels)
+        self.tile_loader = tile_loader
+        self.arrays = []
+        height, width = self.shape[3], self.shape[4]
+        for level in range(self.num_levels):
+            self.arrays.append(group.zeros(str(level), shape=self.shape[:3] + (height, width), chunks=chunks, dtype=self.dtype, overwrite=True))
+            height, width = height // 2, width // 2
+
+    def _cast(self, band):
+        return cast_to_dtype(band, self.dtype)
+
+    def write_planes(self, t, z, channels, placements, prepare_tile):
+        # placements: list of (y, x, height, width, filepath, info) - tiles later in the list are drawn on top
+        # prepare_tile(tile, info) returns the (len(channels), height, width) array to place
+        mosaic_height, mosaic_width = self.shape[3], self.shape[4]
+        order = sorted(range(len(placements)), key=lambda i: placements[i][0])
+        tiles = self.tile_loader.iter_tiles((i, placements[i][4]) for i in order)
+        next_tile = 0
+        cached = {}
+        # per level, the blocks of the current band (partial) and the bands (pending) of each pair of chunk columns not yet downsampled
+        self.partial = [{} for level in range(self.num_levels)]
+        self.pending = [{} for level in range(self.num_levels)]
+
+        for y0 in range(0, mosaic_height, self.chunk_height):
+            y1 = min(y0 + self.chunk_height, mosaic_height)
+            # load the tiles that start above the end of the band, drop the ones that end above it
+            while next_tile < len(order) and placements[order[next_tile]][0] < y1:
+                i, tile = next(tiles)
+                cached[i] = prepare_tile(tile, placements[i][5])
+                next_tile += 1
+            for i in [i for i in cached if placements[i][0] + placements[i][2] <= y0]:
+                del cached[i]
+
+            for x0 in range(0, mosaic_width, self.chunk_width):
+                x1 = min(x0 + self.chunk_width, mosaic_width)
+                block = np.zeros((len(channels), y1 - y0, x1 - x0), dtype=self.dtype)
+                for i in sorted(cached):
+                    y, x, height, width = placements[i][:4]
+                    top = max(y0, y)
+                    bottom = min(y1, y + height)
+                    left = max(x0, x)
+                    right = min(x1, x + width)
+                    if bottom <= top or right <= left:
+                        continue
+                    block[:, top - y0:bottom - y0, left - x0:right - x0] = cached[i][:, top - y:bottom - y, left - x:right - x]
+                self._write_block(0, t, z, channels, y0, x0, block)
+
+        # remaining rows of the pyramid levels
+        for level in range(self.num_levels - 1):
+            for xs in sorted(self.pending[level]):
+                y_start, bands = self.pending[level].pop(xs)
+                self._downsample_to_next_level(level, t, z, channels, y_start, xs, bands)
+
+    def _write_block(self, level, t, z, channels, y0, x0, block):
+        array = self.arrays[level]
+        rows = min(block.shape[1], array.shape[3] - y0)
+        columns = min(block.shape[2], array.shape[4] - x0)
+        if rows <= 0 or columns <= 0:
+            return
+        block = block[:, :rows, :columns]
+        for i, c in enumerate(channels):
+            array[t, c, z, y0:y0 + rows, x0:x0 + columns] = block[i]
+
+        if level + 1 < self.num_levels:
+            # a chunk of the next level is built from two chunk columns and two chunk rows of this level
+            xs = x0 // (2 * self.chunk_width) * (2 * self.chunk_width)
+            blocks = self.partial[level].setdefault(xs, [])
+            blocks.append(block)
+            if sum(b.shape[2] for b in blocks) < min(2 * self.chunk_width, array.shape[4] - xs):
+                return
+            del self.partial[level][xs]
+            y_start, bands = self.pending[level].setdefault(xs, (y0, []))
+            bands.append(np.concatenate(blocks, axis=2))
+            if sum(b.shape[1] for b in bands) >= 2 * self.chunk_height:
+                del self.pending[level][xs]
+                self._downsample_to_next_level(level, t, z, channels, y_start, xs, bands)
+
+    def _downsample_to_next_level(self, level, t, z, channels, y0, x0, bands):
+        band = np.concatenate(bands, axis=1)
+        if band.shape[1] >= 2 and band.shape[2] >= 2:
+            self._write_block(level + 1, t, z, channels, y0 // 2, x0 // 2, self._cast(downsample_2x(band)))
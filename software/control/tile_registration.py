@@ -0,0 +1,190 @@
+import numpy as np
+import scipy.fft
+import scipy.sparse
+import scipy.sparse.linalg
+from concurrent.futures import ThreadPoolExecutor
+
+from control._def import *
+
+
+def _overlap_slices(n, d):
+    # slices of a and b that overlap when a(p) = b(p - d)
+    return slice(max(0, d), n + min(0, d)), slice(max(0, -d), n - max(0, d))
+
+
+class TileRegistration:
+    """
+    :brief: global registration of a set of overlapping tiles. The offset of
+        every pair of neighbouring tiles is measured by phase correlation of
+        their downsampled overlap strips (in parallel) and scored by the
+        normalized cross-correlation of the registered strips. The tile
+        positions are then solved in one weighted least-squares problem, in
+        which the nominal (stage) offsets act as weak priors so that pairs
+        without a reliable measurement still have a position, and measured
+        offsets that disagree with the solution are discarded. Every tile is
+        also weakly tied to its nominal position, which keeps tiles without
+        any overlapping neighbour (and groups of tiles not connected to the
+        others) where the stage put them and the problem well posed.
+        Positions are (y, x) in pixels.
+    """
+    def __init__(self, tile_shape, downsample=STITCHING_REGISTRATION_DOWNSAMPLE, max_shift_px=STITCHING_REGISTRATION_MAX_SHIFT_PX,
+                 min_score=STITCHING_REGISTRATION_MIN_SCORE, max_residual_px=STITCHING_REGISTRATION_MAX_RESIDUAL_PX, n_threads=STITCHING_LOADER_THREADS):
+        self.tile_height, self.tile_width = tile_shape[:2]
+        self.downsample = max(1, int(downsample))
+        self.max_shift_px = max_shift_px
+        self.min_score = min_score
+        self.max_residual_px = max_residual_px
+        self.n_threads = max(1, n_threads)
+        self.prior_weight = 0.01
+        self.position_prior_weight = 1e-4
+        self.min_overlap_px = 8 * self.downsample
+        self.measurements = []
+
+    def find_pairs(self, nominal_positions):
+        # (a, b, nominal offset of b relative to a) for b to the right of or below a with an overlapping strip
+        ids = list(nominal_positions)
+        positions = np.array([nominal_positions[tile_id] for tile_id in ids], dtype=float).reshape(-1, 2)
+        pairs = []
+        for i, tile_id in enumerate(ids):
+            d = positions - positions[i]
+            right = (d[:, 1] > 0) & (d[:, 1] <= self.tile_width - self.min_overlap_px) & (np.abs(d[:, 0]) < self.tile_height / 2)
+            below = (d[:, 0] > 0) & (d[:, 0] <= self.tile_height - self.min_overlap_px) & (np.abs(d[:, 1]) < self.tile_width / 2)
+            for j in np.flatnonzero(right | below):
+                pairs.append((tile_id, ids[j], (int(round(d[j, 0])), int(round(d[j, 1])))))
+        return pairs
+
+    def _overlap_regions(self, offset):
+        # regions of a and b that image the same area when b is at offset relative to a
+        oy, ox = offset
+        region_a = (slice(max(0, oy), min(self.tile_height, self.tile_height + oy)), slice(max(0, ox), min(self.tile_width, self.tile_width + ox)))
+        region_b = (slice(max(0, -oy), min(self.tile_height, self.tile_height - oy)), slice(max(0, -ox), min(self.tile_width, self.tile_width - ox)))
+        return region_a, region_b
+
+    def _strip(self, tile, region):
+        strip = np.asarray(tile[region])
+        if strip.ndim == 3:
+            strip = strip.mean(axis=2)
+        ds = self.downsample
+        if ds > 1:
+            h = strip.shape[0] // ds * ds
+            w = strip.shape[1] // ds * ds
+            strip = strip[:h, :w].reshape(h // ds, ds, w // ds, ds).mean(axis=(1, 3))
+        return strip.astype(np.float32)
+
+    def register_pair(self, strip_a, strip_b):
+        # correction (dy, dx) in pixels to the nominal offset and its score
+        h, w = strip_a.shape
+        if h < 4 or w < 4:
+            return (0, 0), 0
+        window = np.outer(np.hanning(h), np.hanning(w)).astype(np.float32)
+        spectrum = scipy.fft.rfft2((strip_a - strip_a.mean()) * window) * np.conj(scipy.fft.rfft2((strip_b - strip_b.mean()) * window))
+        spectrum /= np.maximum(np.abs(spectrum), 1e-12)
+        correlation = scipy.fft.irfft2(spectrum, s=(h, w))
+
+        # only shifts within max_shift_px (and well within the strip) are considered
+        shifts_y = np.fft.fftfreq(h) * h
+        shifts_x = np.fft.fftfreq(w) * w
+        max_shift_y = min(self.max_shift_px / self.downsample, h // 4)
+        max_shift_x = min(self.max_shift_px / self.downsample, w // 4)
+        allowed = (np.abs(shifts_y)[:, None] <= max_shift_y) & (np.abs(shifts_x)[None, :] <= max_shift_x)
+        correlation = np.where(allowed, correlation, -np.inf)
+        py, px = np.unravel_index(np.argmax(correlation), correlation.shape)
+
+        # subpixel peak
+        def refine(c_minus, c_0, c_plus):
+            denom = c_minus - 2 * c_0 + c_plus
+            if not np.isfinite(denom) or denom >= 0:
+                return 0
+            return 0.5 * (c_minus - c_plus) / denom
+        sy = shifts_y[py] + refine(correlation[(py - 1) % h, px], correlation[py, px], correlation[(py + 1) % h, px])
+        sx = shifts_x[px] + refine(correlation[py, (px - 1) % w], correlation[py, px], correlation[py, (px + 1) % w])
+
+        # normalized cross-correlation of the registered strips
+        rows_a, rows_b = _overlap_slices(h, int(shifts_y[py]))
+        cols_a, cols_b = _overlap_slices(w, int(shifts_x[px]))
+        a = strip_a[rows_a, cols_a].ravel()
+        b = strip_b[rows_b, cols_b].ravel()
+        if a.size < 16 or a.std() == 0 or b.std() == 0:
+            score = 0
+        else:
+            score = float(np.corrcoef(a, b)[0, 1])
+        return (sy * self.downsample, sx * self.downsample), score
+
+    def solve(self, nominal_positions, pairs, measurements):
+        # measurements: {(a, b): ((dy, dx) measured offset of b relative to a, score)}
+        ids = list(nominal_positions)
+        index = {tile_id: i for i, tile_id in enumerate(ids)}
+        active = {pair: True for pair, (offset, score) in measurements.items() if score >= self.min_score}
+
+        while True:
+            rows, columns, values, rhs, weights = [], [], [], [], []
+            def add_equation(a, b, offset, weight):
+                # p_b - p_a = offset
+                n = len(weights)
+                rows.extend([n, n])
+                columns.extend([index[b], index[a]])
+                values.extend([1.0, -1.0])
+                rhs.append(offset)
+                weights.append(weight)
+            for a, b, nominal_offset in pairs:
+                add_equation(a, b, nominal_offset, self.prior_weight)
+            for (a, b), is_active in active.items():
+                if is_active:
+                    offset, score = measurements[(a, b)]
+                    add_equation(a, b, offset, score)
+            # p = nominal position, much weaker than the offsets, so that every connected group of tiles is anchored
+            for tile_id in ids:
+                rows.append(len(weights))
+                columns.append(index[tile_id])
+                values.append(1.0)
+                rhs.append(nominal_positions[tile_id])
+                weights.append(self.position_prior_weight)
+
+            sqrt_weights = np.sqrt(np.array(weights))
+            A = scipy.sparse.csr_matrix((np.array(values) * sqrt_weights[np.array(rows)], (rows, columns)), shape=(len(weights), len(ids)))
+            b = np.array(rhs, dtype=float) * sqrt_weights[:, None]
+            AtA = (A.T @ A).tocsc()
+            positions = np.stack([scipy.sparse.linalg.spsolve(AtA, A.T @ b[:, axis]) for axis in range(2)], axis=-1).reshape(-1, 2)
+
+            # drop the measurement that disagrees most with the solution, if any is beyond max_residual_px
+            worst, worst_residual = None, self.max_residual_px
+            for (a, b), is_active in active.items():
+                if is_active:
+                    residual = np.hypot(*(positions[index[b]] - positions[index[a]] - np.array(measurements[(a, b)][0])))
+                    if residual > worst_residual:
+                        worst, worst_residual = (a, b), residual
+            if worst is None:
+                break
+            print(f"registration: discarding the offset between tiles {worst[0]} and {worst[1]} (residual {worst_residual:.1f} px)")
+            active[worst] = False
+
+        positions = np.round(positions - positions.min(axis=0)).astype(int)
+        return {tile_id: (int(positions[i, 0]), int(positions[i, 1])) for i, tile_id in enumerate(ids)}
+
+    def register(self, nominal_positions, tiles):
+        # tiles: iterable of (tile id, tile) of the registration channel, tiles that are missing keep their nominal offsets
+        pairs = self.find_pairs(nominal_positions)
+        regions = {}
+        for a, b, offset in pairs:
+            region_a, region_b = self._overlap_regions(offset)
+            regions.setdefault(a, []).append(((a, b), 0, region_a))
+            regions.setdefault(b, []).append(((a, b), 1, region_b))
+
+        # only the downsampled overlap strips are kept in memory
+        strips = {}
+        for tile_id, tile in tiles:
+            for pair, side, region in regions.get(tile_id, []):
+                strips.setdefault(pair, [None, None])[side] = self._strip(tile, region)
+
+        pairs_to_register = [(a, b, offset) for a, b, offset in pairs if (a, b) in strips and None not in strips[(a, b)]]
+        def measure(pair):
+            a, b, offset = pair
+            (dy, dx), score = self.register_pair(*strips[(a, b)])
+            return (a, b), ((offset[0] + dy, offset[1] + dx), score)
+        with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            measurements = dict(pool.map(measure, pairs_to_register))
+
+        self.measurements = measurements
+        n_reliable = sum(1 for offset, score in measurements.values() if score >= self.min_score)
+        print(f"registration: {len(pairs)} overlapping pairs, {len(measurements)} measured, {n_reliable} above the score threshold")
+        return self.solve(nominal_positions, pairs, measurements)
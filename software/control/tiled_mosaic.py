@@ -0,0 +1,167 @@
+import numpy as np
+
+from control._def import *
+
+
+def _downsample_2x(block):
+    # mean of 2x2 blocks over the first two axes (the sizes are even)
+    block = block.astype(np.float32)
+    return (block[0::2, 0::2] + block[1::2, 0::2] + block[0::2, 1::2] + block[1::2, 1::2]) / 4
+
+
+class TiledMosaicLevel(object):
+    """
+    :brief: array-like view of one resolution level of a TiledMosaic, as
+        napari expects the levels of a multiscale image. Only the requested
+        region is assembled from the allocated tiles, regions without tiles
+        read as zeros.
+    """
+    def __init__(self,mosaic,level):
+        self.mosaic = mosaic
+        self.level = level
+
+    @property
+    def window(self):
+        # (y0, x0, height, width) of the view in pixels of this level
+        y0, x0, height, width = self.mosaic.window
+        f = 2**self.level
+        top, left = y0 // f, x0 // f
+        return top, left, -(-(y0 + height) // f) - top, -(-(x0 + width) // f) - left
+
+    @property
+    def shape(self):
+        top, left, height, width = self.window
+        return (height, width) + self.mosaic.channel_shape
+
+    @property
+    def dtype(self):
+        return self.mosaic.dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _axis(self,key,n):
+        # (start, stop, step, is_index) of an index or slice along an axis of length n
+        if isinstance(key,slice):
+            start, stop, step = key.indices(n)
+            return start, max(start,stop), step, False
+        key = int(key)
+        if key < 0:
+            key = key + n
+        return key, key + 1, 1, True
+
+    def __getitem__(self,key):
+        if not isinstance(key,tuple):
+            key = (key,)
+        key = key + (slice(None),)*(2 - len(key[:2]))
+        top, left, height, width = self.window
+        y_start, y_stop, y_step, y_index = self._axis(key[0],height)
+        x_start, x_stop, x_step, x_index = self._axis(key[1],width)
+        region = self.mosaic.read(self.level,top + y_start,left + x_start,y_stop - y_start,x_stop - x_start)
+        region = region[::y_step,::x_step]
+        if y_index and x_index:
+            region = region[0,0]
+        elif y_index:
+            region = region[0]
+        elif x_index:
+            region = region[:,0]
+        if len(key) > 2:
+            region = region[(Ellipsis,) + key[2:]]
+        return region
+
+    def __array__(self,dtype=None,copy=None):
+        region = self[:,:]
+        return region if dtype is None else region.astype(dtype)
+
+
+class TiledMosaic(object):
+    """
+    :brief: sparse, multi-resolution mosaic for live display. Pixels are
+        stored in fixed-size tiles that are allocated when an image first
+        covers them, in unbounded coordinates (negative ones included), so
+        the mosaic can grow in any direction without moving data. Each write
+        also updates the region it covers in the lower resolution levels, so
+        the cost of adding an image does not depend on the size of the
+        mosaic. The displayed extent is a window set with set_window, and
+        the levels are exposed as TiledMosaicLevel arrays.
+    """
+    def __init__(self,dtype,rgb=False,tile_size=MOSAIC_TILE_SIZE,num_levels=MOSAIC_PYRAMID_LEVELS):
+        self.dtype = np.dtype(dtype)
+        self.channel_shape = (3,) if rgb else ()
+        self.tile_size = tile_size
+        self.num_levels = max(1,num_levels)
+        self.tiles = [{} for level in range(self.num_levels)] # level -> {(tile row, tile col): array}
+        self.window = (0,0,0,0) # (y0, x0, height, width) at level 0
+        self.levels = [TiledMosaicLevel(self,level) for level in range(self.num_levels)]
+
+    def set_window(self,y0,x0,height,width):
+        self.window = (int(y0),int(x0),int(height),int(width))
+
+    def multiscale_data(self,min_size=256):
+        # levels for napari, down to the first one smaller than min_size
+        levels = [self.levels[0]]
+        for level in self.levels[1:]:
+            if max(levels[-1].shape[:2]) <= min_size:
+                break
+            levels.append(level)
+        return levels
+
+    def _tile_ranges(self,start,length):
+        # (tile index, offset in tile, offset in region, length) of the tiles covering [start, start + length)
+        ranges = []
+        position = start
+        while position < start + length:
+            index = position // self.tile_size
+            offset = position - index*self.tile_size
+            n = min(self.tile_size - offset,start + length - position)
+            ranges.append((index,offset,position - start,n))
+            position = position + n
+        return ranges
+
+    def read(self,level,y,x,height,width):
+        region = np.zeros((height,width) + self.channel_shape,dtype=self.dtype)
+        tiles = self.tiles[level]
+        for row, tile_y, region_y, h in self._tile_ranges(y,height):
+            for col, tile_x, region_x, w in self._tile_ranges(x,width):
+                tile = tiles.get((row,col))
+                if tile is not None:
+                    region[region_y:region_y+h,region_x:region_x+w] = tile[tile_y:tile_y+h,tile_x:tile_x+w]
+        return region
+
+    def _write_level(self,level,image,y,x):
+        tiles = self.tiles[level]
+        for row, tile_y, image_y, h in self._tile_ranges(y,image.shape[0]):
+            for col, tile_x, image_x, w in self._tile_ranges(x,image.shape[1]):
+                block = image[image_y:image_y+h,image_x:image_x+w]
+                tile = tiles.get((row,col))
+                if tile is None:
+                    if not block.any():
+                        continue
+                    tile = np.zeros((self.tile_size,self.tile_size) + self.channel_shape,dtype=self.dtype)
+                    tiles[(row,col)] = tile
+                tile[tile_y:tile_y+h,tile_x:tile_x+w] = block
+
+    def write(self,image,y,x):
+        # image at (y, x) in level 0 pixels, then the covered region of every lower level
+        self._write_level(0,np.asarray(image,dtype=self.dtype),y,x)
+        top, left, bottom, right = y, x, y + image.shape[0], x + image.shape[1]
+        for level in range(1,self.num_levels):
+            # region of the level above aligned to 2x2 blocks
+            top, left = top - top % 2, left - left % 2
+            bottom, right = bottom + bottom % 2, right + right % 2
+            block = _downsample_2x(self.read(level-1,top,left,bottom-top,right-left))
+            if np.issubdtype(self.dtype,np.integer):
+                block = np.round(block)
+            self._write_level(level,block.astype(self.dtype),top//2,left//2)
+            top, left, bottom, right = top//2, left//2, bottom//2, right//2
+
+    def clear(self):
+        self.tiles = [{} for level in range(self.num_levels)]
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from control._def import *
+
+
+class _NullSpan(object):
+    # what span() returns while tracing is off, shared so that a disabled span costs one call
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    def __init__(self,tracer,name,category,args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.tracer.record(self.name,self.category,self.start_ns,time.perf_counter_ns(),self.args)
+        return False
+
+
+class Tracer(object):
+    """
+    :brief: records timing spans (name, category, start, end, thread) while
+        started. Spans are used as context managers, with tracer.span(name)
+        returning a shared no-op object when the tracer is stopped. The spans
+        are exported as a Chrome trace (chrome://tracing, ui.perfetto.dev)
+        and summarized per name (count, total, mean, median, p95, max).
+    """
+    def __init__(self,max_events=TRACING_MAX_EVENTS):
+        self.enabled = False
+        self.max_events = max_events
+        self.events = [] # (name, category, start_ns, end_ns, thread id, args)
+        self.thread_names = {}
+        self.dropped_events = 0
+        self.t0_ns = time.perf_counter_ns()
+
+    def start(self):
+        self.clear()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def clear(self):
+        self.events = []
+        self.thread_names = {}
+        self.dropped_events = 0
+        self.t0_ns = time.perf_counter_ns()
+
+    def span(self,name,category='acquisition',**args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self,name,category,args)
+
+    def record(self,name,category,start_ns,end_ns,args=None):
+        if not self.enabled:
+            return
+        if len(self.events) >= self.max_events:
+            self.dropped_events = self.dropped_events + 1
+            return
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        # list.append is atomic, spans can be recorded from any thread
+        self.events.append((name,category,start_ns,end_ns,tid,args))
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}} for tid, name in list(self.thread_names.items())]
+        for name, category, start_ns, end_ns, tid, args in list(self.events):
+            event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': (start_ns - self.t0_ns)/1000, 'dur': (end_ns - start_ns)/1000}
+            if args:
+                event['args'] = {key: str(value) for key, value in args.items()}
+            trace_events.append(event)
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def summary(self,unit='fov'):
+        # per span name statistics in ms, with the mean time per span of name unit (e.g. per FOV) when there are some
+        # spans of other categories than acquisition are listed as category/name
+        durations = {}
+        for name, category, start_ns, end_ns, tid, args in list(self.events):
+            key = name if category == 'acquisition' else category + '/' + name
+            durations.setdefault(key,[]).append((end_ns - start_ns)/1e6)
+        n_units = len(durations.get(unit,[]))
+        spans = {}
+        for name, values in durations.items():
+            values = np.array(values)
+            spans[name] = {'count': len(values), 'total_s': float(values.sum()/1000), 'mean_ms': float(values.mean()),
+                           'median_ms': float(np.median(values)), 'p95_ms': float(np.percentile(values,95)), 'max_ms': float(values.max())}
+            if n_units > 0:
+                spans[name]['per_' + unit + '_ms'] = float(values.sum()/n_units)
+        duration_s = (max(event[3] for event in self.events) - min(event[2] for event in self.events))/1e9 if len(self.events) > 0 else 0
+        return {'duration_s': duration_s, 'n_' + unit + 's': n_units, 'n_events': len(self.events), 'dropped_events': self.dropped_events, 'spans': spans}
+
+    def write(self,folder,trace_filename='trace.json',summary_filename='timing_summary.json'):
+        try:
+            with open(os.path.join(folder,trace_filename),'w') as f:
+                json.dump(self.chrome_trace(),f)
+            with open(os.path.join(folder,summary_filename),'w') as f:
+                json.dump(self.summary(),f,indent=2)
+        except Exception as e:
+            print('tracing: could not write the trace to ' + str(folder) + ': ' + str(e))
+            return
+        print('tracing: ' + str(len(self.events)) + ' spans written to ' + os.path.join(folder,trace_filename))
+
+
+# shared by the controllers and workers
+tracer = Tracer()
+span = tracer.span
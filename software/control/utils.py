@@ -3,6 +3,7 @@ from numpy import std, square, mean
 import numpy as np
 from scipy.ndimage import label
 import os
+import control.focus_measure as focus_measure
 
 def crop_image(image,crop_width,crop_height):
     image_height = image.shape[0]
@@ -14,20 +15,11 @@ def crop_image(image,crop_width,crop_height):
     image_cropped = image[roi_top:roi_bottom,roi_left:roi_right]
     return image_cropped
 
-def calculate_focus_measure(image,method='LAPE'):
-    if len(image.shape) == 3:
-        image = cv2.cvtColor(image,cv2.COLOR_RGB2GRAY) # optional
-    if method == 'LAPE':
-        if image.dtype == np.uint16:
-            lap = cv2.Laplacian(image,cv2.CV_32F)
-        else:
-            lap = cv2.Laplacian(image,cv2.CV_16S)
-        focus_measure = mean(square(lap))
-    elif method == 'GLVA':
-        focus_measure = np.std(image,axis=None)# GLVA
-    else:
-        focus_measure = np.std(image,axis=None)# GLVA
-    return focus_measure
+def calculate_focus_measure(image,method='LAPE',downsample=1,roi_grid=None,roi_reduce='mean'):
+    # see control/focus_measure.py for the operators, unknown methods fall back to GLVA
+    if method not in focus_measure.OPERATORS:
+        method = 'GLVA'
+    return focus_measure.focus_measure(image,method,downsample,roi_grid,roi_reduce)
 
 def unsigned_to_signed(unsigned_array,N):
     signed = 0
@@ -36,8 +28,9 @@ def unsigned_to_signed(unsigned_array,N):
     signed = signed - (256**N)/2
     return signed
 
-def rotate_and_flip_image(image,rotate_image_angle,flip_image):
-    ret_image = image.copy()
+def rotate_and_flip_image(image,rotate_image_angle,flip_image,copy=True):
+    # with copy=False the input is returned as is (no allocation) when there is nothing to rotate or flip
+    ret_image = image.copy() if copy else image
     if(rotate_image_angle != 0):
         '''
             # ROTATE_90_CLOCKWISE
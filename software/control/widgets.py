@@ -25,6 +25,7 @@ import numpy as np
 from scipy.spatial import Delaunay
 import shutil
 from control._def import *
+from control.tiled_mosaic import TiledMosaic
 from PIL import Image, ImageDraw, ImageFont
 
 
@@ -608,6 +609,10 @@ class FocusMapWidget(QWidget):
             self.fmap_coord_3.setText(f"Focus Map Point 3: ({x:.3f},{y:.3f},{z:.3f})")
         except IndexError:
             pass
+        n_points = len(self.autofocusController.focus_map_coords)
+        if n_points > 3:
+            x,y,z = self.autofocusController.focus_map_coords[-1]
+            self.fmap_coord_3.setText(f"Focus Map Point {n_points}: ({x:.3f},{y:.3f},{z:.3f})")
 
     def enable_focusmap(self):
         self.disable_all_buttons()
@@ -1346,6 +1351,7 @@ class RecordingWidget(QFrame):
             self.streamHandler.start_recording()
         else:
             self.streamHandler.stop_recording()
+            self.imageSaver.finish_experiment()
             self.lineEdit_experimentID.setEnabled(True)
             self.btn_setSavingDir.setEnabled(True)
 
@@ -1354,6 +1360,7 @@ class RecordingWidget(QFrame):
         self.lineEdit_experimentID.setEnabled(True)
         self.btn_record.setChecked(False)
         self.streamHandler.stop_recording()
+        self.imageSaver.finish_experiment()
         self.btn_setSavingDir.setEnabled(True)
 
 
@@ -1886,6 +1893,22 @@ class AutoFocusWidget(QFrame):
         self.entry_N.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
         self.autofocusController.set_N(10)
 
+        self.dropdown_method = QComboBox()
+        self.dropdown_method.addItem('Sweep', 'sweep')
+        self.dropdown_method.addItem('Coarse to Fine', 'coarse_to_fine')
+        self.dropdown_method.addItem('Golden Section', 'golden_section')
+        self.dropdown_method.addItem('Continuous', 'continuous')
+        self.dropdown_method.setCurrentIndex(max(0,self.dropdown_method.findData(self.autofocusController.af_method)))
+        self.dropdown_method.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+
+        self.dropdown_peak_fit = QComboBox()
+        self.dropdown_peak_fit.addItem('None', 'none')
+        self.dropdown_peak_fit.addItem('Parabolic', 'parabolic')
+        self.dropdown_peak_fit.addItem('Gaussian', 'gaussian')
+        self.dropdown_peak_fit.setCurrentIndex(max(0,self.dropdown_peak_fit.findData(self.autofocusController.peak_fit)))
+        self.dropdown_peak_fit.setToolTip('Sub-step estimate of the peak from the best focus measure and its neighbours')
+        self.dropdown_peak_fit.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
+
         self.btn_autofocus = QPushButton('Autofocus')
         self.btn_autofocus.setDefault(False)
         self.btn_autofocus.setCheckable(True)
@@ -1907,7 +1930,15 @@ class AutoFocusWidget(QFrame):
         grid_line0.addSpacing(20)
         grid_line0.addWidget(self.btn_autolevel)
 
+        grid_line1 = QHBoxLayout()
+        grid_line1.addWidget(QLabel('Method'))
+        grid_line1.addWidget(self.dropdown_method)
+        grid_line1.addSpacing(20)
+        grid_line1.addWidget(QLabel('Peak Fit'))
+        grid_line1.addWidget(self.dropdown_peak_fit)
+
         self.grid.addLayout(grid_line0)
+        self.grid.addLayout(grid_line1)
         self.grid.addWidget(self.btn_autofocus)
         self.setLayout(self.grid)
 
@@ -1916,6 +1947,8 @@ class AutoFocusWidget(QFrame):
         self.btn_autolevel.toggled.connect(self.signal_autoLevelSetting.emit)
         self.entry_delta.valueChanged.connect(self.set_deltaZ)
         self.entry_N.valueChanged.connect(self.autofocusController.set_N)
+        self.dropdown_method.currentIndexChanged.connect(lambda: self.autofocusController.set_af_method(self.dropdown_method.currentData()))
+        self.dropdown_peak_fit.currentIndexChanged.connect(lambda: self.autofocusController.set_peak_fit(self.dropdown_peak_fit.currentData()))
         self.autofocusController.autofocusFinished.connect(self.autofocus_is_finished)
 
     def set_deltaZ(self,value):
@@ -3333,12 +3366,21 @@ class MultiPointWidgetGrid(QFrame):
         self.checkbox_stitchOutput = QCheckBox('Stitch Scans')
         self.checkbox_stitchOutput.setChecked(False)
 
+        self.combobox_output_format = QComboBox()
+        self.combobox_output_format.addItem('Files', 'files')
+        self.combobox_output_format.addItem('OME-Zarr', 'ome_zarr')
+        self.combobox_output_format.setCurrentIndex(max(0,self.combobox_output_format.findData(MULTIPOINT_OUTPUT_FORMAT)))
+        self.combobox_output_format.setToolTip('Write the images as one file each, or into a single OME-Zarr plate')
+
         self.btn_startAcquisition = QPushButton('Start\n Acquisition ')
         self.btn_startAcquisition.setStyleSheet("background-color: #C2C2FF")
         self.btn_startAcquisition.setCheckable(True)
         self.btn_startAcquisition.setChecked(False)
         #self.btn_startAcquisition.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
 
+        self.btn_estimateTime = QPushButton('Estimate Time')
+        self.btn_estimateTime.setToolTip('Predict the duration of the acquisition with the current settings, without moving the stage')
+
         self.progress_label = QLabel('Region -/-')
         self.progress_bar = QProgressBar()
         self.eta_label = QLabel('--:--:--')
@@ -3432,6 +3474,8 @@ class MultiPointWidgetGrid(QFrame):
         options_layout.addWidget(self.checkbox_set_z_range)
         if ENABLE_STITCHER:
             options_layout.addWidget(self.checkbox_stitchOutput)
+        options_layout.addWidget(self.combobox_output_format)
+        options_layout.addWidget(self.btn_estimateTime)
 
         bottom_right = QHBoxLayout()
         bottom_right.addLayout(options_layout)
@@ -3460,6 +3504,7 @@ class MultiPointWidgetGrid(QFrame):
         # Connections
         self.btn_setSavingDir.clicked.connect(self.set_saving_dir)
         self.btn_startAcquisition.clicked.connect(self.toggle_acquisition)
+        self.btn_estimateTime.clicked.connect(self.estimate_acquisition_time)
         self.entry_deltaZ.valueChanged.connect(self.set_deltaZ)
         self.entry_NZ.valueChanged.connect(self.multipointController.set_NZ)
         self.entry_dt.valueChanged.connect(self.multipointController.set_deltat)
@@ -4073,72 +4118,7 @@ class MultiPointWidgetGrid(QFrame):
         if pressed:
             self.setEnabled_all(False)
 
-            scan_size_mm = self.entry_scan_size.value()
-            overlap_percent = self.entry_overlap.value()
-            shape = self.combobox_shape.currentText()
-
-            self.sort_coordinates()
-            if self.use_coordinate_acquisition:
-                if len(self.region_coordinates) == 0:
-                    # Use current location if no regions added
-                    x = self.navigationController.x_pos_mm
-                    y = self.navigationController.y_pos_mm
-                    z = self.navigationController.z_pos_mm
-                    self.region_coordinates['current'] = [x, y, z]
-                    scan_coordinates = self.create_region_coordinates(
-                        self.objectiveStore,
-                        x, y,
-                        scan_size_mm=scan_size_mm,
-                        overlap_percent=overlap_percent,
-                        shape=shape
-                    )
-                    self.region_fov_coordinates_dict['current'] = scan_coordinates
-
-                # Calculate total number of positions for signal emission
-                total_positions = sum(len(coords) for coords in self.region_fov_coordinates_dict.values())
-                Nx = Ny = int(math.sqrt(total_positions))
-                dx_mm = dy_mm = scan_size_mm / (Nx - 1) if Nx > 1 else scan_size_mm
-
-            else:
-                # Use grid-based acquisition
-                if self.scanCoordinates.format == 0 or len(self.region_coordinates) == 0:
-                    x = self.navigationController.x_pos_mm
-                    y = self.navigationController.y_pos_mm
-                    z = self.navigationController.z_pos_mm
-                    self.region_coordinates['current'] = [x, y, z]
-                steps, step_size_mm = self.create_scan_grid(
-                    self.objectiveStore,
-                    scan_size_mm=scan_size_mm,
-                    overlap_percent=overlap_percent,
-                    shape=shape
-                )
-                Nx = Ny = steps
-                dx_mm = dy_mm = step_size_mm
-
-                # Set up multipoint controller
-                self.multipointController.set_NX(Nx)
-                self.multipointController.set_NY(Ny)
-                self.multipointController.set_deltaX(dx_mm)
-                self.multipointController.set_deltaY(dy_mm)
-
-            if self.checkbox_set_z_range.isChecked():
-                # Set Z-range (convert from μm to mm)
-                minZ = self.entry_minZ.value() / 1000  # Convert from μm to mm
-                maxZ = self.entry_maxZ.value() / 1000  # Convert from μm to mm
-                self.multipointController.set_z_range(minZ, maxZ)
-                print("set z-range", (minZ, maxZ))
-            else:
-                z = self.navigationController.z_pos_mm
-                self.multipointController.set_z_range(z, z)
-
-            self.multipointController.set_deltaZ(self.entry_deltaZ.value())
-            self.multipointController.set_NZ(self.entry_NZ.value())
-            self.multipointController.set_deltat(self.entry_dt.value())
-            self.multipointController.set_Nt(self.entry_Nt.value())
-            self.multipointController.set_use_piezo(self.checkbox_usePiezo.isChecked())
-            self.multipointController.set_af_flag(self.checkbox_withAutofocus.isChecked())
-            self.multipointController.set_reflection_af_flag(self.checkbox_withReflectionAutofocus.isChecked())
-            self.multipointController.set_selected_configurations([item.text() for item in self.list_configurations.selectedItems()])
+            Nx, Ny, dx_mm, dy_mm = self.apply_acquisition_settings()
             self.multipointController.start_new_experiment(self.lineEdit_experimentID.text())
 
             # Emit signals
@@ -4147,17 +4127,105 @@ class MultiPointWidgetGrid(QFrame):
                                                dx_mm, dy_mm, self.entry_deltaZ.value())
 
             # Start acquisition
-            if self.use_coordinate_acquisition:
-                self.multipointController.run_acquisition(location_list=self.region_coordinates, coordinate_dict=self.region_fov_coordinates_dict)
-            else:
-                if self.scanCoordinates.format == 0:
-                    self.multipointController.run_acquisition(location_list=list(self.region_coordinates.values())) # glass slide
-                else:
-                    self.multipointController.run_acquisition() # wellplate
+            self.multipointController.run_acquisition(**self.get_acquisition_regions())
         else:
             self.multipointController.request_abort_aquisition()
             self.setEnabled_all(True)
 
+    def apply_acquisition_settings(self):
+        # sets up the multipoint controller from the widget, returns the grid shape (Nx, Ny, dx_mm, dy_mm)
+        scan_size_mm = self.entry_scan_size.value()
+        overlap_percent = self.entry_overlap.value()
+        shape = self.combobox_shape.currentText()
+
+        self.sort_coordinates()
+        if self.use_coordinate_acquisition:
+            if len(self.region_coordinates) == 0:
+                # Use current location if no regions added
+                x = self.navigationController.x_pos_mm
+                y = self.navigationController.y_pos_mm
+                z = self.navigationController.z_pos_mm
+                self.region_coordinates['current'] = [x, y, z]
+                scan_coordinates = self.create_region_coordinates(
+                    self.objectiveStore,
+                    x, y,
+                    scan_size_mm=scan_size_mm,
+                    overlap_percent=overlap_percent,
+                    shape=shape
+                )
+                self.region_fov_coordinates_dict['current'] = scan_coordinates
+
+            # Calculate total number of positions for signal emission
+            total_positions = sum(len(coords) for coords in self.region_fov_coordinates_dict.values())
+            Nx = Ny = int(math.sqrt(total_positions))
+            dx_mm = dy_mm = scan_size_mm / (Nx - 1) if Nx > 1 else scan_size_mm
+
+        else:
+            # Use grid-based acquisition
+            if self.scanCoordinates.format == 0 or len(self.region_coordinates) == 0:
+                x = self.navigationController.x_pos_mm
+                y = self.navigationController.y_pos_mm
+                z = self.navigationController.z_pos_mm
+                self.region_coordinates['current'] = [x, y, z]
+            steps, step_size_mm = self.create_scan_grid(
+                self.objectiveStore,
+                scan_size_mm=scan_size_mm,
+                overlap_percent=overlap_percent,
+                shape=shape
+            )
+            Nx = Ny = steps
+            dx_mm = dy_mm = step_size_mm
+
+            # Set up multipoint controller
+            self.multipointController.set_NX(Nx)
+            self.multipointController.set_NY(Ny)
+            self.multipointController.set_deltaX(dx_mm)
+            self.multipointController.set_deltaY(dy_mm)
+
+        if self.checkbox_set_z_range.isChecked():
+            # Set Z-range (convert from μm to mm)
+            minZ = self.entry_minZ.value() / 1000  # Convert from μm to mm
+            maxZ = self.entry_maxZ.value() / 1000  # Convert from μm to mm
+            self.multipointController.set_z_range(minZ, maxZ)
+            print("set z-range", (minZ, maxZ))
+        else:
+            z = self.navigationController.z_pos_mm
+            self.multipointController.set_z_range(z, z)
+
+        self.multipointController.set_deltaZ(self.entry_deltaZ.value())
+        self.multipointController.set_NZ(self.entry_NZ.value())
+        self.multipointController.set_deltat(self.entry_dt.value())
+        self.multipointController.set_Nt(self.entry_Nt.value())
+        self.multipointController.set_use_piezo(self.checkbox_usePiezo.isChecked())
+        self.multipointController.set_af_flag(self.checkbox_withAutofocus.isChecked())
+        self.multipointController.set_reflection_af_flag(self.checkbox_withReflectionAutofocus.isChecked())
+        self.multipointController.set_output_format(self.combobox_output_format.currentData())
+        self.multipointController.set_selected_configurations([item.text() for item in self.list_configurations.selectedItems()])
+
+        return Nx, Ny, dx_mm, dy_mm
+
+    def get_acquisition_regions(self):
+        # arguments of run_acquisition and estimate_acquisition_time
+        if self.use_coordinate_acquisition:
+            return dict(location_list=self.region_coordinates, coordinate_dict=self.region_fov_coordinates_dict)
+        if self.scanCoordinates.format == 0:
+            return dict(location_list=list(self.region_coordinates.values())) # glass slide
+        return {} # wellplate
+
+    def estimate_acquisition_time(self):
+        if not self.list_configurations.selectedItems():
+            QMessageBox.warning(self, "Warning", "Please select at least one imaging channel")
+            return
+        self.apply_acquisition_settings()
+        estimate = self.multipointController.estimate_acquisition_time(**self.get_acquisition_regions())
+        hours, remainder = divmod(int(estimate['total_time_s']), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        QMessageBox.information(self, "Estimated Acquisition Time",
+                                f"{estimate['n_fovs']} FOVs in {estimate['n_regions']} regions\n"
+                                f"Stage travel per time point: {estimate['travel_time_s']:.1f} s ({estimate['travel_time_unoptimized_s']:.1f} s in the given order)\n"
+                                f"Imaging per time point: {estimate['imaging_time_s']:.1f} s\n"
+                                f"Total: {hours:02d}:{minutes:02d}:{seconds:02d}")
+
     def acquisition_is_finished(self):
         self.signal_acquisition_started.emit(False)
         self.btn_startAcquisition.setChecked(False)
@@ -5320,6 +5388,8 @@ class NapariMosaicDisplayWidget(QWidget):
         self.channels = set()
         self.viewer_extents = []  # [min_y, max_y, min_x, max_x]
         self.top_left_coordinate = None  # [y, x] in mm
+        self.mosaic_origin = None  # [y, x] in mm of pixel (0, 0) of the mosaics
+        self.mosaics = {}  # channel name -> TiledMosaic
         self.mosaic_dtype = None
 
     def customizeViewer(self):
@@ -5448,6 +5518,8 @@ class NapariMosaicDisplayWidget(QWidget):
             self.viewer_extents = [y_mm, y_mm + image.shape[0] * image_pixel_size_mm,
                                    x_mm, x_mm + image.shape[1] * image_pixel_size_mm]
             self.top_left_coordinate = [y_mm, x_mm]
+            self.mosaic_origin = [y_mm, x_mm]
+            self.mosaics = {}
             self.mosaic_dtype = image_dtype
         else:
             # convert image dtype and scale if necessary
@@ -5456,16 +5528,29 @@ class NapariMosaicDisplayWidget(QWidget):
                 scale_factor = image_pixel_size_mm / self.viewer_pixel_size_mm
                 image = cv2.resize(image, (int(image.shape[1] * scale_factor), int(image.shape[0] * scale_factor)), interpolation=cv2.INTER_LINEAR)
 
+        # update extents
+        self.viewer_extents[0] = min(self.viewer_extents[0], y_mm)
+        self.viewer_extents[1] = max(self.viewer_extents[1], y_mm + image.shape[0] * self.viewer_pixel_size_mm)
+        self.viewer_extents[2] = min(self.viewer_extents[2], x_mm)
+        self.viewer_extents[3] = max(self.viewer_extents[3], x_mm + image.shape[1] * self.viewer_pixel_size_mm)
+
+        # store previous top-left coordinate
+        prev_top_left = self.top_left_coordinate.copy() if self.top_left_coordinate else None
+        self.top_left_coordinate = [self.viewer_extents[0], self.viewer_extents[2]]
+
         if channel_name not in self.viewer.layers:
-            # create new layer for channel
+            # create new layer for channel, backed by a tiled multiscale mosaic
             channel_info = CHANNEL_COLORS_MAP.get(self.extractWavelength(channel_name), {'hex': 0xFFFFFF, 'name': 'gray'})
             if channel_info['name'] in AVAILABLE_COLORMAPS:
                 color = AVAILABLE_COLORMAPS[channel_info['name']]
             else:
                 color = self.generateColormap(channel_info)
 
+            mosaic = TiledMosaic(self.mosaic_dtype, rgb=len(image.shape) == 3)
+            mosaic.set_window(*self.getMosaicWindow())
+            self.mosaics[channel_name] = mosaic
             layer = self.viewer.add_image(
-                np.zeros_like(image), name=channel_name, rgb=len(image.shape) == 3, colormap=color,
+                mosaic.multiscale_data(), multiscale=True, name=channel_name, rgb=len(image.shape) == 3, colormap=color,
                 visible=True, blending='additive', scale=(self.viewer_pixel_size_mm * 1000, self.viewer_pixel_size_mm * 1000)
             )
             layer.mouse_double_click_callbacks.append(self.onDoubleClick)
@@ -5474,54 +5559,33 @@ class NapariMosaicDisplayWidget(QWidget):
         # get layer for channel
         layer = self.viewer.layers[channel_name]
 
-        # update extents
-        self.viewer_extents[0] = min(self.viewer_extents[0], y_mm)
-        self.viewer_extents[1] = max(self.viewer_extents[1], y_mm + image.shape[0] * self.viewer_pixel_size_mm)
-        self.viewer_extents[2] = min(self.viewer_extents[2], x_mm)
-        self.viewer_extents[3] = max(self.viewer_extents[3], x_mm + image.shape[1] * self.viewer_pixel_size_mm)
-
-        # store previous top-left coordinate
-        prev_top_left = self.top_left_coordinate.copy() if self.top_left_coordinate else None
-        self.top_left_coordinate = [self.viewer_extents[0], self.viewer_extents[2]]
-
-        # update layer
-        self.updateLayer(layer, image, x_mm, y_mm, k, prev_top_left)
-
         # update contrast limits
         min_val, max_val = self.contrastManager.get_limits(channel_name)
         scaled_min = self.convertValue(min_val, self.contrastManager.acquisition_dtype, self.mosaic_dtype)
         scaled_max = self.convertValue(max_val, self.contrastManager.acquisition_dtype, self.mosaic_dtype)
-        layer.contrast_limits = (scaled_min, scaled_max)
-        layer.refresh()
+        if tuple(layer.contrast_limits) != (scaled_min, scaled_max):
+            layer.contrast_limits = (scaled_min, scaled_max)
 
-    def updateLayer(self, layer, image, x_mm, y_mm, k, prev_top_left):
-        # calculate new mosaic size and position
+        # update layer
+        self.updateLayer(layer, image, x_mm, y_mm, k, prev_top_left)
+
+    def getMosaicWindow(self):
+        # (y, x, height, width) of the displayed extents in mosaic pixels
+        y0 = int(math.floor((self.top_left_coordinate[0] - self.mosaic_origin[0]) / self.viewer_pixel_size_mm))
+        x0 = int(math.floor((self.top_left_coordinate[1] - self.mosaic_origin[1]) / self.viewer_pixel_size_mm))
         mosaic_height = int(math.ceil((self.viewer_extents[1] - self.viewer_extents[0]) / self.viewer_pixel_size_mm))
         mosaic_width = int(math.ceil((self.viewer_extents[3] - self.viewer_extents[2]) / self.viewer_pixel_size_mm))
+        return (y0, x0, mosaic_height, mosaic_width)
 
-        is_rgb = len(image.shape) == 3 and image.shape[2] == 3
-        if layer.data.shape[:2] != (mosaic_height, mosaic_width):
-            # calculate offsets for existing data
-            y_offset = int(math.floor((prev_top_left[0] - self.top_left_coordinate[0]) / self.viewer_pixel_size_mm))
-            x_offset = int(math.floor((prev_top_left[1] - self.top_left_coordinate[1]) / self.viewer_pixel_size_mm))
-
-            for mosaic in self.viewer.layers:
-                if mosaic.name != 'Manual ROI':
-                    if len(mosaic.data.shape) == 3 and mosaic.data.shape[2] == 3:
-                        new_data = np.zeros((mosaic_height, mosaic_width, 3), dtype=mosaic.data.dtype)
-                    else:
-                        new_data = np.zeros((mosaic_height, mosaic_width), dtype=mosaic.data.dtype)
-
-                    # ensure offsets don't exceed bounds
-                    y_end = min(y_offset + mosaic.data.shape[0], new_data.shape[0])
-                    x_end = min(x_offset + mosaic.data.shape[1], new_data.shape[1])
-
-                    # shift existing data
-                    if len(mosaic.data.shape) == 3 and mosaic.data.shape[2] == 3:
-                        new_data[y_offset:y_end, x_offset:x_end, :] = mosaic.data[:y_end-y_offset, :x_end-x_offset, :]
-                    else:
-                        new_data[y_offset:y_end, x_offset:x_end] = mosaic.data[:y_end-y_offset, :x_end-x_offset]
-                    mosaic.data = new_data
+    def updateLayer(self, layer, image, x_mm, y_mm, k, prev_top_left):
+        # the mosaics keep their tiles when the extents grow, only the displayed window moves
+        window = self.getMosaicWindow()
+        mosaic = self.mosaics[layer.name]
+        if any(channel_mosaic.window != window for channel_mosaic in self.mosaics.values()):
+            for name, channel_mosaic in self.mosaics.items():
+                channel_mosaic.set_window(*window)
+                if name in self.viewer.layers:
+                    self.viewer.layers[name].data = channel_mosaic.multiscale_data()
 
             if 'Manual ROI' in self.viewer.layers:
                 self.update_shape_layer_position(prev_top_left, self.top_left_coordinate)
@@ -5529,18 +5593,9 @@ class NapariMosaicDisplayWidget(QWidget):
             self.resetView()
 
         # insert new image
-        y_pos = int(math.floor((y_mm - self.top_left_coordinate[0]) / self.viewer_pixel_size_mm))
-        x_pos = int(math.floor((x_mm - self.top_left_coordinate[1]) / self.viewer_pixel_size_mm))
-
-        # ensure indices are within bounds
-        y_end = min(y_pos + image.shape[0], layer.data.shape[0])
-        x_end = min(x_pos + image.shape[1], layer.data.shape[1])
-
-        # insert image data
-        if is_rgb:
-            layer.data[y_pos:y_end, x_pos:x_end, :] = image[:y_end - y_pos, :x_end - x_pos, :]
-        else:
-            layer.data[y_pos:y_end, x_pos:x_end] = image[:y_end - y_pos, :x_end - x_pos]
+        y_pos = int(math.floor((y_mm - self.mosaic_origin[0]) / self.viewer_pixel_size_mm))
+        x_pos = int(math.floor((x_mm - self.mosaic_origin[1]) / self.viewer_pixel_size_mm))
+        mosaic.write(image, y_pos, x_pos)
         layer.refresh()
 
     def convertImageDtype(self, image, target_dtype):
@@ -5617,6 +5672,8 @@ class NapariMosaicDisplayWidget(QWidget):
         self.viewer.layers.clear()
         self.viewer_extents = None
         self.top_left_coordinate = None
+        self.mosaic_origin = None
+        self.mosaics = {}
         self.dtype = None
         self.channels = set()
         self.dz_um = None
@@ -6243,6 +6300,7 @@ class MultiCameraRecordingWidget(QFrame):
         else:
             for channel in self.channels:
                 self.streamHandler[channel].stop_recording()
+                self.imageSaver[channel].finish_experiment()
             self.lineEdit_experimentID.setEnabled(True)
             self.btn_setSavingDir.setEnabled(True)
 
@@ -6252,6 +6310,7 @@ class MultiCameraRecordingWidget(QFrame):
         self.btn_record.setChecked(False)
         for channel in self.channels:
             self.streamHandler[channel].stop_recording()
+            self.imageSaver[channel].finish_experiment()
         self.btn_setSavingDir.setEnabled(True)
 
 
@@ -0,0 +1,53 @@
+# set QT_API environment variable
+import os
+import argparse
+os.environ["QT_API"] = "pyqt5"
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen") # no window
+import qtpy
+
+import sys
+
+# qt libraries
+from qtpy.QtCore import *
+from qtpy.QtWidgets import *
+
+# app specific libraries
+import control.benchmark as benchmark
+
+parser = argparse.ArgumentParser(description="Headless multipoint acquisition benchmark on the simulated microscope, the results are written as JSON.")
+parser.add_argument("--wells", type=int, default=4, help="Number of wells scanned.")
+parser.add_argument("--fovs", type=int, nargs=2, default=[3,3], metavar=("NX","NY"), help="FOV grid in each well.")
+parser.add_argument("--fov-step-mm", type=float, default=0.8, help="Distance between FOVs.")
+parser.add_argument("--nz", type=int, default=1, help="Number of z planes.")
+parser.add_argument("--dz-um", type=float, default=1.5, help="Distance between z planes.")
+parser.add_argument("--channels", type=int, default=1, help="Number of channels (the first ones of the channel configurations).")
+parser.add_argument("--channel-names", nargs="+", default=None, help="Channels to acquire, instead of --channels.")
+parser.add_argument("--nt", type=int, default=1, help="Number of time points.")
+parser.add_argument("--dt-s", type=float, default=0, help="Time between time points.")
+parser.add_argument("--format", default=None, help="Output format (files or ome_zarr).")
+parser.add_argument("--pipelined", action="store_true", help="Pipelined acquisition.")
+parser.add_argument("--no-timing", action="store_true", help="Instantaneous simulated hardware (no move, exposure and readout times).")
+parser.add_argument("--specimen", action="store_true", help="Render the images from a synthetic specimen at the stage position instead of a fixed frame.")
+parser.add_argument("--image-size", type=int, nargs=2, default=None, metavar=("WIDTH","HEIGHT"), help="Size of the simulated images.")
+parser.add_argument("--base-path", default=None, help="Folder of the acquisition (a temporary folder removed afterwards by default).")
+parser.add_argument("--keep-output", action="store_true", help="Keep the acquired images.")
+parser.add_argument("--timeout-s", type=float, default=3600, help="Abort the acquisition after this time.")
+parser.add_argument("--output", default=None, help="JSON file of the results (stdout by default).")
+parser.add_argument("--trace", default=None, help="Also record the timing spans of the acquisition and write them to this file as a Chrome trace.")
+parser.add_argument("--verbose", action="store_true", help="Show the messages of the acquisition.")
+args = parser.parse_args()
+
+if __name__ == "__main__":
+    app = QApplication([])
+    kwargs = {}
+    if args.format is not None:
+        kwargs['output_format'] = args.format
+    result = benchmark.run_benchmark(quiet=not args.verbose,n_wells=args.wells,fov_nx=args.fovs[0],fov_ny=args.fovs[1],fov_step_mm=args.fov_step_mm,
+                                     NZ=args.nz,dz_um=args.dz_um,n_channels=args.channels,channels=args.channel_names,Nt=args.nt,dt_s=args.dt_s,
+                                     pipelined=args.pipelined,realistic_timing=not args.no_timing,specimen=args.specimen,
+                                     image_width=args.image_size[0] if args.image_size else None,image_height=args.image_size[1] if args.image_size else None,
+                                     base_path=args.base_path,keep_output=args.keep_output,timeout_s=args.timeout_s,trace=args.trace is not None,**kwargs)
+    benchmark.write_result(result,args.output)
+    if args.trace is not None:
+        benchmark.write_trace(args.trace)
+    sys.exit(0 if result['completed'] else 1)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the control package the way the main_*.py scripts do, from the software folder
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
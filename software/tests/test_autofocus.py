@@ -0,0 +1,122 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM','offscreen')
+from qtpy.QtWidgets import QApplication
+
+from control._def import *
+import control.camera as camera
+import control.microcontroller as microcontroller
+from control.microcontroller import applied_velocity_mm
+import control.core as core
+
+FOCUS_UM = 5 # in focus between two sweep positions (dz = 2 um)
+
+
+def defocus_stack(focus_um,n_z=81,dz_um=1,size=256):
+    # the same texture blurred more the further the plane is from focus_um, plane n_z//2 is at z = 0
+    sharp = (np.random.default_rng(0).random((size,size))*255).astype(np.float32)
+    stack = []
+    for k in range(n_z):
+        sigma = 0.25*abs((k - n_z//2)*dz_um - focus_um) + 0.5
+        stack.append(cv2.GaussianBlur(sharp,(0,0),sigma).astype(np.uint8))
+    return np.array(stack)
+
+
+@pytest.fixture
+def autofocusController(tmp_path):
+    app = QApplication.instance() or QApplication([])
+    cam = camera.Camera_Simulation()
+    cam.open()
+    cam.set_software_triggered_acquisition()
+    cam.simulate_timing = False
+    mcu = microcontroller.Microcontroller_Simulation()
+    mcu.simulate_motion_timing = False
+    configurationManager = core.ConfigurationManager(filename=str(tmp_path/'channel_configurations.xml'))
+    liveController = core.LiveController(cam,mcu,configurationManager)
+    liveController.set_microscope_mode(configurationManager.configurations[0])
+    navigationController = core.NavigationController(mcu,core.ObjectiveStore())
+    autofocusController = core.AutoFocusController(cam,navigationController,liveController)
+    autofocusController.set_N(21)
+    autofocusController.set_deltaZ(2)
+    # z of the stage relative to where the autofocus starts
+    mm_per_ustep_Z = navigationController.get_mm_per_ustep_Z()
+    z_start = mcu.z_pos
+    cam.set_defocus_stack(defocus_stack(FOCUS_UM),1,lambda: (mcu.z_pos - z_start)*STAGE_MOVEMENT_SIGN_Z*mm_per_ustep_Z*1000)
+    yield autofocusController
+    mcu.close()
+
+
+@pytest.mark.parametrize('method,peak_fit,tolerance_um',[
+    ('sweep','none',1.01),
+    ('coarse_to_fine','none',1.01),
+    ('golden_section','none',1.01),
+    ('sweep','parabolic',0.5),
+    ('sweep','gaussian',0.5),
+])
+def test_finds_the_focus(autofocusController,method,peak_fit,tolerance_um):
+    autofocusController.set_af_method(method)
+    autofocusController.set_peak_fit(peak_fit)
+    worker = core.AutofocusWorker(autofocusController)
+    worker.run_autofocus()
+    result = autofocusController.last_autofocus_result
+    assert result['method'] == method
+    assert result['z_offset_um'] == pytest.approx(FOCUS_UM,abs=tolerance_um)
+    # the stage has been moved to the focus
+    assert autofocusController.camera.get_z_um() == pytest.approx(result['z_offset_um'],abs=0.01)
+
+
+def test_searches_use_fewer_frames_than_the_sweep(autofocusController):
+    frames = {}
+    for method in ['sweep','coarse_to_fine','golden_section']:
+        autofocusController.set_af_method(method)
+        core.AutofocusWorker(autofocusController).run_autofocus()
+        frames[method] = autofocusController.last_autofocus_result['frames']
+        # start the next search from the same z
+        autofocusController.navigationController.move_z_usteps(-int(round(autofocusController.last_autofocus_result['z_offset_um']/1000/autofocusController.navigationController.get_mm_per_ustep_Z())))
+        autofocusController.navigationController.microcontroller.wait_till_operation_is_completed()
+    assert frames['golden_section'] < frames['sweep']
+
+
+def test_applied_velocity():
+    assert applied_velocity_mm(1.239) == pytest.approx(1.23)
+    assert applied_velocity_mm(0.0537) == pytest.approx(0.05)
+    assert applied_velocity_mm(0.004) == 0
+
+
+def test_velocity_is_recorded_as_applied():
+    mcu = microcontroller.Microcontroller_Simulation()
+    mcu.set_max_velocity_acceleration(AXIS.Z,0.0537,10)
+    assert mcu.max_velocity_acceleration[AXIS.Z] == (pytest.approx(0.05),10)
+    mcu.close()
+
+
+def run_continuous_sweep(autofocusController,deltaZ_um,exposure_time_ms):
+    cam = autofocusController.camera
+    mcu = autofocusController.navigationController.microcontroller
+    cam.simulate_timing = True
+    cam.readout_time_ms = 1
+    cam.set_exposure_time(exposure_time_ms)
+    mcu.simulate_motion_timing = True
+    autofocusController.set_deltaZ(deltaZ_um)
+    autofocusController.set_af_method('continuous')
+    velocity_before = mcu.max_velocity_acceleration[AXIS.Z]
+    core.AutofocusWorker(autofocusController).run_autofocus()
+    # the sweep velocity is only set for the sweep
+    assert mcu.max_velocity_acceleration[AXIS.Z] == velocity_before
+    return autofocusController.last_autofocus_result
+
+
+def test_continuous_sweep(autofocusController):
+    result = run_continuous_sweep(autofocusController,2,5)
+    assert result['frames'] >= 3
+    assert result['z_offset_um'] == pytest.approx(FOCUS_UM,abs=2)
+
+
+def test_continuous_sweep_below_the_minimum_velocity(autofocusController):
+    # 0.2 um per 120 ms frame would be below 0.01 mm/s, which the microcontroller cannot move at
+    result = run_continuous_sweep(autofocusController,0.2,100)
+    assert result['frames'] >= 3
@@ -0,0 +1,91 @@
+import os
+import threading
+
+import pandas as pd
+
+from control.coordinate_log import CoordinateLog
+
+COLUMNS = ['i','j','k','x (mm)','y (mm)','z (um)']
+
+
+def row(n):
+    return {'i':n,'j':0,'k':0,'x (mm)':n*0.1,'y (mm)':0.0,'z (um)':1000.0}
+
+
+def test_rows_are_flushed_every_n_rows(tmp_path):
+    path = str(tmp_path/'coordinates.csv')
+    log = CoordinateLog(path,COLUMNS,flush_every=3,flush_interval_s=1e6)
+    log.append(row(0))
+    log.append(row(1))
+    assert not os.path.exists(path)
+    log.append(row(2))
+    assert len(pd.read_csv(path)) == 3
+    log.append(row(3))
+    assert len(pd.read_csv(path)) == 3
+    log.close()
+    df = pd.read_csv(path)
+    assert list(df.columns) == COLUMNS
+    assert list(df['i']) == [0,1,2,3]
+
+
+def test_rows_are_flushed_after_interval(tmp_path):
+    path = str(tmp_path/'coordinates.csv')
+    log = CoordinateLog(path,COLUMNS,flush_every=1000,flush_interval_s=0)
+    log.append(row(0))
+    assert len(pd.read_csv(path)) == 1
+
+
+def test_missing_columns_are_empty(tmp_path):
+    path = str(tmp_path/'coordinates.csv')
+    log = CoordinateLog(path,COLUMNS)
+    log.append({'i':0,'x (mm)':1.5})
+    log.close()
+    df = pd.read_csv(path)
+    assert df['x (mm)'][0] == 1.5
+    assert pd.isna(df['z (um)'][0])
+    assert pd.isna(log.to_dataframe()['z (um)'][0])
+
+
+def test_close_without_rows_writes_header(tmp_path):
+    path = str(tmp_path/'coordinates.csv')
+    CoordinateLog(path,COLUMNS).close()
+    df = pd.read_csv(path)
+    assert list(df.columns) == COLUMNS
+    assert len(df) == 0
+
+
+def test_existing_log_is_replaced(tmp_path):
+    path = str(tmp_path/'coordinates.csv')
+    log = CoordinateLog(path,COLUMNS)
+    log.append(row(0))
+    log.close()
+    log = CoordinateLog(path,COLUMNS)
+    log.append(row(1))
+    log.close()
+    assert list(pd.read_csv(path)['i']) == [1]
+
+
+def test_to_dataframe_and_column(tmp_path):
+    log = CoordinateLog(str(tmp_path/'coordinates.csv'),COLUMNS)
+    for n in range(5):
+        log.append(row(n))
+    assert len(log) == 5
+    assert log.column('i') == [0,1,2,3,4]
+    df = log.to_dataframe()
+    assert list(df.columns) == COLUMNS
+    assert df['x (mm)'].tolist() == [n*0.1 for n in range(5)]
+
+
+def test_concurrent_appends(tmp_path):
+    path = str(tmp_path/'coordinates.csv')
+    log = CoordinateLog(path,COLUMNS,flush_every=7,flush_interval_s=1e6)
+    def append_rows(offset):
+        for n in range(100):
+            log.append(row(offset + n))
+    threads = [threading.Thread(target=append_rows,args=(100*t,)) for t in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    log.close()
+    assert sorted(pd.read_csv(path)['i']) == list(range(400))
@@ -0,0 +1,117 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import control.flatfield as flatfield
+from control.flatfield import FlatfieldCorrector, FlatfieldSampler, FlatfieldStore
+
+
+def vignetting(shape=(40,60)):
+    yy, xx = np.mgrid[:shape[0],:shape[1]]
+    r2 = ((yy - shape[0]/2)/shape[0])**2 + ((xx - shape[1]/2)/shape[1])**2
+    return (1 - 0.5*r2).astype(np.float32)
+
+
+def test_apply_removes_vignetting():
+    profile = vignetting()
+    image = (1000*profile + 100).astype(np.float32)
+    darkfield = np.full(profile.shape,100,dtype=np.float32)
+    corrected = FlatfieldCorrector(profile,darkfield).apply(image)
+    assert corrected.dtype == np.float32
+    assert np.allclose(corrected,1000,rtol=1e-4)
+
+
+def test_apply_rounds_integer_images():
+    profile = np.full((4,4),1.5,dtype=np.float32)
+    image = np.full((4,4),5,dtype=np.uint16) # 5/1.5 = 3.33
+    assert np.all(FlatfieldCorrector(profile).apply(image) == 3)
+    image = np.full((4,4),4,dtype=np.uint16) # 4/1.5 = 2.67, truncated to 2 without rounding
+    assert np.all(FlatfieldCorrector(profile).apply(image) == 3)
+
+
+def test_apply_clips_to_dtype_range():
+    profile = np.full((4,4),0.5,dtype=np.float32)
+    image = np.full((4,4),200,dtype=np.uint8)
+    darkfield = np.full((4,4),250,dtype=np.float32)
+    assert np.all(FlatfieldCorrector(profile).apply(image) == 255)
+    assert np.all(FlatfieldCorrector(profile,darkfield).apply(image) == 0)
+
+
+def test_apply_leaves_mismatched_image():
+    image = np.ones((8,8),dtype=np.uint16)
+    assert FlatfieldCorrector(vignetting()).apply(image) is image
+
+
+def test_apply_does_not_share_output_buffer():
+    corrector = FlatfieldCorrector(np.ones((4,4),dtype=np.float32))
+    first = corrector.apply(np.full((4,4),1,dtype=np.float32))
+    corrector.apply(np.full((4,4),2,dtype=np.float32))
+    assert np.all(first == 1)
+
+
+def test_resize():
+    corrector = FlatfieldCorrector(vignetting((20,30)),np.zeros((20,30),dtype=np.float32)).resize((40,60))
+    assert corrector.shape == (40,60)
+    assert corrector.darkfield.shape == (40,60)
+
+
+def test_store_round_trip(tmp_path):
+    store = FlatfieldStore(str(tmp_path))
+    assert store.get('20x','sensor','BF',1) is None
+    store.put('20x','sensor','BF LED matrix full',2,vignetting(),n_images=12)
+
+    reloaded = FlatfieldStore(str(tmp_path))
+    assert reloaded.has('20x','sensor','BF LED matrix full',2)
+    assert not reloaded.has('20x','sensor','BF LED matrix full',1)
+    corrector = reloaded.get('20x','sensor','BF LED matrix full',2)
+    assert np.allclose(corrector.flatfield,vignetting())
+    assert corrector.darkfield is None
+    assert reloaded.index[reloaded.make_key('20x','sensor','BF LED matrix full',2)]['n_images'] == 12
+
+
+def test_store_keeps_profiles_saved_by_another_store(tmp_path):
+    first = FlatfieldStore(str(tmp_path))
+    second = FlatfieldStore(str(tmp_path))
+    first.put('20x','sensor','A',1,vignetting())
+    second.put('20x','sensor','B',1,vignetting())
+    with open(os.path.join(str(tmp_path),'index.json')) as f:
+        index = json.load(f)
+    assert len(index) == 2
+
+
+def test_sampler_keeps_at_most_n_samples():
+    sampler = FlatfieldSampler(n_samples=5,downsample=4)
+    for i in range(20):
+        sampler.add('A',np.full((40,60),i,dtype=np.uint16))
+    assert sampler.n_seen['A'] == 20
+    assert len(sampler.samples['A']) == 5
+    assert sampler.samples['A'][0].shape == (10,15)
+    assert sampler.shapes['A'] == (40,60)
+
+
+def test_sampler_ignores_color_images():
+    sampler = FlatfieldSampler()
+    sampler.add('A',np.zeros((40,60,3),dtype=np.uint8))
+    assert 'A' not in sampler.samples
+
+
+def test_fit_in_background(tmp_path,monkeypatch):
+    monkeypatch.setattr(flatfield,'fit_flatfield',lambda images: (np.asarray(images).mean(axis=0)/np.asarray(images).mean(),None))
+    sampler = FlatfieldSampler(n_samples=flatfield.FLATFIELD_MIN_SAMPLES,downsample=2)
+    for i in range(flatfield.FLATFIELD_MIN_SAMPLES):
+        sampler.add('A',(1000*vignetting()).astype(np.uint16))
+    sampler.add('B',(1000*vignetting()).astype(np.uint16))
+    store = FlatfieldStore(str(tmp_path))
+    thread = sampler.fit_in_background(store,'20x','sensor',1)
+    thread.join()
+    assert store.has('20x','sensor','A',1)
+    assert not store.has('20x','sensor','B',1) # too few images
+    assert store.get('20x','sensor','A',1).shape == (40,60)
+
+
+def test_calibration_defaults():
+    objective, camera, binning = flatfield.calibration_from_acquisition_parameters({'objective':{'name':'10x'},'binning':2})
+    assert objective == '10x'
+    assert binning == 2
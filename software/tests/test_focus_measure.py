@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import pytest
+
+import control.focus_measure as focus_measure
+import control.utils as utils
+
+OPERATORS = list(focus_measure.OPERATORS.keys())
+
+
+def texture(dtype=np.uint8,size=(120,160),seed=0):
+    max_value = 255 if dtype == np.uint8 else 4095
+    image = np.random.default_rng(seed).random(size)*max_value
+    return image.astype(dtype)
+
+
+def blur(image,sigma=3):
+    return cv2.GaussianBlur(image.astype(np.float32),(0,0),sigma).astype(image.dtype)
+
+
+@pytest.mark.parametrize('operator',OPERATORS)
+@pytest.mark.parametrize('dtype',[np.uint8,np.uint16,np.float32])
+def test_sharp_beats_blurred(operator,dtype):
+    image = texture(dtype)
+    assert focus_measure.focus_measure(image,operator) > focus_measure.focus_measure(blur(image),operator)
+
+
+@pytest.mark.parametrize('operator',OPERATORS)
+@pytest.mark.parametrize('dtype',[np.uint8,np.uint16])
+def test_integer_frames_match_float(operator,dtype):
+    # integer frames are not converted to float, the result must be the same
+    image = texture(dtype)
+    assert focus_measure.focus_measure(image,operator) == pytest.approx(focus_measure.focus_measure(image.astype(np.float32),operator),rel=1e-4)
+
+
+def test_no_overflow_on_bright_uint16():
+    image = np.full((64,64),65535,dtype=np.uint16)
+    image[:,::2] = 0
+    dx = image[:,2:].astype(np.float64) - image[:,:-2].astype(np.float64)
+    dy = image[2:,:].astype(np.float64) - image[:-2,:].astype(np.float64)
+    assert focus_measure.focus_measure(image,'BREN') == pytest.approx(np.mean(dx*dx) + np.mean(dy*dy))
+    assert focus_measure.focus_measure(image,'LAPE') == pytest.approx(focus_measure.focus_measure(image.astype(np.float32),'LAPE'),rel=1e-4)
+
+
+def test_other_dtypes_are_converted():
+    image = texture(np.uint16)
+    assert focus_measure.focus_measure(image.astype(np.int32),'TENG') == pytest.approx(focus_measure.focus_measure(image.astype(np.float32),'TENG'),rel=1e-4)
+
+
+@pytest.mark.parametrize('operator',OPERATORS)
+def test_batch_matches_single_frames(operator):
+    images = [texture(np.uint8,seed=seed) for seed in range(3)]
+    expected = [focus_measure.focus_measure(image,operator) for image in images]
+    assert np.allclose(focus_measure.focus_measure_batch(images,operator),expected,rtol=1e-6)
+    assert np.allclose(focus_measure.focus_measure_batch(np.array(images),operator,roi_grid=(2,2)),
+                       [focus_measure.focus_measure(image,operator,roi_grid=(2,2)) for image in images],rtol=1e-6)
+
+
+def test_downsample_uses_every_nth_pixel():
+    image = texture(np.uint16)
+    assert focus_measure.focus_measure(image,'LAPE',downsample=2) == pytest.approx(focus_measure.focus_measure(image[::2,::2],'LAPE'))
+
+
+def test_roi_grid():
+    image = np.zeros((120,160),dtype=np.uint8)
+    image[:60,:80] = texture(np.uint8,size=(60,80))
+    grid = focus_measure.focus_measure_grid(image,'GLVA',roi_grid=(2,2))
+    assert grid.shape == (2,2)
+    assert grid[0,0] > 0 and grid[1,1] == 0
+    assert focus_measure.focus_measure(image,'GLVA',roi_grid=(2,2),roi_reduce='max') == pytest.approx(grid[0,0])
+    assert focus_measure.focus_measure(image,'GLVA',roi_grid=(2,2),roi_reduce='mean') == pytest.approx(grid.mean())
+    assert focus_measure.focus_measure(image,'GLVA',roi_grid=(2,2),roi_reduce='median') == pytest.approx(np.median(grid))
+    assert focus_measure.focus_measure(image,'GLVA',roi_grid=(1,1)) == focus_measure.focus_measure(image,'GLVA')
+
+
+def test_color_frames_are_converted_to_gray():
+    image = np.stack([texture(np.uint8,seed=seed) for seed in range(3)],axis=-1)
+    gray = cv2.cvtColor(image,cv2.COLOR_RGB2GRAY)
+    assert focus_measure.focus_measure(image,'LAPV') == pytest.approx(focus_measure.focus_measure(gray,'LAPV'))
+
+
+def test_unknown_method_falls_back_to_glva():
+    image = texture(np.uint8)
+    assert utils.calculate_focus_measure(image,'unknown') == focus_measure.focus_measure(image,'GLVA')
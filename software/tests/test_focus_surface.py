@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from control.focus_surface import FocusSurface
+
+
+def plane(x,y):
+    return 1.5 + 0.002*x - 0.001*y
+
+
+def bowl(x,y):
+    return 1.5 + 0.0005*(x - 3)**2 + 0.0003*(y + 2)**2 - 0.0002*x*y
+
+
+def grid_points(function,n=5,size_mm=10):
+    return [(x,y,function(x,y)) for x in np.linspace(0,size_mm,n) for y in np.linspace(0,size_mm,n)]
+
+
+def test_plane():
+    surface = FocusSurface(method='plane')
+    surface.set_points([(0,0,plane(0,0)),(10,0,plane(10,0)),(0,10,plane(0,10))])
+    assert surface.fit() == 'plane'
+    assert surface.predict(5,7) == pytest.approx(plane(5,7),abs=1e-9)
+
+
+def test_quadratic():
+    surface = FocusSurface(method='quadratic')
+    surface.set_points(grid_points(bowl,n=4))
+    assert surface.fit() == 'quadratic'
+    x, y = np.meshgrid(np.linspace(1,9,5),np.linspace(1,9,5))
+    assert np.allclose(surface.predict(x,y),bowl(x,y),atol=1e-9)
+
+
+def test_thin_plate_follows_a_smooth_surface():
+    function = lambda x, y: 1.5 + 0.002*np.sin(x/3)*np.cos(y/4)
+    surface = FocusSurface(method='thin_plate',smoothing=0)
+    surface.set_points(grid_points(function,n=7))
+    assert surface.fit() == 'thin_plate'
+    positions = np.array([[2.5,3.5],[6.1,8.2],[9,1]])
+    assert np.allclose(surface.predict_many(positions),function(positions[:,0],positions[:,1]),atol=0.5e-3)
+    assert np.allclose(surface.get_residuals(),0,atol=1e-7)
+
+
+@pytest.mark.parametrize('n,expected',[(4,'plane'),(7,'quadratic'),(16,'thin_plate')])
+def test_auto_method(n,expected):
+    xy = [(0,0),(10,0),(0,10),(10,10),(5,2),(2,7),(8,6)] if n < 16 else [(x,y) for x in range(0,10,3) for y in range(0,10,3)]
+    surface = FocusSurface(method='auto')
+    surface.set_points([(x,y,plane(x,y)) for x, y in xy[:n]])
+    assert surface.fit() == expected
+
+
+def test_outlier_is_rejected():
+    points = grid_points(plane,n=4)
+    points[5] = (points[5][0],points[5][1],points[5][2] + 0.05) # 50 um off
+    surface = FocusSurface(method='plane',outlier_threshold_um=5)
+    surface.set_points(points)
+    surface.fit()
+    assert not surface.inliers[5]
+    assert np.count_nonzero(surface.inliers) == len(points) - 1
+    assert surface.predict(3,3) == pytest.approx(plane(3,3),abs=1e-6)
+
+
+def test_too_few_or_degenerate_points():
+    surface = FocusSurface(method='plane')
+    surface.set_points([(0,0,1),(1,1,1)])
+    with pytest.raises(ValueError):
+        surface.fit()
+    surface.set_points([(0,0,1),(1,1,1),(2,2,1),(3,3,1)])
+    with pytest.raises(ValueError):
+        surface.fit()
+
+
+def test_add_point_refits():
+    surface = FocusSurface(method='plane')
+    surface.set_points([(0,0,1),(10,0,1),(0,10,1)])
+    surface.fit()
+    surface.add_point(10,10,1.004)
+    assert len(surface) == 4
+    assert surface.predict(10,10) > 1
+
+
+def test_load_coordinates_csv_uses_the_first_z_level(tmp_path):
+    path = tmp_path / 'coordinates.csv'
+    pd.DataFrame({'z_level':[0,1,0,1,0,1],'x (mm)':[0,0,10,10,0,0],'y (mm)':[0,0,0,0,10,10],
+                  'z (um)':[1000,1010,1002,1012,999,1009]}).to_csv(path,index=False)
+    surface = FocusSurface(method='plane')
+    surface.load_coordinates_csv(path)
+    assert len(surface) == 3
+    assert surface.predict(0,0) == pytest.approx(1.0)
+
+
+def test_save(tmp_path):
+    surface = FocusSurface(method='plane')
+    surface.set_points(grid_points(plane,n=3))
+    surface.fit()
+    surface.save(tmp_path / 'focus_surface.csv')
+    saved = pd.read_csv(tmp_path / 'focus_surface.csv')
+    assert len(saved) == 9
+    assert saved['inlier'].all()
+    assert np.allclose(saved['z (um)'],[point[2]*1000 for point in surface.points])
@@ -0,0 +1,89 @@
+import random
+
+import numpy as np
+import pytest
+
+from control.scan_planner import StageMotionModel, ScanPathPlanner
+
+
+def motion_model(simultaneous_xy=True):
+    return StageMotionModel(velocity_x_mm=20,acceleration_x_mm=200,velocity_y_mm=20,acceleration_y_mm=200,
+                            settle_time_x_s=0.01,settle_time_y_s=0.01,simultaneous_xy=simultaneous_xy)
+
+
+def grid(nx,ny,step_mm=1):
+    return [(i*step_mm,j*step_mm) for j in range(ny) for i in range(nx)]
+
+
+def test_axis_move_time_profiles():
+    model = motion_model()
+    # the triangular and trapezoidal profiles meet where the max velocity is just reached (v^2/a = 2 mm)
+    assert model.axis_move_time(2,20,200) == pytest.approx(2*np.sqrt(2/200))
+    assert model.axis_move_time(2,20,200) == pytest.approx(2/20 + 20/200)
+    assert model.axis_move_time(10,20,200) == pytest.approx(10/20 + 20/200)
+    assert model.axis_move_time(-10,20,200) == model.axis_move_time(10,20,200)
+
+
+def test_simultaneous_moves_are_faster():
+    assert motion_model(True).move_time(3,4) < motion_model(False).move_time(3,4)
+    assert motion_model(False).move_time(3,4) == pytest.approx(float(motion_model().axis_move_time(3,20,200) + motion_model().axis_move_time(4,20,200)) + 0.02)
+
+
+def test_path_time():
+    model = motion_model()
+    positions = [(0,0),(1,0),(1,1)]
+    assert model.path_time(positions) == pytest.approx(float(model.move_time(1,0) + model.move_time(0,1)))
+    assert model.path_time(positions,order=[2,1,0]) == pytest.approx(model.path_time(positions))
+    assert model.path_time(positions[:1]) == 0
+
+
+def test_none_keeps_the_given_order():
+    positions = grid(4,3)
+    random.Random(0).shuffle(positions)
+    assert ScanPathPlanner(motion_model(),method='none').order(positions) == list(range(len(positions)))
+
+
+def test_serpentine_on_shuffled_grid():
+    positions = grid(5,4)
+    random.Random(1).shuffle(positions)
+    planner = ScanPathPlanner(motion_model(),method='serpentine')
+    order = planner.order(positions,start=(0,0))
+    assert sorted(order) == list(range(len(positions)))
+    # consecutive positions of the serpentine are neighbours on the grid
+    ordered = np.asarray(positions)[order]
+    assert np.all(np.abs(np.diff(ordered,axis=0)).sum(axis=1) == pytest.approx(1))
+    assert tuple(ordered[0]) == (0,0)
+
+
+def test_faster_given_order_is_kept():
+    # already a serpentine from the start position, nothing to gain
+    positions = [(0,0),(1,0),(2,0),(2,1),(1,1),(0,1)]
+    assert ScanPathPlanner(motion_model(),method='serpentine').order(positions,start=(0,0)) == list(range(len(positions)))
+
+
+def test_tsp_is_not_slower_than_serpentine():
+    rng = np.random.default_rng(2)
+    positions = [tuple(p) for p in rng.uniform(0,20,size=(40,2))]
+    model = motion_model()
+    serpentine = ScanPathPlanner(model,method='serpentine').order(positions,start=(0,0))
+    tsp = ScanPathPlanner(model,method='tsp',max_time_s=1).order(positions,start=(0,0))
+    assert sorted(tsp) == list(range(len(positions)))
+    assert model.path_time(positions,tsp,(0,0)) <= model.path_time(positions,serpentine,(0,0)) + 1e-9
+
+
+def test_tsp_falls_back_to_serpentine_for_large_scans():
+    positions = grid(6,6)
+    random.Random(3).shuffle(positions)
+    model = motion_model()
+    planner = ScanPathPlanner(model,method='tsp',max_tsp_positions=10)
+    assert planner.order(positions,start=(0,0)) == ScanPathPlanner(model,method='serpentine').order(positions,start=(0,0))
+
+
+def test_plan_visits_every_fov_once():
+    regions = {'B2': grid(3,3), 'A1': [(x + 20, y) for x, y in grid(2,2)], 'empty': []}
+    planner = ScanPathPlanner(motion_model(),method='serpentine')
+    plan = planner.plan(regions,start=(0,0))
+    assert [region_id for region_id, fov_order in plan] == ['B2','A1']
+    for region_id, fov_order in plan:
+        assert sorted(fov_order) == list(range(len(regions[region_id])))
+    assert planner.plan_time(regions,plan,(0,0)) > 0
@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+import pytest
+
+import control.focus_measure as focus_measure
+from control.simulated_specimen import SimulatedSpecimen
+
+SIZE_PX = 256
+FOV = (96,128)
+
+
+@pytest.fixture(scope='module')
+def specimen():
+    return SimulatedSpecimen(size_px=SIZE_PX,pixel_size_um=1,seed=0)
+
+
+def sharpness(specimen,x_mm,y_mm,z_mm):
+    return focus_measure.focus_measure(specimen.render_specimen(x_mm,y_mm,z_mm,FOV[0],FOV[1],1).astype(np.float32),'TENG')
+
+
+def test_generated_specimen_is_normalized(specimen):
+    assert specimen.image.shape == (SIZE_PX,SIZE_PX)
+    assert specimen.image.dtype == np.uint8
+    assert specimen.image.min() == 0
+    assert specimen.image.max() == 255
+
+
+def test_specimen_repeats(specimen):
+    period_mm = SIZE_PX/1000
+    a = specimen.render_specimen(0.1,0.05,0,FOV[0],FOV[1],1)
+    b = specimen.render_specimen(0.1+period_mm,0.05-period_mm,0,FOV[0],FOV[1],1)
+    assert np.array_equal(a,b)
+
+
+def test_crop_wraps_around(specimen):
+    crop = specimen._crop(0,SIZE_PX-10,SIZE_PX-20,30,40)
+    expected = np.roll(specimen.image,(10,20),axis=(0,1))[:30,:40]
+    assert np.array_equal(crop,expected)
+
+
+def test_sharpest_at_focal_surface(specimen):
+    measures = [sharpness(specimen,0.1,0.1,z_um/1000) for z_um in (0,3,10,25)]
+    assert measures == sorted(measures,reverse=True)
+    # the blur only depends on the distance to the focal surface
+    assert sharpness(specimen,0.1,0.1,-0.01) == pytest.approx(sharpness(specimen,0.1,0.1,0.01))
+
+
+def test_tilted_focal_surface():
+    specimen = SimulatedSpecimen(size_px=SIZE_PX,pixel_size_um=1,seed=0)
+    specimen.set_focal_surface(0.1,10,-5)
+    assert specimen.get_focus_z_mm(0,0) == pytest.approx(0.1)
+    assert specimen.get_focus_z_mm(1,1) == pytest.approx(0.105)
+    assert sharpness(specimen,1,1,0.105) > sharpness(specimen,1,1,0.1)
+
+
+def test_blur_levels_are_blended(specimen):
+    # halfway between two cached levels, the frame is halfway between them
+    step_mm = specimen.blur_level_step_um/1000
+    a = specimen.render_specimen(0,0,step_mm,FOV[0],FOV[1],1)
+    b = specimen.render_specimen(0,0,2*step_mm,FOV[0],FOV[1],1)
+    c = specimen.render_specimen(0,0,1.5*step_mm,FOV[0],FOV[1],1)
+    assert np.allclose(c,(a+b)/2,atol=1e-5)
+
+
+def test_render_resamples_to_camera_pixel_size(specimen):
+    frame = specimen.render_specimen(0,0,0,FOV[0],FOV[1],0.5)
+    assert frame.shape == FOV
+
+
+@pytest.mark.parametrize('pixel_format,dtype',[('MONO8',np.uint8),('MONO12',np.uint16),('MONO16',np.uint16)])
+def test_pixel_formats(specimen,pixel_format,dtype):
+    frame = specimen.render(0,0,0,FOV[0],FOV[1],1,channel='Fluorescence 488 nm Ex',pixel_format=pixel_format)
+    assert frame.shape == FOV
+    assert frame.dtype == dtype
+    assert frame.max() > 0
+    if pixel_format == 'MONO12':
+        assert np.all(frame & 0xF == 0)
+
+
+def test_brightfield_and_fluorescence_contrast(specimen):
+    bf = specimen.render(0,0,0,FOV[0],FOV[1],1,channel='BF LED matrix full',pixel_format='MONO16')
+    fluorescence = specimen.render(0,0,0,FOV[0],FOV[1],1,channel='Fluorescence 488 nm Ex',pixel_format='MONO16')
+    assert bf.mean() > fluorescence.mean()
+
+
+def test_exposure_scales_signal(specimen):
+    kwargs = dict(channel='Fluorescence 488 nm Ex',pixel_format='MONO16')
+    short = specimen.render(0,0,0,FOV[0],FOV[1],1,exposure_time_ms=5,**kwargs).astype(np.float64)
+    long = specimen.render(0,0,0,FOV[0],FOV[1],1,exposure_time_ms=10,**kwargs).astype(np.float64)
+    assert long.mean()/short.mean() == pytest.approx(2,rel=0.1)
+
+
+def test_from_file(tmp_path):
+    image = np.zeros((64,80,3),dtype=np.uint8)
+    image[16:48,20:60] = (50,100,150)
+    path = str(tmp_path/'specimen.png')
+    cv2.imwrite(path,image)
+    specimen = SimulatedSpecimen.from_file(path,pixel_size_um=0.5)
+    assert specimen.image.shape == (64,80)
+    assert specimen.image.max() == 255
+    assert specimen.image[0,0] == 0
+    assert specimen.pixel_size_um == 0.5
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+import scipy.ndimage
+
+from control.tile_registration import TileRegistration
+
+TILE = 200
+STEP = 160
+
+
+def specimen(size=(640,640),seed=0):
+    return scipy.ndimage.gaussian_filter(np.random.default_rng(seed).random(size),2).astype(np.float32)
+
+
+def grid(ny,nx,step=STEP):
+    return {(i,j):(i*step,j*step) for i in range(ny) for j in range(nx)}
+
+
+def jittered(nominal_positions,max_jitter=4,seed=1):
+    rng = np.random.default_rng(seed)
+    return {tile_id:(y+int(rng.integers(-max_jitter,max_jitter+1)),x+int(rng.integers(-max_jitter,max_jitter+1))) for tile_id,(y,x) in nominal_positions.items()}
+
+
+def normalized(positions):
+    y0 = min(y for y,x in positions.values())
+    x0 = min(x for y,x in positions.values())
+    return {tile_id:(y-y0,x-x0) for tile_id,(y,x) in positions.items()}
+
+
+def tiles_at(world,positions,offset=8):
+    return [(tile_id,world[offset+y:offset+y+TILE,offset+x:offset+x+TILE]) for tile_id,(y,x) in positions.items()]
+
+
+def registration(**kwargs):
+    kwargs = dict(dict(downsample=1,max_shift_px=10,min_score=0.3,max_residual_px=3,n_threads=2),**kwargs)
+    return TileRegistration((TILE,TILE),**kwargs)
+
+
+def test_find_pairs_on_grid():
+    pairs = registration().find_pairs(grid(2,3))
+    assert len(pairs) == 2*2 + 3
+    for a,b,offset in pairs:
+        assert offset in [(0,STEP),(STEP,0)]
+
+
+def test_find_pairs_without_overlap():
+    assert registration().find_pairs(grid(2,2,step=TILE)) == []
+
+
+def test_register_recovers_the_stage_errors():
+    nominal_positions = grid(3,3)
+    true_positions = jittered(nominal_positions)
+    positions = registration().register(nominal_positions,tiles_at(specimen(),true_positions))
+    assert positions == normalized(true_positions)
+
+
+def test_register_keeps_nominal_position_of_missing_tile():
+    nominal_positions = grid(1,3)
+    true_positions = dict(nominal_positions)
+    true_positions[(0,1)] = (3,STEP-4)
+    true_positions[(0,2)] = (3,2*STEP-4)
+    tiles = [tile for tile in tiles_at(specimen(),true_positions) if tile[0] != (0,2)]
+    positions = registration().register(nominal_positions,tiles)
+    assert positions[(0,1)] == (3,STEP-4)
+    # without a measurement, the tile keeps its nominal offset to its neighbour
+    assert positions[(0,2)] == (3,2*STEP-4)
+
+
+def test_solve_ignores_unreliable_measurements():
+    nominal_positions = grid(1,2)
+    pairs = registration().find_pairs(nominal_positions)
+    measurements = {((0,0),(0,1)):((5,STEP+5),0.1)}
+    assert registration().solve(nominal_positions,pairs,measurements) == {(0,0):(0,0),(0,1):(0,STEP)}
+
+
+def test_solve_discards_outlier():
+    nominal_positions = grid(3,3)
+    true_positions = jittered(nominal_positions)
+    tile_registration = registration()
+    pairs = tile_registration.find_pairs(nominal_positions)
+    measurements = {}
+    for a,b,offset in pairs:
+        measurements[(a,b)] = ((true_positions[b][0]-true_positions[a][0],true_positions[b][1]-true_positions[a][1]),0.9)
+    # an edge in the middle of the grid, so that the other offsets disagree with it the most
+    (dy,dx),score = measurements[((1,0),(1,1))]
+    measurements[((1,0),(1,1))] = ((dy+20,dx),0.9)
+    assert tile_registration.solve(nominal_positions,pairs,measurements) == normalized(true_positions)
+
+
+def test_solve_keeps_isolated_tile_at_nominal_position():
+    nominal_positions = grid(1,2)
+    nominal_positions['isolated'] = (0,5*TILE)
+    tile_registration = registration()
+    pairs = tile_registration.find_pairs(nominal_positions)
+    measurements = {((0,0),(0,1)):((0,STEP),0.9)}
+    assert tile_registration.solve(nominal_positions,pairs,measurements) == {(0,0):(0,0),(0,1):(0,STEP),'isolated':(0,5*TILE)}
+
+
+@pytest.mark.parametrize('downsample',[1,2])
+def test_register_pair_measures_shift(downsample):
+    world = specimen()
+    strip_a = world[20:220,100:140]
+    strip_b = world[17:217,102:142]
+    tile_registration = registration(downsample=downsample)
+    (dy,dx),score = tile_registration.register_pair(tile_registration._strip(strip_a,np.s_[:,:]),tile_registration._strip(strip_b,np.s_[:,:]))
+    # strip_a(p) = strip_b(p - (-3, 2))
+    assert dy == pytest.approx(-3,abs=downsample)
+    assert dx == pytest.approx(2,abs=downsample)
+    assert score > 0.5
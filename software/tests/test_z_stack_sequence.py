@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from control._def import *
+from control.microcontroller import Microcontroller_Simulation, z_stack_sequence, z_stack_frames
+
+CHANNELS = [(11,50,100,0),(12,20,100,0)] # (illumination_source, intensity, illumination_on_time_us, wait_after_trigger_us)
+
+
+def run_simulated_sequence(mcu,steps,timeout_s=10):
+    # z position of the simulated stage at each hardware trigger of the sequence
+    z_at_trigger = []
+    mcu.set_hardware_trigger_callback(lambda: z_at_trigger.append(mcu.z_pos))
+    assert mcu.upload_sequence(steps)
+    mcu.run_sequence(1)
+    deadline = time.time() + timeout_s
+    while mcu.sequence_running and time.time() < deadline:
+        time.sleep(0.01)
+    assert not mcu.sequence_running
+    return z_at_trigger
+
+
+@pytest.fixture
+def mcu():
+    mcu = Microcontroller_Simulation()
+    yield mcu
+    mcu.close()
+
+
+def test_steps():
+    steps = z_stack_sequence(10,CHANNELS,3,settle_us=500)
+    assert [step[1] for step in steps if step[0] == SEQUENCE_STEP.MOVE_Z] == [10,10]
+    assert len([step for step in steps if step[0] == SEQUENCE_STEP.SEND_HARDWARE_TRIGGER]) == 3*len(CHANNELS)
+    assert len([step for step in steps if step[0] == SEQUENCE_STEP.WAIT_US]) == 2
+
+
+def test_single_channel_sets_illumination_once():
+    steps = z_stack_sequence(10,CHANNELS[:1],4)
+    assert len([step for step in steps if step[0] == SEQUENCE_STEP.SET_ILLUMINATION]) == 1
+
+
+@pytest.mark.parametrize('dz_usteps',[10,-10])
+def test_backlash_approaches_in_stack_direction(dz_usteps):
+    steps = z_stack_sequence(dz_usteps,CHANNELS,2,backlash_usteps=160)
+    direction = 1 if dz_usteps > 0 else -1
+    assert steps[:2] == [(SEQUENCE_STEP.MOVE_Z,-direction*160),(SEQUENCE_STEP.MOVE_Z,direction*160)]
+
+
+def test_too_many_steps():
+    with pytest.raises(ValueError):
+        z_stack_sequence(10,CHANNELS,MAX_SEQUENCE_STEPS)
+
+
+@pytest.mark.parametrize('dz_usteps',[8,-8])
+def test_frames_map_to_planes(mcu,dz_usteps):
+    n_planes = 4
+    steps = z_stack_sequence(dz_usteps,CHANNELS,n_planes,backlash_usteps=16)
+    z_at_trigger = run_simulated_sequence(mcu,steps)
+    frames = z_stack_frames(n_planes,len(CHANNELS))
+    assert len(z_at_trigger) == len(frames)
+    for (plane, channel), z in zip(frames,z_at_trigger):
+        assert z - z_at_trigger[0] == STAGE_MOVEMENT_SIGN_Z*plane*dz_usteps
+
+
+def test_z_moves_with_current_velocity(mcu):
+    mm_per_ustep_Z = SCREW_PITCH_Z_MM/(MICROSTEPPING_DEFAULT_Z*FULLSTEPS_PER_REV_Z)
+    mcu.set_max_velocity_acceleration(AXIS.Z,0.05,100)
+    usteps = int(round(0.01/mm_per_ustep_Z)) # 0.2 s at 0.05 mm/s
+    duration_s, t_acceleration_s = mcu._move_profile(AXIS.Z,usteps)
+    timestamp_start = time.time()
+    run_simulated_sequence(mcu,[(SEQUENCE_STEP.MOVE_Z,usteps)])
+    assert time.time() - timestamp_start >= 0.9*duration_s
+    assert mcu.z_pos == STAGE_MOVEMENT_SIGN_Z*usteps